@@ -0,0 +1,118 @@
+"""
+Measures concurrent /generation/explain/ throughput of a single server worker against a local fake
+completion server, comparing the legacy blocking client path with the async OpenAIChatSession path. Every
+request explains a code block of its own and the response cache is off, so that each one is a completion.
+
+    python -m benchmarks.async_generation --requests 50 --latency 0.5
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+import httpx
+import openai
+
+from fastapi import FastAPI
+
+from benchmarks.fake_openai import create_fake_openai_app, find_free_port, serve_in_background
+
+
+
+def explain_payload(index: int) -> dict:
+    # Every request has its own code block, identical ones would be merged into one completion
+    return {
+        "language_model": "openai",
+        "code_extension": "python",
+        "code_block_to_generate_from": f"def add_{index}(a, b):\n    return a + b + {index}\n",
+        "explanation_complexity": 30,
+    }
+
+
+def create_blocking_app() -> FastAPI:
+    """Reproduces the previous handler shape: an `async def` route doing a blocking completion call."""
+    from src.core.settings import get_settings
+    from src.generation.schemas import ExplainSchemaIn
+
+    settings = get_settings()
+    blocking_app = FastAPI()
+
+    @blocking_app.post('/generation/explain/')
+    async def explain_code_snippet(metadata: ExplainSchemaIn):
+        session = openai.AzureOpenAI(
+            api_key=settings.azure_openai_api_key,
+            azure_endpoint=settings.azure_openai_endpoint,
+            api_version=settings.openai_api_version,
+        )
+        response = session.chat.completions.create(
+            model="gpt-model-01",
+            messages=[{"role": "user", "content": metadata.code_block_to_generate_from}])
+        return {"explained_output": response.choices[0].message.content,
+                "explanation_complexity": metadata.explanation_complexity}
+
+    return blocking_app
+
+
+async def fire_concurrent_requests(port: int, total_requests: int) -> dict:
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=None) as client:
+        start_time = time.perf_counter()
+        responses = await asyncio.gather(
+            *[client.post('/generation/explain/', json=explain_payload(index)) for index in range(total_requests)])
+        elapsed = time.perf_counter() - start_time
+
+    failures = sum(1 for response in responses if response.status_code != 200)
+    return {
+        "requests": total_requests,
+        "failures": failures,
+        "elapsed_seconds": round(elapsed, 4),
+        "requests_per_second": round(total_requests / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50, help='concurrent requests fired at each server')
+    parser.add_argument('--latency', type=float, default=0.5, help='fake completion latency in seconds')
+    parser.add_argument('--json', action='store_true', help='print machine readable results')
+    args = parser.parse_args()
+
+    fake_port = find_free_port()
+    fake_app = create_fake_openai_app(latency=args.latency)
+    serve_in_background(fake_app, fake_port)
+
+    os.environ['AZURE_OPENAI_ENDPOINT'] = f'http://127.0.0.1:{fake_port}'
+    # Every request has to reach the fake server, a cached answer would not exercise the completion path
+    os.environ['RESPONSE_CACHE_ENABLED'] = 'false'
+    # Quotas high enough that the scheduler never holds requests back, unless the caller set their own
+    os.environ.setdefault('AZURE_MODEL_TOKEN_RATE_LIMIT', str(10 ** 9))
+    os.environ.setdefault('AZURE_MODEL_REQUEST_RATE_LIMIT', str(10 ** 6))
+    # Every request of the benchmark comes from the same address
+    os.environ.setdefault('REQUESTS_PER_USER_PER_MINUTE', str(10 ** 6))
+    for variable in ('AZURE_OPENAI_API_KEY', 'OPENAI_API_VERSION', 'MODEL_NAME', 'ENVIRONMENT',
+                     'OPENAI_SECRET_KEY', 'OPENAI_ORGANIZATION_ID'):
+        os.environ.setdefault(variable, 'benchmark')
+
+    from src.main import app
+
+    results = {}
+    for label, server_app in (('blocking', create_blocking_app()), ('async', app)):
+        port = find_free_port()
+        server = serve_in_background(server_app, port)
+        completions_before = fake_app.state.stats['completions']
+        results[label] = asyncio.run(fire_concurrent_requests(port, args.requests))
+        results[label]["upstream_completions"] = fake_app.state.stats['completions'] - completions_before
+        server.should_exit = True
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for label, result in results.items():
+        print(f"{label:>8}: {result['requests']} requests in {result['elapsed_seconds']:.2f}s "
+              f"({result['requests_per_second']:.2f} req/s, {result['failures']} failures, "
+              f"{result['upstream_completions']} upstream completions)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import json
+import time
+import random
+import socket
+import asyncio
+import hashlib
+import threading
+
+import uvicorn
+
+from typing import Union
+from collections import Counter
+from collections.abc import Callable
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_DISTRIBUTIONS = ('constant', 'uniform', 'lognormal', 'exponential')
+
+
+def sample_latency(rng: random.Random, latency: float, distribution: str, spread: float) -> float:
+    """`latency` is the median of every distribution but the exponential one, where it is the mean."""
+    if distribution == 'uniform':
+        return rng.uniform(latency * max(0.0, 1 - spread), latency * (1 + spread))
+    if distribution == 'lognormal':
+        return latency * rng.lognormvariate(0, spread)
+    if distribution == 'exponential':
+        return rng.expovariate(1 / latency) if latency > 0 else 0.0
+    return latency
+
+
+def create_fake_openai_app(latency: float = 0.5,
+                           content: Union[str, Callable[[dict], str]] = "fake_function: O(n) runtime, O(1) space",
+                           token_interval: float = 0.0, distribution: str = 'constant', latency_spread: float = 0.0,
+                           error_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0) -> FastAPI:
+    """
+    Builds an Azure OpenAI compatible app that answers every chat completion after `latency` seconds, drawn from
+    `distribution`, plus `token_interval` seconds per generated word. Streamed completions send their first token
+    after the latency and every following word `token_interval` apart. `content` is either the text of every
+    completion or a function of the completion request.
+
+    A share `error_rate` of the completions fails with a 500 and a share `rate_limit_rate` is throttled with a 429
+    and a Retry-After. Latencies and injected errors are drawn from `seed`, the request and how many times the
+    same request has been seen before, so a run replaying the same requests sees the same upstream behaviour
+    whatever order they arrive in. Counts of what was answered are kept in `app.state.stats`.
+    """
+    if distribution not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Unknown latency distribution '{distribution}', expected one of {LATENCY_DISTRIBUTIONS}")
+    fake_app = FastAPI()
+    fake_app.state.stats = Counter()
+    attempts: Counter[str] = Counter()
+
+    def request_rng(completion_request: dict) -> random.Random:
+        digest = hashlib.sha256(json.dumps(completion_request, sort_keys=True).encode()).hexdigest()
+        attempts[digest] += 1
+        return random.Random(f'{seed}:{digest}:{attempts[digest]}')
+
+    async def stream_chunks(deployment: str, words: list[str], delay: float):
+        await asyncio.sleep(delay)
+        for index, word in enumerate(words):
+            if index:
+                await asyncio.sleep(token_interval)
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": deployment,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": None,
+                    "delta": {"role": "assistant", "content": word if not index else f' {word}'},
+                }],
+            }
+            yield f'data: {json.dumps(chunk)}\n\n'
+        yield 'data: [DONE]\n\n'
+
+    @fake_app.post('/openai/deployments/{deployment}/chat/completions')
+    async def chat_completions(deployment: str, request: Request):
+        completion_request = await request.json()
+        rng = request_rng(completion_request)
+        delay = sample_latency(rng, latency, distribution, latency_spread)
+
+        outcome = rng.random()
+        if outcome < error_rate:
+            fake_app.state.stats['errors'] += 1
+            await asyncio.sleep(delay)
+            return JSONResponse({"error": {"message": "Injected server error", "code": "server_error"}},
+                                status_code=500)
+        if outcome < error_rate + rate_limit_rate:
+            fake_app.state.stats['rate_limited'] += 1
+            return JSONResponse({"error": {"message": "Injected rate limit", "code": "429"}}, status_code=429,
+                                headers={'retry-after-ms': '100'})
+
+        text = content(completion_request) if callable(content) else content
+        # Split on single spaces so that the streamed words join back into the exact same text
+        words = text.split(' ')
+        fake_app.state.stats['completions'] += 1
+        if completion_request.get('stream'):
+            return StreamingResponse(stream_chunks(deployment, words, delay), media_type='text/event-stream')
+
+        await asyncio.sleep(delay + token_interval * (len(words) - 1))
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": deployment,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        }
+
+    return fake_app
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_in_background(app: FastAPI, port: int) -> uvicorn.Server:
+    """Runs `app` on its own event loop in a daemon thread, the same way a single uvicorn worker would."""
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='error'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
@@ -0,0 +1,80 @@
+"""
+Measures the cache key of an /explain/ or /analyse/ request, which fingerprints the code block, against the
+exact text key used by the other commands, for code blocks of a few sizes in every supported language. Keys
+are timed for text seen for the first time and for repeated text, which skips the fingerprint. The Python
+blocks are fingerprinted both by syntax tree and, as for selections that do not parse, by tokens.
+
+    python -m benchmarks.fingerprint --functions 1 10 100
+"""
+import os
+import json
+import time
+import argparse
+
+from benchmarks.verification import build_files
+
+
+def per_call_microseconds(function, iterations: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start_time) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', type=int, nargs='+', default=[1, 10, 100], help='functions per code block')
+    parser.add_argument('--iterations', type=int, default=200, help='keys built per measurement')
+    parser.add_argument('--json', action='store_true', help='print machine readable results')
+    args = parser.parse_args()
+
+    for variable in ('AZURE_OPENAI_API_KEY', 'AZURE_OPENAI_ENDPOINT', 'OPENAI_API_VERSION', 'MODEL_NAME',
+                     'ENVIRONMENT', 'OPENAI_SECRET_KEY', 'OPENAI_ORGANIZATION_ID'):
+        os.environ.setdefault(variable, 'benchmark')
+
+    from src.generation.cache import build_request_cache_key
+    from src.generation.schemas import AcceptedCodeLanguages, ExplainSchemaIn, SystemPrompt
+    from src.generation.fingerprint import fingerprint_code_block, token_fingerprint
+
+    def build_new_key(metadata):
+        fingerprint_code_block.cache_clear()
+        return build_request_cache_key(SystemPrompt.Explain, metadata)
+
+    results = []
+    for language in ('python', 'java', 'cpp', 'typescript'):
+        for functions in args.functions:
+            original, generated = build_files(language, functions)
+            metadata = ExplainSchemaIn(language_model='openai', code_extension=language,
+                                       code_block_to_generate_from=original)
+            documented = metadata.model_copy(update={"code_block_to_generate_from": generated})
+            assert build_request_cache_key(SystemPrompt.Explain, metadata) \
+                == build_request_cache_key(SystemPrompt.Explain, documented), f'{language} fingerprints differ'
+
+            result = {
+                "language": language,
+                "kilobytes": round(len(original) / 1024, 1),
+                "exact_key_us": per_call_microseconds(
+                    lambda: build_request_cache_key(SystemPrompt.Annotate, metadata), args.iterations),
+                "fingerprint_key_us": per_call_microseconds(lambda: build_new_key(metadata), args.iterations),
+                "repeated_fingerprint_key_us": per_call_microseconds(
+                    lambda: build_request_cache_key(SystemPrompt.Explain, metadata), args.iterations),
+            }
+            if language == 'python':
+                result["token_fingerprint_us"] = per_call_microseconds(
+                    lambda: token_fingerprint(original, AcceptedCodeLanguages.Python), args.iterations)
+            results.append({name: round(value, 1) if isinstance(value, float) else value
+                            for name, value in result.items()})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for result in results:
+        print(f"{result['language']:>10} {result['kilobytes']:>7} KB: exact key {result['exact_key_us']} us, "
+              f"fingerprinted key {result['fingerprint_key_us']} us "
+              f"({result['repeated_fingerprint_key_us']} us repeated)"
+              + (f", tokens only {result['token_fingerprint_us']} us" if 'token_fingerprint_us' in result else ''))
+
+
+if __name__ == '__main__':
+    main()
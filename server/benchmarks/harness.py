@@ -0,0 +1,442 @@
+"""
+Replays realistic payloads against every /generation/ route of the server, started from src.main:app in its own
+process, with a local fake completion server standing in for Azure OpenAI. Reports throughput, p50/p95/p99
+latency (and time to the first event of streams), the server side overhead recorded by the server's own metrics
+of non-streamed routes and the memory of the server process, per route.
+
+The fake server's latency distribution, token rate and injected errors are drawn from a seed, so two runs with
+the same arguments replay the same upstream behaviour. Results can be written to a file and a later run compared
+against it, exiting with status 1 when a route regressed by more than the tolerance:
+
+    python -m benchmarks.harness --requests 50 --concurrency 16 --output baseline.json
+    python -m benchmarks.harness --requests 50 --concurrency 16 --baseline baseline.json --tolerance 0.2
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+from collections import Counter
+from collections.abc import Callable
+
+import httpx
+
+from benchmarks.fake_openai import LATENCY_DISTRIBUTIONS, create_fake_openai_app, find_free_port, \
+    serve_in_background
+
+SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PYTHON_MODULE = '''import math
+
+
+class Account{n}:
+    """A bank account that keeps its balance in cents."""
+
+    def __init__(self, owner, balance=0):
+        self.owner = owner
+        self.balance = balance
+
+    def deposit(self, amount):
+        if amount <= 0:
+            raise ValueError("Deposits must be positive")
+        self.balance += amount
+        return self.balance
+
+
+def compound_interest_{n}(principal, rate, years):
+    total = principal
+    for _ in range(years):
+        total += total * rate
+    return math.floor(total)
+
+
+def moving_average_{n}(values, window=3):
+    averages = []
+    for index in range(len(values) - window + 1):
+        averages.append(sum(values[index:index + window]) / window)
+    return averages
+'''
+
+JAVA_CLASS = '''public class Inventory{n} {{
+    private final Map<String, Integer> stock = new HashMap<>();
+
+    public void add(String item, int quantity) {{
+        stock.merge(item, quantity, Integer::sum);
+    }}
+
+    public boolean remove(String item, int quantity) {{
+        int available = stock.getOrDefault(item, 0);
+        if (available < quantity) {{
+            return false;
+        }}
+        stock.put(item, available - quantity);
+        return true;
+    }}
+}}
+'''
+
+TYPESCRIPT_MODULE = '''export function debounce{n}<T extends (...args: any[]) => void>(callback: T, wait: number) {{
+    let timer: ReturnType<typeof setTimeout> | undefined;
+    return (...args: Parameters<T>) => {{
+        clearTimeout(timer);
+        timer = setTimeout(() => callback(...args), wait);
+    }};
+}}
+
+export function groupBy{n}<T>(items: T[], key: (item: T) => string): Record<string, T[]> {{
+    const groups: Record<string, T[]> = {{}};
+    for (const item of items) {{
+        (groups[key(item)] ||= []).push(item);
+    }}
+    return groups;
+}}
+'''
+
+CODE_SAMPLES = (('python', PYTHON_MODULE), ('java', JAVA_CLASS), ('typescript', TYPESCRIPT_MODULE))
+
+DECLARATION_NAME = re.compile(r'^\s*(?:export\s+)?(?:public\s+|private\s+)?(?:def|class|function|void|boolean|int)\s+'
+                              r'(\w+)', re.MULTILINE)
+
+
+def code_sample(index: int) -> tuple[str, str]:
+    """Code of the index-th request: every request sends different code so none is answered from another."""
+    language, template = CODE_SAMPLES[index % len(CODE_SAMPLES)]
+    return language, template.format(n=index)
+
+
+def base_payload(index: int) -> dict:
+    language, code = code_sample(index)
+    return {"language_model": "openai", "code_extension": language, "code_block_to_generate_from": code}
+
+
+def batch_payload(index: int) -> dict:
+    return {"jobs": [
+        {"command": "explain", "payload": base_payload(index * 4)},
+        {"command": "analyse", "payload": base_payload(index * 4 + 1)},
+        {"command": "annotate", "payload": base_payload(index * 4 + 2)},
+        {"command": "define", "payload": base_payload(index * 4 + 3)},
+    ]}
+
+
+def pdf_payload(index: int) -> dict:
+    language, code = code_sample(index)
+    return {"language_model": "openai", "code_extension": language, "code_file_to_generate_from": code}
+
+
+# Route name: (path, payload of the index-th request, whether the response is streamed)
+ROUTES: dict[str, tuple[str, Callable[[int], dict], bool]] = {
+    'annotate': ('/generation/annotate/', base_payload, False),
+    'explain': ('/generation/explain/', lambda index: {**base_payload(index), "explanation_complexity": 30}, False),
+    'analyse': ('/generation/analyse/', base_payload, False),
+    'revise': ('/generation/revise/', lambda index: {**base_payload(index), "variable_naming_scheme": "camel"},
+               False),
+    'define': ('/generation/define/', base_payload, False),
+    'create-pdf': ('/generation/create-pdf/', pdf_payload, False),
+    'batch': ('/generation/batch/', batch_payload, False),
+    'stream-annotate': ('/generation/stream/annotate/', base_payload, True),
+    'stream-explain': ('/generation/stream/explain/', base_payload, True),
+    'stream-revise': ('/generation/stream/revise/', base_payload, True),
+    'stream-define': ('/generation/stream/define/', base_payload, True),
+}
+
+
+def comment_prefix(code: str) -> str:
+    return '#' if re.search(r'^\s*def |^import ', code, re.MULTILINE) else '//'
+
+
+def patch_completion(command: str, numbered_code: str) -> str:
+    """Insertions answering an /annotate or /define request whose code block came with line numbers."""
+    lines = [line.partition('| ')[2] for line in numbered_code.split('\n')]
+    if command.startswith('/define'):
+        anchors = [number for number, line in enumerate(lines, start=1) if DECLARATION_NAME.match(line)]
+        comment = 'Documented by the benchmark model.\n\nINPUT:\n- value : int\n\nOUTPUT:\nresult : int'
+    else:
+        anchors = [number for number, line in enumerate(lines, start=1) if line.strip().startswith('return')]
+        comment = 'Returns the result computed above.'
+    return json.dumps({"insertions": [{"line": number, "comment": comment} for number in anchors]})
+
+
+def realistic_completion(completion_request: dict) -> str:
+    """What a model would answer to the completion request, in the shape every command parses."""
+    user_content = completion_request['messages'][-1]['content']
+    command, _, code = user_content.partition('\n\n')
+    if '"insertions"' in completion_request['messages'][0]['content']:
+        return patch_completion(command, code)
+    names = DECLARATION_NAME.findall(code) or ['main']
+    if command.startswith(('/annotate', '/define')):
+        comment = comment_prefix(code)
+        return f'{comment} Documented by the benchmark model.\n{code}'
+    if command.startswith('/revise'):
+        return code
+    if command.startswith('/analyse'):
+        return json.dumps({"functions": [{"name": name, "runtime": "O(n)", "space": "O(1)"} for name in names]})
+    if command.startswith('/summarise'):
+        return json.dumps({"title": "Benchmark module",
+                           "description": f"Declarations {', '.join(names)} used by the benchmark."})
+    if command.startswith('/generate'):
+        return json.dumps({"title": "Benchmark module", "description": "Declarations used by the benchmark.",
+                           "functions": [{"name": name, "function_descriptor": f"Function {name}: (value) -> result",
+                                          "description": f"Computes the result of {name}.",
+                                          "usage_example": f"{name}(1)"} for name in names]})
+    return ('The code defines ' + ', '.join(names) + ' and walks through its input once, keeping the running '
+            'result in a local variable before returning it to the caller.')
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))] * 1000, 3)
+
+    return {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99),
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3), "max": round(ordered[-1] * 1000, 3)}
+
+
+def process_memory_megabytes(pid: int) -> dict:
+    """Resident and peak resident memory of a process, empty where /proc is not available."""
+    try:
+        with open(f'/proc/{pid}/status') as status_file:
+            status = dict(line.split(':', 1) for line in status_file if ':' in line)
+    except OSError:
+        return {}
+    return {"rss_mb": round(int(status['VmRSS'].split()[0]) / 1024, 2),
+            "peak_rss_mb": round(int(status['VmHWM'].split()[0]) / 1024, 2)}
+
+
+def server_overhead_totals(metrics_text: str) -> dict[str, list[float]]:
+    """Sum and count of the server overhead histogram for every route."""
+    totals: dict[str, list[float]] = {}
+    for line in metrics_text.splitlines():
+        match = re.match(r'scribe_http_server_overhead_seconds_(sum|count)\{route="([^"]+)"\} (\S+)', line)
+        if match:
+            totals.setdefault(match.group(2), [0.0, 0.0])[match.group(1) == 'count'] = float(match.group(3))
+    return totals
+
+
+def user_address(index: int, users: int) -> str:
+    """Client address the index-th request is sent from, so that requests are spread over `users` users."""
+    user = index % users
+    return f'10.{user >> 16 & 255}.{user >> 8 & 255}.{user & 255}'
+
+
+async def timed_request(client: httpx.AsyncClient, path: str, payload: dict, streamed: bool, user: str) \
+        -> tuple[int, float, float]:
+    """
+    Status, seconds until the first byte of the body and seconds until the response was complete. The request is
+    forwarded for the user's address, which the server accounts it to. Bodies of responses that are not streamed
+    are read at once, their first byte is counted as arriving with the rest.
+    """
+    headers = {'X-Forwarded-For': user}
+    start_time = time.perf_counter()
+    if not streamed:
+        response = await client.post(path, json=payload, headers=headers)
+        end_time = time.perf_counter()
+        return response.status_code, end_time - start_time, end_time - start_time
+
+    first_byte_at = None
+    async with client.stream('POST', path, json=payload, headers=headers) as response:
+        async for _ in response.aiter_raw():
+            if first_byte_at is None:
+                first_byte_at = time.perf_counter()
+    end_time = time.perf_counter()
+    return response.status_code, (first_byte_at or end_time) - start_time, end_time - start_time
+
+
+async def run_route(client: httpx.AsyncClient, server_pid: int, name: str, requests: int, concurrency: int,
+                    warmup: int, users: int) -> dict:
+    path, build_payload, streamed = ROUTES[name]
+    for index in range(warmup):
+        await timed_request(client, path, build_payload(10 ** 6 + index), streamed,
+                            user_address(index, users))
+
+    overhead_before = server_overhead_totals((await client.get('/metrics')).text).get(path, [0.0, 0.0])
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index: int):
+        async with semaphore:
+            return await timed_request(client, path, build_payload(index), streamed,
+                                         user_address(index, users))
+
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*[limited(index) for index in range(requests)])
+    elapsed = time.perf_counter() - start_time
+    overhead_after = server_overhead_totals((await client.get('/metrics')).text).get(path, [0.0, 0.0])
+
+    status_codes = Counter(str(status) for status, _, _ in results)
+    successful = [result for result in results if result[0] == 200]
+    overhead_requests = overhead_after[1] - overhead_before[1]
+    route_result = {
+        "requests": requests,
+        "failures": requests - len(successful),
+        "status_codes": dict(status_codes),
+        "throughput_rps": round(len(successful) / elapsed, 3),
+        "latency_ms": percentiles([total for _, _, total in successful]),
+        # Streamed responses count as model time only until their stream is opened, so their overhead would
+        # include the whole generation
+        "server_overhead_ms": round((overhead_after[0] - overhead_before[0]) / overhead_requests * 1000, 3)
+        if overhead_requests and not streamed else None,
+        "memory": process_memory_megabytes(server_pid),
+    }
+    if streamed:
+        route_result["first_event_ms"] = percentiles([first_byte for _, first_byte, _ in successful])
+    return route_result
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Routes that got slower, lost throughput or failed more than in the baseline, beyond the tolerance."""
+    regressions = []
+    for name, result in results["routes"].items():
+        reference = baseline.get("routes", {}).get(name)
+        if reference is None:
+            continue
+        if result["failures"] > reference["failures"]:
+            regressions.append(f'{name}: {result["failures"]} failures, baseline {reference["failures"]}')
+        for metric in ("p95", "p99"):
+            current, previous = result["latency_ms"][metric], reference["latency_ms"][metric]
+            if current is not None and previous and current > previous * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {current:.1f} ms, baseline {previous:.1f} ms')
+        if reference["throughput_rps"] and result["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(f'{name}: {result["throughput_rps"]:.2f} req/s, '
+                               f'baseline {reference["throughput_rps"]:.2f} req/s')
+        current, previous = result["server_overhead_ms"], reference["server_overhead_ms"]
+        if current is not None and previous and current > previous * (1 + tolerance):
+            regressions.append(f'{name}: server overhead {current:.2f} ms, baseline {previous:.2f} ms')
+    return regressions
+
+
+def start_server(port: int, fake_port: int, job_store_path: str, cache: bool) -> subprocess.Popen:
+    environment = {
+        **os.environ,
+        'AZURE_OPENAI_ENDPOINT': f'http://127.0.0.1:{fake_port}',
+        'JOB_STORE_PATH': job_store_path,
+        'RESPONSE_CACHE_ENABLED': 'true' if cache else 'false',
+        'METRICS_ENABLED': 'true',
+    }
+    # Quotas high enough that the scheduler never holds requests back, unless the caller set their own
+    environment.setdefault('AZURE_MODEL_TOKEN_RATE_LIMIT', str(10 ** 9))
+    environment.setdefault('AZURE_MODEL_REQUEST_RATE_LIMIT', str(10 ** 6))
+    # Requests are accounted to the addresses they are forwarded for, none of them is held back either
+    environment.setdefault('REQUESTS_PER_USER_PER_MINUTE', str(10 ** 6))
+    for variable in ('AZURE_OPENAI_API_KEY', 'OPENAI_API_VERSION', 'MODEL_NAME', 'ENVIRONMENT',
+                     'OPENAI_SECRET_KEY', 'OPENAI_ORGANIZATION_ID'):
+        environment.setdefault(variable, 'benchmark')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'src.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning', '--forwarded-allow-ips', '127.0.0.1'],
+        cwd=SERVER_DIRECTORY, env=environment)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The server exited with status {server.returncode} before it was ready")
+        try:
+            if (await client.get('/metrics')).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("The server was not ready in time")
+
+
+async def run_benchmark(args: argparse.Namespace, port: int, server: subprocess.Popen) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency + 2, max_keepalive_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=None, limits=limits) as client:
+        await wait_until_ready(client, server)
+        memory_at_start = process_memory_megabytes(server.pid)
+        routes = {}
+        for name in args.routes:
+            routes[name] = await run_route(client, server.pid, name, args.requests, args.concurrency, args.warmup,
+                                         args.users)
+    return {"memory_at_start": memory_at_start, "routes": routes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=50, help='measured requests per route')
+    parser.add_argument('--concurrency', type=int, default=16, help='requests in flight at once')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests sent to every route first')
+    parser.add_argument('--routes', type=lambda value: value.split(','), default=list(ROUTES),
+                        help=f'comma separated routes out of {",".join(ROUTES)}')
+    parser.add_argument('--users', type=int, default=16, help='distinct users the requests are spread over')
+    parser.add_argument('--latency', type=float, default=0.3, help='median fake completion latency in seconds')
+    parser.add_argument('--distribution', choices=LATENCY_DISTRIBUTIONS, default='lognormal',
+                        help='distribution of the fake completion latency')
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help='sigma of the lognormal distribution, relative half width of the uniform one')
+    parser.add_argument('--tokens-per-second', type=float, default=0,
+                        help='rate the fake completions generate words at, 0 for all at once')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of completions failing with a 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='share of completions throttled with a 429')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the fake latencies and errors')
+    parser.add_argument('--cache', action='store_true', help='keep the response cache of the server enabled')
+    parser.add_argument('--output', help='file the JSON results are written to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative regression allowed by --baseline')
+    parser.add_argument('--json', action='store_true', help='print machine readable results')
+    args = parser.parse_args()
+    unknown_routes = set(args.routes) - set(ROUTES)
+    if unknown_routes:
+        parser.error(f'unknown routes: {", ".join(sorted(unknown_routes))}')
+    if args.users < 1:
+        parser.error('--users must be at least 1')
+
+    fake_app = create_fake_openai_app(
+        latency=args.latency, content=realistic_completion, distribution=args.distribution,
+        latency_spread=args.latency_spread, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+        token_interval=1 / args.tokens_per_second if args.tokens_per_second else 0.0, seed=args.seed)
+    fake_port, port = find_free_port(), find_free_port()
+    serve_in_background(fake_app, fake_port)
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(port, fake_port, os.path.join(directory, 'jobs.sqlite3'), args.cache)
+        try:
+            results = asyncio.run(run_benchmark(args, port, server))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    results["config"] = {key: value for key, value in vars(args).items()
+                         if key not in ('output', 'baseline', 'json')}
+    results["upstream"] = dict(fake_app.state.stats)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), args.tolerance)
+        results["regressions"] = regressions
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for name, result in results["routes"].items():
+            latency = result["latency_ms"]
+            overhead = result["server_overhead_ms"]
+            print(f"{name:>16}: {result['throughput_rps']:8.2f} req/s, p50 {latency['p50']} ms, "
+                  f"p95 {latency['p95']} ms, p99 {latency['p99']} ms, "
+                  f"overhead {overhead if overhead is not None else '-'} ms, {result['failures']} failures")
+        memory = list(results["routes"].values())[-1]["memory"] if results["routes"] else {}
+        print(f"server memory: {results['memory_at_start'].get('rss_mb')} MB at start, "
+              f"{memory.get('rss_mb')} MB at the end, peak {memory.get('peak_rss_mb')} MB")
+        print(f"upstream: {results['upstream']}")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
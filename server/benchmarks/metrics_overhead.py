@@ -0,0 +1,96 @@
+"""
+Measures the cost of the instrumentation in src/core/metrics.py: a @timeit wrapped call against the bare
+function, a histogram observation, an HTTP request through MetricsMiddleware against the bare ASGI app and
+rendering /metrics. Everything runs in process, without any network, so only the instrumentation is timed.
+
+    python -m benchmarks.metrics_overhead --iterations 200000
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+
+
+def per_call_nanoseconds(function, iterations: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start_time) / iterations * 1e9
+
+
+async def per_async_call_nanoseconds(function, iterations: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        await function()
+    return (time.perf_counter() - start_time) / iterations * 1e9
+
+
+async def asgi_request_nanoseconds(app, iterations: int) -> float:
+    scope = {'type': 'http', 'method': 'POST', 'path': '/generation/explain/', 'headers': []}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(_):
+        pass
+
+    return await per_async_call_nanoseconds(lambda: app(dict(scope), receive, send), iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000, help='calls timed per measurement')
+    parser.add_argument('--json', action='store_true', help='print machine readable results')
+    args = parser.parse_args()
+
+    for variable in ('AZURE_OPENAI_API_KEY', 'AZURE_OPENAI_ENDPOINT', 'OPENAI_API_VERSION', 'MODEL_NAME',
+                     'ENVIRONMENT', 'OPENAI_SECRET_KEY', 'OPENAI_ORGANIZATION_ID'):
+        os.environ.setdefault(variable, 'benchmark')
+
+    from src.core.utils import timeit
+    from src.core.metrics import MetricsMiddleware, MetricsRegistry
+
+    def bare_function():
+        return None
+
+    async def bare_coroutine():
+        return None
+
+    async def bare_app(_, __, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b'{}'})
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram('benchmark_seconds', 'Benchmark histogram', ('command',))
+    for index in range(50):
+        registry.histogram(f'benchmark_{index}_seconds', 'Benchmark histogram', ('command',)).observe(
+            'explain', value=0.1)
+
+    iterations = args.iterations
+    results = {
+        "bare_call_ns": per_call_nanoseconds(bare_function, iterations),
+        "timeit_call_ns": per_call_nanoseconds(timeit(bare_function), iterations),
+        "bare_async_call_ns": asyncio.run(per_async_call_nanoseconds(bare_coroutine, iterations)),
+        "timeit_async_call_ns": asyncio.run(per_async_call_nanoseconds(timeit(bare_coroutine), iterations)),
+        "histogram_observe_ns": per_call_nanoseconds(lambda: histogram.observe('explain', value=0.3), iterations),
+        "bare_asgi_request_ns": asyncio.run(asgi_request_nanoseconds(bare_app, iterations // 4)),
+        "instrumented_asgi_request_ns": asyncio.run(
+            asgi_request_nanoseconds(MetricsMiddleware(bare_app), iterations // 4)),
+        "render_51_histograms_us": per_call_nanoseconds(registry.render, 200) / 1e3,
+    }
+    results = {name: round(value, 1) for name, value in results.items()}
+    results["timeit_overhead_ns"] = round(results["timeit_call_ns"] - results["bare_call_ns"], 1)
+    results["middleware_overhead_ns"] = round(
+        results["instrumented_asgi_request_ns"] - results["bare_asgi_request_ns"], 1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, value in results.items():
+        print(f"{name:>30}: {value}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Measures how long the server takes to start. Reports the import time of src.main, from `python -X importtime`,
+with the modules that take the longest to import (cumulative time, their own imports included), and the time
+from starting uvicorn on src.main:app to the first request it answers, both as the median of several runs:
+
+    python -m benchmarks.startup --runs 5 --top 15
+    python -m benchmarks.startup --runs 5 --output startup.json
+
+The OpenAI SDK is not part of the import of src.main, it is imported by the connection warm-up once the server
+is up. Run with LLM_WARM_UP_ENABLED=false to measure a start without it.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+import httpx
+
+from benchmarks.fake_openai import find_free_port
+
+SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import time: self [us] | cumulative | imported package
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def server_environment(job_store_path: str) -> dict:
+    environment = {**os.environ, 'JOB_STORE_PATH': job_store_path}
+    for variable in ('AZURE_OPENAI_ENDPOINT', 'AZURE_OPENAI_API_KEY', 'OPENAI_API_VERSION', 'MODEL_NAME',
+                     'ENVIRONMENT', 'OPENAI_SECRET_KEY', 'OPENAI_ORGANIZATION_ID'):
+        environment.setdefault(variable, 'http://127.0.0.1:9' if variable == 'AZURE_OPENAI_ENDPOINT' else 'benchmark')
+    return environment
+
+
+def measure_import_time(environment: dict) -> dict[str, tuple[int, int]]:
+    """(self, cumulative) import time in microseconds of every module imported by src.main in a fresh process."""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import src.main'], cwd=SERVER_DIRECTORY,
+                               env=environment, capture_output=True, text=True, check=True)
+    modules = dict()
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def measure_first_request(environment: dict, timeout: float = 30) -> float:
+    """Seconds from starting the server process to the first answer of its `/` route."""
+    port = find_free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'src.main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=SERVER_DIRECTORY, env=environment)
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=1) as client:
+            while time.perf_counter() - started < timeout:
+                if server.poll() is not None:
+                    raise RuntimeError(f"The server exited with status {server.returncode} before it was ready")
+                try:
+                    if client.get('/').status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise RuntimeError("The server did not answer in time")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes measured, the median is reported')
+    parser.add_argument('--top', type=int, default=15, help='slowest modules reported')
+    parser.add_argument('--output', help='file the JSON results are written to')
+    args = parser.parse_args()
+
+    environment = server_environment(os.path.join(SERVER_DIRECTORY, '.startup-benchmark.sqlite3'))
+    try:
+        import_runs = [measure_import_time(environment) for _ in range(args.runs)]
+        first_requests = [measure_first_request(environment) for _ in range(args.runs)]
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(environment['JOB_STORE_PATH'] + suffix):
+                os.remove(environment['JOB_STORE_PATH'] + suffix)
+
+    cumulative = {module: statistics.median(run[module][1] for run in import_runs if module in run)
+                  for module in import_runs[-1]}
+    slowest = sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:args.top]
+    results = {
+        "import_ms": round(cumulative.get('src.main', 0) / 1000, 1),
+        "first_request_ms": round(statistics.median(first_requests) * 1000, 1),
+        "openai_imported": any(module == 'openai' for run in import_runs for module in run),
+        "slowest_imports_ms": {module: round(microseconds / 1000, 1) for module, microseconds in slowest},
+        "runs": args.runs,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    print(f"import of src.main: {results['import_ms']} ms, first request served after "
+          f"{results['first_request_ms']} ms, OpenAI SDK imported: {results['openai_imported']}")
+    for module, milliseconds in results["slowest_imports_ms"].items():
+        print(f"{milliseconds:10.1f} ms  {module}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Measures annotation verification on large generated files for every supported language: the generated code is
+the original with a comment above every declaration and trailing comments on some lines, verified both in one
+piece and streamed in token sized pieces. The previous line based verifier is timed on the Python file too.
+
+    python -m benchmarks.verification --functions 500
+"""
+import os
+import json
+import time
+import argparse
+
+
+PYTHON_FUNCTION = '''def function_{index}(values, threshold={index}):
+    total = 0
+    for value in values:
+        if value > threshold:
+            total += value * {index}
+    return f"{{total}}: done"
+
+'''
+
+C_FAMILY_FUNCTIONS = {
+    'java': '''public int function{index}(int[] values, int threshold) {{
+    int total = 0;
+    for (int value : values) {{
+        if (value > threshold) {{
+            total += value * {index};
+        }}
+    }}
+    return total;
+}}
+
+''',
+    'cpp': '''int function{index}(const std::vector<int>& values, int threshold) {{
+    int total = 0;
+    for (int value : values) {{
+        if (value > threshold) {{
+            total += value * {index};
+        }}
+    }}
+    return total;
+}}
+
+''',
+    'typescript': '''export function function{index}(values: number[], threshold: number): string {{
+    let total = 0;
+    for (const value of values) {{
+        if (value > threshold) {{
+            total += value * {index};
+        }}
+    }}
+    return `${{total}}: done`;
+}}
+
+''',
+}
+
+COMMENT_PREFIXES = {'python': '#', 'java': '//', 'cpp': '//', 'typescript': '//'}
+
+
+def build_files(language: str, functions: int) -> tuple[str, str]:
+    template = PYTHON_FUNCTION if language == 'python' else C_FAMILY_FUNCTIONS[language]
+    comment = COMMENT_PREFIXES[language]
+    original_pieces, generated_pieces = [], []
+    for index in range(functions):
+        function = template.format(index=index)
+        original_pieces.append(function)
+        documented_lines = [f'{comment} Adds up the values above the threshold, scaled by {index}.']
+        for line_number, line in enumerate(function.split('\n')):
+            documented_lines.append(f'{line}  {comment} step {line_number}' if line_number == 2 else line)
+        generated_pieces.append('\n'.join(documented_lines))
+    return ''.join(original_pieces), ''.join(generated_pieces)
+
+
+def legacy_python_verify(original: str, generated: str) -> bool:
+    """The previous verifier: line by line, skipping lines recognised as Python comments."""
+    def single_line_comment(line):
+        return line[0] == '#' or not line.count("'''") % 2
+
+    def comment_block_signature(line):
+        return line.count("'''") % 2 == 1
+
+    original_lines = [line for line in original.split('\n') if line != '']
+    pointer = 0
+    in_comment_block = False
+    for line in generated.split('\n'):
+        if line == '':
+            continue
+        if in_comment_block:
+            in_comment_block = not comment_block_signature(line)
+            continue
+        if comment_block_signature(line):
+            in_comment_block = True
+            continue
+        if single_line_comment(line):
+            continue
+        if pointer >= len(original_lines) or line != original_lines[pointer]:
+            return False
+        pointer += 1
+    return pointer == len(original_lines)
+
+
+def time_per_kilobyte(function, size: int, repeats: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start_time) / repeats / (size / 1024) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--functions', type=int, default=500, help='functions per generated file')
+    parser.add_argument('--repeats', type=int, default=5, help='verifications timed per measurement')
+    parser.add_argument('--json', action='store_true', help='print machine readable results')
+    args = parser.parse_args()
+
+    for variable in ('AZURE_OPENAI_API_KEY', 'AZURE_OPENAI_ENDPOINT', 'OPENAI_API_VERSION', 'MODEL_NAME',
+                     'ENVIRONMENT', 'OPENAI_SECRET_KEY', 'OPENAI_ORGANIZATION_ID'):
+        os.environ.setdefault(variable, 'benchmark')
+
+    from src.generation.schemas import AcceptedCodeLanguages
+    from src.generation.streaming import StreamingCodeVerifier
+
+    def verify(original: str, generated: str, language: AcceptedCodeLanguages, piece_size: int = 0) -> bool:
+        verifier = StreamingCodeVerifier(original, language)
+        if not piece_size:
+            verifier.feed(generated)
+        for offset in range(0, len(generated), piece_size or len(generated) + 1):
+            verifier.feed(generated[offset:offset + piece_size])
+        return verifier.finish()
+
+    results = {}
+    for language in ('python', 'java', 'cpp', 'typescript'):
+        original, generated = build_files(language, args.functions)
+        code_language = AcceptedCodeLanguages(language)
+        assert verify(original, generated, code_language), f'{language} verification failed'
+        assert not verify(original, generated.replace('* 7;', '* 8;').replace('* 7\n', '* 8\n'), code_language)
+
+        results[language] = {
+            "lines": generated.count('\n'),
+            "kilobytes": round(len(generated) / 1024, 1),
+            "ms_per_kb": round(time_per_kilobyte(
+                lambda: verify(original, generated, code_language), len(generated), args.repeats), 4),
+            "streamed_ms_per_kb": round(time_per_kilobyte(
+                lambda: verify(original, generated, code_language, piece_size=4), len(generated), args.repeats), 4),
+        }
+        if language == 'python':
+            results[language]["legacy_ms_per_kb"] = round(time_per_kilobyte(
+                lambda: legacy_python_verify(original, generated), len(generated), args.repeats), 4)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for language, result in results.items():
+        print(f"{language:>10}: {result['lines']} lines ({result['kilobytes']} KB), "
+              f"{result['ms_per_kb']:.3f} ms/KB whole, {result['streamed_ms_per_kb']:.3f} ms/KB streamed"
+              + (f", legacy {result['legacy_ms_per_kb']:.3f} ms/KB" if 'legacy_ms_per_kb' in result else ''))
+
+
+if __name__ == '__main__':
+    main()
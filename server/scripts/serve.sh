@@ -0,0 +1 @@
+export PYTHONPATH=$PWD && python -m src.serve "$@"
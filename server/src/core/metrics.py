@@ -0,0 +1,286 @@
+import math
+import time
+import bisect
+
+from typing import Union
+from contextvars import ContextVar
+from contextlib import contextmanager
+from collections.abc import Callable, Iterator
+
+from src.core.settings import get_settings
+
+settings = get_settings()
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, wide enough for completions of large files
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+LabelValues = tuple[str, ...]
+
+
+def format_labels(label_names: tuple[str, ...], label_values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def escape_label_value(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class CounterMetric:
+    metric_type = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values: dict[LabelValues, float] = dict()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        for label_values, value in self.values.items():
+            yield f'{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}'
+
+
+class GaugeMetric(CounterMetric):
+    metric_type = 'gauge'
+
+    def set(self, *label_values: str, value: float):
+        self.values[label_values] = value
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class CallbackMetric(CounterMetric):
+    """Metric whose samples are read from another component, e.g. the response cache, when scraped."""
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = (), metric_type: str = 'gauge',
+                 callback: Callable[[], dict[LabelValues, float]] = None):
+        super().__init__(name, description, label_names)
+        self.metric_type = metric_type
+        self.callback = callback
+
+    def samples(self) -> Iterator[str]:
+        if self.callback is None:
+            return
+        for label_values, value in self.callback().items():
+            yield f'{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}'
+
+
+class HistogramMetric:
+    metric_type = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # Per label set: count per bucket (the last one is +Inf), sum and count of observations
+        self.values: dict[LabelValues, list] = dict()
+
+    def observe(self, *label_values: str, value: float):
+        series = self.values.get(label_values)
+        if series is None:
+            series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self) -> Iterator[str]:
+        for label_values, (bucket_counts, total, count) in self.values.items():
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative_count += bucket_count
+                labels = format_labels(self.label_names, label_values, extra=f'le="{format_value(upper_bound)}"')
+                yield f'{self.name}_bucket{labels} {cumulative_count}'
+            yield f'{self.name}_sum{format_labels(self.label_names, label_values)} {format_value(total)}'
+            yield f'{self.name}_count{format_labels(self.label_names, label_values)} {count}'
+
+
+Metric = Union[CounterMetric, GaugeMetric, CallbackMetric, HistogramMetric]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = dict()
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> CounterMetric:
+        return self.register(CounterMetric(name, description, label_names))
+
+    def gauge(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> GaugeMetric:
+        return self.register(GaugeMetric(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> HistogramMetric:
+        return self.register(HistogramMetric(name, description, label_names, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.metric_type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+
+http_request_duration = metrics.histogram(
+    'scribe_http_request_duration_seconds', 'Time spent answering HTTP requests', ('route', 'method', 'status'))
+http_server_overhead = metrics.histogram(
+    'scribe_http_server_overhead_seconds',
+    'Time spent answering HTTP requests while no model completion was in flight', ('route',))
+http_requests_in_flight = metrics.gauge('scribe_http_requests_in_flight', 'HTTP requests being answered')
+function_duration = metrics.histogram(
+    'scribe_function_duration_seconds', 'Execution time of instrumented functions', ('function',))
+model_request_duration = metrics.histogram(
+    'scribe_model_request_duration_seconds', 'Time until a model completion (or its stream) is returned',
+    ('model', 'command', 'outcome'))
+model_requests_in_flight = metrics.gauge(
+    'scribe_model_requests_in_flight', 'Model completions waiting for a response', ('model',))
+model_routes = metrics.counter(
+    'scribe_model_routes_total', 'Completions routed to each model and why', ('command', 'model', 'reason'))
+model_tokens = metrics.counter(
+    'scribe_model_tokens_total', 'Tokens reported by the model', ('model', 'command', 'kind'))
+generation_retries = metrics.counter(
+    'scribe_generation_retries_total', 'Completions repeated because their output could not be used', ('command',))
+structured_outputs = metrics.counter(
+    'scribe_structured_outputs_total', 'Structured model answers by how they could be read: valid, repaired, '
+    'legacy (plain text) or failed', ('command', 'result'))
+complexity_estimates = metrics.counter(
+    'scribe_complexity_estimates_total', 'Function complexities answered by /analyse, estimated locally or by '
+    'the model', ('language', 'source'))
+revisions = metrics.counter(
+    'scribe_revisions_total', 'Revisions produced by the local renaming engine or by the model',
+    ('language', 'source'))
+prompt_budgets = metrics.counter(
+    'scribe_prompt_budgets_total', 'Completions checked against the context window of their model: sent as '
+    'routed, moved to the large context model or rejected', ('command', 'result'))
+compacted_prompt_tokens = metrics.counter(
+    'scribe_compacted_prompt_tokens_total', 'Tokens of the code sent to the model before and after compaction',
+    ('command', 'stage'))
+batch_jobs = metrics.counter(
+    'scribe_batch_jobs_total', 'Generations of /batch/ requests by command: ok, rejected with an HTTP error or '
+    'failed unexpectedly', ('command', 'result'))
+verifications = metrics.counter(
+    'scribe_verifications_total', 'Generated code checked against the original code', ('command', 'result'))
+upstream_errors = metrics.counter(
+    'scribe_upstream_errors_total', 'Errors returned by the OpenAI API', ('error',))
+upstream_retries = metrics.counter(
+    'scribe_upstream_retries_total', 'Completions attempted again after a transient error', ('error',))
+deployment_selections = metrics.counter(
+    'scribe_deployment_selections_total', 'Completions sent to every Azure OpenAI deployment', ('deployment',))
+hedged_requests = metrics.counter(
+    'scribe_hedged_requests_total',
+    'Second requests for slow completions, by which request answered first or `skipped` without spare quota',
+    ('winner',))
+
+
+class ModelTime:
+    """Wall clock time during which at least one model completion of a request was in flight."""
+
+    def __init__(self):
+        self.active = 0
+        self.started_at = 0.0
+        self.busy_seconds = 0.0
+
+    def enter(self):
+        if self.active == 0:
+            self.started_at = time.perf_counter()
+        self.active += 1
+
+    def exit(self):
+        self.active -= 1
+        if self.active == 0:
+            self.busy_seconds += time.perf_counter() - self.started_at
+
+
+# Set per HTTP request by `MetricsMiddleware`, shared by the tasks the request spawns
+request_model_time: ContextVar[Union[ModelTime, None]] = ContextVar('request_model_time', default=None)
+
+
+@contextmanager
+def track_model_request(model: str, command: str):
+    model_time = request_model_time.get()
+    if model_time is not None:
+        model_time.enter()
+    model_requests_in_flight.inc(model)
+    start_time = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        model_request_duration.observe(model, command, outcome, value=time.perf_counter() - start_time)
+        model_requests_in_flight.dec(model)
+        if model_time is not None:
+            model_time.exit()
+
+
+def record_token_usage(model: str, command: str, usage):
+    if usage is None:
+        return
+    model_tokens.inc(model, command, 'prompt', amount=usage.prompt_tokens or 0)
+    model_tokens.inc(model, command, 'completion', amount=usage.completion_tokens or 0)
+
+
+# OpenTelemetry tracer used by `utils.timeit`, only when tracing is enabled and the API is installed
+tracer = trace.get_tracer('scribe') if trace is not None and settings.tracing_enabled else None
+
+
+class MetricsMiddleware:
+    """Records the latency, status and model-free server time of every HTTP request, labelled by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        model_time = ModelTime()
+        context_token = request_model_time.set(model_time)
+        http_requests_in_flight.inc()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start_time
+            http_requests_in_flight.dec()
+            request_model_time.reset(context_token)
+            route = scope.get('route')
+            route_path = getattr(route, 'path', 'unmatched')
+            http_request_duration.observe(route_path, scope['method'], str(status_code), value=duration)
+            http_server_overhead.observe(route_path, value=max(0.0, duration - model_time.busy_seconds))
@@ -1,4 +1,12 @@
+import functools
+
 from .base import CommonSettings
 
 
 AppSettings = CommonSettings
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> CommonSettings:
+    """The settings of the process, read from the environment (and `.env`) once and shared by every module."""
+    return AppSettings()
@@ -1,5 +1,7 @@
 import os
 
+from typing import Union
+
 from dotenv import load_dotenv
 from pydantic import ConfigDict
 from pydantic_settings import BaseSettings
@@ -22,10 +24,129 @@ class CommonSettings(BaseSettings):
     openai_api_version: str = os.getenv("OPENAI_API_VERSION")
     azure_model_name: str = os.getenv("MODEL_NAME")
 
+    # Azure OpenAI deployments completions are spread over, a JSON list of objects (see
+    # `deployments.parse_deployments`), the single endpoint above is used when it is empty. Deployments are
+    # selected `least_loaded` or by `latency`
+    azure_openai_deployments: str = os.getenv("AZURE_OPENAI_DEPLOYMENTS", "")
+    deployment_selection: str = os.getenv("DEPLOYMENT_SELECTION", "least_loaded")
+
     accepted_versions: list[str] = ["v1"]
     deprecated_versions: list[str] = []
 
-    requests_per_user_per_minute: int = 10
+    # Requests every user (see `dependencies.get_requesting_user`) may start per minute, 0 leaves them unlimited.
+    # Editor extensions send every request of a developer from the same address, only turn it on when the server
+    # is shared
+    requests_per_user_per_minute: int = int(os.getenv("REQUESTS_PER_USER_PER_MINUTE", 0))
+
+    # Worker processes started by `src.serve`, one per available core unless set, and how long a worker that is
+    # shutting down keeps serving the requests and documentation jobs in flight
+    web_concurrency: Union[int, None] = int(os.getenv("WEB_CONCURRENCY")) if os.getenv("WEB_CONCURRENCY") else None
+    shutdown_drain_seconds: int = int(os.getenv("SHUTDOWN_DRAIN_SECONDS", 30))
+    # SQLite file the rate limit quotas are kept in, so that they hold across the worker processes sharing it
+    shared_state_path: Union[str, None] = os.getenv("SHARED_STATE_PATH", None)
+
+    # Quota of the Azure deployment and the window (in seconds) over which bursts are allowed to spend it
+    azure_model_token_rate_limit: int = int(os.getenv("AZURE_MODEL_TOKEN_RATE_LIMIT", 120000))
+    azure_model_request_rate_limit: int = int(os.getenv("AZURE_MODEL_REQUEST_RATE_LIMIT", 720))
+    rate_limit_burst_seconds: int = int(os.getenv("RATE_LIMIT_BURST_SECONDS", 10))
+
+    # Model routing, off unless enabled: explanations and analyses of small code blocks at a low complexity
+    # level go to the small model, requests estimated above the default model's context to the large context
+    # model and everything else to the default model. A request moves on to the next suitable model when the
+    # rate limiter would hold it back for longer than the allowed wait on the chosen one.
+    model_routing_enabled: bool = os.getenv("MODEL_ROUTING_ENABLED", "false").lower() == "true"
+    model_routing_default_model: str = os.getenv("MODEL_ROUTING_DEFAULT_MODEL", "gpt-model-01")
+    model_routing_small_model: str = os.getenv("MODEL_ROUTING_SMALL_MODEL", "gpt-3.5-turbo")
+    model_routing_large_context_model: str = os.getenv("MODEL_ROUTING_LARGE_CONTEXT_MODEL", "gpt-3.5-turbo-16k")
+    model_routing_small_commands: str = os.getenv("MODEL_ROUTING_SMALL_COMMANDS", "explain,analyse")
+    model_routing_small_max_tokens: int = int(os.getenv("MODEL_ROUTING_SMALL_MAX_TOKENS", 1500))
+    model_routing_small_max_complexity: int = int(os.getenv("MODEL_ROUTING_SMALL_MAX_COMPLEXITY", 2))
+    model_routing_large_context_min_tokens: int = int(os.getenv("MODEL_ROUTING_LARGE_CONTEXT_MIN_TOKENS", 3500))
+    model_routing_max_wait_seconds: float = float(os.getenv("MODEL_ROUTING_MAX_WAIT_SECONDS", 1.0))
+
+    # Import the OpenAI SDK, create the clients and open a connection to every endpoint in the background right
+    # after startup, rather than on the first completion
+    llm_warm_up_enabled: bool = os.getenv("LLM_WARM_UP_ENABLED", "true").lower() == "true"
+    llm_warm_up_timeout: float = float(os.getenv("LLM_WARM_UP_TIMEOUT", 5.0))
+
+    # Shared HTTP connection pool used by every Azure OpenAI client in the process
+    llm_http2: bool = os.getenv("LLM_HTTP2", "false").lower() == "true"
+    llm_max_connections: int = int(os.getenv("LLM_MAX_CONNECTIONS", 100))
+    llm_max_keepalive_connections: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 20))
+    llm_keepalive_expiry: float = float(os.getenv("LLM_KEEPALIVE_EXPIRY", 30.0))
+    llm_request_timeout: float = float(os.getenv("LLM_REQUEST_TIMEOUT", 60.0))
+
+    # Completions that fail transiently are retried with exponential backoff and jitter (or after the
+    # Retry-After the API asks for), a circuit breaker per endpoint fails fast after consecutive failures and,
+    # when hedging is enabled, a second request is sent once a completion has taken longer than the recent p95
+    llm_max_attempts: int = int(os.getenv("LLM_MAX_ATTEMPTS", 4))
+    llm_backoff_base_seconds: float = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+    llm_backoff_max_seconds: float = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 20.0))
+    llm_circuit_failure_threshold: int = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))
+    llm_circuit_reset_seconds: float = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", 30.0))
+    llm_hedging_enabled: bool = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+    llm_hedging_min_delay_seconds: float = float(os.getenv("LLM_HEDGING_MIN_DELAY_SECONDS", 1.0))
+
+    # /analyse and /create-pdf ask for JSON answers and request the API's JSON mode unless this is turned off,
+    # for API versions that do not support it
+    llm_json_mode: bool = os.getenv("LLM_JSON_MODE", "true").lower() == "true"
+
+    # Prompts are counted with the models' tokenizer (tiktoken when installed, a local approximation otherwise):
+    # completions get a `max_tokens` for their command and requests that cannot fit the context window of any
+    # model are rejected before they are sent. The Azure deployment's context window is not known from its name.
+    prompt_budgeting_enabled: bool = os.getenv("PROMPT_BUDGETING_ENABLED", "true").lower() == "true"
+    azure_model_context_tokens: int = int(os.getenv("AZURE_MODEL_CONTEXT_TOKENS", 8192))
+
+    # /explain, /analyse and /create-pdf send code without its comments, docstrings, blank lines and repeated
+    # whitespace, unless this is turned off
+    prompt_compaction_enabled: bool = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+
+    # /annotate and /define ask the model only for the comments to insert and the lines they belong to, and insert
+    # them into the code block themselves, unless this is turned off and the model echoes the whole code block
+    llm_patch_output: bool = os.getenv("LLM_PATCH_OUTPUT", "true").lower() == "true"
+
+    # /analyse estimates the complexity of the functions it can classify from their loops and recursion itself and
+    # only asks the model about the others, unless this is turned off
+    local_analysis_enabled: bool = os.getenv("LOCAL_ANALYSIS_ENABLED", "true").lower() == "true"
+
+    # /revise renames variables to the requested casing scheme itself and only asks the model for hungarian
+    # notation, unless this is turned off
+    local_revision_enabled: bool = os.getenv("LOCAL_REVISION_ENABLED", "true").lower() == "true"
+
+    # Files with at least this many lines are documented declaration by declaration by /create-pdf/
+    pdf_chunking_min_lines: int = int(os.getenv("PDF_CHUNKING_MIN_LINES", 200))
+
+    # Largest batch accepted by /generation/batch/ and how many of its jobs are generated at once
+    batch_max_jobs: int = int(os.getenv("BATCH_MAX_JOBS", 200))
+    batch_max_concurrency: int = int(os.getenv("BATCH_MAX_CONCURRENCY", 8))
+
+    # Documentation jobs: the SQLite file they are kept in, the largest job accepted and how many files are
+    # documented at once across all jobs
+    job_store_path: str = os.getenv("JOB_STORE_PATH", "scribe_jobs.sqlite3")
+    job_max_files: int = int(os.getenv("JOB_MAX_FILES", 1000))
+    job_worker_count: int = int(os.getenv("JOB_WORKER_COUNT", 4))
+    # Files being documented are leased to one worker process, which renews the lease while it works on them,
+    # and are picked up by another worker once a lease runs out
+    job_lease_seconds: int = int(os.getenv("JOB_LEASE_SECONDS", 60))
+    # Jobs whose files have all finished are deleted, results included, once they have not changed for this long
+    job_retention_seconds: int = int(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 60 * 60))
+
+    # Prometheus metrics at /metrics, and OpenTelemetry spans around chat session methods when the
+    # opentelemetry packages are installed and configured
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    tracing_enabled: bool = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+    # Generation response cache, the on-disk tier is only enabled when a path is provided
+    response_cache_enabled: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    response_cache_max_entries: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 1024))
+    response_cache_ttl_seconds: int = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 24 * 60 * 60))
+    response_cache_path: Union[str, None] = os.getenv("RESPONSE_CACHE_PATH", None)
+    response_cache_disk_max_entries: int = int(os.getenv("RESPONSE_CACHE_DISK_MAX_ENTRIES", 100000))
+    # Identical generations in flight at the same time always share one completion within a worker. With the
+    # on-disk tier, workers sharing it also wait for each other through leases held for at most this many
+    # seconds, 0 leaves every worker to generate on its own
+    response_cache_lease_seconds: int = int(os.getenv("RESPONSE_CACHE_LEASE_SECONDS", 0))
+
     model_config = ConfigDict(
         ignored_types=(
             int,
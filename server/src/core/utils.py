@@ -1,24 +1,59 @@
 import time
 import random
 import string
+import inspect
 
 from typing import Any
 from functools import wraps
 
+from src.core.metrics import function_duration, tracer
+
 
 def timeit(func: Any):
+    """Records the execution time of `func` in the function duration histogram, inside a tracing span if enabled."""
+    name = func.__qualname__
+    if tracer is not None:
+        func = traced(func, name)
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def compute_async_execution_time(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                function_duration.observe(name, value=time.perf_counter() - start_time)
+
+        return compute_async_execution_time
+
     @wraps(func)
     def compute_execution_time(*args, **kwargs):
         start_time = time.perf_counter()
-        res = func(*args, **kwargs)
-        end_time = time.perf_counter()
-
-        print(f"Func {func.__name__} finished in {(end_time - start_time):.4f}s")
-        return res
+        try:
+            return func(*args, **kwargs)
+        finally:
+            function_duration.observe(name, value=time.perf_counter() - start_time)
 
     return compute_execution_time
 
 
+def traced(func: Any, name: str):
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def trace_async_execution(*args, **kwargs):
+            with tracer.start_as_current_span(name):
+                return await func(*args, **kwargs)
+
+        return trace_async_execution
+
+    @wraps(func)
+    def trace_execution(*args, **kwargs):
+        with tracer.start_as_current_span(name):
+            return func(*args, **kwargs)
+
+    return trace_execution
+
+
 def generate_alphanumeric_id(length=10, case_sensitive=False, upper_only=False, lower_only=False):
     sample_space = (
         string.digits
@@ -0,0 +1,154 @@
+import re
+import math
+import functools
+
+from typing import NamedTuple, Union
+
+from src.core.settings import get_settings
+from src.generation.declarations import is_statement_string
+from src.generation.schemas import AcceptedCodeLanguages, AcceptedNaturalLanguages, GenerativeTransformerModel, \
+    SystemPrompt
+from src.generation.tokenizer import COMMENT, NEWLINE, STRING, WHITESPACE, tokenize
+from src.generation.constants import COMPLETION_TOKEN_BUDGETS, DEFAULT_COMPLETION_TOKEN_ESTIMATE, \
+    EXPLANATION_COMPLETION_TOKENS, GENERATE_TOKENS_PER_DECLARATION, MIN_COMPLETION_TOKENS, MODEL_CONTEXT_TOKENS, \
+    NATURAL_LANGUAGE_TOKEN_FACTORS, PATCH_COMPLETION_TOKEN_BUDGET
+
+settings = get_settings()
+
+# Every supported model reads the same vocabulary
+MODEL_ENCODING = 'cl100k_base'
+
+# Tokens the chat format adds around every message and ahead of the answer
+MESSAGE_OVERHEAD_TOKENS = 3
+REPLY_PRIMING_TOKENS = 3
+
+# The pieces the GPT tokenizers split text into before merging them: contractions, words with their leading
+# space, up to three digits, runs of punctuation and runs of whitespace. Without tiktoken, a word counts as one
+# token per `CHARACTERS_PER_WORD_TOKEN` characters and punctuation as one token per two characters.
+TOKEN_PIECE = re.compile(r"'(?:s|t|re|ve|m|ll|d)\b| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|_+|\s+")
+CHARACTERS_PER_WORD_TOKEN = 6
+
+# Commands whose answer does not contain the code block, their code is sent compacted
+COMPACTED_COMMANDS = {SystemPrompt.Explain, SystemPrompt.Analyse, SystemPrompt.Generate, SystemPrompt.Summarise}
+ECHOING_COMMANDS = {SystemPrompt.Annotate, SystemPrompt.Define, SystemPrompt.Revise}
+
+
+class PromptBudget(NamedTuple):
+    model: GenerativeTransformerModel
+    prompt_tokens: int
+    completion_tokens: int
+
+
+class PromptBudgetExceeded(ValueError):
+    """Raised when a request cannot fit the context window of the model it would be sent to."""
+
+
+@functools.lru_cache(maxsize=1)
+def load_encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.get_encoding(MODEL_ENCODING)
+    except Exception:
+        # The vocabulary is downloaded on first use, which fails on machines without internet access
+        return None
+
+
+def approximate_tokens(text: str) -> int:
+    tokens = 0
+    for piece in TOKEN_PIECE.findall(text):
+        if piece.isspace():
+            tokens += 1
+        elif piece.lstrip()[:1].isalpha():
+            tokens += math.ceil(len(piece) / CHARACTERS_PER_WORD_TOKEN)
+        else:
+            tokens += math.ceil(len(piece) / 2)
+    return tokens
+
+
+def count_tokens(text: str) -> int:
+    encoding = load_encoding()
+    if encoding is None:
+        return approximate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list[dict]) -> int:
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages) \
+        + REPLY_PRIMING_TOKENS
+
+
+def context_tokens(model: GenerativeTransformerModel) -> int:
+    return MODEL_CONTEXT_TOKENS.get(model, settings.azure_model_context_tokens)
+
+
+def compact_code(code_block: str, language: AcceptedCodeLanguages) -> str:
+    """
+    The code block without its comments, Python docstrings, blank lines and trailing whitespace, and with the
+    whitespace inside every line collapsed to single spaces. Indentation is kept, Python's syntax depends on it.
+    """
+    tokens = list(tokenize(code_block, language))
+    lines, line = [], []
+    has_code = False
+    for index, token in enumerate(tokens):
+        if token.kind == NEWLINE:
+            if has_code:
+                lines.append(''.join(line).rstrip())
+            line, has_code = [], False
+        elif token.kind == WHITESPACE and not line:
+            line.append(token.text)
+        elif token.kind in (WHITESPACE, COMMENT) or (token.kind == STRING and language == AcceptedCodeLanguages.Python
+                                                      and is_statement_string(tokens, index)):
+            # Kept as a single space so that the code on both sides of it is not joined together
+            if line and not line[-1][-1:].isspace():
+                line.append(' ')
+        else:
+            line.append(token.text)
+            has_code = True
+    if has_code:
+        lines.append(''.join(line).rstrip())
+    return '\n'.join(lines)
+
+
+def completion_token_limit(command: SystemPrompt, code_tokens: int, complexity: Union[int, None] = None,
+                           patch: bool = False, response_language: Union[AcceptedNaturalLanguages, None] = None,
+                           declarations: int = 0) -> int:
+    """
+    `max_tokens` of a completion for `command` about a code block of `code_tokens` tokens, explanations in
+    `response_language` and PDF documentation of a code block with `declarations` declarations.
+    """
+    if command == SystemPrompt.Explain:
+        # Languages nobody measured are given as many tokens as the most expensive one
+        factor = NATURAL_LANGUAGE_TOKEN_FACTORS.get(response_language, max(NATURAL_LANGUAGE_TOKEN_FACTORS.values())) \
+            if response_language is not None else 1.0
+        return math.ceil(EXPLANATION_COMPLETION_TOKENS.get(complexity, DEFAULT_COMPLETION_TOKEN_ESTIMATE) * factor)
+    allowance, share = PATCH_COMPLETION_TOKEN_BUDGET if patch \
+        else COMPLETION_TOKEN_BUDGETS.get(command, (DEFAULT_COMPLETION_TOKEN_ESTIMATE, 0.0))
+    if command == SystemPrompt.Generate:
+        allowance += declarations * GENERATE_TOKENS_PER_DECLARATION
+    return allowance + math.ceil(code_tokens * share)
+
+
+def plan_prompt_budget(messages: list[dict], command: SystemPrompt, model: GenerativeTransformerModel,
+                       complexity: Union[int, None] = None, patch: bool = False,
+                       response_language: Union[AcceptedNaturalLanguages, None] = None,
+                       declarations: int = 0) -> PromptBudget:
+    """
+    Prompt tokens of the messages and the completion tokens they leave room for on `model`: the command's
+    `max_tokens`, cut down to what is left of the context window. Raises PromptBudgetExceeded when less is left
+    than the answer needs, which is the whole code block again for the commands that echo it.
+    """
+    prompt_tokens = count_message_tokens(messages)
+    code_tokens = count_tokens(messages[-1]["content"].partition('\n\n')[2])
+    wanted_tokens = completion_token_limit(command, code_tokens, complexity, patch, response_language, declarations)
+    required_tokens = code_tokens if command in ECHOING_COMMANDS and not patch \
+        else min(wanted_tokens, MIN_COMPLETION_TOKENS)
+
+    available_tokens = context_tokens(model) - prompt_tokens
+    if available_tokens < required_tokens:
+        raise PromptBudgetExceeded(
+            f"The request needs about {prompt_tokens + required_tokens} tokens, more than the "
+            f"{context_tokens(model)} tokens {model.value} accepts. Please send a smaller code block.")
+    return PromptBudget(model, prompt_tokens, min(wanted_tokens, available_tokens))
@@ -0,0 +1,332 @@
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+
+from enum import Enum
+from typing import Any, Union
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+from src.core.utils import generate_alphanumeric_id
+from src.core.settings import AppSettings
+from src.generation.fingerprint import fingerprint_code_block
+from src.generation.schemas import AcceptedCodeLanguages, BaseGenerationSchema, GenerativeTransformerModel, \
+    SystemPrompt
+
+
+def normalize_code_block(code_block: str) -> str:
+    """Drops line ending differences, trailing whitespace and surrounding blank lines."""
+    lines = code_block.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+def build_cache_key(
+    command: SystemPrompt,
+    language: AcceptedCodeLanguages,
+    model: GenerativeTransformerModel,
+    code_block: str,
+    **parameters: Any,
+) -> str:
+    key_parameters = {name: value.value if isinstance(value, Enum) else value
+                      for name, value in sorted(parameters.items())}
+    key_material = json.dumps(
+        [command.value, language.value, model.value, normalize_code_block(code_block), key_parameters],
+        separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(key_material.encode('utf-8')).hexdigest()
+
+
+# Request fields, besides the code block, that change the generated output of each command
+CACHE_KEY_PARAMETERS = {
+    SystemPrompt.Explain: ('explanation_complexity', 'response_language'),
+    SystemPrompt.Revise: ('variable_naming_scheme',),
+    SystemPrompt.Define: ('alternative_framework',),
+}
+
+# Commands whose output only depends on what the code does, so cosmetically different code blocks share a
+# response. The other commands return the code block itself and are keyed by its exact text.
+FINGERPRINTED_COMMANDS = {SystemPrompt.Explain, SystemPrompt.Analyse}
+
+
+def build_request_cache_key(
+    command: SystemPrompt,
+    metadata: BaseGenerationSchema,
+    model: GenerativeTransformerModel = GenerativeTransformerModel.Azure,
+) -> str:
+    """
+    Key of a request's response. It holds the model the request asked for, not the models its completions were
+    routed to: routing is decided per completion from the load of the rate limiter at the time, so it is not
+    known when the cache is looked up. Every model a completion can be routed to is given the same prompt and its
+    answer goes through the same verification and parsing before it is stored, so routing changes which model
+    wrote a response but never the kind of answer a request gets.
+    """
+    code_block = metadata.code_block_to_generate_from
+    if command in FINGERPRINTED_COMMANDS:
+        code_block = fingerprint_code_block(code_block, metadata.code_extension)
+    return build_cache_key(command, metadata.code_extension, model, code_block,
+                           **{parameter: getattr(metadata, parameter)
+                              for parameter in CACHE_KEY_PARAMETERS.get(command, ())})
+
+
+class SQLiteResponseStore:
+    """
+    On-disk cache tier so that generated responses survive server restarts. Its calls may wait for the write
+    lock of another process, `ResponseCache` makes them from a worker thread.
+    """
+
+    EVICTION_INTERVAL = 100
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self.writes_since_eviction = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS responses '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)')
+
+    def get(self, key: str) -> Union[Any, None]:
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM responses WHERE key = ? AND expires_at > ?', (key, now)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl_seconds: int):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value), now + ttl_seconds, now))
+            self.writes_since_eviction += 1
+            if self.writes_since_eviction >= self.EVICTION_INTERVAL:
+                self.evict(now)
+
+    def evict(self, now: float):
+        self.writes_since_eviction = 0
+        self.connection.execute('DELETE FROM responses WHERE expires_at <= ?', (now,))
+        self.connection.execute(
+            'DELETE FROM responses WHERE key IN '
+            '(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def acquire_lease(self, key: str, owner: str, lease_seconds: int) -> bool:
+        """Claims the generation of `key` for `owner`, unless another owner holds an unexpired lease on it."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute('DELETE FROM leases WHERE key = ? AND expires_at <= ?', (key, now))
+            cursor = self.connection.execute(
+                'INSERT OR IGNORE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)',
+                (key, owner, now + lease_seconds))
+        return cursor.rowcount == 1
+
+    def release_lease(self, key: str, owner: str):
+        with self.lock:
+            self.connection.execute('DELETE FROM leases WHERE key = ? AND owner = ?', (key, owner))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SingleFlight:
+    """
+    Lets concurrent calls for the same key share one execution: the first caller runs it and callers arriving
+    while it is in flight await its result, or its exception. If the first caller is cancelled, e.g. because
+    its client disconnected, one of the waiting callers runs it instead.
+    """
+
+    def __init__(self):
+        self.in_flight: dict[str, asyncio.Future] = dict()
+        self.coalesced = 0
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        while (in_flight := self.in_flight.get(key)) is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved when nobody else was waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.in_flight[key]
+
+
+class ResponseCache:
+    """
+    Two tier cache for generated responses: a bounded in-memory LRU in front of an optional SQLite store.
+    Entries expire after `ttl_seconds` in both tiers. Identical generations that are in flight at the same
+    time are coalesced into one, and with `lease_seconds` also across the workers that share the SQLite store.
+    """
+
+    # How often a worker waiting for another worker's generation checks the SQLite store
+    LEASE_POLL_SECONDS = 0.25
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: int = 24 * 60 * 60,
+                 disk_store: Union[SQLiteResponseStore, None] = None, lease_seconds: int = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_store = disk_store
+        self.lease_seconds = lease_seconds
+        self.lease_owner = generate_alphanumeric_id(length=16, lower_only=True)
+        self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.single_flight = SingleFlight()
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.coalesced_across_workers = 0
+
+    @classmethod
+    def from_settings(cls, app_settings: AppSettings) -> 'ResponseCache':
+        disk_store = None
+        if app_settings.response_cache_path:
+            disk_store = SQLiteResponseStore(
+                app_settings.response_cache_path, max_entries=app_settings.response_cache_disk_max_entries)
+        return cls(
+            max_entries=app_settings.response_cache_max_entries if app_settings.response_cache_enabled else 0,
+            ttl_seconds=app_settings.response_cache_ttl_seconds,
+            disk_store=disk_store if app_settings.response_cache_enabled else None,
+            lease_seconds=app_settings.response_cache_lease_seconds,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.disk_store is not None
+
+    def memory_get(self, key: str) -> Union[Any, None]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                return value
+            del self.entries[key]
+        return None
+
+    async def get(self, key: str) -> Union[Any, None]:
+        value = self.memory_get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.disk_store is not None:
+            value = await asyncio.to_thread(self.disk_store.get, key)
+            if value is not None:
+                self.remember(key, value)
+                self.hits += 1
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def contains(self, key: str) -> bool:
+        """Looks a key up without counting towards the hit rate."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return True
+        return self.disk_store is not None and await asyncio.to_thread(self.disk_store.get, key) is not None
+
+    def remember(self, key: str, value: Any):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def set(self, key: str, value: Any):
+        self.remember(key, value)
+        if self.disk_store is not None:
+            await asyncio.to_thread(self.disk_store.set, key, value, self.ttl_seconds)
+
+    async def fetch(
+        self,
+        key: str,
+        generate: Callable[[], Awaitable[Any]],
+        should_store: Callable[[Any], bool] = lambda _: True,
+    ) -> Any:
+        """
+        Returns the cached response for `key`, otherwise generates it and stores it if `should_store` allows.
+        Callers asking for a key that is already being generated wait for that generation instead.
+        """
+        if not self.enabled:
+            return await self.single_flight.run(key, generate)
+
+        cached_value = await self.get(key)
+        if cached_value is not None:
+            return cached_value
+
+        return await self.single_flight.run(key, lambda: self.generate_and_store(key, generate, should_store))
+
+    async def generate_and_store(self, key: str, generate: Callable[[], Awaitable[Any]],
+                                 should_store: Callable[[Any], bool]) -> Any:
+        shared = self.disk_store is not None and self.lease_seconds > 0
+        if shared:
+            cached_value = await self.wait_for_lease(key)
+            if cached_value is not None:
+                return cached_value
+
+        try:
+            value = await generate()
+            if should_store(value):
+                await self.set(key, value)
+            return value
+        finally:
+            if shared:
+                await asyncio.to_thread(self.disk_store.release_lease, key, self.lease_owner)
+
+    async def wait_for_lease(self, key: str) -> Union[Any, None]:
+        """
+        Waits while another worker generates the response for `key`. Returns that response once it is stored,
+        or None once this worker holds the lease, e.g. because the other worker's output was not stored.
+        """
+        while not await asyncio.to_thread(self.disk_store.acquire_lease, key, self.lease_owner, self.lease_seconds):
+            await asyncio.sleep(self.LEASE_POLL_SECONDS)
+            value = await asyncio.to_thread(self.disk_store.get, key)
+            if value is not None:
+                self.remember(key, value)
+                self.coalesced_across_workers += 1
+                return value
+        return None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "memory_entries": len(self.entries),
+            "coalesced": self.single_flight.coalesced + self.coalesced_across_workers,
+        }
+
+    def close(self):
+        self.entries.clear()
+        if self.disk_store is not None:
+            self.disk_store.close()
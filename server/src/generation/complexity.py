@@ -0,0 +1,1004 @@
+import ast
+import textwrap
+
+from typing import NamedTuple, Union
+
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.declarations import Declaration, split_declarations
+from src.generation.tokenizer import NAME, NUMBER, OPERATOR, STRING, Token, tokenize
+
+
+class Order(NamedTuple):
+    """Growth of `base^n` when `base` is above 1, otherwise of `n^degree * log^logs n`."""
+    base: int = 0
+    degree: int = 0
+    logs: int = 0
+
+    @property
+    def notation(self) -> str:
+        if self.base > 1:
+            return f'O({self.base}^n)'
+        factors = []
+        if self.degree:
+            factors.append('n' if self.degree == 1 else f'n^{self.degree}')
+        if self.logs:
+            factors.append('log n' if self.logs == 1 else f'log^{self.logs} n')
+        return f'O({" ".join(factors) or "1"})'
+
+
+CONSTANT = Order()
+LOGARITHMIC = Order(logs=1)
+LINEAR = Order(degree=1)
+LINEARITHMIC = Order(degree=1, logs=1)
+
+
+def times(first: Order, second: Order) -> Order:
+    if first.base > 1 or second.base > 1:
+        return Order(base=max(first.base, second.base))
+    return Order(degree=first.degree + second.degree, logs=first.logs + second.logs)
+
+
+class ComplexityEstimate(NamedTuple):
+    name: str
+    source: str
+    runtime: Order
+    space: Order
+    # False when the function does something the analyzer cannot classify, its complexity is then left to the model
+    confident: bool
+
+
+class FunctionCost:
+    """Runtime and extra space of a function as its body is walked, and whether every part of it was understood."""
+
+    def __init__(self):
+        self.runtime = CONSTANT
+        self.space = CONSTANT
+        self.confident = True
+        self.recursive_calls = 0
+        self.recursion_shrinks: set[str] = set()
+        self.recursion_in_loop = False
+
+    def spend(self, factor: Order, cost: Order = CONSTANT):
+        self.runtime = max(self.runtime, times(factor, cost))
+
+    def allocate(self, factor: Order, size: Order = CONSTANT):
+        self.space = max(self.space, times(factor, size))
+
+    def include(self, factor: Order, callee: 'FunctionCost'):
+        self.spend(factor, callee.runtime)
+        self.space = max(self.space, callee.space)
+        self.confident = self.confident and callee.confident
+
+    def doubt(self):
+        self.confident = False
+
+    def resolve_recursion(self, calls_per_path: int):
+        """
+        Folds the calls a function makes to itself into its complexity: `calls_per_path` calls on arguments that
+        shrink by a constant (`decrement`) or by half (`halve`) on every path through the body. Recursion inside
+        loops, on arguments that shrink some other way, or that mixes both, is not classified.
+        """
+        if not self.recursive_calls:
+            return
+        if self.recursion_in_loop or len(self.recursion_shrinks) != 1 or 'unknown' in self.recursion_shrinks:
+            self.doubt()
+            return
+
+        work = self.runtime
+        if self.recursion_shrinks == {'decrement'}:
+            self.space = max(self.space, LINEAR)
+            self.runtime = times(LINEAR, work) if calls_per_path == 1 else Order(base=calls_per_path)
+            return
+
+        self.space = max(self.space, LOGARITHMIC)
+        if calls_per_path == 1:
+            # T(n) = T(n/2) + f(n) is dominated by f(n) once f grows polynomially
+            self.runtime = work if work.degree else times(LOGARITHMIC, work)
+        elif calls_per_path == 2:
+            # T(n) = 2T(n/2) + f(n)
+            if work.degree == 0:
+                self.runtime = LINEAR
+            elif work.degree == 1:
+                self.runtime = times(LOGARITHMIC, work)
+        else:
+            self.doubt()
+
+
+# Python
+
+PYTHON_LINEAR_FUNCTIONS = {'sum', 'min', 'max', 'any', 'all', 'list', 'tuple', 'set', 'frozenset', 'dict', 'sorted',
+                           'bytes', 'bytearray', 'Counter', 'deque', 'heapify'}
+PYTHON_COPYING_FUNCTIONS = {'list', 'tuple', 'set', 'frozenset', 'dict', 'sorted', 'bytes', 'bytearray', 'Counter',
+                            'deque'}
+PYTHON_LAZY_FUNCTIONS = {'enumerate', 'reversed', 'zip', 'iter', 'map', 'filter', 'sorted', 'list', 'tuple', 'set',
+                         'frozenset'}
+PYTHON_LOGARITHMIC_FUNCTIONS = {'heappush', 'heappop', 'heapreplace', 'heappushpop', 'bisect', 'bisect_left',
+                                'bisect_right'}
+# Method name: (runtime, extra space)
+PYTHON_METHOD_COSTS = {
+    'sort': (LINEARITHMIC, LINEAR),
+    'index': (LINEAR, CONSTANT),
+    'count': (LINEAR, CONSTANT),
+    'remove': (LINEAR, CONSTANT),
+    'insert': (LINEAR, CONSTANT),
+    'reverse': (LINEAR, CONSTANT),
+    'copy': (LINEAR, LINEAR),
+    'extend': (LINEAR, LINEAR),
+    'join': (LINEAR, LINEAR),
+    'split': (LINEAR, LINEAR),
+    'splitlines': (LINEAR, LINEAR),
+    'union': (LINEAR, LINEAR),
+    'intersection': (LINEAR, LINEAR),
+    'difference': (LINEAR, LINEAR),
+    'insort': (LINEAR, CONSTANT),
+    'insort_left': (LINEAR, CONSTANT),
+    'insort_right': (LINEAR, CONSTANT),
+    'nlargest': (LINEARITHMIC, LINEAR),
+    'nsmallest': (LINEARITHMIC, LINEAR),
+}
+PYTHON_GROWING_METHODS = {'append', 'add', 'appendleft', 'setdefault', 'put', 'insert', 'extend', 'update'}
+# Containers with a constant time membership test, and the ones that are searched
+HASHED_KINDS = {'set', 'dict'}
+SEQUENCE_KINDS = {'list', 'str'}
+ANNOTATION_KINDS = {
+    'list': 'list', 'List': 'list', 'Sequence': 'list', 'tuple': 'list', 'Tuple': 'list', 'str': 'str',
+    'set': 'set', 'Set': 'set', 'frozenset': 'set', 'FrozenSet': 'set', 'AbstractSet': 'set',
+    'dict': 'dict', 'Dict': 'dict', 'Mapping': 'dict', 'defaultdict': 'dict', 'Counter': 'dict',
+}
+MEMOIZING_DECORATORS = ('cache', 'memo')
+FunctionNode = Union[ast.FunctionDef, ast.AsyncFunctionDef]
+
+
+def call_name(call: ast.Call) -> tuple[Union[str, None], Union[ast.expr, None]]:
+    """Name of the called function or method, and the object the method is called on."""
+    if isinstance(call.func, ast.Name):
+        return call.func.id, None
+    if isinstance(call.func, ast.Attribute):
+        return call.func.attr, call.func.value
+    return None, None
+
+
+def is_literal(node: ast.expr, constant_names: set[str]) -> bool:
+    """Whether the expression is made of literals and module level constants only."""
+    return all(isinstance(child, (ast.Constant, ast.BinOp, ast.UnaryOp, ast.Tuple, ast.List, ast.Set, ast.Load,
+                                  ast.operator, ast.unaryop))
+               or (isinstance(child, ast.Name) and child.id in constant_names)
+               for child in ast.walk(node))
+
+
+def value_kind(node: ast.expr, kinds: dict[str, str]) -> Union[str, None]:
+    if isinstance(node, (ast.List, ast.ListComp)) or (isinstance(node, ast.BinOp) and isinstance(node.left, ast.List)):
+        return 'list'
+    if isinstance(node, (ast.Set, ast.SetComp)):
+        return 'set'
+    if isinstance(node, (ast.Dict, ast.DictComp)):
+        return 'dict'
+    if isinstance(node, (ast.JoinedStr, ast.Constant)) and isinstance(getattr(node, 'value', ''), str):
+        return 'str'
+    if isinstance(node, ast.Name):
+        return kinds.get(node.id)
+    if isinstance(node, ast.Call):
+        name, receiver = call_name(node)
+        if receiver is None:
+            return ANNOTATION_KINDS.get(name, 'list' if name == 'sorted' else None)
+        if name in ('keys', 'items'):
+            return 'set'
+        if name in ('split', 'splitlines'):
+            return 'list'
+    return None
+
+
+class PythonModule:
+    """Functions and constants of a Python code block, and the cost of every function once it is analysed."""
+
+    def __init__(self, module: ast.Module):
+        self.functions: dict[str, list[FunctionNode]] = dict()
+        self.classes: dict[FunctionNode, ast.ClassDef] = dict()
+        self.constant_names: set[str] = set()
+        self.costs: dict[FunctionNode, FunctionCost] = dict()
+        self.analysing: list[FunctionNode] = []
+
+        for node in module.body:
+            if isinstance(node, ast.Assign) and is_literal(node.value, set()):
+                self.constant_names.update(target.id for target in node.targets if isinstance(target, ast.Name))
+        for node in ast.walk(module):
+            if isinstance(node, ast.ClassDef):
+                for child in node.body:
+                    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        self.classes[child] = node
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                self.functions.setdefault(node.name, []).append(node)
+
+    def resolve(self, name: str, receiver: Union[ast.expr, None], caller: FunctionNode) -> Union[FunctionNode, None]:
+        """The function of the code block a call refers to, by bare name or as a method of the caller's class."""
+        if receiver is None:
+            candidates = [node for node in self.functions.get(name, []) if node not in self.classes]
+        elif isinstance(receiver, ast.Name) and receiver.id in ('self', 'cls') and caller in self.classes:
+            candidates = [node for node in self.classes[caller].body
+                          if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == name]
+        else:
+            return None
+        return candidates[0] if len(candidates) == 1 else None
+
+    def cost(self, node: FunctionNode) -> FunctionCost:
+        if node not in self.costs:
+            self.analysing.append(node)
+            try:
+                self.costs[node] = PythonFunctionAnalyzer(self, node).analyse()
+            finally:
+                self.analysing.pop()
+        return self.costs[node]
+
+
+class PythonFunctionAnalyzer:
+    """
+    Walks the body of one Python function, multiplying the cost of every operation by the loops around it:
+    `for` loops and comprehensions run over their iterable (constant for literal ranges and containers),
+    `while` loops that halve or step a variable of their condition are logarithmic or linear. Calls to other
+    functions of the code block add their own cost, known builtins and methods theirs, anything else is taken
+    as constant time.
+    """
+
+    def __init__(self, module: PythonModule, node: FunctionNode):
+        self.module = module
+        self.node = node
+        self.cost = FunctionCost()
+        self.kinds = self.collect_kinds()
+        self.halving_names = {
+            target.id for child in ast.walk(node) if isinstance(child, ast.Assign) and self.halves(child.value)
+            for target in child.targets if isinstance(target, ast.Name)}
+
+    def collect_kinds(self) -> dict[str, str]:
+        kinds = dict()
+        arguments = self.node.args
+        for argument in arguments.posonlyargs + arguments.args + arguments.kwonlyargs:
+            annotation = argument.annotation
+            if isinstance(annotation, ast.Subscript):
+                annotation = annotation.value
+            if isinstance(annotation, ast.Attribute):
+                annotation = ast.Name(annotation.attr)
+            if isinstance(annotation, ast.Name) and annotation.id in ANNOTATION_KINDS:
+                kinds[argument.arg] = ANNOTATION_KINDS[annotation.id]
+        for child in ast.walk(self.node):
+            if isinstance(child, (ast.Assign, ast.AnnAssign)) and child.value is not None:
+                targets = child.targets if isinstance(child, ast.Assign) else [child.target]
+                kind = value_kind(child.value, kinds)
+                for target in targets:
+                    if isinstance(target, ast.Name) and kind is not None:
+                        kinds[target.id] = kind
+        for name in self.module.constant_names:
+            kinds.setdefault(name, 'constant')
+        return kinds
+
+    @staticmethod
+    def halves(node: ast.expr) -> bool:
+        return any(isinstance(child, ast.BinOp) and isinstance(child.op, (ast.FloorDiv, ast.Div, ast.RShift))
+                   and isinstance(child.right, ast.Constant) and child.right.value in (1, 2)
+                   for child in ast.walk(node))
+
+    def analyse(self) -> FunctionCost:
+        for statement in self.node.body:
+            self.visit(statement, CONSTANT, CONSTANT)
+        if self.cost.recursive_calls and any(
+                any(marker in ast.unparse(decorator).lower() for marker in MEMOIZING_DECORATORS)
+                for decorator in self.node.decorator_list):
+            self.cost.doubt()
+        self.cost.resolve_recursion(self.calls_per_path(self.node.body))
+        return self.cost
+
+    def visit(self, node: ast.AST, factor: Order, retained: Order):
+        """`factor` is how often the node runs, `retained` how many copies of what it allocates are kept."""
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            # Nested functions cost something when they are called
+            return
+        if isinstance(node, (ast.For, ast.AsyncFor)):
+            self.visit(node.iter, factor, retained)
+            inner = times(factor, self.iteration_order(node.iter))
+            self.cost.spend(inner)
+            self.visit_all(node.body, inner, retained)
+            self.visit_all(node.orelse, factor, retained)
+        elif isinstance(node, ast.While):
+            inner = times(factor, self.while_order(node))
+            self.cost.spend(inner)
+            self.visit(node.test, inner, retained)
+            self.visit_all(node.body, inner, retained)
+            self.visit_all(node.orelse, factor, retained)
+        elif isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+            self.visit_comprehension(node, factor, retained)
+        elif isinstance(node, ast.Call):
+            self.visit_call(node, factor, retained)
+        elif isinstance(node, ast.Compare):
+            for operator, comparator in zip(node.ops, node.comparators):
+                if isinstance(operator, (ast.In, ast.NotIn)):
+                    self.visit_membership(comparator, factor)
+            self.visit_children(node, factor, retained)
+        elif isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Slice):
+            if not self.constant_slice(node.slice):
+                self.cost.spend(factor, LINEAR)
+                self.cost.allocate(retained, LINEAR)
+            self.visit_children(node, factor, retained)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add) and self.concatenates_lists(node):
+            # `out + [x]` copies both lists into a new one
+            self.cost.spend(factor, LINEAR)
+            self.cost.allocate(retained, LINEAR)
+            self.visit_children(node, factor, retained)
+        elif isinstance(node, ast.Delete):
+            for target in node.targets:
+                if isinstance(target, ast.Subscript) and not isinstance(target.slice, ast.Slice):
+                    self.visit_removal(target.value, target.slice, factor)
+            self.visit_children(node, factor, retained)
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Mult) \
+                and isinstance(node.left, (ast.List, ast.Constant)) \
+                and not is_literal(node, self.module.constant_names):
+            # `[0] * n` and `'-' * width`
+            self.cost.spend(factor, LINEAR)
+            self.cost.allocate(retained, LINEAR)
+            self.visit_children(node, factor, retained)
+        elif isinstance(node, ast.AugAssign):
+            kind = value_kind(node.target, self.kinds) if isinstance(node.target, ast.Name) else None
+            if isinstance(node.op, ast.Add) and (kind in SEQUENCE_KINDS or value_kind(node.value, self.kinds) == 'str'):
+                # Strings and lists built up piece by piece
+                self.cost.allocate(factor)
+            self.visit_children(node, factor, retained)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name) \
+                        and self.kinds.get(target.value.id) == 'dict':
+                    self.cost.allocate(factor)
+            self.visit_children(node, factor, retained)
+        else:
+            self.visit_children(node, factor, retained)
+
+    def visit_all(self, nodes: list, factor: Order, retained: Order):
+        for node in nodes:
+            self.visit(node, factor, retained)
+
+    def visit_children(self, node: ast.AST, factor: Order, retained: Order):
+        for child in ast.iter_child_nodes(node):
+            self.visit(child, factor, retained)
+
+    def visit_comprehension(self, node: ast.expr, factor: Order, retained: Order):
+        inner, size = factor, CONSTANT
+        for generator in node.generators:
+            self.visit(generator.iter, inner, retained)
+            order = self.iteration_order(generator.iter)
+            inner, size = times(inner, order), times(size, order)
+            for condition in generator.ifs:
+                self.visit(condition, inner, retained)
+        self.cost.spend(inner)
+        if not isinstance(node, ast.GeneratorExp):
+            retained = times(retained, size)
+            self.cost.allocate(retained)
+        for element in (node.key, node.value) if isinstance(node, ast.DictComp) else (node.elt,):
+            self.visit(element, inner, retained)
+
+    def visit_call(self, node: ast.Call, factor: Order, retained: Order):
+        self.visit_children(node, factor, retained)
+        self.cost.spend(factor)
+        name, receiver = call_name(node)
+        if name is None:
+            return
+
+        if self.is_self_call(node):
+            self.cost.recursive_calls += 1
+            self.cost.recursion_in_loop = self.cost.recursion_in_loop or factor != CONSTANT
+            self.cost.recursion_shrinks.add(self.shrink_kind(node))
+            return
+        callee = self.module.resolve(name, receiver, self.node)
+        if callee is not None:
+            if callee in self.module.analysing:
+                # Functions calling each other in a cycle
+                self.cost.doubt()
+            else:
+                self.cost.include(factor, self.module.cost(callee))
+            return
+
+        arguments = len(node.args) + len(node.keywords)
+        if receiver is None or (isinstance(receiver, ast.Name) and receiver.id in ('heapq', 'bisect', 'collections')):
+            if name in PYTHON_LOGARITHMIC_FUNCTIONS:
+                self.cost.spend(factor, LOGARITHMIC)
+            elif name in PYTHON_LINEAR_FUNCTIONS and len(node.args) == 1 \
+                    and not is_literal(node.args[0], self.module.constant_names):
+                self.cost.spend(factor, LINEARITHMIC if name == 'sorted' else LINEAR)
+                if name in PYTHON_COPYING_FUNCTIONS:
+                    self.cost.allocate(retained, LINEAR)
+            elif name in PYTHON_METHOD_COSTS:
+                runtime, space = PYTHON_METHOD_COSTS[name]
+                self.cost.spend(factor, runtime)
+                self.cost.allocate(retained, space)
+            return
+
+        if name == 'pop' and node.args:
+            self.visit_removal(receiver, node.args[0], factor)
+        elif name in PYTHON_METHOD_COSTS and arguments <= 2:
+            runtime, space = PYTHON_METHOD_COSTS[name]
+            self.cost.spend(factor, runtime)
+            self.cost.allocate(retained, space)
+        if name in PYTHON_GROWING_METHODS:
+            self.cost.allocate(factor)
+
+    def visit_removal(self, container: ast.expr, index: ast.expr, factor: Order):
+        """
+        `items.pop(index)` and `del items[index]`: removing from a list shifts every element after the index,
+        unless it counts from the end, removing from a dict does not. Containers that could be either are left
+        to the model, unless the index is an integer literal.
+        """
+        if isinstance(index, ast.UnaryOp) or (isinstance(index, ast.Constant) and index.value == -1):
+            return
+        kind = value_kind(container, self.kinds)
+        if kind in HASHED_KINDS or kind == 'constant':
+            return
+        if kind in SEQUENCE_KINDS or (isinstance(index, ast.Constant) and type(index.value) is int):
+            self.cost.spend(factor, LINEAR)
+        else:
+            self.cost.doubt()
+
+    def concatenates_lists(self, node: ast.BinOp) -> bool:
+        """Whether one side of `+` is a list that grows with the input, rather than a list display."""
+        return any(not isinstance(operand, ast.List) and value_kind(operand, self.kinds) == 'list'
+                   for operand in (node.left, node.right))
+
+    def visit_membership(self, container: ast.expr, factor: Order):
+        if is_literal(container, self.module.constant_names):
+            return
+        if isinstance(container, ast.Call) and call_name(container)[0] == 'range':
+            return
+        kind = value_kind(container, self.kinds)
+        if kind in SEQUENCE_KINDS:
+            self.cost.spend(factor, LINEAR)
+        elif kind not in HASHED_KINDS and kind != 'constant':
+            # `x in items` is constant time for sets and dicts and linear for lists, which cannot be told apart
+            self.cost.doubt()
+
+    def constant_slice(self, node: ast.Slice) -> bool:
+        lower, upper = node.lower, node.upper
+        constant = (lambda part: part is None or is_literal(part, self.module.constant_names))
+        if not constant(node.step):
+            return False
+        if upper is not None and constant(upper) and constant(lower):
+            return True
+        # x[-3:] keeps a constant number of elements
+        return upper is None and isinstance(lower, ast.UnaryOp) and constant(lower)
+
+    def iteration_order(self, node: ast.expr) -> Order:
+        if is_literal(node, self.module.constant_names):
+            return CONSTANT
+        if isinstance(node, ast.Name) and self.kinds.get(node.id) == 'constant':
+            return CONSTANT
+        if isinstance(node, ast.Call):
+            name, receiver = call_name(node)
+            if name == 'range' and receiver is None:
+                if any(isinstance(child, ast.BinOp) and isinstance(child.op, ast.Pow)
+                       or isinstance(child, ast.Name) and child.id in ('sqrt', 'isqrt')
+                       or isinstance(child, ast.Attribute) and child.attr in ('sqrt', 'isqrt')
+                       for argument in node.args for child in ast.walk(argument)):
+                    # Square root bounds are out of the analyzer's vocabulary
+                    self.cost.doubt()
+                return CONSTANT if all(is_literal(argument, self.module.constant_names) for argument in node.args) \
+                    else LINEAR
+            if name in PYTHON_LAZY_FUNCTIONS and receiver is None and node.args:
+                return max(self.iteration_order(argument) for argument in node.args)
+            if name in ('items', 'keys', 'values') and receiver is not None:
+                return self.iteration_order(receiver)
+        return LINEAR
+
+    def while_order(self, node: ast.While) -> Order:
+        test_names = {child.id for child in ast.walk(node.test) if isinstance(child, ast.Name)}
+        if not test_names:
+            # `while True` loops end on a condition somewhere in their body
+            self.cost.doubt()
+            return LINEAR
+
+        halving = stepping = consuming = nested_loop = False
+        for statement in node.body:
+            for child in ast.walk(statement):
+                if isinstance(child, (ast.For, ast.AsyncFor, ast.While, ast.comprehension)):
+                    nested_loop = True
+                elif isinstance(child, ast.AugAssign) and isinstance(child.target, ast.Name) \
+                        and child.target.id in test_names:
+                    if isinstance(child.op, (ast.FloorDiv, ast.Div, ast.RShift, ast.Mult, ast.LShift, ast.Mod)):
+                        halving = True
+                    elif isinstance(child.op, (ast.Add, ast.Sub)):
+                        stepping = True
+                elif isinstance(child, ast.Assign):
+                    targets = {target.id for assigned in child.targets for target in ast.walk(assigned)
+                               if isinstance(target, ast.Name)}
+                    if self.halves(child.value) or (targets & test_names and any(
+                            isinstance(part, ast.BinOp) and isinstance(part.op, ast.Mod)
+                            for part in ast.walk(child.value))):
+                        # Binary searches and Euclid's algorithm
+                        halving = True
+                    elif targets & test_names and isinstance(child.value, ast.Attribute):
+                        # node = node.next
+                        consuming = True
+                    elif targets & test_names and isinstance(child.value, ast.BinOp) \
+                            and isinstance(child.value.op, (ast.Add, ast.Sub)):
+                        stepping = True
+                elif isinstance(child, ast.Call) and call_name(child)[0] in ('pop', 'popleft', 'popitem') \
+                        and isinstance(call_name(child)[1], ast.Name) and call_name(child)[1].id in test_names:
+                    consuming = True
+
+        if halving:
+            return LOGARITHMIC
+        if stepping or consuming:
+            # Work queues that are refilled inside the loop (graph traversals) are left to the model
+            if consuming and nested_loop:
+                self.cost.doubt()
+            return LINEAR
+        self.cost.doubt()
+        return LINEAR
+
+    def is_self_call(self, node: ast.Call) -> bool:
+        name, receiver = call_name(node)
+        if name != self.node.name:
+            return False
+        if self.node in self.module.classes:
+            return isinstance(receiver, ast.Name) and receiver.id in ('self', 'cls')
+        return receiver is None
+
+    def shrink_kind(self, node: ast.Call) -> str:
+        kinds = set()
+        for argument in node.args + [keyword.value for keyword in node.keywords]:
+            for child in ast.walk(argument):
+                if isinstance(child, ast.Name) and child.id in self.halving_names or self.halves(child):
+                    kinds.add('halve')
+                elif isinstance(child, ast.BinOp) and isinstance(child.op, (ast.Sub, ast.Add)) \
+                        and isinstance(child.right, ast.Constant):
+                    kinds.add('decrement')
+                elif isinstance(child, ast.Slice) and (child.lower is not None or child.upper is not None) \
+                        and all(part is None or isinstance(part, (ast.Constant, ast.UnaryOp))
+                                for part in (child.lower, child.upper)):
+                    kinds.add('decrement')
+        if 'halve' in kinds:
+            return 'halve'
+        return 'decrement' if kinds else 'unknown'
+
+    def calls_per_path(self, nodes: list) -> int:
+        return sum(self.path_calls(node) for node in nodes)
+
+    def path_calls(self, node: ast.AST) -> int:
+        """Calls to the function itself on the path through `node` that makes the most of them."""
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+            return 0
+        if isinstance(node, ast.If):
+            return self.path_calls(node.test) + max(self.calls_per_path(node.body), self.calls_per_path(node.orelse))
+        if isinstance(node, ast.IfExp):
+            return self.path_calls(node.test) + max(self.path_calls(node.body), self.path_calls(node.orelse))
+        calls = 1 if isinstance(node, ast.Call) and self.is_self_call(node) else 0
+        return calls + sum(self.path_calls(child) for child in ast.iter_child_nodes(node))
+
+
+def estimate_python_complexities(code_block: str) -> list[ComplexityEstimate]:
+    source = textwrap.dedent(code_block)
+    try:
+        module = ast.parse(source)
+    except (SyntaxError, ValueError, RecursionError):
+        return []
+
+    python_module = PythonModule(module)
+    lines = source.split('\n')
+    declared = []
+
+    def collect(nodes: list, qualifier: str = ''):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                declared.append((node, f'{qualifier}{node.name}'))
+            elif isinstance(node, ast.ClassDef):
+                collect(node.body, f'{qualifier}{node.name}.')
+
+    collect(module.body)
+    short_names = [node.name for node, _ in declared]
+    estimates = []
+    for node, qualified_name in declared:
+        cost = python_module.cost(node)
+        first_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        estimates.append(ComplexityEstimate(
+            name=node.name if short_names.count(node.name) == 1 else qualified_name,
+            source=textwrap.dedent('\n'.join(lines[first_line - 1:node.end_lineno])),
+            runtime=cost.runtime,
+            space=cost.space,
+            confident=cost.confident,
+        ))
+    return estimates
+
+
+# Java, C++, JavaScript and TypeScript
+
+BRACE_KEYWORDS = {'if', 'for', 'while', 'switch', 'catch', 'return', 'sizeof', 'typeof', 'function', 'new', 'do',
+                  'super', 'this', 'await', 'throw', 'synchronized', 'foreach'}
+# Methods whose callback runs once per element
+ITERATING_METHODS = {'forEach', 'map', 'filter', 'reduce', 'reduceRight', 'some', 'every', 'flatMap', 'anyMatch',
+                     'allMatch', 'noneMatch', 'for_each', 'transform', 'accumulate'}
+JAVASCRIPT_ITERATING_METHODS = {'find', 'findIndex', 'findLast', 'findLastIndex'}
+# Method or function name: (runtime, extra space)
+BRACE_CALL_COSTS = {
+    'sort': (LINEARITHMIC, LOGARITHMIC),
+    'sorted': (LINEARITHMIC, LINEAR),
+    'stable_sort': (LINEARITHMIC, LINEAR),
+    'binarySearch': (LOGARITHMIC, CONSTANT),
+    'binary_search': (LOGARITHMIC, CONSTANT),
+    'lower_bound': (LOGARITHMIC, CONSTANT),
+    'upper_bound': (LOGARITHMIC, CONSTANT),
+    'indexOf': (LINEAR, CONSTANT),
+    'lastIndexOf': (LINEAR, CONSTANT),
+    'includes': (LINEAR, CONSTANT),
+    'reverse': (LINEAR, CONSTANT),
+    'fill': (LINEAR, CONSTANT),
+    'splice': (LINEAR, LINEAR),
+    'shift': (LINEAR, CONSTANT),
+    'unshift': (LINEAR, CONSTANT),
+    'slice': (LINEAR, LINEAR),
+    'concat': (LINEAR, LINEAR),
+    'join': (LINEAR, LINEAR),
+    'split': (LINEAR, LINEAR),
+    'from': (LINEAR, LINEAR),
+    'toArray': (LINEAR, LINEAR),
+    'copyOf': (LINEAR, LINEAR),
+    'copyOfRange': (LINEAR, LINEAR),
+    'clone': (LINEAR, LINEAR),
+    'collect': (LINEAR, LINEAR),
+    'toList': (LINEAR, LINEAR),
+    'addAll': (LINEAR, LINEAR),
+    # The callbacks of iterating methods are already counted once per element
+    'map': (CONSTANT, LINEAR),
+    'filter': (CONSTANT, LINEAR),
+    'flatMap': (CONSTANT, LINEAR),
+}
+GROWING_METHODS = {'push', 'add', 'put', 'push_back', 'emplace_back', 'emplace', 'append', 'offer', 'insert',
+                   'addLast', 'addFirst', 'push_front', 'unshift', 'set', 'putIfAbsent', 'computeIfAbsent'}
+# Lookups that are constant time on hashed containers and linear on lists, which tokens cannot tell apart
+AMBIGUOUS_METHODS = {'contains', 'remove', 'erase', 'count', 'find', 'containsKey', 'containsValue'}
+COLLECTION_TYPE_MARKERS = ('List', 'Set', 'Map', 'Array', 'Vector', 'Queue', 'Deque', 'Stack', 'Heap', 'Buffer',
+                           'Builder', 'vector', 'deque', 'map', 'set')
+BRACKET_PAIRS = {'(': ')', '[': ']', '{': '}'}
+JAVASCRIPT_FAMILY = {AcceptedCodeLanguages.Javascript, AcceptedCodeLanguages.Typescript,
+                     AcceptedCodeLanguages.JavascriptReact, AcceptedCodeLanguages.TypescriptReact}
+
+
+class BraceFunctionAnalyzer:
+    """
+    Token based counterpart of `PythonFunctionAnalyzer` for languages with braces: `for` and `while` loops and
+    iterating methods (`forEach`, `map`, streams) multiply the cost of what runs inside them, `for` headers
+    that multiply or shift their counter are logarithmic and ones bounded by a literal are constant.
+    """
+
+    def __init__(self, declaration: Declaration, language: AcceptedCodeLanguages,
+                 functions: dict[str, Declaration], costs: dict[str, FunctionCost], analysing: list[str]):
+        self.declaration = declaration
+        self.language = language
+        self.short_name = declaration.name.split('.')[-1]
+        self.functions = functions
+        self.costs = costs
+        self.analysing = analysing
+        self.iterating_methods = ITERATING_METHODS | (JAVASCRIPT_ITERATING_METHODS if language in JAVASCRIPT_FAMILY
+                                                      else set())
+        self.tokens: list[Token] = [token for token in tokenize(declaration.source, language)
+                                    if token.kind in (NAME, NUMBER, STRING, OPERATOR) and not token.text.isspace()]
+        self.matches = self.match_brackets()
+        self.cost = FunctionCost()
+
+    def text(self, index: int) -> str:
+        return self.tokens[index].text if 0 <= index < len(self.tokens) else ''
+
+    def joined(self, start: int, end: int) -> str:
+        return ''.join(token.text for token in self.tokens[start:end])
+
+    def match_brackets(self) -> dict[int, int]:
+        matches, openings = dict(), []
+        for index, token in enumerate(self.tokens):
+            if token.text in BRACKET_PAIRS:
+                openings.append(index)
+            elif token.text in BRACKET_PAIRS.values():
+                while openings and BRACKET_PAIRS[self.tokens[openings[-1]].text] != token.text:
+                    openings.pop()
+                if openings:
+                    matches[openings.pop()] = index
+        return matches
+
+    def statement_end(self, start: int) -> int:
+        """Index of the last token of the statement starting at `start`, for loops whose body is not a block."""
+        index = start
+        while index < len(self.tokens):
+            text = self.text(index)
+            if text in BRACKET_PAIRS:
+                closing = self.matches.get(index, len(self.tokens) - 1)
+                if text == '{' and self.text(closing + 1) != 'else':
+                    return closing
+                index = closing + 1
+                continue
+            if text == ';':
+                if self.text(index + 1) != 'else':
+                    return index
+            index += 1
+        return len(self.tokens) - 1
+
+    def names_in(self, start: int, end: int) -> set[str]:
+        return {token.text for token in self.tokens[start:end] if token.kind == NAME}
+
+    def for_order(self, open_paren: int, close_paren: int) -> Order:
+        parts, part_start, depth = [], open_paren + 1, 0
+        for index in range(open_paren + 1, close_paren):
+            text = self.text(index)
+            if text in BRACKET_PAIRS:
+                depth += 1
+            elif text in BRACKET_PAIRS.values():
+                depth -= 1
+            elif text == ';' and depth == 0:
+                parts.append((part_start, index))
+                part_start = index + 1
+        parts.append((part_start, close_paren))
+
+        if len(parts) != 3:
+            # for (x : xs), for (const x of xs), for (key in object)
+            iterable = next((index + 1 for index in range(open_paren + 1, close_paren)
+                             if self.text(index) in ('of', 'in', ':') and self.text(index + 1) != ':'
+                             and self.text(index - 1) != ':'), None)
+            if iterable is not None and self.text(iterable) == '[' \
+                    and all(token.kind != NAME for token in self.tokens[iterable:close_paren]):
+                return CONSTANT
+            return LINEAR
+
+        (init_start, init_end), (condition_start, condition_end), (update_start, update_end) = parts
+        update = self.joined(update_start, update_end)
+        condition = self.joined(condition_start, condition_end)
+        counters = self.names_in(init_start, init_end) | self.names_in(update_start, update_end)
+        if any(operator in update for operator in ('*=', '/=', '>>=', '<<=')) \
+                or any(f'{counter}={counter}{operator}' in update for counter in counters for operator in '*/'):
+            return LOGARITHMIC
+        if any(f'{counter}*{counter}' in condition for counter in counters):
+            # Square root bounds are out of the analyzer's vocabulary
+            self.cost.doubt()
+            return LINEAR
+        bounds = self.names_in(condition_start, condition_end) - counters
+        if not bounds and any(token.kind == NUMBER for token in self.tokens[condition_start:condition_end]):
+            return CONSTANT
+        if not any(operator in update for operator in ('++', '--', '+=', '-=')):
+            self.cost.doubt()
+        return LINEAR
+
+    def while_order(self, open_paren: int, close_paren: int, body_start: int, body_end: int) -> Order:
+        names = self.names_in(open_paren + 1, close_paren) - {'true', 'false', 'null', 'nullptr', 'undefined'}
+        if not names:
+            self.cost.doubt()
+            return LINEAR
+
+        body = self.joined(body_start, body_end + 1)
+        if any(f'{name}{operator}' in body for name in names for operator in ('/=', '>>=', '>>>=', '*=', '<<=', '%=')) \
+                or any(pattern in body for pattern in ('/2;', '/2)', '>>1;', '>>1)', '>>>1')) \
+                or any(f'{name}={other}%' in body for name in names for other in names):
+            return LOGARITHMIC
+        if any(f'{name}{operator}' in body or f'{operator}{name}' in body
+               for name in names for operator in ('++', '--')) \
+                or any(f'{name}{operator}' in body for name in names for operator in ('+=', '-=')):
+            return LINEAR
+        consuming = any(f'{name}.{method}(' in body for name in names
+                        for method in ('pop', 'shift', 'poll', 'pollFirst', 'pollLast', 'removeFirst', 'dequeue')) \
+            or any(f'{name}={name}.' in body or f'{name}={name}->' in body for name in names)
+        if consuming and not any(self.text(index) in ('for', 'while') or self.text(index) in self.iterating_methods
+                                 for index in range(body_start, body_end)):
+            return LINEAR
+        self.cost.doubt()
+        return LINEAR
+
+    def loop_regions(self, body_start: int) -> list[tuple[int, int, Order]]:
+        regions = []
+        for index in range(body_start, len(self.tokens)):
+            text = self.text(index)
+            if text in ('for', 'while') and self.text(index + 1) == '(' and index + 1 in self.matches:
+                close_paren = self.matches[index + 1]
+                if text == 'while' and self.text(close_paren + 1) == ';' \
+                        and any(end == index - 1 for _, end, _ in regions):
+                    # The condition of a do-while loop, classified with its body
+                    continue
+                body_start_index = close_paren + 1
+                body_end = self.matches.get(body_start_index, len(self.tokens) - 1) \
+                    if self.text(body_start_index) == '{' else self.statement_end(body_start_index)
+                order = self.for_order(index + 1, close_paren) if text == 'for' \
+                    else self.while_order(index + 1, close_paren, body_start_index, body_end)
+                regions.append((index, body_end, order))
+            elif text == 'do' and self.text(index + 1) == '{' and index + 1 in self.matches:
+                body_end = self.matches[index + 1]
+                condition = body_end + 2
+                if self.text(body_end + 1) == 'while' and condition in self.matches:
+                    order = self.while_order(condition, self.matches[condition], index + 1, body_end)
+                else:
+                    self.cost.doubt()
+                    order = LINEAR
+                regions.append((index, body_end, order))
+            elif text in self.iterating_methods and self.text(index - 1) == '.' and self.text(index + 1) == '(' \
+                    and index + 1 in self.matches:
+                regions.append((index, self.matches[index + 1], LINEAR))
+        return regions
+
+    def halving_names(self, body_start: int) -> set[str]:
+        names = set()
+        for index in range(body_start, len(self.tokens) - 1):
+            if self.tokens[index].kind == NAME and self.text(index + 1) == '=' and self.text(index + 2) != '=':
+                end = index + 2
+                while end < len(self.tokens) and self.text(end) not in (';', ','):
+                    end += 1
+                statement = self.joined(index + 2, end)
+                if '/2' in statement or '>>1' in statement:
+                    names.add(self.text(index))
+        return names
+
+    def shrink_kind(self, open_paren: int, halving_names: set[str]) -> str:
+        close_paren = self.matches.get(open_paren, len(self.tokens) - 1)
+        arguments = self.joined(open_paren + 1, close_paren)
+        if self.names_in(open_paren + 1, close_paren) & halving_names or '/2' in arguments or '>>1' in arguments:
+            return 'halve'
+        if any(token.kind == NUMBER and self.text(index - 1) in ('-', '+')
+               for index, token in enumerate(self.tokens[open_paren + 1:close_paren], start=open_paren + 1)) \
+                or '.slice(1' in arguments or '.substring(1' in arguments:
+            return 'decrement'
+        return 'unknown'
+
+    def is_self_call(self, index: int) -> bool:
+        if self.text(index) != self.short_name or self.text(index + 1) != '(':
+            return False
+        before = self.text(index - 1)
+        if before in ('.', '->'):
+            return self.text(index - 2) == 'this'
+        return before not in ('function', 'new', ':') \
+            and (self.tokens[index - 1].kind != NAME or before in ('return', 'await', 'yield', 'else', 'throw'))
+
+    def analyse(self) -> FunctionCost:
+        body_start = next((index for index, token in enumerate(self.tokens) if token.text == '{'
+                           and not self.inside_parentheses(index)), None)
+        if body_start is None:
+            self.cost.doubt()
+            return self.cost
+
+        regions = self.loop_regions(body_start + 1)
+        halving_names = self.halving_names(body_start + 1)
+        exclusive_calls = 0
+        for index in range(body_start + 1, len(self.tokens)):
+            factor = CONSTANT
+            for start, end, order in regions:
+                if start <= index <= end:
+                    factor = times(factor, order)
+            self.cost.spend(factor)
+            self.visit_token(index, factor, halving_names)
+            if self.is_self_call(index) and self.text(index - (3 if self.text(index - 1) in ('.', '->') else 1)) \
+                    in ('return', '?', ':'):
+                exclusive_calls += 1
+
+        # Self calls that are returned directly, or are the branches of a conditional, never run on the same path
+        calls = self.cost.recursive_calls - exclusive_calls + min(exclusive_calls, 1)
+        self.cost.resolve_recursion(calls)
+        return self.cost
+
+    def inside_parentheses(self, index: int) -> bool:
+        return any(opening < index < closing for opening, closing in self.matches.items() if self.text(opening) == '(')
+
+    def visit_token(self, index: int, factor: Order, halving_names: set[str]):
+        token = self.tokens[index]
+        text = token.text
+        if text == 'new':
+            self.visit_allocation(index + 1, factor)
+            return
+        if text == '.' and self.text(index + 1) == '.' and self.text(index + 2) == '.':
+            # Spread syntax copies the whole collection
+            self.cost.spend(factor, LINEAR)
+            self.cost.allocate(CONSTANT, LINEAR)
+            return
+        if text in ('vector', 'deque') and self.language == AcceptedCodeLanguages.CPlusPlus:
+            self.visit_vector(index, factor)
+            return
+        if token.kind != NAME or self.text(index + 1) != '(' or text in BRACE_KEYWORDS:
+            return
+
+        if self.is_self_call(index):
+            self.cost.recursive_calls += 1
+            self.cost.recursion_in_loop = self.cost.recursion_in_loop or factor != CONSTANT
+            self.cost.recursion_shrinks.add(self.shrink_kind(index + 1, halving_names))
+            return
+        method = self.text(index - 1) in ('.', '->')
+        if text in self.functions and (not method or self.text(index - 2) == 'this') \
+                and self.functions[text] is not self.declaration:
+            if text in self.analysing:
+                self.cost.doubt()
+            else:
+                self.cost.include(factor, brace_function_cost(self.functions[text], self.language, self.functions,
+                                                              self.costs, self.analysing))
+            return
+
+        if method and text in AMBIGUOUS_METHODS and not (self.language in JAVASCRIPT_FAMILY and text == 'find'):
+            self.cost.doubt()
+        elif text in BRACE_CALL_COSTS and (method or text not in ('map', 'filter', 'from', 'join', 'split')):
+            runtime, space = BRACE_CALL_COSTS[text]
+            self.cost.spend(factor, runtime)
+            self.cost.allocate(CONSTANT, space)
+        if method and text in GROWING_METHODS:
+            self.cost.allocate(factor)
+
+    def visit_allocation(self, index: int, factor: Order):
+        type_name = ''
+        while self.tokens[index:index + 1] and (self.tokens[index].kind == NAME or self.text(index) in ('.', ':')):
+            type_name += self.text(index)
+            index += 1
+        if self.text(index) == '<':
+            depth = 0
+            while index < len(self.tokens):
+                depth += {'<': 1, '>': -1}.get(self.text(index), 0)
+                index += 1
+                if depth == 0:
+                    break
+
+        if self.text(index) == '[':
+            dimensions = 0
+            while self.text(index) == '[' and index in self.matches:
+                if self.names_in(index + 1, self.matches[index]):
+                    dimensions += 1
+                index = self.matches[index] + 1
+            self.cost.spend(factor, Order(degree=dimensions))
+            self.cost.allocate(CONSTANT, Order(degree=dimensions))
+        elif self.text(index) == '(' and index in self.matches \
+                and any(marker in type_name for marker in COLLECTION_TYPE_MARKERS) \
+                and self.names_in(index + 1, self.matches[index]):
+            # new ArrayList<>(items), new Array(n), new Set(values)
+            self.cost.spend(factor, LINEAR)
+            self.cost.allocate(CONSTANT, LINEAR)
+
+    def visit_vector(self, index: int, factor: Order):
+        # vector<int> counts(n), vector<vector<int>> grid(n, vector<int>(m))
+        end = index + 1
+        if self.text(end) == '<':
+            depth = 0
+            while end < len(self.tokens):
+                depth += {'<': 1, '>': -1}.get(self.text(end), 0)
+                end += 1
+                if depth == 0:
+                    break
+        if self.tokens[end:end + 1] and self.tokens[end].kind == NAME:
+            end += 1
+        if self.text(end) in ('(', '{') and end in self.matches and self.names_in(end + 1, self.matches[end]):
+            dimensions = 1 + sum(self.text(position) in ('vector', 'deque')
+                                 for position in range(end + 1, self.matches[end]))
+            self.cost.spend(factor, Order(degree=dimensions))
+            self.cost.allocate(CONSTANT, Order(degree=dimensions))
+
+
+def brace_function_cost(declaration: Declaration, language: AcceptedCodeLanguages,
+                        functions: dict[str, Declaration], costs: dict[str, FunctionCost],
+                        analysing: list[str]) -> FunctionCost:
+    short_name = declaration.name.split('.')[-1]
+    if declaration.name not in costs:
+        analysing.append(short_name)
+        try:
+            costs[declaration.name] = BraceFunctionAnalyzer(declaration, language, functions, costs,
+                                                            analysing).analyse()
+        finally:
+            analysing.pop()
+    return costs[declaration.name]
+
+
+def estimate_brace_complexities(code_block: str, language: AcceptedCodeLanguages) -> list[ComplexityEstimate]:
+    declarations = split_declarations(code_block, language)
+    short_names = [declaration.name.split('.')[-1] for declaration in declarations]
+    # Calls by bare name only resolve to a function when that name is not overloaded
+    functions = {short_name: declaration for short_name, declaration in zip(short_names, declarations)
+                 if short_names.count(short_name) == 1}
+    costs: dict[str, FunctionCost] = dict()
+    estimates = []
+    for short_name, declaration in zip(short_names, declarations):
+        cost = brace_function_cost(declaration, language, functions, costs, [])
+        estimates.append(ComplexityEstimate(
+            name=short_name if short_names.count(short_name) == 1 else declaration.name,
+            source=textwrap.dedent(declaration.source),
+            runtime=cost.runtime,
+            space=cost.space,
+            confident=cost.confident,
+        ))
+    return estimates
+
+
+def estimate_complexities(code_block: str, language: AcceptedCodeLanguages) -> list[ComplexityEstimate]:
+    """
+    Runtime and space complexity of every function of a code block, worked out from its loops, recursion and
+    allocations without a model: Python is analysed on its syntax tree, the other languages on their tokens.
+    Returns an empty list when no function could be found, e.g. for code that does not parse.
+    """
+    if language == AcceptedCodeLanguages.Python:
+        return estimate_python_complexities(code_block)
+    return estimate_brace_complexities(code_block, language)
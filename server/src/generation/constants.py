@@ -1,7 +1,8 @@
 # OpenAI relevant constants
 
 from typing import Union
-from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.schemas import AcceptedCodeLanguages, AcceptedNaturalLanguages, GenerativeTransformerModel, \
+    SystemPrompt
 
 DEFINE_CODE_PREFIX = "/define"
 REVISE_CODE_PREFIX = "/revise"
@@ -9,6 +10,7 @@ EXPLAIN_CODE_PREFIX = "/explain"
 ANALYSE_CODE_PREFIX = "/analyse"
 ANNOTATE_CODE_PREFIX = "/annotate"
 GENERATE_PDF_CODE_PREFIX = "/generate"
+SUMMARISE_CODE_PREFIX = "/summarise"
 
 NAME_SCHEME_PARAMETER_TAG = '--naming-scheme'
 FRAMEWORK_PARAMETER_TAG = '--framework'
@@ -24,11 +26,62 @@ SIMPLE_MODEL_REQUEST_RATE_LIMIT = 3500
 INTERMEDIATE_MODEL_REQUEST_RATE_LIMIT = 3500
 COMPLEX_MODEL_REQUEST_RATE_LIMIT = 200
 
+# (tokens per minute, requests per minute), the Azure deployment quota is read from the settings
+MODEL_RATE_LIMITS = {
+    GenerativeTransformerModel.Simple: (SIMPLE_MODEL_TOKEN_RATE_LIMIT, SIMPLE_MODEL_REQUEST_RATE_LIMIT),
+    GenerativeTransformerModel.Intermediate: (INTERMEDIATE_MODEL_TOKEN_RATE_LIMIT,
+                                              INTERMEDIATE_MODEL_REQUEST_RATE_LIMIT),
+    GenerativeTransformerModel.Complex: (COMPLEX_MODEL_TOKEN_RATE_LIMIT, COMPLEX_MODEL_REQUEST_RATE_LIMIT),
+}
+
+# Completion tokens reserved for commands whose output does not echo the input code block
+DEFAULT_COMPLETION_TOKEN_ESTIMATE = 512
+
+# Context windows (prompt and completion tokens together), the Azure deployment's is read from the settings
+MODEL_CONTEXT_TOKENS = {
+    GenerativeTransformerModel.Complex: 8192,
+    GenerativeTransformerModel.Simple: 4096,
+    GenerativeTransformerModel.Intermediate: 16384,
+}
+
+# `max_tokens` of every completion as a fixed allowance plus a share of the code block's tokens, the commands
+# that echo the code block get more than the code block itself for the comments or longer names they add
+COMPLETION_TOKEN_BUDGETS = {
+    SystemPrompt.Annotate: (256, 2.0),
+    SystemPrompt.Define: (512, 2.0),
+    SystemPrompt.Revise: (256, 1.25),
+    SystemPrompt.Analyse: (256, 0.25),
+    SystemPrompt.Generate: (512, 0.5),
+    SystemPrompt.Summarise: (512, 0.0),
+}
+PATCH_COMPLETION_TOKEN_BUDGET = (256, 1.0)
+# /create-pdf answers with a name, description, descriptor and usage example for every declaration on top of that
+GENERATE_TOKENS_PER_DECLARATION = 160
+# /explain is budgeted by its complexity level, level 1 answers in at most 50 words
+EXPLANATION_COMPLETION_TOKENS = {1: 128, 2: 256, 3: 512, 4: 768, 5: 1024}
+# The same explanation takes about this many times the tokens of its English version, languages written in other
+# scripts are split into far shorter tokens
+NATURAL_LANGUAGE_TOKEN_FACTORS = {
+    AcceptedNaturalLanguages.English: 1.0,
+    AcceptedNaturalLanguages.German: 1.5,
+    AcceptedNaturalLanguages.Spanish: 1.5,
+    AcceptedNaturalLanguages.Italian: 1.5,
+    AcceptedNaturalLanguages.Portuguese: 1.5,
+    AcceptedNaturalLanguages.Latin: 1.75,
+    AcceptedNaturalLanguages.Mandarin: 2.0,
+    AcceptedNaturalLanguages.Japanese: 2.5,
+    AcceptedNaturalLanguages.Russian: 2.5,
+    AcceptedNaturalLanguages.Arabic: 3.0,
+    AcceptedNaturalLanguages.Urdu: 3.5,
+    AcceptedNaturalLanguages.Hindi: 4.0,
+}
+# Completions of commands that do not echo the code block are not worth sending with fewer tokens left than this
+MIN_COMPLETION_TOKENS = 256
+
 
 # SYSTEM PROMPTS
 def EXPLAIN_PROMPT(language: Union[str, None]) -> str:
-    return f"You are required to give your responses in {language if language is not None else 'english'}." \
-           "You are a helpful and autonomous code documentation tool, you understand the general structure and " \
+    return "You are a helpful and autonomous code documentation tool, you understand the general structure and " \
            "functionality of code. You will be given blocks of code and you will have to generate documentation " \
            "and explanations relevant to those blocks of code. You will act when prompted with the following " \
            "command:" \
@@ -45,7 +98,8 @@ def EXPLAIN_PROMPT(language: Union[str, None]) -> str:
            "optimize the performance of code if there are any." \
            "" \
            "Your responses shouldn't include any other metadata or conversational text, just the appropriate " \
-           "output from the above command."
+           "output from the above command. " \
+           f"You are required to give your responses in {language if language is not None else 'english'}."
 
 
 def DEFINE_PROMPT(custom_framework: Union[str, None]) -> str:
@@ -117,6 +171,62 @@ def ANNOTATE_PROMPT() -> str:
         "output from the above command."
 
 
+def ANNOTATE_PATCH_PROMPT() -> str:
+    return "You are a helpful and autonomous code documentation tool, you understand the general structure and " \
+           "functionality of code. You will be given blocks of code and you will have to generate documentation " \
+           "and explanations relevant to those blocks of code. You will act when prompted with the following " \
+           "command:" \
+           "" \
+           "Your command is /annotate. I will query you with a statement prefaced by the term \"/annotate\", " \
+           "followed by a code block in which every line starts with its line number and a \"|\" separator. You " \
+           "will write line by line comments for that code block wherever you see fit, but instead of returning " \
+           "the code block you will only return each comment together with the number of the line it is to be " \
+           "written directly above. If there is a code chunk that can collectively be summarized by a singular " \
+           "comment, give that comment for the first line of the chunk without commenting each line in that " \
+           "particular chunk. Do not add any comments for the line declaring a function or a class, I only want " \
+           "comments inside a function or a class. Only write the text of the comment, without any comment " \
+           "characters or indentation, it will be indented and wrapped to 100 characters for you. Your output " \
+           "must be a single JSON object of the following format:" \
+           "\n" \
+           "{\"insertions\": [" \
+           "{\"line\": 3, \"comment\": \"<comment for line 3>\"}, " \
+           "{\"line\": 7, \"comment\": \"<comment for the chunk starting at line 7>\"}" \
+           "]}" \
+           "\n" \
+           "Your responses shouldn't include any other metadata or conversational text, just the JSON object."
+
+
+def DEFINE_PATCH_PROMPT(custom_framework: Union[str, None]) -> str:
+    framework_snippet = \
+        f"Write every definition following the specifications of the {custom_framework} documentation framework." \
+        if custom_framework is not None else \
+        "Write every definition as a short description of the declaration, followed by an \"INPUT:\" section " \
+        "listing each input argument as \"- input_argument : input_type (brief input explanation)\" and an " \
+        "\"OUTPUT:\" section describing the output as \"output_parameter : output_type (brief output " \
+        "explanation)\", on lines of their own."
+
+    return "You are a helpful and autonomous code documentation tool, you understand the general structure and " \
+           "functionality of code. You will be given blocks of code and you will have to generate documentation " \
+           "and explanations relevant to those blocks of code. You will act when prompted with the following " \
+           "command:" \
+           "" \
+           "Your command is /define. I will give you a statement prefaced by the term \"/define\" and this command " \
+           "will be followed by a block of code in which every line starts with its line number and a \"|\" " \
+           "separator. Your task is to write a definition for every function and class declared in the code " \
+           "block, detailing what the declaration does and its parameter information, but instead of returning " \
+           "the code block you will only return each definition together with the number of the line the " \
+           "declaration starts on. " + framework_snippet + " Only write the text of the definition, without any " \
+           "comment characters, docstring quotes or indentation, it will be formatted as a documentation block " \
+           "of the code's language for you. Your output must be a single JSON object of the following format:" \
+           "\n" \
+           "{\"insertions\": [" \
+           "{\"line\": 1, \"comment\": \"<definition of the declaration on line 1>\"}, " \
+           "{\"line\": 12, \"comment\": \"<definition of the declaration on line 12>\"}" \
+           "]}" \
+           "\n" \
+           "Your responses shouldn't include any other metadata or conversational text, just the JSON object."
+
+
 def REVISE_PROMPT(casing_scheme: Union[str, None]) -> str:
     casing_snippet = f'3) Variable names must be written in the {casing_scheme}-case scheme.' \
                      f'' if casing_scheme is not None else ''
@@ -153,64 +263,54 @@ def ANALYSE_PROMPT() -> str:
            "" \
            "Your command is /analyse. I will query you with a statement prefaced by the term \"/analyse\", you " \
            "will take a code block that will be provided to you and return the complexity of that code block. " \
-           "If there are multiple functions, you will have to provide the time complexity and space complexity " \
-           "of each function in big O notation separated by newlines. Your output should be of the following " \
-           "format;" \
-           "" \
-           "<Function 1 name>: O(n) runtime, O(log n) space" \
-           "<Function 2 name>: O(2^n) runtime, O(n * log n) space" \
-           "<Function 3 name>: O(n^3) runtime, O(n^2) space" \
-           "" \
+           "For every function, you will have to provide the time complexity and space complexity in big O " \
+           "notation. Your output must be a single JSON object of the following format:" \
+           "\n" \
+           "{\"functions\": [" \
+           "{\"name\": \"<function 1 name>\", \"runtime\": \"O(n)\", \"space\": \"O(log n)\"}, " \
+           "{\"name\": \"<function 2 name>\", \"runtime\": \"O(2^n)\", \"space\": \"O(n * log n)\"}" \
+           "]}" \
+           "\n" \
            "Please note that this is just a placeholder template for the format of the output and you will need " \
-           "to parse the function names from the input code block.Your responses shouldn't include any other " \
-           "metadata or conversational text, just the appropriate output from the above command."
+           "to parse the function names from the input code block. Your responses shouldn't include any other " \
+           "metadata or conversational text, just the JSON object."
 
 
 def GENERATE_PDF_PROMPT(code_language: AcceptedCodeLanguages) -> str:
-    return "You are a helpful and autonomous code documentation tool, you understand te general structure and " \
-           "functionality of code. You will be given blocks of code and you will generation documentation and " \
+    return "You are a helpful and autonomous code documentation tool, you understand the general structure and " \
+           "functionality of code. You will be given blocks of code and you will generate documentation and " \
            "explanations relevant to those blocks of code. You will act when prompted with the following command:" \
            "" \
            "Your command is /generate. I will query you with a statement prefaced by the term \"/generate\", you " \
            "will take a code block that will be provided to you and return metadata that pertains to " \
-           "documentation for each function definition in that code block in the specified tempate below, wherever you " \
-           f"need to write code blocks, please use the {code_language.value} programming language; You will " \
-           "write the snippets between \"#####\" separation tags as will be shown in the format below. " \
-           "Firstly you will write a title and brief description of the purpose of this code segment. " \
-           "After that you will write the function snapshot with its input and output parameters" \
-           " and function explanations in the following format, for the function explanations, please give a slightly " \
-           "detailed rundown of the functionality and purpose of this function in atleast 5 lines. You should separate " \
-           "the function explanation portions of your response with \"#####\" separation tags as showing in the template " \
-           "below. This is an absolutely necessary step. Given below is the template of your response. Please follow it religiously." \
-           "\n" \
-           "...\n" \
+           "documentation for each function definition in that code block as a single JSON object in the " \
+           f"template below. Wherever you need to write code, please use the {code_language.value} programming " \
+           "language. Firstly you will write a title and brief description of the purpose of this code segment. " \
+           "After that you will write, for every function, its name, its descriptor with its input and output " \
+           "parameters, a slightly detailed rundown of the functionality and purpose of the function in at least " \
+           "5 sentences and an example of its usage with one line of usage context before and after the function " \
+           "call. Given below is the template of your response. Please follow it religiously." \
            "\n" \
-           "title: <insert_title_here>\n" \
-           "description: <insert_description_here>\n" \
+           "{\"title\": \"<insert_title_here>\", \"description\": \"<insert_description_here>\", " \
+           "\"functions\": [{\"name\": \"<function_name>\", " \
+           "\"function_descriptor\": \"Function <function_name>: (<input_parameter_name>: <input_type>, ...) -> " \
+           "<output_parameter_name>: <output_type>\", " \
+           "\"description\": \"<insert_detailed_function_explanation>\", " \
+           "\"usage_example\": \"<example_instance_of_the_function>\"}]}" \
            "\n" \
-           "#####\n" \
-           "\n" \
-           "Function <function_name_1>: (<input_parameter_name>: <input_type>, <input_parameter_name>: <input_type>, ...) -> <output_parameter_name>: <output_type>\n" \
-           "<insert_detailed_function_explanation>\n" \
-           "Usage Example:\n" \
-           "<example_instance of function with a one line of usage context before and after the function call>" \
-           "\n" \
-           "#####\n" \
-           "\n" \
-           "Function <function_name_2>: (<input_parameter_name>: <input_type>, <input_parameter_name>: <input_type>, ...) -> <output_parameter_name>: <output_type>\n" \
-           "<insert_detailed_function_explanation>\n" \
-           "Usage Example:\n" \
-           "<example_instance of function with a one line of usage context before and after the function call>" \
-           "\n" \
-           "#####\n" \
-           "\n" \
-           "Function <function_name_3>: (<input_parameter_name>: <input_type>, <input_parameter_name>: <input_type>, ...) -> <output_parameter_name>: <output_type>\n" \
-           "<insert_detailed_function_explanation>\n" \
-           "Usage Example:\n" \
-           "<example_instance of function with a one line of usage context before and after the function call>" \
+           "Your responses shouldn't include any other metadata or conversational text, just the JSON object."
+
+
+def SUMMARISE_PROMPT(code_language: AcceptedCodeLanguages) -> str:
+    return "You are a helpful and autonomous code documentation tool, you understand the general structure and " \
+           "functionality of code. You will be given blocks of code and you will generate documentation and " \
+           "explanations relevant to those blocks of code. You will act when prompted with the following command:" \
+           "" \
+           "Your command is /summarise. I will query you with a statement prefaced by the term \"/summarise\", you " \
+           f"will take an outline of a {code_language.value} file where function bodies have been replaced with " \
+           "\"...\" and return a title and a brief description of the purpose of the file as a single JSON object " \
+           "in the template below." \
            "\n" \
-           "...\n" \
+           "{\"title\": \"<insert_title_here>\", \"description\": \"<insert_description_here>\"}" \
            "\n" \
-           "Please make sure that the \"#####\" seperation tags are correctly displayed in your output between all sections (do not shift away " \
-           "from this format). Your responses shouldn't include any other metadata or conversational text, " \
-           "just the appropriate output from the above command."
+           "Your responses shouldn't include any other metadata or conversational text, just the JSON object."
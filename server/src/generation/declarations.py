@@ -0,0 +1,210 @@
+import re
+import ast
+import textwrap
+
+from typing import NamedTuple, Union
+
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.tokenizer import COMMENT, NEWLINE, OPERATOR, STRING, WHITESPACE, tokenize
+
+CONTROL_KEYWORDS = {'if', 'else', 'for', 'while', 'do', 'switch', 'try', 'catch', 'finally', 'with', 'return'}
+CONTAINER_HEADER = re.compile(r'\b(?:class|interface|struct|enum|record|namespace|module)\s+([A-Za-z_$][\w$]*)')
+FUNCTION_KEYWORD_HEADER = re.compile(r'\bfunction\b\s*\*?\s*([A-Za-z_$][\w$]*)?')
+ASSIGNMENT_HEADER = re.compile(r'([A-Za-z_$][\w$]*)\s*(?::[^=]*)?=(?![=>])')
+CALLABLE_NAME = re.compile(r'([A-Za-z_$~][\w$:~]*)\s*(?:<[^()]*>)?\s*\($')
+
+
+class Declaration(NamedTuple):
+    name: str
+    source: str
+    start: int
+    end: int
+
+
+def split_declarations(source: str, language: AcceptedCodeLanguages,
+                       include_containers: bool = False) -> list[Declaration]:
+    """
+    Splits a file into the function declarations a documentation pass cares about: top level functions and the
+    methods of top level classes (or namespaces), in source order, with the classes themselves ahead of their
+    methods when `include_containers` is set. Returns an empty list when nothing could be recognised so that
+    callers can fall back to handling the file as a whole.
+    """
+    if language == AcceptedCodeLanguages.Python:
+        return split_python_declarations(source, include_containers)
+    return split_brace_declarations(source, language, include_containers=include_containers)
+
+
+def split_python_declarations(source: str, include_containers: bool = False) -> list[Declaration]:
+    try:
+        module = ast.parse(source)
+    except SyntaxError:
+        return []
+
+    line_offsets = [0]
+    for line in source.split('\n'):
+        line_offsets.append(line_offsets[-1] + len(line) + 1)
+
+    def to_declaration(node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef],
+                       qualifier: str = '') -> Declaration:
+        first_line = min([node.lineno] + [decorator.lineno for decorator in node.decorator_list])
+        start, end = line_offsets[first_line - 1], line_offsets[node.end_lineno]
+        return Declaration(f'{qualifier}{node.name}', source[start:end], start, end)
+
+    declarations = []
+    for node in module.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            declarations.append(to_declaration(node))
+        elif isinstance(node, ast.ClassDef):
+            if include_containers:
+                declarations.append(to_declaration(node))
+            declarations.extend(to_declaration(child, qualifier=f'{node.name}.') for child in node.body
+                                if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)))
+    return declarations
+
+
+def split_brace_declarations(source: str, language: AcceptedCodeLanguages, offset: int = 0,
+                             qualifier: str = '', nesting: int = 0,
+                             include_containers: bool = False) -> list[Declaration]:
+    declarations = []
+    depth = 0
+    paren_depth = 0
+    segment_start = None
+    body_start = None
+    header = ''
+
+    for token in tokenize(source, language):
+        if token.kind in (WHITESPACE, NEWLINE, COMMENT):
+            continue
+        if segment_start is None:
+            segment_start = token.start
+        if token.kind != OPERATOR:
+            continue
+
+        # Braces opened inside parentheses (callbacks, decorator arguments) never start a declaration body
+        if depth == 0 and token.text in '()':
+            paren_depth = max(0, paren_depth + (1 if token.text == '(' else -1))
+        elif token.text == '{':
+            if depth == 0 and paren_depth == 0:
+                header = source[segment_start:token.start].strip()
+                body_start = token.end
+            depth += 1
+        elif token.text == '}' and depth > 0:
+            depth -= 1
+            if depth == 0 and body_start is not None:
+                declarations.extend(classify_segment(source, language, header, segment_start, body_start, token,
+                                                     offset, qualifier, nesting, include_containers))
+                segment_start = body_start = None
+        elif token.text == ';' and depth == 0 and paren_depth == 0:
+            segment_start = body_start = None
+
+    return declarations
+
+
+def classify_segment(source: str, language: AcceptedCodeLanguages, header: str, segment_start: int,
+                     body_start: int, closing_token, offset: int, qualifier: str, nesting: int,
+                     include_containers: bool = False) -> list[Declaration]:
+    first_word = header.split(maxsplit=1)[0] if header else ''
+    if not header or first_word in CONTROL_KEYWORDS:
+        return []
+
+    container = CONTAINER_HEADER.search(header)
+    if container is not None and nesting < 2:
+        # Document the members of classes and namespaces rather than the container as a whole
+        members = split_brace_declarations(source[body_start:closing_token.start], language,
+                                           offset=offset + body_start, qualifier=f'{qualifier}{container.group(1)}.',
+                                           nesting=nesting + 1, include_containers=include_containers)
+        if not include_containers:
+            return members
+        return [Declaration(f'{qualifier}{container.group(1)}', source[segment_start:closing_token.end],
+                            offset + segment_start, offset + closing_token.end)] + members
+
+    name = declaration_name(header)
+    if name is None:
+        return []
+    return [Declaration(f'{qualifier}{name}', source[segment_start:closing_token.end],
+                        offset + segment_start, offset + closing_token.end)]
+
+
+def declaration_name(header: str) -> Union[str, None]:
+    function_keyword = FUNCTION_KEYWORD_HEADER.search(header)
+    if function_keyword is not None:
+        return function_keyword.group(1) or 'default'
+    if '=>' in header:
+        assignment = ASSIGNMENT_HEADER.search(header)
+        return assignment.group(1) if assignment is not None else None
+
+    # C++, Java and class member signatures: the name directly precedes the parameter list
+    if '(' not in header or '=' in header.split('(', 1)[0]:
+        return None
+    callable_name = CALLABLE_NAME.search(header.split('(', 1)[0] + '(')
+    return callable_name.group(1) if callable_name is not None else None
+
+
+def outline_declarations(source: str, declarations: list[Declaration]) -> str:
+    """Returns the file with every declaration body collapsed to its signature line."""
+    outline_pieces = []
+    cursor = 0
+    for declaration in declarations:
+        outline_pieces.append(source[cursor:declaration.start])
+        declaration_lines = declaration.source.split('\n')
+        short_name = declaration.name.split('.')[-1]
+        signature = next((line for line in declaration_lines if short_name in line), declaration_lines[0])
+        outline_pieces.append(signature.rstrip() + ' ...' + ('\n' if declaration.source.endswith('\n') else ''))
+        cursor = declaration.end
+    outline_pieces.append(source[cursor:])
+    return ''.join(outline_pieces)
+
+
+def normalize_declaration_source(source: str, language: AcceptedCodeLanguages) -> str:
+    """
+    Declaration source without its comments (and docstrings for Python), indentation, trailing whitespace and
+    blank lines. Two declarations that only differ in their documentation or position normalize the same, so
+    documentation generated for one can be reused for the other.
+    """
+    tokens = list(tokenize(textwrap.dedent(source), language))
+    kept_pieces = []
+    for index, token in enumerate(tokens):
+        if token.kind == COMMENT:
+            continue
+        if token.kind == STRING and language == AcceptedCodeLanguages.Python \
+                and is_statement_string(tokens, index):
+            continue
+        kept_pieces.append(token.text)
+
+    lines = ''.join(kept_pieces).replace('\r\n', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines if line.strip())
+
+
+def is_statement_string(tokens: list, index: int) -> bool:
+    # A string that is the only thing on its line is an expression statement, i.e. a docstring
+    before = next((token for token in reversed(tokens[:index]) if token.kind != WHITESPACE), None)
+    after = next((token for token in tokens[index + 1:] if token.kind not in (WHITESPACE, COMMENT)), None)
+    return (before is None or before.kind == NEWLINE) and (after is None or after.kind == NEWLINE)
+
+
+def documented_span(source: str, declaration: Declaration, language: AcceptedCodeLanguages) -> tuple[int, int]:
+    """
+    Start and end offsets of a declaration together with the comment lines directly above it, widened to whole
+    lines so that the span can be cut out of one file and spliced into another.
+    """
+    line_start = source.rfind('\n', 0, declaration.start) + 1
+    if source[line_start:declaration.start].strip():
+        return declaration.start, declaration.end
+
+    span_start = line_start
+    tokens = list(tokenize(source[:line_start], language))
+    index = len(tokens) - 1
+    while index >= 0 and tokens[index].kind == NEWLINE:
+        comment_index = index - 1
+        while comment_index >= 0 and tokens[comment_index].kind == WHITESPACE:
+            comment_index -= 1
+        if comment_index < 0 or tokens[comment_index].kind != COMMENT:
+            break
+        index = comment_index - 1
+        while index >= 0 and tokens[index].kind == WHITESPACE:
+            index -= 1
+        if index >= 0 and tokens[index].kind != NEWLINE:
+            # The comment trails code on the same line, it does not belong to this declaration
+            break
+        span_start = tokens[index].end if index >= 0 else 0
+    return span_start, declaration.end
@@ -0,0 +1,41 @@
+from typing import Annotated
+from fastapi import Depends, Request
+
+from src.generation.cache import ResponseCache
+from src.generation.ratelimit import RateLimitScheduler
+from src.generation.service import ChatSessionFactory, LLMClientRegistry
+
+def get_llm_client_registry(request: Request) -> LLMClientRegistry:
+    return request.app.state.llm_clients
+
+
+def get_response_cache(request: Request) -> ResponseCache:
+    return request.app.state.response_cache
+
+
+def get_rate_limiter(request: Request) -> RateLimitScheduler:
+    return request.app.state.rate_limiter
+
+
+# Requests are accounted to the user an authentication middleware has signed in, otherwise to the client
+# address. Behind a reverse proxy the address is the one uvicorn takes from the forwarded headers of trusted
+# proxies (`--forwarded-allow-ips`), headers sent by the client itself are never trusted.
+def get_requesting_user(request: Request) -> str:
+    user = request.scope.get('user')
+    if user is not None and user.is_authenticated:
+        return f'user:{user.display_name}'
+    return f'address:{request.client.host}' if request.client else 'anonymous'
+
+
+LLMClients = Annotated[LLMClientRegistry, Depends(get_llm_client_registry)]
+ResponseCacheDep = Annotated[ResponseCache, Depends(get_response_cache)]
+RateLimiter = Annotated[RateLimitScheduler, Depends(get_rate_limiter)]
+RequestingUser = Annotated[str, Depends(get_requesting_user)]
+
+
+def get_chat_session_factory(llm_clients: LLMClients, rate_limiter: RateLimiter,
+                             user: RequestingUser) -> ChatSessionFactory:
+    return ChatSessionFactory(llm_clients, rate_limiter, user=user)
+
+
+ChatSessions = Annotated[ChatSessionFactory, Depends(get_chat_session_factory)]
@@ -0,0 +1,161 @@
+import json
+import time
+
+from typing import Any, Union
+from contextlib import contextmanager
+from collections.abc import Collection
+
+from src.core.settings import AppSettings
+from src.core.metrics import deployment_selections
+from src.generation.resilience import upstream_calls
+from src.generation.schemas import GenerativeTransformerModel
+from src.generation.constants import MODEL_RATE_LIMITS
+
+# Name of the deployment made of the single endpoint in the settings when no deployments are listed
+DEFAULT_DEPLOYMENT = 'default'
+
+SELECTION_STRATEGIES = ('least_loaded', 'latency')
+
+
+class Deployment:
+    """
+    One Azure OpenAI resource completions can be sent to: its endpoint and credentials, the name of its deployment
+    of every model it serves, the quota of each of them and how it has been performing lately.
+    """
+
+    # Weight of the latest completion in the moving average of the deployment's latency
+    LATENCY_SMOOTHING = 0.2
+
+    def __init__(self, name: str, endpoint: str, api_key: str, api_version: str, region: Union[str, None] = None,
+                 weight: float = 1.0, models: Union[dict[GenerativeTransformerModel, dict], None] = None):
+        self.name = name
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.api_version = api_version
+        self.region = region
+        self.weight = weight
+        self.models = models if models is not None else {model: dict() for model in GenerativeTransformerModel}
+        self.client = None
+        self.in_flight = 0
+        self.latency_seconds: Union[float, None] = None
+        self.last_selected_at = 0.0
+
+    def serves(self, model: GenerativeTransformerModel) -> bool:
+        return model in self.models
+
+    def deployment_name(self, model: GenerativeTransformerModel) -> str:
+        return self.models[model].get('deployment', model.value)
+
+    def rate_limits(self, default_rate_limits: dict[GenerativeTransformerModel, tuple[int, int]]) \
+            -> dict[GenerativeTransformerModel, tuple[int, int]]:
+        return {model: (options.get('token_rate_limit', default_rate_limits[model][0]),
+                        options.get('request_rate_limit', default_rate_limits[model][1]))
+                for model, options in self.models.items()}
+
+    @property
+    def healthy(self) -> bool:
+        return upstream_calls.breaker(self.name).state != 'open'
+
+    def observe_latency(self, seconds: float):
+        if self.latency_seconds is None:
+            self.latency_seconds = seconds
+        else:
+            self.latency_seconds += self.LATENCY_SMOOTHING * (seconds - self.latency_seconds)
+
+
+def default_rate_limits(app_settings: AppSettings) -> dict[GenerativeTransformerModel, tuple[int, int]]:
+    return {
+        **MODEL_RATE_LIMITS,
+        GenerativeTransformerModel.Azure: (app_settings.azure_model_token_rate_limit,
+                                           app_settings.azure_model_request_rate_limit),
+    }
+
+
+def parse_deployments(app_settings: AppSettings) -> list[Deployment]:
+    """
+    Deployments listed in `azure_openai_deployments`, a JSON list of objects with a `name`, `endpoint`, `api_key`
+    and optionally an `api_version`, `region`, `weight` and the `models` it serves, each mapped to its
+    `deployment` name and `token_rate_limit` / `request_rate_limit`. Without any, the single endpoint in the
+    settings is the only deployment.
+    """
+    if not app_settings.azure_openai_deployments.strip():
+        return [Deployment(DEFAULT_DEPLOYMENT, app_settings.azure_openai_endpoint, app_settings.azure_openai_api_key,
+                           app_settings.openai_api_version)]
+
+    deployments = []
+    for entry in json.loads(app_settings.azure_openai_deployments):
+        models = None
+        if entry.get('models') is not None:
+            models = {GenerativeTransformerModel(model): options or dict()
+                      for model, options in entry['models'].items()}
+        deployments.append(Deployment(
+            name=entry['name'],
+            endpoint=entry['endpoint'],
+            api_key=entry['api_key'],
+            api_version=entry.get('api_version', app_settings.openai_api_version),
+            region=entry.get('region'),
+            weight=float(entry.get('weight', 1.0)),
+            models=models,
+        ))
+    if len({deployment.name for deployment in deployments}) != len(deployments):
+        raise ValueError("Every deployment in AZURE_OPENAI_DEPLOYMENTS needs a distinct name")
+    return deployments
+
+
+class DeploymentPool:
+    """
+    Spreads completions over the deployments serving their model. Deployments whose circuit breaker is open are
+    skipped while any other one is available. `least_loaded` picks the deployment that can start the request the
+    soonest under its quota, then the one with the fewest requests in flight for its weight, `latency` the one
+    expected to answer first given its recent latency and the requests already waiting on it. Deployments that
+    score the same take turns.
+    """
+
+    def __init__(self, deployments: list[Deployment], selection: str = 'least_loaded'):
+        if not deployments:
+            raise ValueError("At least one deployment is required")
+        if selection not in SELECTION_STRATEGIES:
+            raise ValueError(f"Unknown deployment selection '{selection}', expected one of {SELECTION_STRATEGIES}")
+        self.deployments = deployments
+        self.selection = selection
+
+    def score(self, deployment: Deployment, quota_delay: float) -> float:
+        load = deployment.in_flight / deployment.weight
+        if self.selection == 'latency':
+            # Deployments without any completion yet are tried as if they were the fastest
+            return quota_delay + (deployment.latency_seconds or 0.0) * (1 + load)
+        return quota_delay + load
+
+    def candidates(self, model: GenerativeTransformerModel, excluded: Collection[str] = ()) -> list[Deployment]:
+        """Deployments serving the model, only the healthy ones unless none of them is."""
+        candidates = [deployment for deployment in self.deployments
+                      if deployment.serves(model) and deployment.name not in excluded]
+        return [deployment for deployment in candidates if deployment.healthy] or candidates
+
+    def select(self, model: GenerativeTransformerModel, estimated_tokens: int, rate_limiter: Any = None,
+               excluded: Collection[str] = ()) -> Deployment:
+        candidates = self.candidates(model, excluded)
+        if not candidates:
+            raise ValueError(f"No deployment serves the model '{model.value}'")
+
+        def quota_delay(deployment: Deployment) -> float:
+            if rate_limiter is None:
+                return 0.0
+            return rate_limiter.expected_delay(model, estimated_tokens, deployment=deployment.name)
+
+        deployment = min(candidates, key=lambda candidate: (self.score(candidate, quota_delay(candidate)),
+                                                            candidate.last_selected_at))
+        deployment.last_selected_at = time.monotonic()
+        deployment_selections.inc(deployment.name)
+        return deployment
+
+    @contextmanager
+    def track(self, deployment: Deployment):
+        """Counts the request as in flight on the deployment and records its latency if it succeeds."""
+        deployment.in_flight += 1
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            deployment.in_flight -= 1
+        deployment.observe_latency(time.perf_counter() - start_time)
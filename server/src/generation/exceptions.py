@@ -1,42 +1,64 @@
 
-from typing import Any
-from functools import wraps
+import inspect
+import logging
+
+from typing import Any, NoReturn
+from functools import lru_cache, wraps
 from fastapi import HTTPException
 from collections.abc import Callable
 
-from openai import APIError, APIConnectionError, \
-    RateLimitError, AuthenticationError, OpenAIError
+from src.core.metrics import upstream_errors
+from src.generation.resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def openai_errors() -> tuple[type[Exception], ...]:
+    """
+    The errors a completion can fail with. The OpenAI SDK takes longer to import than the rest of the server,
+    it is only imported once the first completion, or the connection warm-up, needs it.
+    """
+    from openai import APIError, APIConnectionError, RateLimitError, AuthenticationError, OpenAIError
+
+    return APIError, OpenAIError, AuthenticationError, PermissionError, APIConnectionError, RateLimitError, \
+        CircuitOpenError
+
+
+def raise_service_unavailable(error: Exception) -> NoReturn:
+    from openai import APIConnectionError, RateLimitError, AuthenticationError
+
+    upstream_errors.inc(type(error).__name__)
+    # The most specific errors first, every OpenAI error is an OpenAIError
+    if isinstance(error, RateLimitError):
+        logger.warning("OpenAI API request exceeded rate limit: %s", error)
+    elif isinstance(error, (AuthenticationError, PermissionError)):
+        logger.error("Failed to authenticate with provided token for OpenAI API: %s", error)
+    elif isinstance(error, APIConnectionError):
+        logger.warning("Failed to connect or verify signature to OpenAI API: %s", error)
+    else:
+        logger.warning("OpenAI API returned an API Error: %s", error)
+
+    raise HTTPException(
+        status_code=503, detail="Service is temporarily unavailable... Please try again later!") from error
 
 
 def openai_error_handler(func: Callable[..., Any]):
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def capture_async_error_information(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except openai_errors() as e:
+                raise_service_unavailable(e)
+
+        return capture_async_error_information
+
     @wraps(func)
     def capture_error_information(*args, **kwargs):
         try:
             return func(*args, **kwargs)
-
-        except (APIError, OpenAIError) as e:
-            # Handle API error here, e.g. retry or log
-            print(f"OpenAI API returned an API Error: {e}")
-            raise HTTPException(
-                status_code=503, detail="Service is temporarily unavailable... Please try again later!")
-
-        except (AuthenticationError, PermissionError) as e:
-            # Handle connection error here
-            print(
-                f"Failed to authenticate with provided token for OpenAI API: {e}")
-            raise HTTPException(
-                status_code=503, detail="Service is temporarily unavailable... Please try again later!")
-
-        except (APIConnectionError) as e:
-            # Handle connection error here
-            print(f"Failed to connect or verify signature to OpenAI API: {e}")
-            raise HTTPException(
-                status_code=503, detail="Service is temporarily unavailable... Please try again later!")
-
-        except RateLimitError as e:
-            # Handle rate limit error (we recommend using exponential backoff)
-            print(f"OpenAI API request exceeded rate limit: {e}")
-            raise HTTPException(
-                status_code=503, detail="Service is temporarily unavailable... Please try again later!")
+        except openai_errors() as e:
+            raise_service_unavailable(e)
 
     return capture_error_information
@@ -0,0 +1,58 @@
+import re
+import ast
+import textwrap
+
+from functools import lru_cache
+
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.tokenizer import CODE, CODE_PATTERNS, NEWLINE, normalize_code
+
+# A space inside a run of code only matters between two words (`int x`) or two operators (`a - -b`)
+OPTIONAL_SPACE = re.compile(r'(?<=\w) (?!\w)|(?<!\w) (?=\w)|(?<=[()\[\]{},;]) | (?=[()\[\]{},;])')
+
+# Fields of statements, exception handlers and match cases that hold a list of statements
+STATEMENT_LIST_FIELDS = ('body', 'orelse', 'finalbody', 'handlers', 'cases')
+
+
+# Repeated requests for the same text, the usual way a response is reused, skip parsing it again
+@lru_cache(maxsize=256)
+def fingerprint_code_block(code_block: str, language: AcceptedCodeLanguages) -> str:
+    """
+    Text that is the same for code blocks which only differ cosmetically: indentation, whitespace, comments,
+    docstrings and, for Python code that parses, quoting, parentheses and line wrapping. Python is compared by
+    its syntax tree, every other language (and Python selections that do not parse on their own) by its
+    normalized token stream.
+    """
+    if language == AcceptedCodeLanguages.Python:
+        try:
+            tree = ast.parse(textwrap.dedent(code_block))
+        except (SyntaxError, ValueError, RecursionError):
+            pass
+        else:
+            tree.body = strip_docstrings(tree.body)
+            return 'ast\n' + ast.dump(tree, annotate_fields=False)
+    return 'tokens\n' + token_fingerprint(code_block, language)
+
+
+def token_fingerprint(code_block: str, language: AcceptedCodeLanguages) -> str:
+    pieces = []
+    for kind, text in normalize_code(code_block, language, CODE_PATTERNS):
+        if kind == CODE:
+            text = OPTIONAL_SPACE.sub('', text)
+        pieces.append('\n' if kind == NEWLINE else text)
+    return ' '.join(pieces)
+
+
+def strip_docstrings(statements: list) -> list:
+    """Statements without string expression statements, i.e. docstrings, at any depth."""
+    kept_statements = []
+    for statement in statements:
+        if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Constant) \
+                and isinstance(statement.value.value, str):
+            continue
+        for field in STATEMENT_LIST_FIELDS:
+            nested_statements = getattr(statement, field, None)
+            if nested_statements:
+                setattr(statement, field, strip_docstrings(nested_statements) or [ast.Pass()])
+        kept_statements.append(statement)
+    return kept_statements
@@ -0,0 +1,254 @@
+import re
+import ast
+import bisect
+import textwrap
+
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.declarations import Declaration, documented_span, split_declarations
+from src.generation.renaming import REACT_LANGUAGES, contains_jsx, significant_tokens
+from src.generation.structured import StructuredOutputError
+from src.generation.tokenizer import COMMENT, STRING, tokenize
+
+# Comments are wrapped so that no line, indentation included, is longer than this
+MAX_COMMENT_WIDTH = 100
+MIN_COMMENT_WIDTH = 40
+
+# A definition anchored this many lines away from the start of a declaration still belongs to it
+DEFINITION_ANCHOR_TOLERANCE = 2
+
+LINE_COMMENT_MARKERS = {AcceptedCodeLanguages.Python: '#'}
+DEFAULT_LINE_COMMENT_MARKER = '//'
+
+# Comment characters the model writes although it was asked for the text alone
+COMMENT_DECORATION = re.compile(r'^\s*(?:#+|//+|/\*+|\*/|\*(?!\*)|"""|\'\'\')\s?')
+TRAILING_COMMENT_DECORATION = re.compile(r'\s*(?:\*/|"""|\'\'\')\s*$')
+DOCUMENTATION_COMMENT = ('/**', '///')
+
+# (first line index, end line index, lines replacing them), inserting where both indices are the same
+LineEdit = tuple[int, int, list[str]]
+
+
+def number_lines(code_block: str) -> str:
+    """The code block with every line prefixed by its number, for the model to anchor insertions to."""
+    return '\n'.join(f'{number}| {line}' for number, line in enumerate(code_block.split('\n'), start=1))
+
+
+def supports_patches(code_block: str, language: AcceptedCodeLanguages) -> bool:
+    # Comments inside JSX markup have to be written as expressions, which is left to the model
+    return language not in REACT_LANGUAGES or not contains_jsx(significant_tokens(code_block, language))
+
+
+def comment_text_lines(comment: str) -> list[str]:
+    lines = [TRAILING_COMMENT_DECORATION.sub('', COMMENT_DECORATION.sub('', line)).rstrip()
+             for line in comment.replace('\r\n', '\n').split('\n')]
+    while lines and not lines[0].strip():
+        lines.pop(0)
+    while lines and not lines[-1].strip():
+        lines.pop()
+    return lines
+
+
+def wrap_text_lines(lines: list[str], width: int) -> list[str]:
+    """Lines longer than `width` wrapped at word boundaries, continuation lines keeping their indentation."""
+    wrapped = []
+    for line in lines:
+        if len(line) <= width or not line.strip():
+            wrapped.append(line)
+            continue
+        indentation = line[:len(line) - len(line.lstrip())]
+        wrapped.extend(textwrap.wrap(line.strip(), width=max(width, len(indentation) + MIN_COMMENT_WIDTH),
+                                     initial_indent=indentation, subsequent_indent=indentation,
+                                     break_long_words=False, break_on_hyphens=False))
+    return wrapped
+
+
+def leading_whitespace(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+
+def apply_line_edits(code_block: str, edits: list[LineEdit]) -> str:
+    lines = code_block.split('\n')
+    line_ending = '\r' if '\r\n' in code_block else ''
+    # Applied from the bottom up so that the line indices of the remaining edits stay valid
+    for start, end, replacement in sorted(edits, key=lambda edit: (edit[0], edit[1]), reverse=True):
+        lines[start:end] = [line + line_ending for line in replacement]
+    return '\n'.join(lines)
+
+
+def insertable_lines(code_block: str, language: AcceptedCodeLanguages) -> set[int]:
+    """
+    Numbers of the lines a comment line can be inserted above without changing the code: every line except
+    those starting inside a multi-line string or comment and those continuing the line before them.
+    """
+    lines = code_block.split('\n')
+    line_starts = [0]
+    for line in lines[:-1]:
+        line_starts.append(line_starts[-1] + len(line) + 1)
+
+    blocked = {number for number in range(2, len(lines) + 1) if lines[number - 2].rstrip().endswith('\\')}
+    for token in tokenize(code_block, language):
+        if token.kind not in (STRING, COMMENT) or '\n' not in token.text:
+            continue
+        index = bisect.bisect_right(line_starts, token.start)
+        while index < len(line_starts) and line_starts[index] < token.end:
+            blocked.add(index + 1)
+            index += 1
+    return set(range(1, len(lines) + 1)) - blocked
+
+
+def insert_annotations(code_block: str, language: AcceptedCodeLanguages,
+                       insertions: list[tuple[int, str]]) -> str:
+    """
+    The code block with every comment of `insertions`, given as (line number, comment text), written as line
+    comments directly above its line, indented like the code below it and wrapped to `MAX_COMMENT_WIDTH`.
+    Insertions anchored to lines no comment can be written above are dropped, a StructuredOutputError is raised
+    when that leaves none of them.
+    """
+    lines = code_block.split('\n')
+    allowed_lines = insertable_lines(code_block, language)
+    marker = LINE_COMMENT_MARKERS.get(language, DEFAULT_LINE_COMMENT_MARKER)
+
+    comments_above: dict[int, list[str]] = dict()
+    for number, comment in insertions:
+        # A comment anchored to a blank line describes the code after it
+        while 0 < number < len(lines) and not lines[number - 1].strip():
+            number += 1
+        text_lines = comment_text_lines(comment)
+        if number not in allowed_lines or not text_lines:
+            continue
+        indentation = leading_whitespace(lines[number - 1])
+        width = MAX_COMMENT_WIDTH - len(indentation.expandtabs()) - len(marker) - 1
+        rendered = [f'{indentation}{marker} {text}'.rstrip() for text in wrap_text_lines(text_lines, width)]
+        comments = comments_above.setdefault(number, [])
+        if rendered != comments[-len(rendered):]:
+            comments.extend(rendered)
+
+    if insertions and not comments_above:
+        raise StructuredOutputError("None of the comments is anchored to a line they can be written above")
+    return apply_line_edits(code_block, [(number - 1, number - 1, comments)
+                                         for number, comments in comments_above.items()])
+
+
+def snap_definitions(insertions: list[tuple[int, str]], headers: list[tuple[int, int]]) -> dict[int, str]:
+    """
+    Definition text by the index of the declaration it belongs to, given the first and last line numbers of
+    every declaration's header. Definitions that belong to no declaration are dropped, the first definition of a
+    declaration wins.
+    """
+    definitions = dict()
+    for number, comment in insertions:
+        distances = [max(first - number, number - last, 0) for first, last in headers]
+        candidates = [index for index, distance in enumerate(distances)
+                      if distance <= DEFINITION_ANCHOR_TOLERANCE and index not in definitions]
+        if candidates:
+            definitions[min(candidates, key=lambda index: distances[index])] = comment
+    return definitions
+
+
+def python_docstring(text_lines: list[str], indentation: str) -> list[str]:
+    width = MAX_COMMENT_WIDTH - len(indentation.expandtabs())
+    # Every quote of a triple quote is escaped, so that no three quotes in a row are left to end the docstring
+    escaped = [line.replace('\\', '\\\\').replace('"""', '\\"\\"\\"') for line in text_lines]
+    body = [f'{indentation}{line}'.rstrip() for line in wrap_text_lines(escaped, width)]
+    return [f'{indentation}"""'] + body + [f'{indentation}"""']
+
+
+def python_definition_edits(code_block: str, insertions: list[tuple[int, str]]) -> list[LineEdit]:
+    try:
+        module = ast.parse(code_block)
+    except SyntaxError:
+        raise StructuredOutputError("The code block does not parse, definitions cannot be placed in it")
+
+    lines = code_block.split('\n')
+    nodes = [node for node in ast.walk(module) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                                                    ast.ClassDef))]
+    nodes.sort(key=lambda node: node.lineno)
+
+    def first_line(node: ast.stmt) -> int:
+        return min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+
+    # The header of a declaration runs from its first decorator to the line before its body
+    headers = [(first_line(node), max(node.lineno, first_line(node.body[0]) - 1)) for node in nodes]
+    edits = []
+    for index, comment in snap_definitions(insertions, headers).items():
+        body = nodes[index].body[0]
+        body_line = first_line(body)
+        # Column offsets count UTF-8 bytes, a body on the header's line has code ahead of it
+        prefix = lines[body_line - 1].encode()[:body.col_offset].strip()
+        text_lines = comment_text_lines(comment)
+        if prefix not in (b'', b'@') or not text_lines:
+            continue
+
+        docstring = python_docstring(text_lines, leading_whitespace(lines[body_line - 1]))
+        if isinstance(body, ast.Expr) and isinstance(body.value, ast.Constant) and isinstance(body.value.value, str) \
+                and not lines[body.end_lineno - 1].encode()[body.end_col_offset:].strip():
+            # A definition replaces the docstring the declaration already has
+            edits.append((body_line - 1, body.end_lineno, docstring))
+        else:
+            edits.append((body_line - 1, body_line - 1, docstring))
+    return edits
+
+
+def documentation_block(text_lines: list[str], indentation: str) -> list[str]:
+    width = MAX_COMMENT_WIDTH - len(indentation.expandtabs()) - len(' * ')
+    body = [f'{indentation} * {line}'.rstrip() for line in wrap_text_lines(
+        [line.replace('*/', '*\\/') for line in text_lines], width)]
+    return [f'{indentation}/**'] + body + [f'{indentation} */']
+
+
+def brace_definition_edits(code_block: str, language: AcceptedCodeLanguages,
+                           insertions: list[tuple[int, str]]) -> list[LineEdit]:
+    declarations = split_declarations(code_block, language, include_containers=True)
+
+    def line_number(offset: int) -> int:
+        return code_block.count('\n', 0, offset) + 1
+
+    def header_end(declaration: Declaration) -> int:
+        body_start = declaration.source.find('{')
+        return declaration.start + (body_start if body_start >= 0 else 0)
+
+    headers = [(line_number(declaration.start), line_number(header_end(declaration)))
+               for declaration in declarations]
+    edits = []
+    for index, comment in snap_definitions(insertions, headers).items():
+        declaration = declarations[index]
+        line_start = code_block.rfind('\n', 0, declaration.start) + 1
+        text_lines = comment_text_lines(comment)
+        # Declarations that share their first line with other code cannot have a block above them
+        if code_block[line_start:declaration.start].strip() or not text_lines:
+            continue
+
+        block = documentation_block(text_lines, code_block[line_start:declaration.start])
+        first_line = line_number(declaration.start) - 1
+        span_start, _ = documented_span(code_block, declaration, language)
+        if code_block[span_start:line_start].lstrip().startswith(DOCUMENTATION_COMMENT):
+            # A definition replaces the documentation comment the declaration already has
+            edits.append((line_number(span_start) - 1, first_line, block))
+        else:
+            edits.append((first_line, first_line, block))
+    return edits
+
+
+def insert_definitions(code_block: str, language: AcceptedCodeLanguages,
+                       insertions: list[tuple[int, str]]) -> str:
+    """
+    The code block with every definition of `insertions`, given as (line number, definition text), written as
+    the documentation of the function or class declared on that line: a docstring in Python and a `/** */` block
+    above the declaration otherwise, replacing the documentation the declaration already had. Definitions that
+    are not anchored within `DEFINITION_ANCHOR_TOLERANCE` lines of a declaration are dropped, a
+    StructuredOutputError is raised when that leaves none of them.
+    """
+    if language == AcceptedCodeLanguages.Python:
+        edits = python_definition_edits(code_block, insertions)
+    else:
+        edits = brace_definition_edits(code_block, language, insertions)
+
+    if insertions and not edits:
+        raise StructuredOutputError("None of the definitions is anchored to a declaration")
+    return apply_line_edits(code_block, edits)
+
+
+def apply_insertions(code_block: str, language: AcceptedCodeLanguages, insertions: list[tuple[int, str]],
+                     definitions: bool = False) -> str:
+    return insert_definitions(code_block, language, insertions) if definitions \
+        else insert_annotations(code_block, language, insertions)
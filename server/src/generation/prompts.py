@@ -0,0 +1,102 @@
+import re
+import sys
+import inspect
+
+from typing import Any, NamedTuple, Union
+from collections.abc import Callable
+
+from src.generation.schemas import AcceptedCodeLanguages, AcceptedNaturalLanguages, SystemPrompt
+from src.generation.constants import ANALYSE_PROMPT, ANNOTATE_PATCH_PROMPT, ANNOTATE_PROMPT, DEFINE_PATCH_PROMPT, \
+    DEFINE_PROMPT, EXPLAIN_PROMPT, GENERATE_PDF_PROMPT, REVISE_PROMPT, SUMMARISE_PROMPT
+
+PROMPT_BUILDERS: dict[SystemPrompt, Callable[..., str]] = {
+    SystemPrompt.Define: DEFINE_PROMPT,
+    SystemPrompt.Revise: REVISE_PROMPT,
+    SystemPrompt.Analyse: ANALYSE_PROMPT,
+    SystemPrompt.Explain: EXPLAIN_PROMPT,
+    SystemPrompt.Annotate: ANNOTATE_PROMPT,
+    SystemPrompt.Generate: GENERATE_PDF_PROMPT,
+    SystemPrompt.Summarise: SUMMARISE_PROMPT,
+}
+
+# Prompts of the commands that can answer with the comments to insert into the code block instead of echoing it
+PATCH_PROMPT_BUILDERS: dict[SystemPrompt, Callable[..., str]] = {
+    SystemPrompt.Define: DEFINE_PATCH_PROMPT,
+    SystemPrompt.Annotate: ANNOTATE_PATCH_PROMPT,
+}
+
+# Parameters every system prompt is compiled for at startup, other frameworks and naming schemes are compiled
+# the first time they are requested
+PRECOMPILED_PARAMETERS: dict[SystemPrompt, list[Any]] = {
+    SystemPrompt.Define: [None],
+    SystemPrompt.Revise: ['lower'],
+    SystemPrompt.Analyse: [None],
+    SystemPrompt.Explain: [language.value for language in AcceptedNaturalLanguages],
+    SystemPrompt.Annotate: [None],
+    SystemPrompt.Generate: list(AcceptedCodeLanguages),
+    SystemPrompt.Summarise: list(AcceptedCodeLanguages),
+}
+
+# Roughly one token per short word, number or punctuation mark of English prose
+PROSE_TOKEN = re.compile(r'[A-Za-z]{1,8}|\d{1,3}|[^\sA-Za-z\d]')
+
+
+def estimate_prose_tokens(text: str) -> int:
+    return len(PROSE_TOKEN.findall(text))
+
+
+class PromptVariant(NamedTuple):
+    command: SystemPrompt
+    parameter: Any
+    content: str
+    estimated_tokens: int
+    patch: bool = False
+
+
+def compile_prompt(command: SystemPrompt, parameter: Any = None, patch: bool = False) -> PromptVariant:
+    builder = (PATCH_PROMPT_BUILDERS if patch else PROMPT_BUILDERS)[command]
+    content = builder(parameter) if inspect.signature(builder).parameters else builder()
+    return PromptVariant(command, parameter, sys.intern(content), estimate_prose_tokens(content), patch)
+
+
+class PromptRegistry:
+    """
+    System prompts compiled once per command and parameter. Every request with the same command and parameter
+    sends the very same system prompt text, ahead of the request specific user message, so that the provider
+    can reuse its cached prompt prefix, and the scheduler reads the token estimate computed at compile time.
+    """
+
+    # Frameworks and naming schemes are free text from requests, only this many variants are kept
+    MAX_VARIANTS = 512
+
+    def __init__(self):
+        self.variants: dict[tuple[SystemPrompt, Any, bool], PromptVariant] = dict()
+        self.variants_by_content: dict[str, PromptVariant] = dict()
+
+    def precompile(self):
+        for command, parameters in PRECOMPILED_PARAMETERS.items():
+            for parameter in parameters:
+                self.get(command, parameter)
+                if command in PATCH_PROMPT_BUILDERS:
+                    self.get(command, parameter, patch=True)
+
+    def get(self, command: SystemPrompt, parameter: Any = None, patch: bool = False) -> PromptVariant:
+        variant = self.variants.get((command, parameter, patch))
+        if variant is None:
+            variant = compile_prompt(command, parameter, patch)
+            if len(self.variants) < self.MAX_VARIANTS:
+                self.variants[(command, parameter, patch)] = variant
+                self.variants_by_content[variant.content] = variant
+        return variant
+
+    def find(self, content: str) -> Union[PromptVariant, None]:
+        """The compiled system prompt with this text, None for any other text."""
+        return self.variants_by_content.get(content)
+
+    def estimated_tokens(self, content: str) -> Union[int, None]:
+        """Token estimate of a compiled system prompt, None for any other text."""
+        variant = self.find(content)
+        return variant.estimated_tokens if variant is not None else None
+
+
+prompt_registry = PromptRegistry()
@@ -0,0 +1,340 @@
+import math
+import time
+import asyncio
+import sqlite3
+import threading
+
+from typing import Any, Union
+from collections.abc import Callable
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+from src.core.settings import AppSettings
+from src.generation.schemas import GenerativeTransformerModel
+from src.generation.deployments import default_rate_limits, parse_deployments
+
+# Rough number of characters per token for the GPT tokenizers, good enough to schedule against a quota
+CHARACTERS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+class TokenBucket:
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.available = capacity
+        self.updated_at = self.clock()
+
+    def projected_level(self, available: float, updated_at: float, now: float) -> float:
+        return min(self.capacity, available + max(0.0, now - updated_at) * self.refill_per_second)
+
+    def refill(self):
+        now = self.clock()
+        self.available = self.projected_level(self.available, self.updated_at, now)
+        self.updated_at = now
+
+    def level(self) -> float:
+        """Tokens available right now, without writing the refill back."""
+        return self.projected_level(self.available, self.updated_at, self.clock())
+
+    def wait_for(self, amount: float, available: float) -> float:
+        amount = min(amount, self.capacity)
+        if available >= amount:
+            return 0.0
+        return (amount - available) / self.refill_per_second
+
+    def time_until_available(self, amount: float) -> float:
+        self.refill()
+        return self.wait_for(amount, self.available)
+
+    def expected_wait(self, amount: float) -> float:
+        """Same as `time_until_available`, but only reads the bucket."""
+        return self.wait_for(amount, self.level())
+
+    def consume(self, amount: float):
+        # Spending more than is available leaves the bucket in debt, which later acquisitions wait out
+        self.refill()
+        self.available -= amount
+
+
+class SQLiteBucketStore:
+    """
+    Levels of token buckets kept in a SQLite file, so that every worker process of the server spends the same
+    quota. Buckets are updated inside `transaction()`, which holds the database's write lock and may wait for
+    other processes, so the event loop hands every update to a worker thread (see `run_bucket_operation`).
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.RLock()
+        self.depth = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, available REAL NOT NULL, '
+            'updated_at REAL NOT NULL)')
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            # Buckets updated together, e.g. the token and request buckets of a model, share one transaction
+            self.depth += 1
+            if self.depth == 1:
+                self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                if self.depth == 1:
+                    self.connection.execute('ROLLBACK')
+                raise
+            else:
+                if self.depth == 1:
+                    self.connection.execute('COMMIT')
+            finally:
+                self.depth -= 1
+
+    def load(self, key: str, capacity: float) -> tuple[float, float]:
+        """Level of the bucket and when it was last refilled, a new bucket starts full."""
+        # A read outside of a transaction sees the last committed levels and never waits for a writer (WAL)
+        with self.lock:
+            row = self.connection.execute('SELECT available, updated_at FROM buckets WHERE key = ?',
+                                          (key,)).fetchone()
+        return row if row is not None else (capacity, time.time())
+
+    def save(self, key: str, available: float, updated_at: float):
+        self.connection.execute('INSERT OR REPLACE INTO buckets (key, available, updated_at) VALUES (?, ?, ?)',
+                                (key, available, updated_at))
+
+    def delete(self, keys: list[str]):
+        with self.transaction():
+            self.connection.executemany('DELETE FROM buckets WHERE key = ?', [(key,) for key in keys])
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket whose level lives in a `SQLiteBucketStore`, wall clock time is used across processes."""
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, store: SQLiteBucketStore, key: str, capacity: float, refill_per_second: float):
+        super().__init__(capacity, refill_per_second)
+        self.store = store
+        self.key = key
+
+    def refill(self):
+        with self.store.transaction():
+            self.available, self.updated_at = self.store.load(self.key, self.capacity)
+            super().refill()
+            self.store.save(self.key, self.available, self.updated_at)
+
+    def consume(self, amount: float):
+        with self.store.transaction():
+            super().consume(amount)
+            self.store.save(self.key, self.available, self.updated_at)
+
+    def level(self) -> float:
+        available, updated_at = self.store.load(self.key, self.capacity)
+        return self.projected_level(available, updated_at, self.clock())
+
+
+def token_bucket(capacity: float, refill_per_second: float, store: Union[SQLiteBucketStore, None] = None,
+                 key: str = '') -> TokenBucket:
+    if store is None:
+        return TokenBucket(capacity, refill_per_second)
+    return SharedTokenBucket(store, key, capacity, refill_per_second)
+
+
+def bucket_transaction(store: Union[SQLiteBucketStore, None]):
+    return store.transaction() if store is not None else nullcontext()
+
+
+async def run_bucket_operation(store: Union[SQLiteBucketStore, None], operation: Callable[..., Any], *args) -> Any:
+    """Runs `operation` in a worker thread when it writes to a shared store, in place otherwise."""
+    if store is None:
+        return operation(*args)
+    return await asyncio.to_thread(operation, *args)
+
+
+class ModelRateLimiter:
+    """
+    Token and request buckets for one model. Callers queue in FIFO order until both buckets can cover the
+    request instead of being sent upstream to fail with a 429. With a `bucket_store` the buckets are shared by
+    every worker process, each of which queues its own callers.
+    """
+
+    def __init__(self, token_limit_per_minute: int, request_limit_per_minute: int, burst_seconds: float = 60,
+                 bucket_store: Union[SQLiteBucketStore, None] = None, key: str = ''):
+        burst_fraction = min(burst_seconds, 60) / 60
+        self.token_limit_per_minute = token_limit_per_minute
+        self.request_limit_per_minute = request_limit_per_minute
+        self.bucket_store = bucket_store
+        self.token_bucket = token_bucket(max(1.0, token_limit_per_minute * burst_fraction),
+                                         token_limit_per_minute / 60, store=bucket_store, key=f'{key}/tokens')
+        self.request_bucket = token_bucket(max(1.0, request_limit_per_minute * burst_fraction),
+                                           request_limit_per_minute / 60, store=bucket_store, key=f'{key}/requests')
+        self.dispatch_lock = asyncio.Lock()
+        self.queue_depth = 0
+
+    async def acquire(self, estimated_tokens: int):
+        self.queue_depth += 1
+        try:
+            # asyncio.Lock wakes its waiters in arrival order, which makes the queue first come first served
+            async with self.dispatch_lock:
+                while (delay := await run_bucket_operation(self.bucket_store, self.try_consume,
+                                                           estimated_tokens)) > 0:
+                    await asyncio.sleep(delay)
+        finally:
+            self.queue_depth -= 1
+
+    def try_consume(self, estimated_tokens: int) -> float:
+        """Spends a request if both buckets can cover it, otherwise returns the seconds until they can."""
+        # Other workers spend the same shared buckets, so checking and spending them is atomic
+        with bucket_transaction(self.bucket_store):
+            delay = max(self.token_bucket.time_until_available(estimated_tokens),
+                        self.request_bucket.time_until_available(1))
+            if delay <= 0:
+                self.token_bucket.consume(estimated_tokens)
+                self.request_bucket.consume(1)
+        return delay
+
+    def expected_delay(self, estimated_tokens: int) -> float:
+        """Seconds a request would wait for capacity right now, infinite while other requests are queued."""
+        if self.queue_depth > 0:
+            return math.inf
+        return max(self.token_bucket.expected_wait(estimated_tokens), self.request_bucket.expected_wait(1))
+
+    async def record_usage(self, estimated_tokens: int, used_tokens: int):
+        """Corrects the token bucket once the real usage of a completion is known."""
+        await run_bucket_operation(self.bucket_store, self.token_bucket.consume, used_tokens - estimated_tokens)
+
+    def status(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "token_limit_per_minute": self.token_limit_per_minute,
+            "request_limit_per_minute": self.request_limit_per_minute,
+            "available_tokens": max(0, math.floor(self.token_bucket.level())),
+            "available_requests": max(0, math.floor(self.request_bucket.level())),
+        }
+
+
+class RateLimitScheduler:
+    """
+    Schedules completions against the quota of every model on every deployment (`constants.MODEL_RATE_LIMITS`
+    and the Azure deployment quota from the settings, unless the deployment sets its own). Incoming requests are
+    first held to `requests_per_user_per_minute` per user, when it is set, so that one busy client cannot starve
+    the others, the buckets of the `MAX_TRACKED_USERS` users seen last are kept.
+    With `shared_state_path` set, every quota is kept in that SQLite file and holds across worker processes.
+    """
+
+    MAX_TRACKED_USERS = 1024
+
+    def __init__(self, app_settings: AppSettings):
+        self.requests_per_user_per_minute = app_settings.requests_per_user_per_minute
+        self.bucket_store = None
+        if app_settings.shared_state_path:
+            self.bucket_store = SQLiteBucketStore(app_settings.shared_state_path)
+        rate_limits = default_rate_limits(app_settings)
+        self.deployment_limiters = {
+            deployment.name: {
+                model: ModelRateLimiter(token_limit, request_limit, burst_seconds=app_settings.rate_limit_burst_seconds,
+                                        bucket_store=self.bucket_store, key=f'{deployment.name}/{model.value}')
+                for model, (token_limit, request_limit) in deployment.rate_limits(rate_limits).items()
+            }
+            for deployment in parse_deployments(app_settings)
+        }
+        self.user_buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        # Shared buckets of evicted users, deleted from the store by the next acquisition
+        self.evicted_users: list[str] = []
+        self.user_queue_depth = 0
+
+    def user_bucket(self, user: str) -> TokenBucket:
+        if user in self.user_buckets:
+            self.user_buckets.move_to_end(user)
+            return self.user_buckets[user]
+        while len(self.user_buckets) >= self.MAX_TRACKED_USERS:
+            # The user seen the longest ago has usually refilled its bucket, which is the same as a new one
+            evicted_user, _ = self.user_buckets.popitem(last=False)
+            if self.bucket_store is not None:
+                self.evicted_users.append(f'user/{evicted_user}')
+        self.user_buckets[user] = token_bucket(self.requests_per_user_per_minute,
+                                               self.requests_per_user_per_minute / 60,
+                                               store=self.bucket_store, key=f'user/{user}')
+        return self.user_buckets[user]
+
+    async def acquire_for_user(self, user: str):
+        if self.requests_per_user_per_minute <= 0:
+            return
+        user_bucket = self.user_bucket(user)
+        if self.evicted_users:
+            evicted_users, self.evicted_users = self.evicted_users, []
+            await run_bucket_operation(self.bucket_store, self.bucket_store.delete, evicted_users)
+        self.user_queue_depth += 1
+        try:
+            while (delay := await run_bucket_operation(self.bucket_store, self.try_consume_for_user,
+                                                       user_bucket)) > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self.user_queue_depth -= 1
+
+    def try_consume_for_user(self, user_bucket: TokenBucket) -> float:
+        with bucket_transaction(self.bucket_store):
+            delay = user_bucket.time_until_available(1)
+            if delay <= 0:
+                user_bucket.consume(1)
+        return delay
+
+    def model_limiters(self, model: GenerativeTransformerModel) -> list[ModelRateLimiter]:
+        return [limiters[model] for limiters in self.deployment_limiters.values() if model in limiters]
+
+    def limiter(self, model: GenerativeTransformerModel, deployment: Union[str, None] = None) -> ModelRateLimiter:
+        # Completions sent outside of the deployment pool are accounted to the first deployment of their model
+        if deployment is None:
+            return self.model_limiters(model)[0]
+        return self.deployment_limiters[deployment][model]
+
+    async def acquire(self, model: GenerativeTransformerModel, estimated_tokens: int,
+                      deployment: Union[str, None] = None):
+        await self.limiter(model, deployment).acquire(estimated_tokens)
+
+    def expected_delay(self, model: GenerativeTransformerModel, estimated_tokens: int,
+                       deployment: Union[str, None] = None) -> float:
+        """Wait on the given deployment, or on the deployment serving the model that is the least busy."""
+        if deployment is not None:
+            return self.limiter(model, deployment).expected_delay(estimated_tokens)
+        return min((limiter.expected_delay(estimated_tokens) for limiter in self.model_limiters(model)),
+                   default=math.inf)
+
+    async def record_usage(self, model: GenerativeTransformerModel, estimated_tokens: int, used_tokens: int,
+                           deployment: Union[str, None] = None):
+        await self.limiter(model, deployment).record_usage(estimated_tokens, used_tokens)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.user_queue_depth + sum(limiter.queue_depth for limiters in self.deployment_limiters.values()
+                                           for limiter in limiters.values())
+
+    def status(self) -> dict:
+        deployments = {name: {model.value: limiter.status() for model, limiter in limiters.items()}
+                       for name, limiters in self.deployment_limiters.items()}
+        # Every model across all of its deployments
+        models = dict()
+        for model_statuses in deployments.values():
+            for model, model_status in model_statuses.items():
+                models[model] = {key: models.get(model, {}).get(key, 0) + value for key, value in model_status.items()}
+        return {
+            "queue_depth": self.queue_depth,
+            "user_queue_depth": self.user_queue_depth,
+            "models": models,
+            "deployments": deployments,
+        }
+
+    def close(self):
+        if self.bucket_store is not None:
+            self.bucket_store.close()
@@ -0,0 +1,917 @@
+import re
+import ast
+import keyword
+import builtins
+import textwrap
+
+from typing import Union
+
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.declarations import Declaration, split_declarations
+from src.generation.tokenizer import COMMENT, NAME, NEWLINE, STRING, WHITESPACE, Token, tokenize
+
+# Naming schemes that only change how a name is written, hungarian notation prefixes names with their type
+LOCAL_NAMING_SCHEMES = ('snake', 'camel', 'pascal', 'lower', 'upper')
+WORD = re.compile(r'(?:[A-Z]+(?![a-z])|[A-Z]?[a-z]+)\d*|\d+')
+NAME_AFFIXES = re.compile(r'^([_$]*)(.*?)(_*)$', re.DOTALL)
+EMBEDDED_NAME = re.compile(r'(?<![\w$.])([^\W\d][\w$]*)')
+
+PYTHON_RESERVED = set(keyword.kwlist) | set(keyword.softkwlist) | set(dir(builtins)) | {'self', 'cls'}
+JAVA_RESERVED = {
+    'abstract', 'assert', 'boolean', 'break', 'byte', 'case', 'catch', 'char', 'class', 'const', 'continue',
+    'default', 'do', 'double', 'else', 'enum', 'extends', 'final', 'finally', 'float', 'for', 'goto', 'if',
+    'implements', 'import', 'instanceof', 'int', 'interface', 'long', 'native', 'new', 'package', 'private',
+    'protected', 'public', 'return', 'short', 'static', 'strictfp', 'super', 'switch', 'synchronized', 'this',
+    'throw', 'throws', 'transient', 'try', 'void', 'volatile', 'while', 'var', 'yield', 'record', 'sealed',
+    'permits', 'true', 'false', 'null', 'String', 'Object', 'System', 'Math',
+}
+CPP_RESERVED = {
+    'alignas', 'alignof', 'and', 'and_eq', 'asm', 'auto', 'bitand', 'bitor', 'bool', 'break', 'case', 'catch',
+    'char', 'char8_t', 'char16_t', 'char32_t', 'class', 'compl', 'concept', 'const', 'consteval', 'constexpr',
+    'constinit', 'const_cast', 'continue', 'co_await', 'co_return', 'co_yield', 'decltype', 'default', 'delete',
+    'do', 'double', 'dynamic_cast', 'else', 'enum', 'explicit', 'export', 'extern', 'false', 'float', 'for',
+    'friend', 'goto', 'if', 'inline', 'int', 'long', 'mutable', 'namespace', 'new', 'noexcept', 'not', 'not_eq',
+    'nullptr', 'operator', 'or', 'or_eq', 'private', 'protected', 'public', 'register', 'reinterpret_cast',
+    'requires', 'return', 'short', 'signed', 'sizeof', 'static', 'static_assert', 'static_cast', 'struct', 'switch',
+    'template', 'this', 'thread_local', 'throw', 'true', 'try', 'typedef', 'typeid', 'typename', 'union',
+    'unsigned', 'using', 'virtual', 'void', 'volatile', 'wchar_t', 'while', 'xor', 'xor_eq', 'override', 'final',
+    'std', 'size_t', 'string', 'vector', 'map', 'set', 'cout', 'cin', 'endl',
+}
+JAVASCRIPT_RESERVED = {
+    'break', 'case', 'catch', 'class', 'const', 'continue', 'debugger', 'default', 'delete', 'do', 'else', 'export',
+    'extends', 'false', 'finally', 'for', 'function', 'if', 'import', 'in', 'instanceof', 'new', 'null', 'return',
+    'super', 'switch', 'this', 'throw', 'true', 'try', 'typeof', 'var', 'void', 'while', 'with', 'yield', 'let',
+    'static', 'enum', 'await', 'implements', 'package', 'protected', 'interface', 'private', 'public', 'of',
+    'async', 'get', 'set', 'undefined', 'NaN', 'Infinity', 'arguments', 'eval', 'console', 'window', 'document',
+    'globalThis', 'require', 'module', 'exports', 'Object', 'Array', 'String', 'Number', 'Math', 'JSON', 'Promise',
+    'Map', 'Set', 'Symbol', 'Date', 'Error', 'React',
+}
+TYPESCRIPT_RESERVED = JAVASCRIPT_RESERVED | {
+    'as', 'any', 'number', 'string', 'boolean', 'unknown', 'never', 'object', 'symbol', 'bigint', 'type',
+    'readonly', 'declare', 'abstract', 'keyof', 'infer', 'is', 'namespace', 'satisfies', 'override',
+}
+RESERVED_NAMES = {
+    AcceptedCodeLanguages.Python: PYTHON_RESERVED,
+    AcceptedCodeLanguages.Java: JAVA_RESERVED,
+    AcceptedCodeLanguages.CPlusPlus: CPP_RESERVED,
+    AcceptedCodeLanguages.Javascript: JAVASCRIPT_RESERVED,
+    AcceptedCodeLanguages.JavascriptReact: JAVASCRIPT_RESERVED,
+    AcceptedCodeLanguages.Typescript: TYPESCRIPT_RESERVED,
+    AcceptedCodeLanguages.TypescriptReact: TYPESCRIPT_RESERVED,
+}
+JAVASCRIPT_FAMILY = {AcceptedCodeLanguages.Javascript, AcceptedCodeLanguages.Typescript,
+                     AcceptedCodeLanguages.JavascriptReact, AcceptedCodeLanguages.TypescriptReact}
+REACT_LANGUAGES = {AcceptedCodeLanguages.JavascriptReact, AcceptedCodeLanguages.TypescriptReact}
+
+# Names through which code can reach variables by their name at runtime, functions using them are left as they are
+PYTHON_DYNAMIC_NAMES = {'locals', 'vars', 'eval', 'exec', 'globals'}
+JAVASCRIPT_DYNAMIC_NAMES = {'eval', 'arguments', 'with'}
+# Words that can stand before a name in Java and C++ without being its type
+NON_TYPE_WORDS = {
+    'return', 'new', 'throw', 'else', 'case', 'delete', 'goto', 'sizeof', 'typeof', 'instanceof', 'yield',
+    'co_return', 'co_yield', 'co_await', 'and', 'or', 'not', 'do', 'in', 'extends', 'implements', 'import',
+    'package', 'using', 'namespace', 'typename', 'template', 'class', 'struct', 'enum', 'union', 'operator',
+    'throws', 'assert', 'break', 'continue', 'default', 'public', 'private', 'protected', 'friend', 'virtual',
+    'typedef', 'alignof', 'decltype', 'noexcept', 'requires', 'concept', 'export',
+}
+TYPE_MODIFIERS = {'final', 'const', 'static', 'volatile', 'register', 'constexpr', 'unsigned', 'signed', 'long',
+                  'short', 'struct', 'enum', 'mutable', 'thread_local', 'constinit', 'inline', 'typename'}
+TYPESCRIPT_PARAMETER_PROPERTIES = {'public', 'private', 'protected', 'readonly', 'override'}
+BRACKET_PAIRS = {'(': ')', '[': ']', '{': '}'}
+
+
+def apply_naming_scheme(name: str, scheme: str) -> str:
+    """`name` written in one of `LOCAL_NAMING_SCHEMES`, keeping its leading and trailing underscores."""
+    prefix, core, suffix = NAME_AFFIXES.match(name).groups()
+    words = WORD.findall(core)
+    if not words or ''.join(words) != core.replace('_', ''):
+        return name
+
+    if scheme == 'lower':
+        converted = core.lower()
+    elif scheme == 'upper':
+        converted = core.upper()
+    elif scheme == 'snake':
+        converted = '_'.join(word.lower() for word in words)
+    elif scheme == 'camel':
+        converted = words[0].lower() + ''.join(word.capitalize() for word in words[1:])
+    elif scheme == 'pascal':
+        converted = ''.join(word.capitalize() for word in words)
+    else:
+        return name
+    return f'{prefix}{converted}{suffix}'
+
+
+def unconverted_names(names: set[str], renames: dict[str, str], scheme: str, reserved: set[str]) -> set[str]:
+    """Names that `scheme` would change but that are not renamed, e.g. because their new name is taken."""
+    return {name for name in names - set(renames)
+            if name not in reserved and apply_naming_scheme(name, scheme) != name}
+
+
+def choose_renames(names: list[str], scheme: str, used_names: set[str], reserved: set[str],
+                   targets: dict[str, str]) -> dict[str, str]:
+    """
+    New names of `names` under `scheme`, leaving out every rename whose new name is reserved, already used in the
+    code block or taken by another rename, so that no renamed variable can capture or shadow another name.
+    """
+    renames = dict()
+    for name in names:
+        new_name = apply_naming_scheme(name, scheme)
+        if new_name == name or new_name in reserved or new_name in used_names \
+                or targets.get(new_name, name) != name:
+            continue
+        targets[new_name] = name
+        renames[name] = new_name
+    return renames
+
+
+# Python
+
+class PythonScope:
+    def __init__(self, kind: str, parent: Union['PythonScope', None]):
+        self.kind = kind
+        self.parent = parent
+        self.bound: set[str] = set()
+        self.parameters: set[str] = set()
+        self.globals: set[str] = set()
+        self.nonlocals: set[str] = set()
+        self.dynamic = False
+
+    @property
+    def unit(self) -> 'PythonScope':
+        """The top level function or method this scope is part of."""
+        scope = self
+        while scope.parent is not None and scope.parent.kind not in ('module', 'class'):
+            scope = scope.parent
+        return scope
+
+    def resolve(self, name: str) -> Union['PythonScope', None]:
+        """The scope of the variable `name` refers to here, None for module level and builtin names."""
+        scope, innermost = self, True
+        while scope is not None:
+            if name in scope.globals:
+                return None
+            if name in scope.bound and name not in scope.nonlocals and (innermost or scope.kind != 'class'):
+                return scope
+            scope, innermost = scope.parent, False
+        return None
+
+
+class PythonScopeBuilder(ast.NodeVisitor):
+    """Records every scope of a module, what each binds, and every place a variable name is written."""
+
+    def __init__(self):
+        self.scope = PythonScope('module', None)
+        self.scopes = [self.scope]
+        # (scope the name is written in, name, node holding it)
+        self.occurrences: list[tuple[PythonScope, str, ast.AST]] = []
+        # Names that appear without a node of their own (imports, global statements, match patterns) or that are
+        # function and class names
+        self.blocked: set[str] = set()
+        self.keyword_names: set[str] = set()
+        self.used_names: set[str] = set()
+        self.definition_names: set[str] = set()
+
+    def enter(self, kind: str) -> PythonScope:
+        scope = PythonScope(kind, self.scope)
+        self.scopes.append(scope)
+        self.scope = scope
+        return scope
+
+    def bind(self, name: str, node: Union[ast.AST, None] = None, scope: Union[PythonScope, None] = None):
+        scope = scope or self.scope
+        scope.bound.add(name)
+        self.used_names.add(name)
+        if node is None:
+            self.blocked.add(name)
+        else:
+            self.occurrences.append((scope, name, node))
+
+    def visit_all(self, nodes: list):
+        for node in nodes:
+            if node is not None:
+                self.visit(node)
+
+    def visit_arguments(self, arguments: ast.arguments, scope: PythonScope):
+        for argument in arguments.posonlyargs + arguments.args + arguments.kwonlyargs \
+                + [arguments.vararg, arguments.kwarg]:
+            if argument is not None:
+                scope.parameters.add(argument.arg)
+                self.bind(argument.arg, argument, scope)
+
+    def visit_function(self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda]):
+        arguments = node.args
+        self.visit_all(arguments.defaults + arguments.kw_defaults)
+        if not isinstance(node, ast.Lambda):
+            self.bind(node.name)
+            self.definition_names.add(node.name)
+            self.visit_all(node.decorator_list)
+            self.visit_all([argument.annotation for argument in arguments.posonlyargs + arguments.args
+                            + arguments.kwonlyargs + [arguments.vararg, arguments.kwarg] if argument is not None])
+            self.visit_all([node.returns])
+
+        parent = self.scope
+        scope = self.enter('function')
+        self.visit_arguments(arguments, scope)
+        self.visit_all(node.body if isinstance(node.body, list) else [node.body])
+        self.scope = parent
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_Lambda = visit_function
+
+    def visit_ClassDef(self, node: ast.ClassDef):
+        self.bind(node.name)
+        self.definition_names.add(node.name)
+        self.visit_all(node.decorator_list + node.bases + node.keywords)
+        parent = self.scope
+        self.enter('class')
+        self.visit_all(node.body)
+        self.scope = parent
+
+    def visit_comprehension_scope(self, node: Union[ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp]):
+        # The first iterable is evaluated in the enclosing scope
+        self.visit(node.generators[0].iter)
+        parent = self.scope
+        self.enter('comprehension')
+        for position, generator in enumerate(node.generators):
+            if position:
+                self.visit(generator.iter)
+            self.visit(generator.target)
+            self.visit_all(generator.ifs)
+        self.visit_all([node.key, node.value] if isinstance(node, ast.DictComp) else [node.elt])
+        self.scope = parent
+
+    visit_ListComp = visit_SetComp = visit_DictComp = visit_GeneratorExp = visit_comprehension_scope
+
+    def visit_Name(self, node: ast.Name):
+        if isinstance(node.ctx, (ast.Store, ast.Del)):
+            self.bind(node.id, node)
+            return
+        self.used_names.add(node.id)
+        self.occurrences.append((self.scope, node.id, node))
+        if node.id in PYTHON_DYNAMIC_NAMES:
+            self.scope.dynamic = True
+
+    def visit_NamedExpr(self, node: ast.NamedExpr):
+        self.visit(node.value)
+        # Assignment expressions in comprehensions bind in the enclosing function
+        scope = self.scope
+        while scope.kind == 'comprehension':
+            scope = scope.parent
+        self.bind(node.target.id, node.target, scope)
+
+    def visit_Global(self, node: ast.Global):
+        self.scope.globals.update(node.names)
+        self.blocked.update(node.names)
+
+    def visit_Nonlocal(self, node: ast.Nonlocal):
+        self.scope.nonlocals.update(node.names)
+        self.blocked.update(node.names)
+
+    def visit_Import(self, node: Union[ast.Import, ast.ImportFrom]):
+        for alias in node.names:
+            self.bind(alias.asname or alias.name.split('.')[0])
+
+    visit_ImportFrom = visit_Import
+
+    def visit_ExceptHandler(self, node: ast.ExceptHandler):
+        self.visit_all([node.type])
+        if node.name:
+            self.bind(node.name, node)
+        self.visit_all(node.body)
+
+    def visit_MatchAs(self, node: Union[ast.MatchAs, ast.MatchStar]):
+        if node.name:
+            self.bind(node.name)
+        self.generic_visit(node)
+
+    visit_MatchStar = visit_MatchAs
+
+    def visit_MatchMapping(self, node: ast.MatchMapping):
+        if node.rest:
+            self.bind(node.rest)
+        self.generic_visit(node)
+
+    def visit_keyword(self, node: ast.keyword):
+        if node.arg:
+            self.keyword_names.add(node.arg)
+        self.visit(node.value)
+
+
+def node_name(node: ast.AST) -> str:
+    return node.id if isinstance(node, ast.Name) else node.arg if isinstance(node, ast.arg) else node.name
+
+
+def set_node_name(node: ast.AST, name: str):
+    setattr(node, 'id' if isinstance(node, ast.Name) else 'arg' if isinstance(node, ast.arg) else 'name', name)
+
+
+def name_position(node: ast.AST, name: str, lines: list[bytes]) -> Union[tuple[int, int], None]:
+    """Line and byte column where a name node's name is written."""
+    if not isinstance(node, ast.ExceptHandler):
+        return node.lineno - 1, node.col_offset
+    # `except Error as name` has no position for the name itself
+    line = node.type.end_lineno - 1
+    match = re.compile(rb'\s*as\s+' + re.escape(name.encode()) + rb'\b').match(lines[line], node.type.end_col_offset)
+    return (line, match.end() - len(name.encode())) if match else None
+
+
+def is_special_name(name: str) -> bool:
+    return name.startswith('__') and name.endswith('__')
+
+
+def python_member_names(tree: ast.Module) -> set[str]:
+    """Methods, class variables and attributes set through `self` or `cls` of the classes in a module."""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ClassDef):
+            for statement in node.body:
+                if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    names.add(statement.name)
+                elif isinstance(statement, ast.Assign):
+                    names.update(target.id for target in statement.targets if isinstance(target, ast.Name))
+                elif isinstance(statement, ast.AnnAssign) and isinstance(statement.target, ast.Name):
+                    names.add(statement.target.id)
+        elif isinstance(node, ast.Attribute) and isinstance(node.ctx, ast.Store) \
+                and isinstance(node.value, ast.Name) and node.value.id in ('self', 'cls'):
+            names.add(node.attr)
+    return {name for name in names if not is_special_name(name)}
+
+
+def rename_python_identifiers(source: str, scheme: str) -> Union[str, None]:
+    """
+    Renames the local variables and parameters of every function and method to `scheme`, function and class
+    names are kept. Returns None when the code does not parse, has no function, has methods, class variables or
+    attributes that are not written in `scheme`, which only the model can rename along with their uses, or has
+    a function that would only be partly converted: variables reachable through `locals()`, `global` and
+    `nonlocal` statements or imports, parameters the code block passes by keyword, and names whose new name is
+    already taken.
+    """
+    lines = source.splitlines(keepends=True)
+    dedented = textwrap.dedent(source)
+    try:
+        tree = ast.parse(dedented)
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+    dedented_lines = [line.encode() for line in dedented.splitlines(keepends=True)]
+    if len(dedented_lines) != len(lines):
+        return None
+
+    builder = PythonScopeBuilder()
+    builder.visit(tree)
+    if not any(scope.kind == 'function' for scope in builder.scopes):
+        return None
+    if unconverted_names(python_member_names(tree), dict(), scheme, PYTHON_RESERVED):
+        return None
+    dynamic_units = {scope.unit for scope in builder.scopes if scope.dynamic}
+
+    def is_local(scope: Union[PythonScope, None]) -> bool:
+        return scope is not None and scope.kind in ('function', 'comprehension')
+
+    def renameable(scope: PythonScope, name: str) -> bool:
+        if scope.unit in dynamic_units or name in builder.blocked or name == '_' or name.startswith('__'):
+            return False
+        # Callers in the code block would have to be renamed along with the parameter
+        return name not in scope.parameters or name not in builder.keyword_names
+
+    local_names = {name for scope, name, _ in builder.occurrences if is_local(scope.resolve(name))} \
+        - builder.definition_names
+    variables = [(node, name) for scope, name, node in builder.occurrences
+                 if is_local(scope.resolve(name)) and renameable(scope.resolve(name), name)]
+    names = sorted({name for _, name in variables})
+    renames = choose_renames(names, scheme, builder.used_names, PYTHON_RESERVED, dict())
+    if unconverted_names(local_names, renames, scheme, PYTHON_RESERVED):
+        return None
+
+    edits = []
+    for node, name in variables:
+        if name not in renames:
+            continue
+        position = name_position(node, name, dedented_lines)
+        if position is None:
+            return None
+        edits.append((*position, name, renames[name]))
+        set_node_name(node, renames[name])
+
+    revised_lines = [line.encode() for line in lines]
+    margins = [len(line) - len(dedented_line) for line, dedented_line in zip(revised_lines, dedented_lines)]
+    for line, column, name, new_name in sorted(edits, reverse=True):
+        # Lines keep the indentation that was taken off to parse them
+        column += margins[line]
+        if revised_lines[line][column:column + len(name.encode())] != name.encode():
+            return None
+        revised_lines[line] = revised_lines[line][:column] + new_name.encode() \
+            + revised_lines[line][column + len(name.encode()):]
+    revised = b''.join(revised_lines).decode()
+
+    # The revision has to parse to the same tree as the original with the renamed nodes renamed
+    try:
+        if ast.dump(ast.parse(textwrap.dedent(revised))) != ast.dump(tree):
+            return None
+    except (SyntaxError, ValueError, RecursionError):
+        return None
+    return revised
+
+
+# Java, C++, JavaScript and TypeScript
+
+def match_brackets(tokens: list[Token]) -> tuple[dict[int, int], list[Union[int, None]]]:
+    """Closing bracket of every opening one, and the innermost opening bracket around every token."""
+    matches, openings, enclosing = dict(), [], []
+    for index, token in enumerate(tokens):
+        enclosing.append(openings[-1] if openings else None)
+        if token.text in BRACKET_PAIRS:
+            openings.append(index)
+        elif token.text in BRACKET_PAIRS.values():
+            while openings and BRACKET_PAIRS[tokens[openings[-1]].text] != token.text:
+                openings.pop()
+            if openings:
+                matches[openings.pop()] = index
+    return matches, enclosing
+
+
+class BraceRenamer:
+    """
+    Renames the local variables and parameters of every function of a brace language code block, or of none of
+    them when one of the functions would only be partly converted or when fields and methods are not written in
+    the naming scheme, which only the model can rename along with their uses. Declarations
+    are found on the tokens: `let`, `const` and `var`, a type followed by a name in Java and C++, parameter lists
+    and lambda parameters. Every variable is given the scope of the block, loop or lambda it is declared in, and
+    a name is only renamed when every use of it in the function falls inside the scope of one of its
+    declarations. Names that also appear as members in Java and C++, where fields can be used without `this`, or
+    as shorthand properties and destructuring patterns in JavaScript are left as they are.
+    """
+
+    def __init__(self, source: str, language: AcceptedCodeLanguages):
+        self.source = source
+        self.language = language
+        self.javascript = language in JAVASCRIPT_FAMILY
+        self.tokens = [token for token in tokenize(source, language)
+                       if token.kind not in (WHITESPACE, NEWLINE, COMMENT)]
+        self.matches, self.enclosing = match_brackets(self.tokens)
+        self.reserved = RESERVED_NAMES[language]
+
+    def text(self, index: int) -> str:
+        return self.tokens[index].text if 0 <= index < len(self.tokens) else ''
+
+    def operator_at(self, index: int, operator: str) -> bool:
+        """Whether the tokens from `index` spell `operator` without any space between them."""
+        if index < 0 or index + len(operator) > len(self.tokens):
+            return False
+        pieces = self.tokens[index:index + len(operator)]
+        return ''.join(piece.text for piece in pieces) == operator \
+            and all(first.end == second.start for first, second in zip(pieces, pieces[1:]))
+
+    def is_name(self, index: int) -> bool:
+        return 0 <= index < len(self.tokens) and self.tokens[index].kind == NAME \
+            and self.text(index) not in self.reserved
+
+    def is_member(self, index: int) -> bool:
+        return self.text(index - 1) == '.' or self.operator_at(index - 2, '->') or self.operator_at(index - 2, '::')
+
+    def newline_before(self, index: int) -> bool:
+        return index > 0 and '\n' in self.source[self.tokens[index - 1].end:self.tokens[index].start]
+
+    def statement_end(self, start: int, end: int) -> int:
+        """Last token of the statement starting at `start`, for loops whose body is not a block."""
+        index = start
+        while index < end:
+            text = self.text(index)
+            if text in BRACKET_PAIRS:
+                closing = self.matches.get(index, end - 1)
+                if text == '{' and self.text(closing + 1) != 'else':
+                    return closing
+                index = closing + 1
+                continue
+            if text == ';' and self.text(index + 1) != 'else':
+                return index
+            index += 1
+        return end - 1
+
+    def expression_end(self, start: int, end: int) -> int:
+        """Last token of the expression starting at `start`, e.g. the body of a lambda."""
+        index = start
+        while index < end:
+            text = self.text(index)
+            if text in BRACKET_PAIRS:
+                index = self.matches.get(index, end - 1) + 1
+                continue
+            if text in BRACKET_PAIRS.values() or text in (',', ';'):
+                return index - 1
+            index += 1
+        return end - 1
+
+    def arrow_after(self, index: int) -> Union[int, None]:
+        """Index of the body after a `=>` or `->` lambda arrow starting at `index`."""
+        if self.operator_at(index, '=>') or (not self.javascript and self.language != AcceptedCodeLanguages.CPlusPlus
+                                             and self.operator_at(index, '->')):
+            return index + 2
+        return None
+
+    def body_end(self, body: int, end: int) -> int:
+        return self.matches.get(body, end - 1) if self.text(body) == '{' else self.expression_end(body, end)
+
+    def declaration_scope(self, index: int, unit: tuple[int, int], header: Union[int, None]) -> tuple[int, int]:
+        opening = self.enclosing[index]
+        if opening is None or opening < unit[0] or opening == header:
+            return unit
+        text = self.text(opening)
+        closing = self.matches.get(opening, unit[1] - 1)
+        if text != '(':
+            return opening, closing
+        if self.text(opening - 1) in ('for', 'catch'):
+            return opening, self.statement_end(closing + 1, unit[1])
+        if self.text(closing + 1) == '{':
+            return opening, self.matches.get(closing + 1, unit[1] - 1)
+        body = self.arrow_after(closing + 1)
+        if body is not None:
+            return opening, self.body_end(body, unit[1])
+        return opening, closing
+
+    def parameter_names(self, opening: int) -> tuple[list[int], set[str]]:
+        """Indices of the parameter names in a parameter list, and names that cannot be renamed."""
+        closing = self.matches.get(opening)
+        if closing is None:
+            return [], set()
+        parameters, blocked, segment = [], set(), []
+        for index in range(opening + 1, closing + 1):
+            if index < closing and (self.text(index) != ',' or self.enclosing[index] != opening):
+                if self.enclosing[index] == opening:
+                    segment.append(index)
+                continue
+            names = [position for position in segment if self.tokens[position].kind == NAME]
+            if self.javascript:
+                first = next((position for position in segment if self.text(position) != '.'), None)
+                if first is not None and self.text(first) in BRACKET_PAIRS:
+                    # Destructured parameters
+                    blocked.update(self.text(position) for position in range(first, self.matches.get(first, first))
+                                   if self.tokens[position].kind == NAME)
+                elif first is not None and self.text(first) in TYPESCRIPT_PARAMETER_PROPERTIES:
+                    blocked.update(self.text(position) for position in names)
+                elif first is not None and self.is_name(first) and self.text(first) != 'this':
+                    parameters.append(first)
+            else:
+                default = next((position for position in segment if self.text(position) == '='), None)
+                typed = [position for position in names if default is None or position < default]
+                # A single name is either an untyped lambda parameter or a parameter type without a name
+                if typed and (len(typed) > 1 or self.arrow_after(closing + 1) is not None):
+                    parameters.append(typed[-1])
+            segment = []
+        return parameters, blocked
+
+    def is_typed_declaration(self, index: int, unit: tuple[int, int]) -> bool:
+        """Whether the name at `index` is declared with a type before it, e.g. `final List<String> names = ...`."""
+        following = self.text(index + 1)
+        if following == '=' and self.operator_at(index + 1, '=='):
+            return False
+        cpp = self.language == AcceptedCodeLanguages.CPlusPlus
+        if following in ('(', '{') and cpp:
+            closing = self.matches.get(index + 1)
+            if closing is None or closing == index + 2 or self.text(closing + 1) not in (';', ','):
+                return False
+        elif following not in ('=', ';', ',', ':', ')', '['):
+            return False
+
+        position = index - 1
+        while True:
+            if self.text(position) in ('*', '&'):
+                position -= 1
+            elif self.text(position) == ']' and self.text(position - 1) == '[':
+                position -= 2
+            elif self.text(position) == '.' and self.operator_at(position - 2, '...'):
+                position -= 3
+            else:
+                break
+        if self.text(position) == '>':
+            depth = 0
+            while position >= unit[0]:
+                text = self.text(position)
+                if text == '>':
+                    depth += 1
+                elif text == '<':
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif self.tokens[position].kind != NAME and text not in (',', '.', ':', '?', '[', ']', '*', '&'):
+                    return False
+                position -= 1
+            position -= 1
+        if position < unit[0] or self.tokens[position].kind != NAME or self.text(position) in NON_TYPE_WORDS:
+            return False
+
+        while position - 2 >= unit[0] and self.text(position - 1) == '.' and self.tokens[position - 2].kind == NAME:
+            position -= 2
+        while position - 3 >= unit[0] and self.operator_at(position - 2, '::') \
+                and self.tokens[position - 3].kind == NAME:
+            position -= 3
+        while self.text(position - 1) in TYPE_MODIFIERS or self.text(position - 2) == '@':
+            position -= 2 if self.text(position - 2) == '@' else 1
+        return self.text(position - 1) in ('{', '}', ';', '(', ',', ':', ')') or position <= unit[0]
+
+    def declarators(self, index: int, unit: tuple[int, int]) -> list[int]:
+        """The names declared by the statement whose first declared name is at `index`: `int a = 1, b = 2;`."""
+        names, position = [index], index + 1
+        while position < unit[1]:
+            text = self.text(position)
+            if text in BRACKET_PAIRS:
+                position = self.matches.get(position, unit[1]) + 1
+                continue
+            if text in (';', ')', ']', '}') or (self.javascript and self.newline_before(position)
+                                                and self.text(position - 1) != ','):
+                break
+            if text == ',' and self.is_name(position + 1):
+                names.append(position + 1)
+            position += 1
+        return names
+
+    def find_declarations(self, unit: tuple[int, int], header: Union[int, None],
+                          declared: dict[str, list[tuple[int, int]]], blocked: set[str]):
+        def declare(position: int, scope: Union[tuple[int, int], None] = None):
+            declared.setdefault(self.text(position), []).append(
+                scope or self.declaration_scope(position, unit, header))
+
+        if header is not None:
+            parameters, blocked_parameters = self.parameter_names(header)
+            blocked.update(blocked_parameters)
+            for position in parameters:
+                declare(position, unit)
+
+        start = self.matches.get(header, unit[0]) + 1 if header is not None else unit[0]
+        for index in range(start, unit[1]):
+            text = self.text(index)
+            if self.javascript and text in ('let', 'const', 'var') and self.tokens[index].kind == NAME:
+                scope = unit if text == 'var' else None
+                if self.text(index + 1) in ('{', '['):
+                    closing = self.matches.get(index + 1, index + 1)
+                    blocked.update(self.text(position) for position in range(index + 1, closing)
+                                   if self.tokens[position].kind == NAME)
+                elif self.is_name(index + 1):
+                    for position in self.declarators(index + 1, unit):
+                        declare(position, scope)
+            elif text == 'function' and self.javascript:
+                if self.tokens[index + 1].kind == NAME:
+                    blocked.add(self.text(index + 1))
+            elif text == '(' and index in self.matches:
+                closing = self.matches[index]
+                before = self.text(index - 1)
+                nested_function = (self.tokens[index - 1].kind == NAME and before not in self.reserved
+                                   and self.text(closing + 1) == '{') or before == 'function'
+                lambda_body = self.arrow_after(closing + 1)
+                if nested_function or lambda_body is not None or (before == 'catch' and self.javascript):
+                    parameters, blocked_parameters = self.parameter_names(index)
+                    blocked.update(blocked_parameters)
+                    if nested_function and before != 'function':
+                        blocked.add(before)
+                    for position in parameters:
+                        declare(position, self.declaration_scope(position, unit, None))
+            elif self.is_name(index) and self.arrow_after(index + 1) is not None and self.text(index - 1) != ')':
+                # x => x * 2
+                body = self.arrow_after(index + 1)
+                declare(index, (index, self.body_end(body, unit[1])))
+            elif not self.javascript and self.is_name(index) and self.is_typed_declaration(index, unit):
+                opening = self.enclosing[index]
+                if opening is not None and self.text(opening) == '(' and opening >= unit[0]:
+                    declare(index)
+                else:
+                    for position in self.declarators(index, unit):
+                        declare(position)
+
+    def occurrences(self, unit: tuple[int, int], names: set[str],
+                    blocked: set[str]) -> dict[str, list[tuple[int, int]]]:
+        """Token index and source offset of every use of the declared names in a function."""
+        found: dict[str, list[tuple[int, int]]] = {name: [] for name in names}
+        for index in range(unit[0], unit[1]):
+            token = self.tokens[index]
+            if token.kind == STRING and self.javascript and token.text.startswith('`'):
+                for name, offset in self.template_names(token):
+                    if name in found:
+                        found[name].append((index, offset))
+                continue
+            if token.kind != NAME or token.text not in found:
+                continue
+            if self.is_member(index):
+                if not self.javascript:
+                    # Java and C++ fields can be used without `this`, so the name could mean either
+                    blocked.add(token.text)
+                continue
+            before, after = self.text(index - 1), self.text(index + 1)
+            inside_braces = self.enclosing[index] is not None and self.text(self.enclosing[index]) == '{'
+            if self.javascript and inside_braces and before in ('{', ','):
+                if after == ':':
+                    # Object literal keys and type members
+                    continue
+                if after in ('}', ','):
+                    # Shorthand properties are keys as well
+                    blocked.add(token.text)
+            if not self.javascript and before in ('goto', 'break', 'continue'):
+                blocked.add(token.text)
+            if self.language == AcceptedCodeLanguages.Java and after == '(':
+                # Methods and variables have separate names in Java
+                continue
+            found[token.text].append((index, token.start))
+        return found
+
+    def template_names(self, token: Token) -> list[tuple[str, int]]:
+        """Names used in the `${...}` expressions of a template literal, with their offset in the source."""
+        names, position = [], 0
+        while True:
+            start = token.text.find('${', position)
+            if start < 0:
+                return names
+            depth, end = 0, start + 1
+            while end < len(token.text):
+                depth += {'{': 1, '}': -1}.get(token.text[end], 0)
+                if depth == 0:
+                    break
+                end += 1
+            expression = token.text[start + 2:end]
+            for inner in tokenize(expression, self.language):
+                if inner.kind == NAME and not expression[:inner.start].rstrip().endswith('.'):
+                    names.append((inner.text, token.start + start + 2 + inner.start))
+            position = end
+
+    def rename(self, scheme: str) -> Union[str, None]:
+        all_names = {token.text for token in self.tokens if token.kind == NAME}
+        for token in self.tokens:
+            if token.kind == STRING and self.javascript and token.text.startswith('`'):
+                all_names.update(name for name, _ in self.template_names(token))
+        targets: dict[str, str] = dict()
+        edits = []
+        # Names used by preprocessor directives, which macros could expand anywhere
+        macro_names = {name for line in self.source.split('\n') if line.lstrip().startswith('#')
+                       for name in re.findall(r'[^\W\d]\w*', line)}
+
+        declarations = split_declarations(self.source, self.language)
+        if not declarations:
+            return None
+        if unconverted_names(self.member_names(declarations), dict(), scheme, self.reserved):
+            return None
+        last_end = -1
+        for declaration in sorted(declarations, key=lambda declaration: declaration.start):
+            if declaration.start < last_end:
+                continue
+            last_end = declaration.end
+            indices = [index for index, token in enumerate(self.tokens)
+                       if declaration.start <= token.start < declaration.end]
+            if not indices:
+                continue
+            unit = (indices[0], indices[-1] + 1)
+            if self.javascript and {self.text(index) for index in range(*unit)} & JAVASCRIPT_DYNAMIC_NAMES:
+                return None
+
+            header = self.header(declaration.name.split('.')[-1], unit)
+            declared: dict[str, list[tuple[int, int]]] = dict()
+            blocked = {declaration.name.split('.')[-1] for declaration in declarations} | macro_names
+            self.find_declarations(unit, header, declared, blocked)
+            found = self.occurrences(unit, set(declared), blocked)
+
+            renameable = []
+            for name, scopes in declared.items():
+                if name in blocked or not all(any(start <= index <= end for start, end in scopes)
+                                              for index, _ in found[name]):
+                    continue
+                renameable.append(name)
+            renames = choose_renames(sorted(renameable), scheme, all_names, self.reserved, targets)
+            if unconverted_names(set(declared), renames, scheme, self.reserved):
+                return None
+            for name, new_name in renames.items():
+                edits.extend((offset, name, new_name) for _, offset in found[name])
+
+        revised = self.source
+        for offset, name, new_name in sorted(set(edits), reverse=True):
+            revised = revised[:offset] + new_name + revised[offset + len(name):]
+        return revised
+
+    def member_names(self, declarations: list[Declaration]) -> set[str]:
+        """Methods of the classes in the code block, fields declared in their bodies and fields set through `this`."""
+        names = {re.split(r'\.|::', declaration.name)[-1] for declaration in declarations
+                 if '.' in declaration.name or '::' in declaration.name}
+        for index, token in enumerate(self.tokens):
+            if token.text != 'this':
+                continue
+            member = index + 2 if self.text(index + 1) == '.' else index + 3 if self.operator_at(index + 1, '->') \
+                else None
+            if member is not None and member < len(self.tokens) and self.tokens[member].kind == NAME:
+                names.add(self.text(member))
+
+        methods = {(declaration.start, declaration.end) for declaration in declarations}
+        for container in split_declarations(self.source, self.language, include_containers=True):
+            if (container.start, container.end) in methods:
+                continue
+            body = next((index for index, token in enumerate(self.tokens)
+                         if container.start <= token.start < container.end and token.text == '{'), None)
+            if body is None:
+                continue
+            for index in range(body + 1, self.matches.get(body, body)):
+                # `int count = 0;`, `count: number;` and `count = 0;` directly in the class body
+                if self.enclosing[index] == body and self.is_name(index) and not self.is_member(index) \
+                        and self.text(index + 1) in ('=', ';', ':', ',') and not self.operator_at(index + 1, '=='):
+                    names.add(self.text(index))
+        return {name for name in names if not is_special_name(name)}
+
+    def header(self, short_name: str, unit: tuple[int, int]) -> Union[int, None]:
+        """Opening parenthesis of a function's own parameter list."""
+        for index in range(*unit):
+            text = self.text(index)
+            if text == '{' or self.arrow_after(index) is not None:
+                break
+            if text == short_name and self.text(index + 1) == '(':
+                return index + 1
+        for index in range(*unit):
+            text = self.text(index)
+            if text == '{' or self.arrow_after(index) is not None:
+                return None
+            if text == '(' and self.text(index - 2) != '@':
+                return index
+        return None
+
+
+def contains_jsx(tokens: list[Token]) -> bool:
+    return any(token.text == '<' and index + 1 < len(tokens) and tokens[index + 1].start == token.end
+               and (tokens[index + 1].kind == NAME or tokens[index + 1].text == '>')
+               and tokens[index - 1].text in ('(', 'return', '=', ',', '?', ':', '&', '|', '>', '{', '[')
+               for index, token in enumerate(tokens) if index)
+
+
+def significant_tokens(source: str, language: AcceptedCodeLanguages) -> list[Token]:
+    return [token for token in tokenize(source, language) if token.kind not in (WHITESPACE, NEWLINE, COMMENT)]
+
+
+def member_names(code_block: str, language: AcceptedCodeLanguages) -> set[str]:
+    """Methods, fields and attributes of the classes declared in the code block."""
+    if language == AcceptedCodeLanguages.Python:
+        try:
+            return python_member_names(ast.parse(textwrap.dedent(code_block)))
+        except (SyntaxError, ValueError, RecursionError):
+            return set()
+    renamer = BraceRenamer(code_block, language)
+    return renamer.member_names(split_declarations(code_block, language))
+
+
+def is_consistent_renaming(original: str, revised: str, language: AcceptedCodeLanguages) -> bool:
+    """
+    Whether `revised` is `original` with some of its variables renamed and nothing else changed, whitespace and
+    comments aside: every renamed name is renamed the same way everywhere, no two names end up as the same name,
+    no name is renamed to one that is still used unchanged, and keywords, members of anything but the classes of
+    the code block and every other token are untouched. Names inside f-strings and template literals are renamed
+    along with the rest.
+    """
+    original_tokens = significant_tokens(original, language)
+    revised_tokens = significant_tokens(revised, language)
+    if len(original_tokens) != len(revised_tokens):
+        return False
+
+    reserved = RESERVED_NAMES[language]
+    own_members = member_names(original, language)
+
+    def is_member(index: int) -> bool:
+        previous = original_tokens[index - 1].text if index > 0 else ''
+        return previous == '.' or (previous in ('>', ':') and index > 1
+                                   and original_tokens[index - 2].text == ('-' if previous == '>' else ':'))
+
+    renames: dict[str, str] = dict()
+    targets: dict[str, str] = dict()
+    kept: set[str] = set()
+    kept_members: set[str] = set()
+    changed_strings = []
+    for index, (before, after) in enumerate(zip(original_tokens, revised_tokens)):
+        if before.kind != after.kind:
+            return False
+        member = is_member(index)
+        if before.text == after.text:
+            if before.kind == NAME:
+                (kept_members if member else kept).add(before.text)
+            continue
+        if before.kind == STRING:
+            changed_strings.append((before.text, after.text))
+            continue
+        if before.kind != NAME or (member and before.text not in own_members) or before.text in reserved \
+                or after.text in reserved:
+            return False
+        if renames.setdefault(before.text, after.text) != after.text \
+                or targets.setdefault(after.text, before.text) != before.text:
+            return False
+
+    # A name renamed in some places only, or renamed to one that is still used unchanged
+    if kept & (set(renames) | set(targets)) or kept_members & (set(renames) | set(targets)):
+        return False
+    return all(EMBEDDED_NAME.sub(lambda match: renames.get(match.group(1), match.group(1)), before) == after
+               for before, after in changed_strings)
+
+
+def rename_identifiers(code_block: str, language: AcceptedCodeLanguages, scheme: str) -> Union[str, None]:
+    """
+    The code block with the local variables and parameters of its functions renamed to `scheme`, without a model.
+    Returns None when it has to be left to the model: for hungarian notation, which needs the type of every
+    variable, for code without functions, with variables that cannot all be renamed or with class members that
+    are not written in `scheme`, for Python that does not parse and for JSX, whose attributes and text cannot be
+    told apart from variables.
+    """
+    if scheme not in LOCAL_NAMING_SCHEMES:
+        return None
+    if language == AcceptedCodeLanguages.Python:
+        return rename_python_identifiers(code_block, scheme)
+    if language in REACT_LANGUAGES and contains_jsx(significant_tokens(code_block, language)):
+        return None
+
+    revised = BraceRenamer(code_block, language).rename(scheme)
+    return revised if revised is not None and is_consistent_renaming(code_block, revised, language) else None
@@ -0,0 +1,249 @@
+import math
+import time
+import random
+import asyncio
+
+from typing import Any, Union
+from collections import deque
+from email.utils import parsedate_to_datetime
+from collections.abc import Awaitable, Callable
+
+from src.core.settings import AppSettings, get_settings
+from src.core.metrics import hedged_requests, upstream_retries
+
+# Status codes worth another attempt besides rate limiting and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+
+def is_retryable(error: Exception) -> bool:
+    from openai import APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+
+    if isinstance(error, (APIConnectionError, RateLimitError, InternalServerError)):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code in RETRYABLE_STATUS_CODES
+                                                  or error.status_code >= 500)
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    from openai import RateLimitError
+
+    # Being throttled says nothing about the health of the endpoint
+    return is_retryable(error) and not isinstance(error, RateLimitError) \
+        and getattr(error, 'status_code', None) != 429
+
+
+def retry_after_seconds(error: Exception) -> Union[float, None]:
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000
+        retry_after = headers.get('retry-after')
+        if retry_after is None:
+            return None
+        if retry_after.replace('.', '', 1).isdigit():
+            return float(retry_after)
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_seconds`, after which a
+    single trial call is let through: its success closes the circuit again, its failure reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Union[float, None] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'open' if time.monotonic() - self.opened_at < self.reset_seconds else 'half_open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'open' or self.trial_in_flight:
+            return False
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        # The trial call ended without telling anything about the endpoint, e.g. it was cancelled
+        self.trial_in_flight = False
+
+
+class LatencyWindow:
+    """Durations of the most recent successful completions of one model and command."""
+
+    MIN_SAMPLES = 20
+
+    def __init__(self, size: int = 200):
+        self.samples: deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Union[float, None]:
+        if len(self.samples) < self.MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class UpstreamCallPolicy:
+    """
+    Calls the OpenAI API with retries, exponential backoff with full jitter, a circuit breaker per endpoint
+    and optional hedging. Retries take the Retry-After of throttled responses into account, errors that are
+    not transient (authentication, bad requests, ...) are raised straight away.
+    """
+
+    HEDGE_PERCENTILE = 0.95
+
+    def __init__(self, app_settings: AppSettings):
+        self.max_attempts = max(1, app_settings.llm_max_attempts)
+        self.backoff_base_seconds = app_settings.llm_backoff_base_seconds
+        self.backoff_max_seconds = app_settings.llm_backoff_max_seconds
+        self.failure_threshold = app_settings.llm_circuit_failure_threshold
+        self.reset_seconds = app_settings.llm_circuit_reset_seconds
+        self.hedging_enabled = app_settings.llm_hedging_enabled
+        self.hedging_min_delay_seconds = app_settings.llm_hedging_min_delay_seconds
+        self.breakers: dict[str, CircuitBreaker] = dict()
+        self.latencies: dict[tuple[str, str], LatencyWindow] = dict()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+        return self.breakers[endpoint]
+
+    def latency_window(self, latency_key: tuple[str, str]) -> LatencyWindow:
+        if latency_key not in self.latencies:
+            self.latencies[latency_key] = LatencyWindow()
+        return self.latencies[latency_key]
+
+    def backoff_seconds(self, attempt: int, error: Exception) -> float:
+        exponential_delay = min(self.backoff_max_seconds, self.backoff_base_seconds * 2 ** (attempt - 1))
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(self.backoff_max_seconds, retry_after) + random.uniform(0, self.backoff_base_seconds)
+        return random.uniform(0, exponential_delay)
+
+    def hedge_delay(self, latency_key: tuple[str, str]) -> Union[float, None]:
+        if not self.hedging_enabled:
+            return None
+        p95 = self.latency_window(latency_key).percentile(self.HEDGE_PERCENTILE)
+        return max(self.hedging_min_delay_seconds, p95) if p95 is not None else None
+
+    async def call(self, endpoint: str, latency_key: tuple[str, str], create: Callable[[], Awaitable[Any]],
+                   hedge: bool = True, failover: bool = False,
+                   charge: Union[Callable[[], Awaitable[None]], None] = None,
+                   can_charge: Union[Callable[[], bool], None] = None) -> Any:
+        """
+        Runs `create` until it succeeds, fails with a permanent error or runs out of attempts. With `failover`,
+        failures of the endpoint itself are raised straight away for the caller to try another endpoint.
+
+        The caller pays for the first request, every retry and hedge is paid for with `charge`, e.g. by
+        acquiring rate limit capacity. Requests are only hedged while `can_charge` says there is capacity to
+        spare for them.
+        """
+        breaker = self.breaker(endpoint)
+        for attempt in range(1, self.max_attempts + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit breaker for {endpoint} is open after repeated failures")
+
+            start_time = time.perf_counter()
+            try:
+                if attempt > 1 and charge is not None:
+                    await charge()
+                hedge_delay = self.hedge_delay(latency_key) if hedge else None
+                result = await (self.hedged(create, hedge_delay, charge=charge, can_charge=can_charge)
+                                if hedge_delay is not None else create())
+            except asyncio.CancelledError:
+                breaker.release_trial()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.release_trial()
+                    raise
+                if is_endpoint_failure(e):
+                    breaker.record_failure()
+                else:
+                    breaker.release_trial()
+                if attempt == self.max_attempts or (failover and is_endpoint_failure(e)):
+                    raise
+                upstream_retries.inc(type(e).__name__)
+                await asyncio.sleep(self.backoff_seconds(attempt, e))
+                continue
+
+            breaker.record_success()
+            self.latency_window(latency_key).observe(time.perf_counter() - start_time)
+            return result
+
+    @staticmethod
+    async def hedged(create: Callable[[], Awaitable[Any]], hedge_delay: float,
+                     charge: Union[Callable[[], Awaitable[None]], None] = None,
+                     can_charge: Union[Callable[[], bool], None] = None) -> Any:
+        """
+        Sends a second request when the first one has not answered after `hedge_delay` seconds and returns
+        whichever succeeds first, the other one is cancelled. The second request is paid for with `charge` and
+        not sent at all when `can_charge` says it could not be paid for straight away.
+        """
+        async def charged_create():
+            if charge is not None:
+                await charge()
+            return await create()
+
+        first = asyncio.ensure_future(create())
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                if can_charge is not None and not can_charge():
+                    hedged_requests.inc('skipped')
+                    return await first
+                tasks.append(asyncio.ensure_future(charged_create()))
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if len(tasks) > 1:
+                            hedged_requests.inc('first' if task is first else 'hedge')
+                        return task.result()
+            # Both failed, the error of the original request is the one reported
+            return first.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()
+
+
+upstream_calls = UpstreamCallPolicy(get_settings())
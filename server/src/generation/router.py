@@ -1,14 +1,25 @@
 from base64 import decode
-from fastapi import APIRouter, Depends, File
+from functools import partial
+from fastapi import APIRouter, Depends, File, HTTPException
+from fastapi.responses import StreamingResponse
 
 from typing import Annotated
 
-from src.generation.service import OpenAIChatSession
+from src.core.settings import get_settings
+from src.generation.cache import build_request_cache_key
+from src.generation.streaming import BufferedVerifier, NDJSON_MEDIA_TYPE, generation_events, \
+    cached_generation_events
+from src.generation.dependencies import ChatSessions, RateLimiter, ResponseCacheDep
+from src.generation.service import generate_annotation, generate_explanation, generate_analysis, \
+    generate_revision, generate_definition, generate_batch, generate_pdf_documentation
 from src.generation.schemas import ExplainSchemaIn, ExplainSchemaOut, GeneratePDFSchemaIn, \
     ReviseSchemaIn, ReviseSchemaOut, DefineSchemaIn, DefineSchemaOut, AnnotateSchemaIn, GeneratePDFSchemaOut, \
-    AnnotateSchemaOut, AnalyseSchemaIn, AnalyseSchemaOut, GenerativeTransformerModel, SystemPrompt
+    AnnotateSchemaOut, AnalyseSchemaIn, AnalyseSchemaOut, GenerativeTransformerModel, SystemPrompt, \
+    CacheStatsSchemaOut, RateLimitStatusSchemaOut, BatchSchemaIn, BatchSchemaOut
 
 
+settings = get_settings()
+
 generation_router = APIRouter(
     prefix='/generation',
     tags=['code_generation', 'openai', 'explanations', 'documentation'],
@@ -18,99 +29,179 @@ generation_router = APIRouter(
 
 
 @generation_router.post('/annotate/', response_model=AnnotateSchemaOut)
-async def annotate_code_snippet(metadata: AnnotateSchemaIn):
-    chat_session = OpenAIChatSession(
+async def annotate_code_snippet(metadata: AnnotateSchemaIn, chat_sessions: ChatSessions,
+                                response_cache: ResponseCacheDep):
+    return await generate_annotation(metadata, chat_sessions, response_cache)
+
+
+@generation_router.post('/explain/', response_model=ExplainSchemaOut)
+async def explain_code_snippet(metadata: ExplainSchemaIn, chat_sessions: ChatSessions,
+                               response_cache: ResponseCacheDep):
+    return await generate_explanation(metadata, chat_sessions, response_cache)
+
+
+@generation_router.post('/analyse/', response_model=AnalyseSchemaOut)
+async def analyse_code_snippet(metadata: AnalyseSchemaIn, chat_sessions: ChatSessions,
+                               response_cache: ResponseCacheDep):
+    return await generate_analysis(metadata, chat_sessions, response_cache)
+
+
+@generation_router.post("/revise/", response_model=ReviseSchemaOut)
+async def revise_code_snippet(
+    metadata: ReviseSchemaIn,
+    chat_sessions: ChatSessions,
+    response_cache: ResponseCacheDep,
+):
+    return await generate_revision(metadata, chat_sessions, response_cache)
+
+
+@generation_router.post('/define/', response_model=DefineSchemaOut)
+async def define_code_snippet(metadata: DefineSchemaIn, chat_sessions: ChatSessions,
+                              response_cache: ResponseCacheDep):
+    return await generate_definition(metadata, chat_sessions, response_cache)
+
+
+@generation_router.post('/create-pdf/', response_model=GeneratePDFSchemaOut)
+async def define_code_snippet(metadata: GeneratePDFSchemaIn, chat_sessions: ChatSessions,
+                              response_cache: ResponseCacheDep):
+    return await generate_pdf_documentation(metadata, chat_sessions, response_cache)
+
+
+@generation_router.post('/batch/', response_model=BatchSchemaOut)
+async def batch_generate_code_snippets(metadata: BatchSchemaIn, chat_sessions: ChatSessions,
+                                       response_cache: ResponseCacheDep):
+    if len(metadata.jobs) > settings.batch_max_jobs:
+        raise HTTPException(status_code=413, detail=f"Batches are limited to {settings.batch_max_jobs} jobs")
+
+    results = await generate_batch(metadata.jobs, chat_sessions, response_cache,
+                                   max_concurrency=settings.batch_max_concurrency)
+    return {"results": results}
+
+
+@generation_router.post('/stream/annotate/')
+async def stream_annotate_code_snippet(metadata: AnnotateSchemaIn, chat_sessions: ChatSessions,
+                                       response_cache: ResponseCacheDep):
+    cache_key = build_request_cache_key(SystemPrompt.Annotate, metadata)
+    cached_output = await response_cache.get(cache_key)
+    if cached_output is not None:
+        return StreamingResponse(cached_generation_events(
+            cached_output["annotated_output"], cached_output["successful_annotation"]), media_type=NDJSON_MEDIA_TYPE)
+
+    chat_session = chat_sessions.create(
         language=metadata.code_extension,
         model=GenerativeTransformerModel.Azure,
         command=SystemPrompt.Annotate,
     )
 
-    successful_annotation, annotated_output = chat_session.annotate_code_block(
-        metadata.code_block_to_generate_from)
-
-    return {
-        "annotated_output": annotated_output,
-        "successful_annotation": successful_annotation,
-    }
-
-
-@generation_router.post('/explain/', response_model=ExplainSchemaOut)
-async def explain_code_snippet(metadata: ExplainSchemaIn):
-    chat_session = OpenAIChatSession(
+    async def store_annotation(annotated_output: str, successful_annotation: bool):
+        if successful_annotation:
+            await response_cache.set(cache_key, {
+                "annotated_output": annotated_output,
+                "successful_annotation": successful_annotation,
+            })
+
+    token_stream = await chat_session.stream_annotate_code_block(metadata.code_block_to_generate_from)
+    return StreamingResponse(generation_events(
+        token_stream,
+        verifier=chat_session.create_code_verifier(metadata.code_block_to_generate_from),
+        on_complete=store_annotation), media_type=NDJSON_MEDIA_TYPE)
+
+
+@generation_router.post('/stream/explain/')
+async def stream_explain_code_snippet(metadata: ExplainSchemaIn, chat_sessions: ChatSessions,
+                                      response_cache: ResponseCacheDep):
+    cache_key = build_request_cache_key(SystemPrompt.Explain, metadata)
+    cached_output = await response_cache.get(cache_key)
+    if cached_output is not None:
+        return StreamingResponse(cached_generation_events(cached_output["explained_output"]),
+                                 media_type=NDJSON_MEDIA_TYPE)
+
+    chat_session = chat_sessions.create(
         language=metadata.code_extension,
         model=GenerativeTransformerModel.Azure,
         command=SystemPrompt.Explain,
     )
 
-    explained_output = chat_session.explain_code_block(
+    async def store_explanation(explained_output: str, _: None):
+        await response_cache.set(cache_key, {
+            "explained_output": explained_output,
+            "explanation_complexity": metadata.explanation_complexity,
+        })
+
+    token_stream = await chat_session.stream_explain_code_block(
         metadata.code_block_to_generate_from,
         complexity=metadata.explanation_complexity // 10,
         response_language=metadata.response_language)
+    return StreamingResponse(generation_events(
+        token_stream, strip_code_fences=False, on_complete=store_explanation), media_type=NDJSON_MEDIA_TYPE)
 
-    return {
-        "explained_output": explained_output,
-        "explanation_complexity": metadata.explanation_complexity,
-    }
 
+@generation_router.post('/stream/revise/')
+async def stream_revise_code_snippet(metadata: ReviseSchemaIn, chat_sessions: ChatSessions,
+                                     response_cache: ResponseCacheDep):
+    cache_key = build_request_cache_key(SystemPrompt.Revise, metadata)
+    cached_output = await response_cache.get(cache_key)
+    if cached_output is not None:
+        return StreamingResponse(cached_generation_events(
+            cached_output["revised_output"], cached_output["successful_revision"]), media_type=NDJSON_MEDIA_TYPE)
 
-@generation_router.post('/analyse/', response_model=AnalyseSchemaOut)
-async def analyse_code_snippet(metadata: AnalyseSchemaIn):
-    chat_session = OpenAIChatSession(
-        language=metadata.code_extension,
-        model=GenerativeTransformerModel.Azure,
-        command=SystemPrompt.Analyse,
-    )
-
-    analysed_output, complexity_dict = chat_session.analyse_code_block(
-        metadata.code_block_to_generate_from)
-
-    return {
-        "analysed_output": analysed_output,
-        "complexity_breakdown": complexity_dict
-    }
-
-
-@generation_router.post("/revise/", response_model=ReviseSchemaOut)
-async def revise_code_snippet(
-    metadata: ReviseSchemaIn,
-):
-    chat_session = OpenAIChatSession(
+    chat_session = chat_sessions.create(
         language=metadata.code_extension,
         model=GenerativeTransformerModel.Azure,
         command=SystemPrompt.Revise,
     )
 
-    successful_revision, revised_output = chat_session.revise_code_block(
-        metadata.code_block_to_generate_from, scheme=metadata.variable_naming_scheme)
-
-    return {
-        "revised_output": revised_output,
-        "successful_revision": successful_revision
-    }
+    async def store_revision(revised_output: str, successful_revision: bool):
+        if successful_revision:
+            await response_cache.set(cache_key, {
+                "revised_output": revised_output,
+                "successful_revision": successful_revision
+            })
 
-
-@generation_router.post('/define/', response_model=DefineSchemaOut)
-async def define_code_snippet(metadata: DefineSchemaIn):
-    chat_session = OpenAIChatSession(
+    token_stream = await chat_session.stream_revise_code_block(
+        metadata.code_block_to_generate_from, scheme=metadata.variable_naming_scheme)
+    return StreamingResponse(generation_events(
+        token_stream,
+        verifier=BufferedVerifier(
+            partial(chat_session.verify_revision_correctness, metadata.code_block_to_generate_from)),
+        on_complete=store_revision), media_type=NDJSON_MEDIA_TYPE)
+
+
+@generation_router.post('/stream/define/')
+async def stream_define_code_snippet(metadata: DefineSchemaIn, chat_sessions: ChatSessions,
+                                     response_cache: ResponseCacheDep):
+    cache_key = build_request_cache_key(SystemPrompt.Define, metadata)
+    cached_output = await response_cache.get(cache_key)
+    if cached_output is not None:
+        return StreamingResponse(cached_generation_events(
+            cached_output["defined_output"], cached_output["successful_definition"]), media_type=NDJSON_MEDIA_TYPE)
+
+    chat_session = chat_sessions.create(
         language=metadata.code_extension,
         model=GenerativeTransformerModel.Azure,
         command=SystemPrompt.Define,
     )
-    successful_definition, defined_output = chat_session.define_code_block(
+
+    async def store_definition(defined_output: str, successful_definition: bool):
+        if successful_definition:
+            await response_cache.set(cache_key, {
+                "defined_output": defined_output,
+                "successful_definition": successful_definition
+            })
+
+    token_stream = await chat_session.stream_define_code_block(
         metadata.code_block_to_generate_from, framework=metadata.alternative_framework)
+    return StreamingResponse(generation_events(
+        token_stream,
+        verifier=chat_session.create_code_verifier(metadata.code_block_to_generate_from),
+        on_complete=store_definition), media_type=NDJSON_MEDIA_TYPE)
 
-    return {
-        "defined_output": defined_output,
-        "successful_definition": successful_definition
-    }
 
+@generation_router.get('/cache/', response_model=CacheStatsSchemaOut)
+async def response_cache_statistics(response_cache: ResponseCacheDep):
+    return response_cache.stats()
 
-@generation_router.post('/create-pdf/', response_model=GeneratePDFSchemaOut)
-async def define_code_snippet(metadata: GeneratePDFSchemaIn):
-    chat_session = OpenAIChatSession(
-        language=metadata.code_extension,
-        model=GenerativeTransformerModel.Azure,
-        command=SystemPrompt.Generate,
-    )
 
-    return chat_session.generate_pdf_metadata(metadata.code_file_to_generate_from)
+@generation_router.get('/rate-limits/', response_model=RateLimitStatusSchemaOut)
+async def rate_limit_status(rate_limiter: RateLimiter):
+    return rate_limiter.status()
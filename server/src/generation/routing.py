@@ -0,0 +1,67 @@
+from typing import NamedTuple, Union
+
+from src.core.settings import AppSettings, get_settings
+from src.core.metrics import model_routes
+from src.generation.ratelimit import RateLimitScheduler
+from src.generation.schemas import GenerativeTransformerModel, SystemPrompt
+
+
+class ModelRoute(NamedTuple):
+    model: GenerativeTransformerModel
+    reason: str
+
+
+class ModelRouter:
+    """
+    Picks the model of every completion from its estimated tokens, its command and, for explanations, the
+    requested complexity level. Candidates are tried in order of preference and the first one the rate limiter
+    can serve within `max_wait_seconds` is used, the preferred one when all of them are saturated.
+    """
+
+    def __init__(self, app_settings: AppSettings):
+        self.enabled = app_settings.model_routing_enabled
+        self.default_model = GenerativeTransformerModel(app_settings.model_routing_default_model)
+        self.small_model = GenerativeTransformerModel(app_settings.model_routing_small_model)
+        self.large_context_model = GenerativeTransformerModel(app_settings.model_routing_large_context_model)
+        self.small_commands = {SystemPrompt(f'/{command.strip()}')
+                               for command in app_settings.model_routing_small_commands.split(',') if command.strip()}
+        self.small_max_tokens = app_settings.model_routing_small_max_tokens
+        self.small_max_complexity = app_settings.model_routing_small_max_complexity
+        self.large_context_min_tokens = app_settings.model_routing_large_context_min_tokens
+        self.max_wait_seconds = app_settings.model_routing_max_wait_seconds
+
+    def candidates(self, command: SystemPrompt, estimated_tokens: int,
+                   complexity: Union[int, None] = None) -> list[ModelRoute]:
+        if estimated_tokens >= self.large_context_min_tokens:
+            # Nothing else fits, the request waits for the large context model's quota if it has to
+            return [ModelRoute(self.large_context_model, 'large_context')]
+        if command in self.small_commands and estimated_tokens <= self.small_max_tokens \
+                and (complexity is None or complexity <= self.small_max_complexity):
+            return [ModelRoute(self.small_model, 'small'), ModelRoute(self.default_model, 'fallback'),
+                    ModelRoute(self.large_context_model, 'fallback')]
+        return [ModelRoute(self.default_model, 'default'), ModelRoute(self.large_context_model, 'fallback')]
+
+    def large_context_route(self, requested_model: GenerativeTransformerModel) -> GenerativeTransformerModel:
+        """The model a request for `requested_model` is moved to when it does not fit the model it was routed to."""
+        if not self.enabled or requested_model != self.default_model:
+            return requested_model
+        return self.large_context_model
+
+    def route(self, requested_model: GenerativeTransformerModel, command: SystemPrompt, estimated_tokens: int,
+              complexity: Union[int, None] = None,
+              rate_limiter: Union[RateLimitScheduler, None] = None) -> GenerativeTransformerModel:
+        # Sessions created for a specific model other than the default one keep it
+        if not self.enabled or requested_model != self.default_model:
+            return requested_model
+
+        candidates = self.candidates(command, estimated_tokens, complexity)
+        route = candidates[0]
+        if rate_limiter is not None:
+            route = next((candidate for candidate in candidates
+                          if rate_limiter.expected_delay(candidate.model, estimated_tokens) <= self.max_wait_seconds),
+                         route)
+        model_routes.inc(command.name.lower(), route.model.value, route.reason)
+        return route.model
+
+
+model_router = ModelRouter(get_settings())
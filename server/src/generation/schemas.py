@@ -5,7 +5,7 @@ from src.core.schemas import PrivateBaseModel
 
 from fastapi import Form
 from typing import Annotated
-from pydantic import FieldValidationInfo, field_validator
+from pydantic import Field, FieldValidationInfo, field_validator
 
 
 class SystemPrompt(Enum):
@@ -15,6 +15,7 @@ class SystemPrompt(Enum):
     Explain = '/explain'
     Annotate = '/annotate'
     Generate = '/generate'
+    Summarise = '/summarise'
 
 
 class GenerativeTransformerModel(Enum):
@@ -174,4 +175,77 @@ class GeneratePDFSchemaOut(PrivateBaseModel):
 
 
 class GeneratePDFSchemaIn(BaseGenerationPDFSchema):
-    pass
+    # Document every declaration with its own concurrent request, automatic for large files when left unset
+    chunk_by_declaration: Union[bool, None] = None
+
+
+class CacheStatsSchemaOut(PrivateBaseModel):
+    hits: int
+    misses: int
+    disk_hits: int
+    hit_rate: float
+    memory_entries: int
+    coalesced: int
+
+
+class ModelRateLimitSchemaOut(PrivateBaseModel):
+    queue_depth: int
+    token_limit_per_minute: int
+    request_limit_per_minute: int
+    available_tokens: int
+    available_requests: int
+
+
+class RateLimitStatusSchemaOut(PrivateBaseModel):
+    queue_depth: int
+    user_queue_depth: int
+    models: dict[str, ModelRateLimitSchemaOut]
+    deployments: dict[str, dict[str, ModelRateLimitSchemaOut]]
+
+
+class AnnotateBatchJobIn(PrivateBaseModel):
+    command: Literal['annotate']
+    payload: AnnotateSchemaIn
+
+
+class ExplainBatchJobIn(PrivateBaseModel):
+    command: Literal['explain']
+    payload: ExplainSchemaIn
+
+
+class AnalyseBatchJobIn(PrivateBaseModel):
+    command: Literal['analyse']
+    payload: AnalyseSchemaIn
+
+
+class ReviseBatchJobIn(PrivateBaseModel):
+    command: Literal['revise']
+    payload: ReviseSchemaIn
+
+
+class DefineBatchJobIn(PrivateBaseModel):
+    command: Literal['define']
+    payload: DefineSchemaIn
+
+
+BatchJobIn = Annotated[
+    Union[AnnotateBatchJobIn, ExplainBatchJobIn, AnalyseBatchJobIn, ReviseBatchJobIn, DefineBatchJobIn],
+    Field(discriminator='command'),
+]
+
+
+class BatchSchemaIn(PrivateBaseModel):
+    jobs: list[BatchJobIn] = Field(min_length=1)
+
+
+class BatchItemSchemaOut(PrivateBaseModel):
+    index: int
+    command: str
+    status: Literal['ok', 'error']
+    result: Union[AnnotateSchemaOut, ExplainSchemaOut, AnalyseSchemaOut, ReviseSchemaOut, DefineSchemaOut,
+                  None] = None
+    error: Union[str, None] = None
+
+
+class BatchSchemaOut(PrivateBaseModel):
+    results: list[BatchItemSchemaOut]
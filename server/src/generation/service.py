@@ -1,24 +1,154 @@
 
-import openai
-
+import httpx
+import re
+import asyncio
+import logging
+import textwrap
+
+from typing import TYPE_CHECKING, Any, Union
+from functools import cached_property, partial
+from collections import Counter
 from fastapi import HTTPException
 from src.core.utils import timeit
-from collections.abc import Callable
-from src.core.settings import AppSettings
+from src.core.metrics import batch_jobs, compacted_prompt_tokens, complexity_estimates, generation_retries, \
+    prompt_budgets, record_token_usage, revisions, track_model_request, verifications
+from collections.abc import AsyncIterator, Awaitable, Callable
+from src.core.settings import AppSettings, get_settings
 from src.core.utils import generate_alphanumeric_id
-from src.generation.exceptions import openai_error_handler
-
-
+from src.generation.resilience import CircuitOpenError, is_endpoint_failure, upstream_calls
+from src.generation.deployments import DeploymentPool, parse_deployments
+from src.generation.exceptions import openai_error_handler, openai_errors
+from src.generation.ratelimit import RateLimitScheduler, estimate_tokens
+from src.generation.declarations import Declaration, documented_span, normalize_declaration_source, \
+    outline_declarations, split_declarations
+from src.generation.complexity import ComplexityEstimate, estimate_complexities
+from src.generation.patches import apply_insertions, number_lines, supports_patches
+from src.generation.budget import COMPACTED_COMMANDS, PromptBudget, PromptBudgetExceeded, compact_code, \
+    context_tokens, count_tokens, plan_prompt_budget
+from src.generation.renaming import is_consistent_renaming, rename_identifiers
+from src.generation.streaming import StreamingCodeVerifier, StreamingFenceStripper
+from src.generation.structured import StructuredOutputError, format_complexity_breakdown, \
+    parse_complexity_breakdown, parse_insertions, parse_pdf_metadata
+
+
+from src.generation.cache import ResponseCache, build_cache_key, build_request_cache_key
 from src.generation.schemas import AcceptedCodeLanguages, AcceptedNaturalLanguages, \
-    GenerativeTransformerModel, SystemPrompt, GeneratePDFSchemaOut, FunctionExplanationSchema
-from .constants import ANNOTATE_PROMPT, ANALYSE_PROMPT, REVISE_PROMPT, \
-    EXPLAIN_PROMPT, DEFINE_PROMPT, GENERATE_PDF_PROMPT, \
-    ANNOTATE_CODE_PREFIX, EXPLAIN_CODE_PREFIX, REVISE_CODE_PREFIX, \
-    ANALYSE_CODE_PREFIX, DEFINE_CODE_PREFIX, GENERATE_PDF_CODE_PREFIX, COMPLEXITY_PARAMETER_TAG \
+    GenerativeTransformerModel, SystemPrompt, GeneratePDFSchemaIn, GeneratePDFSchemaOut, FunctionExplanationSchema, \
+    AnnotateSchemaIn, ExplainSchemaIn, AnalyseSchemaIn, ReviseSchemaIn, DefineSchemaIn, BatchJobIn
+from src.generation.routing import model_router
+from src.generation.prompts import PromptVariant, prompt_registry
+from .constants import SUMMARISE_CODE_PREFIX, ANNOTATE_CODE_PREFIX, EXPLAIN_CODE_PREFIX, REVISE_CODE_PREFIX, \
+    ANALYSE_CODE_PREFIX, DEFINE_CODE_PREFIX, GENERATE_PDF_CODE_PREFIX, COMPLEXITY_PARAMETER_TAG, \
+    DEFAULT_COMPLETION_TOKEN_ESTIMATE
+
+if TYPE_CHECKING:
+    import openai
+    from types import ModuleType
+
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+TRUNCATED_DOCUMENTATION_FOOTNOTE = 'The documentation was cut off, some declarations may be missing.'
+# Title and description of files whose summary could not be generated
+DEFAULT_FILE_SUMMARY = {"title": "Code documentation", "description": None}
+MISSING_SUMMARY_FOOTNOTE = 'A title and description could not be generated for this file.'
+
+
+def openai_sdk() -> 'ModuleType':
+    """
+    The OpenAI SDK, imported the first time a client is created: it takes longer to import than the rest of the
+    server, and the server starts without it.
+    """
+    import openai
+
+    return openai
+
+
+def is_truncated(response: Any) -> bool:
+    """Whether a completion stopped at its `max_tokens` rather than at the end of its answer."""
+    return bool(response.choices) and getattr(response.choices[0], 'finish_reason', None) == 'length'
+
+
+class LLMClientRegistry:
+    """
+    Process-wide registry of Azure OpenAI clients. All clients share one pooled HTTP client so that
+    connections (and their TLS sessions) are kept alive and reused across requests, and every deployment of the
+    pool gets its client from here.
+    """
+
+    def __init__(self, app_settings: AppSettings = settings):
+        self.settings = app_settings
+        self.clients: dict[tuple[str, str, str], 'openai.AsyncAzureOpenAI'] = dict()
+        self.deployment_pool = DeploymentPool(parse_deployments(app_settings), app_settings.deployment_selection)
+
+    @cached_property
+    def http_client(self) -> httpx.AsyncClient:
+        # Created on first use, loading the TLS certificates takes as long as importing the rest of the server
+        return httpx.AsyncClient(
+            http2=self.http2_available(self.settings.llm_http2),
+            timeout=httpx.Timeout(self.settings.llm_request_timeout),
+            limits=httpx.Limits(
+                max_connections=self.settings.llm_max_connections,
+                max_keepalive_connections=self.settings.llm_max_keepalive_connections,
+                keepalive_expiry=self.settings.llm_keepalive_expiry,
+            ),
+        )
 
+    def ensure_clients(self):
+        """Creates the client of every deployment, the first time a completion or the warm-up needs them."""
+        for deployment in self.deployment_pool.deployments:
+            if deployment.client is None:
+                deployment.client = self.get_client(deployment.endpoint, deployment.api_key, deployment.api_version)
+
+    async def warm_up(self):
+        """
+        Imports the OpenAI SDK and creates the clients off the event loop, then opens a pooled connection to
+        every endpoint, so that the first completion does not pay for any of it. Endpoints that cannot be reached
+        are left to the first completion to report.
+        """
+        await asyncio.to_thread(self.ensure_clients)
+        endpoints = {deployment.endpoint for deployment in self.deployment_pool.deployments if deployment.endpoint}
+
+        async def connect(endpoint: str):
+            try:
+                await self.http_client.head(endpoint, timeout=self.settings.llm_warm_up_timeout)
+            except httpx.HTTPError as e:
+                logger.warning("Could not warm up the connection to %s: %s", endpoint, e)
+
+        await asyncio.gather(*(connect(endpoint) for endpoint in endpoints))
 
+    @staticmethod
+    def http2_available(requested: bool) -> bool:
+        if not requested:
+            return False
+        try:
+            import h2  # noqa
+        except ImportError:
+            logger.warning("HTTP/2 requested for LLM clients but the 'h2' package is not installed, using HTTP/1.1")
+            return False
+        return True
 
-settings = AppSettings()
+    def get_client(self, endpoint: str = None, api_key: str = None, api_version: str = None) \
+            -> 'openai.AsyncAzureOpenAI':
+        client_key = (endpoint or self.settings.azure_openai_endpoint,
+                      api_key or self.settings.azure_openai_api_key,
+                      api_version or self.settings.openai_api_version)
+        if client_key not in self.clients:
+            self.clients[client_key] = openai_sdk().AsyncAzureOpenAI(
+                azure_endpoint=client_key[0],
+                api_key=client_key[1],
+                api_version=client_key[2],
+                http_client=self.http_client,
+                # Retries, backoff and hedging are done by `upstream_calls` for every completion
+                max_retries=0,
+            )
+        return self.clients[client_key]
+
+    async def aclose(self):
+        self.clients.clear()
+        if 'http_client' in self.__dict__:
+            await self.http_client.aclose()
 
 
 class OpenAIChatSession:
@@ -29,244 +159,451 @@ class OpenAIChatSession:
         command: SystemPrompt,
         language: AcceptedCodeLanguages,
         model: GenerativeTransformerModel = GenerativeTransformerModel.Azure,
+        client: Union['openai.AsyncAzureOpenAI', None] = None,
+        rate_limiter: Union[RateLimitScheduler, None] = None,
+        admit_user: Union[Callable[[], Awaitable[None]], None] = None,
+        deployment_pool: Union[DeploymentPool, None] = None,
     ):
         self.model = model
         self.command = command
         self.language = language
-        self.session = openai.AzureOpenAI(
+        self.rate_limiter = rate_limiter
+        self.admit_user = admit_user
+        self.deployment_pool = deployment_pool
+        self.session = client if client is not None else openai_sdk().AsyncAzureOpenAI(
             api_key=settings.azure_openai_api_key,
             azure_endpoint=settings.azure_openai_endpoint,
             api_version=settings.openai_api_version,
+            max_retries=0,
         )
 
     @classmethod
     def get_chat_models(cls):
-        return openai.Model.list()
-
-    def single_line_comment(self, line) -> bool:
-        if self.language == 'python':
-            return line[0] == '#' or not line.count("'''") % 2
-        return False
-
-    def comment_block_signature(self, line) -> bool:
-        if self.language == 'python':
-            return line.count("\'\'\'") % 2 == 1
-        return False
+        return openai_sdk().Model.list()
 
     @timeit
     def verify_revision_correctness(self, original_code, generated_code) -> bool:
-        return True
+        successful = is_consistent_renaming(original_code, generated_code, self.language)
+        verifications.inc(self.command_label, 'passed' if successful else 'failed')
+        return successful
+
+    @timeit
+    def revise_locally(self, code_block, scheme: str) -> Union[str, None]:
+        """The revision of the local renaming engine, None when it has to be left to the model."""
+        revised_block = rename_identifiers(code_block, self.language, scheme) \
+            if settings.local_revision_enabled else None
+        revisions.inc(self.language.value, 'model' if revised_block is None else 'local')
+        return revised_block
+
+    def create_code_verifier(self, original) -> StreamingCodeVerifier:
+        return StreamingCodeVerifier(original, self.language, command_label=self.command_label)
 
     @timeit
     def verify_code_correctness(self, original, generated_code) -> bool:
-        original_code_lines = list(
-            filter(lambda x: x != '', original.split('\n')))
-        generated_code_lines = list(
-            filter(lambda x: x != '', generated_code.split('\n')))
-
-        original_pointer = 0
-        initiated_comment_block = False
-        for line in generated_code_lines:
-            # If observed comment block initiation previously and see another. This marks the
-            # end of a comment block so we can safely set comment block to False
-            if initiated_comment_block:
-                if self.comment_block_signature(line):
-                    initiated_comment_block = False
-                continue
+        code_verifier = self.create_code_verifier(original)
+        code_verifier.feed(generated_code)
+        return code_verifier.finish()
 
-            # If we are not in a comment block and see its signature, we have initiated a comment block
-            # Therefore we can ignore all lines until we reach the end of the comment block
-            if not initiated_comment_block and self.comment_block_signature(line):
-                initiated_comment_block = True
-                continue
+    @property
+    def command_label(self) -> str:
+        return self.command.name.lower()
 
-            # If we are not in a comment block or a single line comment we can compare and continue
-            if not self.single_line_comment(line):
-                if line != original_code_lines[original_pointer]:
-                    return False
-                original_pointer += 1
-        return True
+    def get_system_prompt(self, system_metadata: Any = None, patch: bool = False) -> PromptVariant:
+        return prompt_registry.get(self.command, system_metadata, patch=patch)
 
-    def get_system_prompt(self) -> Callable[..., str]:
-        if self.command == SystemPrompt.Define:
-            return DEFINE_PROMPT
-        if self.command == SystemPrompt.Revise:
-            return REVISE_PROMPT
-        if self.command == SystemPrompt.Analyse:
-            return ANALYSE_PROMPT
-        if self.command == SystemPrompt.Explain:
-            return EXPLAIN_PROMPT
-        if self.command == SystemPrompt.Generate:
-            return GENERATE_PDF_PROMPT
-        return ANNOTATE_PROMPT
-
-    def generate_conversation_messages(self, user_content: str = "", system_metadata: str = None):
+    def generate_conversation_messages(self, user_content: str = "", system_metadata: Any = None,
+                                       patch: bool = False):
         if not user_content:
             raise Exception("No user prompt provided")
-        return [{"role": "system", "content": (self.get_system_prompt())(system_metadata)
-                if system_metadata is not None else (self.get_system_prompt())()},
+        # The system prompt goes first and is the same text for every request with the same command and
+        # parameter, everything specific to the request is in the user message after it
+        return [{"role": "system", "content": self.get_system_prompt(system_metadata, patch=patch).content},
                 {"role": "user", "content": user_content}]
 
+    def code_prompt(self, code_prefix: str, code_block: str) -> str:
+        """The user message of a completion about a code block, compacted for the commands that do not echo it."""
+        if settings.prompt_compaction_enabled and self.command in COMPACTED_COMMANDS:
+            compacted_block = compact_code(code_block, self.language)
+            if compacted_block:
+                compacted_prompt_tokens.inc(self.command_label, 'original', amount=count_tokens(code_block))
+                compacted_prompt_tokens.inc(self.command_label, 'compacted', amount=count_tokens(compacted_block))
+                code_block = compacted_block
+        return f'{code_prefix}\n\n{code_block}'
+
+    def fit_prompt_budget(self, messages: list[dict], model: GenerativeTransformerModel,
+                          complexity: Union[int, None] = None) -> PromptBudget:
+        """
+        Tokens of the messages and the `max_tokens` left for the answer on the model they were routed to, or on the
+        large context model when they only fit that one. Requests that fit neither are rejected before anything
+        is sent or waited for.
+        """
+        system_prompt = prompt_registry.find(messages[0]["content"])
+        patch = system_prompt is not None and system_prompt.patch
+        response_language = AcceptedNaturalLanguages(system_prompt.parameter) \
+            if self.command == SystemPrompt.Explain and system_prompt is not None and system_prompt.parameter \
+            else None
+        # Every declaration of a file documented as a whole gets its own entry in the answer
+        declarations = len(split_declarations(messages[-1]["content"].partition('\n\n')[2], self.language)) \
+            if self.command == SystemPrompt.Generate else 0
+        large_context_model = model_router.large_context_route(self.model)
+        for candidate, result in ((model, 'fits'), (large_context_model, 'rerouted')):
+            try:
+                budget = plan_prompt_budget(messages, self.command, candidate, complexity=complexity, patch=patch,
+                                            response_language=response_language, declarations=declarations)
+            except PromptBudgetExceeded as e:
+                budget_error = e
+                continue
+            prompt_budgets.inc(self.command_label, result)
+            return budget
+        prompt_budgets.inc(self.command_label, 'rejected')
+        raise HTTPException(status_code=413, detail=str(budget_error))
+
+    def exceeds_context(self, user_content: str, system_metadata: Any = None, patch: bool = False) -> bool:
+        """Whether a completion with this user message fits none of the models this session can be routed to."""
+        if not settings.prompt_budgeting_enabled:
+            return False
+        messages = self.generate_conversation_messages(user_content, system_metadata=system_metadata, patch=patch)
+        try:
+            plan_prompt_budget(messages, self.command, model_router.large_context_route(self.model), patch=patch)
+        except PromptBudgetExceeded:
+            return True
+        return False
+
     @staticmethod
     def remove_gpt_based_comment_blocks_from_code(code_block: str) -> str:
-        lines_of_code = code_block.split('\n')
-        if lines_of_code[0].startswith('```'):
-            lines_of_code = lines_of_code[1:]
-        return '\n'.join(lines_of_code).rstrip('\n').rstrip('`')
+        fence_stripper = StreamingFenceStripper()
+        return fence_stripper.feed(code_block) + fence_stripper.finish()
+
+    def estimate_request_tokens(self, messages: list[dict]) -> int:
+        prompt_tokens = 0
+        for message in messages:
+            system_prompt_tokens = prompt_registry.estimated_tokens(message["content"])
+            prompt_tokens += system_prompt_tokens if system_prompt_tokens is not None \
+                else estimate_tokens(message["content"])
+        system_prompt = prompt_registry.find(messages[0]["content"])
+        if self.command in (SystemPrompt.Explain, SystemPrompt.Analyse) \
+                or (system_prompt is not None and system_prompt.patch):
+            return prompt_tokens + DEFAULT_COMPLETION_TOKEN_ESTIMATE
+        # The remaining commands echo (or document every declaration of) the code block they are given
+        return prompt_tokens + estimate_tokens(messages[-1]["content"])
+
+    # Every completion goes through here so that it is routed to a model that suits it, sent to the deployment
+    # of that model that can serve it best and scheduled against that deployment's rate limits, `complexity`
+    # being the explanation level the request asked for
+    async def create_completion(self, messages: list[dict], complexity: Union[int, None] = None,
+                                **completion_parameters):
+        if self.session is None:
+            raise Exception("OpenAI session doesn't exist")
+
+        if self.admit_user is not None:
+            await self.admit_user()
+
+        estimated_tokens = self.estimate_request_tokens(messages)
+        model = model_router.route(self.model, self.command, estimated_tokens, complexity=complexity,
+                                   rate_limiter=self.rate_limiter)
+        if settings.prompt_budgeting_enabled:
+            budget = self.fit_prompt_budget(messages, model, complexity=complexity)
+            model = budget.model
+            # Callers asking for more tokens than planned, to finish an answer that was cut off, are given at
+            # most what is left of the context window
+            completion_parameters['max_tokens'] = min(completion_parameters['max_tokens'],
+                                                      context_tokens(model) - budget.prompt_tokens) \
+                if 'max_tokens' in completion_parameters else budget.completion_tokens
+        if self.deployment_pool is None:
+            return await self.complete_on(self.session, str(self.session.base_url), model.value, model, messages,
+                                          estimated_tokens, completion_parameters)
+
+        # A deployment that is down hands the completion over to the next best one, the last one left retries
+        failed_deployments = set()
+        while True:
+            deployment = self.deployment_pool.select(model, estimated_tokens, rate_limiter=self.rate_limiter,
+                                                     excluded=failed_deployments)
+            failover = len(self.deployment_pool.candidates(model, failed_deployments | {deployment.name})) > 0
+            try:
+                with self.deployment_pool.track(deployment):
+                    return await self.complete_on(deployment.client, deployment.name, deployment.deployment_name(model),
+                                                  model, messages, estimated_tokens, completion_parameters,
+                                                  deployment=deployment.name, failover=failover)
+            except openai_errors() as e:
+                if not failover or not (isinstance(e, CircuitOpenError) or is_endpoint_failure(e)):
+                    raise
+                failed_deployments.add(deployment.name)
+
+    async def complete_on(self, client: 'openai.AsyncAzureOpenAI', endpoint: str, deployed_model: str,
+                          model: GenerativeTransformerModel, messages: list[dict], estimated_tokens: int,
+                          completion_parameters: dict, deployment: Union[str, None] = None, failover: bool = False):
+        def can_charge() -> bool:
+            return self.rate_limiter.expected_delay(model, estimated_tokens, deployment=deployment) <= 0
+
+        charge = None
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire(model, estimated_tokens, deployment=deployment)
+            # Retries and hedges are requests of their own and spend the quota like the first one
+            charge = partial(self.rate_limiter.acquire, model, estimated_tokens, deployment=deployment)
+
+        # Streams are not hedged, their first response only means the stream has been opened
+        with track_model_request(model.value, self.command_label):
+            response = await upstream_calls.call(
+                endpoint, (model.value, self.command_label),
+                lambda: client.chat.completions.create(
+                    model=deployed_model, messages=messages, **completion_parameters),
+                hedge=not completion_parameters.get('stream'), failover=failover, charge=charge,
+                can_charge=can_charge if self.rate_limiter is not None else None)
+        usage = getattr(response, 'usage', None)
+        record_token_usage(model.value, self.command_label, usage)
+        if self.rate_limiter is not None and usage is not None:
+            await self.rate_limiter.record_usage(model, estimated_tokens, usage.total_tokens, deployment=deployment)
+        return response
+
+    @openai_error_handler
+    # Opens a streamed completion up front so that connection and authentication failures still surface as
+    # HTTP errors, then hands back an iterator over the generated text.
+    async def stream_completion(self, user_content: str, system_metadata: str = None,
+                                complexity: Union[int, None] = None) -> AsyncIterator[str]:
+        response_stream = await self.create_completion(
+            self.generate_conversation_messages(user_content=user_content, system_metadata=system_metadata),
+            complexity=complexity, stream=True)
+
+        async def iterate_generated_text():
+            async for chunk in response_stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+        return iterate_generated_text()
+
+    async def stream_annotate_code_block(self, code_block) -> AsyncIterator[str]:
+        return await self.stream_completion(f'{ANNOTATE_CODE_PREFIX}\n\n{code_block}')
+
+    async def stream_explain_code_block(self, code_block, complexity: int = 3,
+                                        response_language: AcceptedNaturalLanguages = None) -> AsyncIterator[str]:
+        return await self.stream_completion(
+            self.code_prompt(f'{EXPLAIN_CODE_PREFIX} {COMPLEXITY_PARAMETER_TAG}={complexity}', code_block),
+            system_metadata=response_language.value, complexity=complexity)
+
+    async def stream_define_code_block(self, code_block, framework: str = None) -> AsyncIterator[str]:
+        return await self.stream_completion(f'{DEFINE_CODE_PREFIX}\n\n{code_block}', system_metadata=framework)
+
+    async def stream_revise_code_block(self, code_block, scheme: str = 'lower') -> AsyncIterator[str]:
+        revised_block = self.revise_locally(code_block, scheme)
+        if revised_block is not None:
+            async def iterate_local_revision():
+                yield revised_block
+
+            return iterate_local_revision()
+        return await self.stream_completion(f'{REVISE_CODE_PREFIX}\n\n{code_block}', system_metadata=scheme)
+
+    # Asks the model only for the comments to insert into the code block and the lines they go above, rather than
+    # for the whole code block with its comments, and inserts them itself. Returns None when the answer cannot be
+    # applied, for the caller to ask for the whole code block instead.
+    async def patch_code_block(self, code_prefix: str, code_block, system_metadata: Any = None) -> Union[str, None]:
+        if not settings.llm_patch_output or not supports_patches(code_block, self.language):
+            return None
+
+        response = await self.create_completion(self.generate_conversation_messages(
+            user_content=f'{code_prefix}\n\n{number_lines(code_block)}', system_metadata=system_metadata, patch=True),
+            **self.structured_output_parameters())
+        try:
+            insertions = parse_insertions(response.choices[0].message.content, command_label=self.command_label)
+            return apply_insertions(code_block, self.language, insertions,
+                                    definitions=self.command == SystemPrompt.Define)
+        except StructuredOutputError:
+            return None
 
     @timeit
     @openai_error_handler
     # Annotate code block that returns a commented version of code which is analogous in functionality.
-    # Provided line by line code documentation for functions and classes.
-    def annotate_code_block(self, code_block) -> tuple[bool, str]:
-        if self.session is None:
-            raise Exception("OpenAI session doesn't exist")
-        response = self.session.chat.completions.create(model=self.model.value,
-                                                        messages=self.generate_conversation_messages(
-                                                            user_content=f'{ANNOTATE_CODE_PREFIX}\n\n{code_block}'))
-        response_block = response.choices[0].message.content
-        code_matched = self.verify_code_correctness(code_block, response_block)
-        return code_matched, self.remove_gpt_based_comment_blocks_from_code(response_block)
+    # Provided line by line code documentation for functions and classes. The model is asked for the comments
+    # alone first and for the whole commented code block when they cannot be inserted.
+    async def annotate_code_block(self, code_block) -> tuple[bool, str]:
+        patched_block = await self.patch_code_block(ANNOTATE_CODE_PREFIX, code_block)
+        if patched_block is not None and self.verify_code_correctness(code_block, patched_block):
+            return True, patched_block
+
+        response = await self.create_completion(self.generate_conversation_messages(
+            user_content=f'{ANNOTATE_CODE_PREFIX}\n\n{code_block}'))
+        response_block = self.remove_gpt_based_comment_blocks_from_code(response.choices[0].message.content)
+        return self.verify_code_correctness(code_block, response_block), response_block
 
     @timeit
     @openai_error_handler
     # Explain code block that returns description of code with an appropriate level of technical complexity
-    def explain_code_block(self, code_block, complexity: int = 3,
-                           response_language: AcceptedNaturalLanguages = None):
-        if self.session is None:
-            raise Exception("OpenAI session doesn't exist")
-        explanation_query = f'{EXPLAIN_CODE_PREFIX} {COMPLEXITY_PARAMETER_TAG}={complexity}\n\n{code_block}'
-        response = self.session.chat.completions.create(model=self.model.value,
-                                                        messages=self.generate_conversation_messages(
-                                                            user_content=explanation_query,
-                                                            system_metadata=response_language.value))
+    async def explain_code_block(self, code_block, complexity: int = 3,
+                                 response_language: AcceptedNaturalLanguages = None):
+        explanation_query = self.code_prompt(f'{EXPLAIN_CODE_PREFIX} {COMPLEXITY_PARAMETER_TAG}={complexity}',
+                                             code_block)
+        response = await self.create_completion(self.generate_conversation_messages(
+            user_content=explanation_query,
+            system_metadata=response_language.value), complexity=complexity)
         return response.choices[0].message.content
 
     @timeit
     @openai_error_handler
     # Returns the same code block but adds a function or class definition to each declaration in the block
-    # in the format of the specified framework
-    def define_code_block(self, code_block, framework: str = None) -> tuple[bool, str]:
-        if self.session is None:
-            raise Exception("OpenAI session doesn't exist")
-        response = self.session.chat.completions.create(model=self.model.value,
-                                                        messages=self.generate_conversation_messages(
-                                                            user_content=f'{DEFINE_CODE_PREFIX}\n\n{code_block}',
-                                                            system_metadata=framework))
-        response_block = response.choices[0].message.content
-        code_matched = self.verify_code_correctness(code_block, response_block)
-        return code_matched, self.remove_gpt_based_comment_blocks_from_code(response_block)
+    # in the format of the specified framework, asking the model for the definitions alone first
+    async def define_code_block(self, code_block, framework: str = None) -> tuple[bool, str]:
+        patched_block = await self.patch_code_block(DEFINE_CODE_PREFIX, code_block, system_metadata=framework)
+        if patched_block is not None and self.verify_code_correctness(code_block, patched_block):
+            return True, patched_block
+
+        response = await self.create_completion(self.generate_conversation_messages(
+            user_content=f'{DEFINE_CODE_PREFIX}\n\n{code_block}',
+            system_metadata=framework))
+        response_block = self.remove_gpt_based_comment_blocks_from_code(response.choices[0].message.content)
+        return self.verify_code_correctness(code_block, response_block), response_block
+
+    def cache_key(self, code_block: str, **parameters: Any) -> str:
+        return build_cache_key(self.command, self.language, self.model, code_block, **parameters)
+
+    def declaration_cache_key(self, declaration_source: str, **parameters: Any) -> str:
+        # Keyed by the normalized source so that documenting, re-indenting or moving a declaration keeps its key
+        return self.cache_key(normalize_declaration_source(declaration_source, self.language), **parameters)
 
     @staticmethod
+    def declarations_by_unique_name(declarations: list[Declaration]) -> dict[str, Declaration]:
+        name_counts = Counter(declaration.name for declaration in declarations)
+        return {declaration.name: declaration for declaration in declarations if name_counts[declaration.name] == 1}
+
     @timeit
-    def parse_complexity_analysis_output(analysis: str) -> dict[str, dict[str, str]]:
-        output_dict = dict()
-        individual_complexities = analysis.split('\n')
-        for line in individual_complexities:
-            parts = line.split(':')
-            complexity_dict = dict()
-            function_name, function_complexity_string = parts[0], parts[1]
-            split_complexities = function_complexity_string.split(',')
-            runtime, space = [*split_complexities[0]], [*split_complexities[1]]
-            if not len(split_complexities[0]) or not len(split_complexities[1]):
-                return {}
-
-            # Go through runtime complexity and parse big O notation.
-            try:
-                while space.pop() != ' ':
-                    continue
-                while runtime.pop() != ' ':
-                    continue
-            except IndexError as e:
-                return {}
-            complexity_dict['space'] = ''.join(space).rstrip(' ').lstrip(' ')
-            complexity_dict['runtime'] = ''.join(
-                runtime).rstrip(' ').lstrip(' ')
-
-            # Go through space complexity and parse big O notation.
-            output_dict[function_name] = complexity_dict
-        return output_dict
+    # Define code block one declaration at a time: definitions generated earlier for a declaration with the same
+    # normalized source are spliced back in, and only changed or new declarations are sent to the model. The
+    # whole block is defined at once when none of its declarations has been seen before, unless it is too large
+    # to be sent to any model at once.
+    async def define_code_block_incrementally(self, code_block, framework: str = None,
+                                              response_cache: ResponseCache = None) -> tuple[bool, str]:
+        declarations = split_declarations(code_block, self.language)
+        split = bool(declarations) and self.exceeds_context(
+            f'{DEFINE_CODE_PREFIX}\n\n{code_block}', system_metadata=framework, patch=settings.llm_patch_output)
+        caching = response_cache is not None and response_cache.enabled
+        if not split and (not caching or not declarations):
+            return await self.define_code_block(code_block, framework=framework)
+
+        cache_keys = [self.declaration_cache_key(declaration.source, alternative_framework=framework)
+                      for declaration in declarations]
+        definitions = [await response_cache.get(cache_key) if caching else None for cache_key in cache_keys]
+        if not split and all(definition is None for definition in definitions):
+            successful_definition, defined_output = await self.define_code_block(code_block, framework=framework)
+            if successful_definition:
+                await self.remember_declaration_definitions(code_block, defined_output, framework, response_cache)
+            return successful_definition, defined_output
+
+        spans = [documented_span(code_block, declaration, self.language) for declaration in declarations]
+        changed_positions = [position for position, definition in enumerate(definitions) if definition is None]
+        # Changed declarations are sent without the comments above them, their new definition replaces those
+        generated_definitions = await asyncio.gather(*[
+            self.define_code_block(textwrap.dedent(declarations[position].source), framework=framework)
+            for position in changed_positions])
+
+        successful_definition = True
+        for position, (successful_declaration, defined_declaration) in zip(changed_positions, generated_definitions):
+            definitions[position] = defined_declaration.rstrip('\n')
+            if successful_declaration and caching:
+                await response_cache.set(cache_keys[position], definitions[position])
+            else:
+                successful_definition = False
+
+        defined_pieces = []
+        cursor = 0
+        for (start, end), definition in zip(spans, definitions):
+            original_span = code_block[start:end]
+            indentation = re.match(r'[ \t]*', original_span).group()
+            defined_pieces.append(code_block[cursor:start])
+            defined_pieces.append(textwrap.indent(definition, indentation)
+                                  + original_span[len(original_span.rstrip('\n')):])
+            cursor = end
+        defined_pieces.append(code_block[cursor:])
+        return successful_definition, ''.join(defined_pieces)
+
+    # Stores the definition of every declaration of a block that was defined as a whole, for later incremental runs
+    async def remember_declaration_definitions(self, code_block: str, defined_output: str,
+                                               framework: Union[str, None], response_cache: ResponseCache):
+        original_declarations = self.declarations_by_unique_name(split_declarations(code_block, self.language))
+        defined_declarations = self.declarations_by_unique_name(split_declarations(defined_output, self.language))
+        for name, defined_declaration in defined_declarations.items():
+            original_declaration = original_declarations.get(name)
+            if original_declaration is None \
+                    or normalize_declaration_source(original_declaration.source, self.language) \
+                    != normalize_declaration_source(defined_declaration.source, self.language):
+                continue
+            start, end = documented_span(defined_output, defined_declaration, self.language)
+            cache_key = self.declaration_cache_key(original_declaration.source, alternative_framework=framework)
+            await response_cache.set(cache_key, textwrap.dedent(defined_output[start:end]).rstrip('\n'))
+
+    @timeit
+    def parse_complexity_analysis_output(self, analysis: str) -> dict[str, dict[str, str]]:
+        return parse_complexity_breakdown(analysis, command_label=self.command_label)
+
+    @staticmethod
+    def structured_output_parameters() -> dict:
+        """Completion parameters of the commands whose answer is a JSON object."""
+        return {"response_format": {"type": "json_object"}} if settings.llm_json_mode else {}
+
+    def merge_complexity_breakdowns(self, estimates: list[ComplexityEstimate],
+                                    model_breakdown: dict[str, dict[str, str]]) -> dict[str, dict[str, str]]:
+        """
+        Local estimates in source order, with the model's answer for the functions they were not confident about.
+        Functions the model left out keep their local estimate, functions only the model found are added last.
+        """
+        if not estimates:
+            return model_breakdown
+
+        remaining = dict(model_breakdown)
+        breakdown = dict()
+        for estimate in estimates:
+            answer = None
+            if not estimate.confident:
+                short_name = estimate.name.split('.')[-1]
+                name = next((name for name in remaining
+                             if name == estimate.name or name.split('.')[-1] == short_name), None)
+                answer = remaining.pop(name) if name is not None else None
+            complexity_estimates.inc(self.language.value, 'model' if answer else 'local')
+            breakdown[estimate.name] = answer or {"runtime": estimate.runtime.notation,
+                                                  "space": estimate.space.notation}
+        breakdown.update(remaining)
+        return breakdown
 
     @timeit
     @openai_error_handler
     # Analyse code block returns a dictionary of the runtime and space complexity breakdown of
-    # all functions declared within a code block
-    def analyse_code_block(self, code_block) -> tuple[str, dict[str, dict[str, str]]]:
-        if self.session is None:
-            raise Exception("OpenAI session doesn't exist")
-        response = self.session.chat.completions.create(model=self.model.value,
-                                                        messages=self.generate_conversation_messages(
-                                                            user_content=f'{ANALYSE_CODE_PREFIX}\n\n{code_block}'))
-
-        analysed_output = response.choices[0].message.content
-        return analysed_output, self.parse_complexity_analysis_output(analysed_output)
+    # all functions declared within a code block. Functions whose loops and recursion can be classified locally
+    # are answered without the model, which is only asked about the others, or the whole block when no
+    # function could be found in it.
+    async def analyse_code_block(self, code_block) -> tuple[str, dict[str, dict[str, str]]]:
+        estimates = estimate_complexities(code_block, self.language) if settings.local_analysis_enabled else []
+        unclear = [estimate for estimate in estimates if not estimate.confident]
+
+        analysed_output, model_breakdown = '', dict()
+        if unclear or not estimates:
+            user_content = '\n\n'.join(estimate.source for estimate in unclear) if estimates else code_block
+            response = await self.create_completion(self.generate_conversation_messages(
+                user_content=self.code_prompt(ANALYSE_CODE_PREFIX, user_content)),
+                **self.structured_output_parameters())
+            analysed_output = response.choices[0].message.content
+            model_breakdown = self.parse_complexity_analysis_output(analysed_output)
+
+        complexity_breakdown = self.merge_complexity_breakdowns(estimates, model_breakdown)
+        # The JSON answer is shown as the readable lines the analysis has always been shown as
+        return format_complexity_breakdown(complexity_breakdown) or analysed_output, complexity_breakdown
 
     @timeit
     @openai_error_handler
     # Revise code block provides a revised version of the block with updated variable names in
-    # any case that is requested by the client.
-    def revise_code_block(self, code_block, scheme: str = 'lower') -> tuple[bool, str]:
-        if self.session is None:
-            raise Exception("OpenAI session doesn't exist")
-        response = self.session.chat.completions.create(model=self.model.value,
-                                                        messages=self.generate_conversation_messages(
-                                                            user_content=f'{REVISE_CODE_PREFIX}\n\n{code_block}',
-                                                            system_metadata=scheme))
-        response_block = response.choices[0].message.content
-        code_matched = self.verify_revision_correctness(
-            code_block, response_block)
-        return code_matched, self.remove_gpt_based_comment_blocks_from_code(response_block)
+    # any case that is requested by the client. Casing schemes are applied by the local renaming engine, the
+    # model is only asked for hungarian notation, which needs the type of every variable, and for code the
+    # engine cannot convert completely.
+    async def revise_code_block(self, code_block, scheme: str = 'lower') -> tuple[bool, str]:
+        revised_block = self.revise_locally(code_block, scheme)
+        if revised_block is not None:
+            return True, revised_block
+
+        response = await self.create_completion(self.generate_conversation_messages(
+            user_content=f'{REVISE_CODE_PREFIX}\n\n{code_block}',
+            system_metadata=scheme))
+        response_block = self.remove_gpt_based_comment_blocks_from_code(response.choices[0].message.content)
+        return self.verify_revision_correctness(code_block, response_block), response_block
 
     @timeit
     def parse_pdf_metadata(self, generated_content) -> dict:
-        parsed_information = dict()
-        content_sections = generated_content.split('#####')
-
-        title_description_section = content_sections[0]
-        function_metadata_sections = content_sections[1:]
-
-        title_description_section_lines = title_description_section.split('\n')
-        title_lines = []
-        description_lines = []
-        for line in title_description_section_lines:
-            line = line.rstrip('\n')
-            if line == '':
-                continue
-            if 'title:' in line:
-                title_lines.append(line.replace('title: ', ''))
-            else:
-                description_lines.append(line.replace('description: ', ''))
-
-        title = ' '.join(title_lines)
-        description = ' '.join(description_lines)
-
-        function_explanations = []
-
-        for section in function_metadata_sections:
-            lines = list(filter(lambda x: x != '', section.split('\n')))
-
-            function_descriptor = lines[0]
-            remaining_lines = lines[1:]
-            function_description_lines = [remaining_lines[0]]
-            usage_example_lines = list(map(lambda x: x.replace(
-                'Usage Example:', ''), remaining_lines[1:]))
-
-            explanation_metadata = dict()
-            explanation_metadata['name'] = function_descriptor.split(':')[
-                0].split(' ')[1]
-            explanation_metadata['function_descriptor'] = function_descriptor
-            explanation_metadata['description'] = ' '.join(
-                function_description_lines)
-            explanation_metadata['usage_example'] = '\n'.join(
-                usage_example_lines)
-
-            function_explanations.append(explanation_metadata)
-
-        parsed_information['title'] = title
-        parsed_information['footnotes'] = []
-        parsed_information['description'] = description
-        parsed_information['function_explanations'] = function_explanations
-        return parsed_information
+        return parse_pdf_metadata(generated_content, command_label=self.command_label)
 
     @timeit
     def convert_dict_to_pydantic_model(self, pdf_metadata_dict: dict) -> GeneratePDFSchemaOut:
@@ -280,23 +617,390 @@ class OpenAIChatSession:
     @timeit
     @openai_error_handler
     # Create PDF metadata for code block with function explanations and other meta information.
-    def generate_pdf_metadata(self, file_information: str) -> GeneratePDFSchemaOut:
-        limit = 3
+    async def generate_pdf_metadata(self, file_information: str,
+                                    response_cache: ResponseCache = None) -> GeneratePDFSchemaOut:
+        # Malformed answers are repaired locally, the file is only documented again when nothing could be recovered
+        limit = 2
         count = 0
         while count != limit:
             count += 1
+            response = await self.create_completion(self.generate_conversation_messages(
+                user_content=self.code_prompt(GENERATE_PDF_CODE_PREFIX, file_information),
+                system_metadata=self.language), **self.structured_output_parameters())
             try:
-                if self.session is None:
-                    raise Exception("OpenAI session doesn't exist")
-                response = self.session.chat.completions.create(model=self.model.value,
-                                                                messages=self.generate_conversation_messages(
-                                                                    user_content=f'{GENERATE_PDF_CODE_PREFIX}\n\n{file_information}',
-                                                                    system_metadata=self.language))
-
-                pdf_metadata_dict = self.parse_pdf_metadata(
-                    generated_content=response.choices[0].message.content)
-                return self.convert_dict_to_pydantic_model(pdf_metadata_dict)
-            except Exception:
+                pdf_metadata_dict = self.parse_pdf_metadata(generated_content=response.choices[0].message.content)
+            except StructuredOutputError:
+                generation_retries.inc(self.command_label)
                 continue
 
+            if is_truncated(response):
+                # The explanations after the last complete one were cut off, the file is documented declaration
+                # by declaration instead, or the documentation says it is incomplete
+                generation_retries.inc(self.command_label)
+                if split_declarations(file_information, self.language):
+                    return await self.generate_pdf_metadata_by_declaration(file_information,
+                                                                           response_cache=response_cache)
+                pdf_metadata_dict.setdefault("footnotes", []).append(TRUNCATED_DOCUMENTATION_FOOTNOTE)
+                return self.convert_dict_to_pydantic_model(pdf_metadata_dict)
+
+            if response_cache is not None:
+                await self.remember_declaration_explanations(file_information, pdf_metadata_dict, response_cache)
+            return self.convert_dict_to_pydantic_model(pdf_metadata_dict)
+
         raise HTTPException(status_code=400)
+
+    # Stores the summary and the function explanations of every declaration of a file documented as a whole, so
+    # that documenting the file again later only regenerates the declarations that changed in between
+    async def remember_declaration_explanations(self, file_information: str, pdf_metadata_dict: dict,
+                                                response_cache: ResponseCache):
+        declarations = split_declarations(file_information, self.language)
+        if not declarations:
+            return
+
+        summary_session = self.derive_session(SystemPrompt.Summarise)
+        await response_cache.set(summary_session.cache_key(outline_declarations(file_information, declarations)),
+                                 {"title": pdf_metadata_dict["title"], "description": pdf_metadata_dict["description"]})
+
+        explanations_by_name = dict()
+        for function_explanation in pdf_metadata_dict["function_explanations"]:
+            explanations_by_name.setdefault(function_explanation["name"], []).append(function_explanation)
+        short_names = Counter(declaration.name.split('.')[-1] for declaration in declarations)
+        for declaration in declarations:
+            short_name = declaration.name.split('.')[-1]
+            if short_names[short_name] == 1 and short_name in explanations_by_name:
+                await response_cache.set(self.declaration_cache_key(declaration.source),
+                                         explanations_by_name[short_name])
+
+    async def has_documented_declarations(self, file_information: str, response_cache: ResponseCache) -> bool:
+        for declaration in split_declarations(file_information, self.language):
+            if await response_cache.contains(self.declaration_cache_key(declaration.source)):
+                return True
+        return False
+
+    def derive_session(self, command: SystemPrompt) -> 'OpenAIChatSession':
+        return OpenAIChatSession(command=command, language=self.language, model=self.model, client=self.session,
+                                 rate_limiter=self.rate_limiter, admit_user=self.admit_user,
+                                 deployment_pool=self.deployment_pool)
+
+    @timeit
+    # Title and description of a file, generated from an outline that leaves out the declaration bodies. The
+    # outline is summarised again when nothing can be recovered from the answer, returns None once all attempts
+    # have failed.
+    async def summarise_code_file(self, file_outline: str) -> Union[dict, None]:
+        for _ in range(2):
+            response = await self.create_completion(self.generate_conversation_messages(
+                user_content=self.code_prompt(SUMMARISE_CODE_PREFIX, file_outline),
+                system_metadata=self.language), **self.structured_output_parameters())
+            try:
+                pdf_metadata_dict = self.parse_pdf_metadata(generated_content=response.choices[0].message.content)
+            except StructuredOutputError:
+                generation_retries.inc(self.command_label)
+                continue
+            return {"title": pdf_metadata_dict["title"], "description": pdf_metadata_dict["description"]}
+        return None
+
+    # Function explanations for a single declaration. Only this declaration is re-queried when nothing can be
+    # recovered from its output or its output was cut off, returns None once all attempts have failed.
+    async def explain_declaration(self, declaration: Declaration) -> Union[list[dict], None]:
+        user_content = self.code_prompt(GENERATE_PDF_CODE_PREFIX, textwrap.dedent(declaration.source))
+        if self.exceeds_context(user_content, system_metadata=self.language):
+            # Too large to be sent whole, the declaration is explained from its signature alone
+            user_content = self.code_prompt(GENERATE_PDF_CODE_PREFIX, outline_declarations(
+                declaration.source, [declaration._replace(start=0, end=len(declaration.source))]))
+        function_explanations, completion_parameters = None, self.structured_output_parameters()
+        for _ in range(2):
+            response = await self.create_completion(self.generate_conversation_messages(
+                user_content=user_content,
+                system_metadata=self.language), **completion_parameters)
+            try:
+                recovered_explanations = self.parse_pdf_metadata(
+                    generated_content=response.choices[0].message.content)["function_explanations"]
+            except StructuredOutputError:
+                generation_retries.inc(self.command_label)
+                continue
+            function_explanations = recovered_explanations or function_explanations
+            if not is_truncated(response):
+                if recovered_explanations:
+                    return recovered_explanations
+                continue
+            # Asked again with twice the tokens the answer was cut off at, what was recovered of it is kept
+            # should that be cut off too
+            generation_retries.inc(self.command_label)
+            completion_parameters = {**completion_parameters, "max_tokens": 2 * response.usage.completion_tokens} \
+                if getattr(response, 'usage', None) is not None else completion_parameters
+        return function_explanations
+
+    @staticmethod
+    async def fetch_cached(response_cache: Union[ResponseCache, None], cache_key: str,
+                           generate: Callable[[], Awaitable[Any]]) -> Any:
+        if response_cache is None:
+            return await generate()
+        return await response_cache.fetch(cache_key, generate, should_store=lambda output: output is not None)
+
+    @timeit
+    @openai_error_handler
+    # Create PDF metadata by documenting every declaration of the file concurrently and merging the results,
+    # so a large file takes about as long as its slowest declaration instead of the sum of all of them.
+    # Declarations (and outlines) documented before are taken from the response cache instead.
+    async def generate_pdf_metadata_by_declaration(self, file_information: str,
+                                                   response_cache: ResponseCache = None) -> GeneratePDFSchemaOut:
+        declarations = split_declarations(file_information, self.language)
+        if not declarations:
+            return await self.generate_pdf_metadata(file_information)
+
+        summary_session = self.derive_session(SystemPrompt.Summarise)
+        file_outline = outline_declarations(file_information, declarations)
+        # Every completion runs to its end, a declaration that failed is left out of the documentation rather
+        # than failing the whole file
+        summary, *declaration_explanations = await asyncio.gather(
+            self.fetch_cached(response_cache, summary_session.cache_key(file_outline),
+                              partial(summary_session.summarise_code_file, file_outline)),
+            *[self.fetch_cached(response_cache, self.declaration_cache_key(declaration.source),
+                                partial(self.explain_declaration, declaration))
+              for declaration in declarations], return_exceptions=True)
+
+        errors = [result for result in [summary, *declaration_explanations] if isinstance(result, BaseException)]
+        for error in errors:
+            if not isinstance(error, Exception):
+                # Cancellation and interpreter shutdown are not per declaration failures
+                raise error
+            logger.warning("Documenting part of a file failed: %r", error)
+
+        function_explanations = []
+        footnotes = []
+        if summary is None or isinstance(summary, Exception):
+            footnotes.append(MISSING_SUMMARY_FOOTNOTE)
+            summary = DEFAULT_FILE_SUMMARY
+        for declaration, explanations in zip(declarations, declaration_explanations):
+            if explanations is None or isinstance(explanations, Exception):
+                footnotes.append(f'Documentation could not be generated for {declaration.name}.')
+                continue
+            function_explanations.extend(explanations)
+
+        if not function_explanations:
+            # Nothing was documented, upstream errors are answered as the service being unavailable
+            if errors:
+                raise errors[0]
+            raise HTTPException(status_code=400)
+
+        pdf_metadata_dict = {**summary, "footnotes": footnotes, "function_explanations": function_explanations}
+        return self.convert_dict_to_pydantic_model(pdf_metadata_dict)
+
+
+class ChatSessionFactory:
+    """
+    Builds the chat sessions of a single API request on top of the shared clients and rate limiter. The user
+    behind the request is admitted against their per user quota once, right before its first completion, so
+    requests answered from a cache do not count against it.
+    """
+
+    def __init__(self, llm_clients: LLMClientRegistry, rate_limiter: RateLimitScheduler, user: str = None):
+        self.llm_clients = llm_clients
+        self.rate_limiter = rate_limiter
+        self.user = user
+        self.user_admitted = user is None
+
+    async def admit_user(self):
+        if not self.user_admitted:
+            self.user_admitted = True
+            await self.rate_limiter.acquire_for_user(self.user)
+
+    def create(
+        self,
+        command: SystemPrompt,
+        language: AcceptedCodeLanguages,
+        model: GenerativeTransformerModel = GenerativeTransformerModel.Azure,
+    ) -> OpenAIChatSession:
+        self.llm_clients.ensure_clients()
+        return OpenAIChatSession(
+            command=command,
+            language=language,
+            model=model,
+            client=self.llm_clients.get_client(),
+            rate_limiter=self.rate_limiter,
+            admit_user=self.admit_user,
+            deployment_pool=self.llm_clients.deployment_pool,
+        )
+
+
+# Request level generation shared by the single, streamed and batched routes. Every command is answered from
+# the response cache when possible, responses that failed verification or parsing are never stored.
+
+async def generate_annotation(metadata: AnnotateSchemaIn, chat_sessions: ChatSessionFactory,
+                              response_cache: ResponseCache) -> dict:
+    async def annotate():
+        chat_session = chat_sessions.create(
+            language=metadata.code_extension,
+            model=GenerativeTransformerModel.Azure,
+            command=SystemPrompt.Annotate,
+        )
+
+        successful_annotation, annotated_output = await chat_session.annotate_code_block(
+            metadata.code_block_to_generate_from)
+
+        return {
+            "annotated_output": annotated_output,
+            "successful_annotation": successful_annotation,
+        }
+
+    return await response_cache.fetch(build_request_cache_key(SystemPrompt.Annotate, metadata), annotate,
+                                      should_store=lambda output: output["successful_annotation"])
+
+
+async def generate_explanation(metadata: ExplainSchemaIn, chat_sessions: ChatSessionFactory,
+                               response_cache: ResponseCache) -> dict:
+    async def explain():
+        chat_session = chat_sessions.create(
+            language=metadata.code_extension,
+            model=GenerativeTransformerModel.Azure,
+            command=SystemPrompt.Explain,
+        )
+
+        explained_output = await chat_session.explain_code_block(
+            metadata.code_block_to_generate_from,
+            complexity=metadata.explanation_complexity // 10,
+            response_language=metadata.response_language)
+
+        return {
+            "explained_output": explained_output,
+            "explanation_complexity": metadata.explanation_complexity,
+        }
+
+    return await response_cache.fetch(build_request_cache_key(SystemPrompt.Explain, metadata), explain)
+
+
+async def generate_analysis(metadata: AnalyseSchemaIn, chat_sessions: ChatSessionFactory,
+                            response_cache: ResponseCache) -> dict:
+    async def analyse():
+        chat_session = chat_sessions.create(
+            language=metadata.code_extension,
+            model=GenerativeTransformerModel.Azure,
+            command=SystemPrompt.Analyse,
+        )
+
+        analysed_output, complexity_dict = await chat_session.analyse_code_block(
+            metadata.code_block_to_generate_from)
+
+        return {
+            "analysed_output": analysed_output,
+            "complexity_breakdown": complexity_dict
+        }
+
+    return await response_cache.fetch(build_request_cache_key(SystemPrompt.Analyse, metadata), analyse,
+                                      should_store=lambda output: bool(output["complexity_breakdown"]))
+
+
+async def generate_revision(metadata: ReviseSchemaIn, chat_sessions: ChatSessionFactory,
+                            response_cache: ResponseCache) -> dict:
+    async def revise():
+        chat_session = chat_sessions.create(
+            language=metadata.code_extension,
+            model=GenerativeTransformerModel.Azure,
+            command=SystemPrompt.Revise,
+        )
+
+        successful_revision, revised_output = await chat_session.revise_code_block(
+            metadata.code_block_to_generate_from, scheme=metadata.variable_naming_scheme)
+
+        return {
+            "revised_output": revised_output,
+            "successful_revision": successful_revision
+        }
+
+    return await response_cache.fetch(build_request_cache_key(SystemPrompt.Revise, metadata), revise,
+                                      should_store=lambda output: output["successful_revision"])
+
+
+async def generate_definition(metadata: DefineSchemaIn, chat_sessions: ChatSessionFactory,
+                              response_cache: ResponseCache) -> dict:
+    async def define():
+        chat_session = chat_sessions.create(
+            language=metadata.code_extension,
+            model=GenerativeTransformerModel.Azure,
+            command=SystemPrompt.Define,
+        )
+        successful_definition, defined_output = await chat_session.define_code_block_incrementally(
+            metadata.code_block_to_generate_from, framework=metadata.alternative_framework,
+            response_cache=response_cache)
+
+        return {
+            "defined_output": defined_output,
+            "successful_definition": successful_definition
+        }
+
+    return await response_cache.fetch(build_request_cache_key(SystemPrompt.Define, metadata), define,
+                                      should_store=lambda output: output["successful_definition"])
+
+
+async def generate_pdf_documentation(metadata: GeneratePDFSchemaIn, chat_sessions: ChatSessionFactory,
+                                     response_cache: ResponseCache = None) -> GeneratePDFSchemaOut:
+    chat_session = chat_sessions.create(
+        language=metadata.code_extension,
+        model=GenerativeTransformerModel.Azure,
+        command=SystemPrompt.Generate,
+    )
+
+    # Large files, files too large to be sent at once and files documented before are documented per declaration
+    # so that only the declarations missing from the response cache are sent to the model
+    chunk_by_declaration = metadata.chunk_by_declaration
+    if chunk_by_declaration is None:
+        chunk_by_declaration = \
+            metadata.code_file_to_generate_from.count('\n') + 1 >= settings.pdf_chunking_min_lines \
+            or chat_session.exceeds_context(
+                chat_session.code_prompt(GENERATE_PDF_CODE_PREFIX, metadata.code_file_to_generate_from),
+                system_metadata=metadata.code_extension) \
+            or (response_cache is not None and await chat_session.has_documented_declarations(
+                metadata.code_file_to_generate_from, response_cache))
+    if chunk_by_declaration:
+        return await chat_session.generate_pdf_metadata_by_declaration(
+            metadata.code_file_to_generate_from, response_cache=response_cache)
+    return await chat_session.generate_pdf_metadata(metadata.code_file_to_generate_from,
+                                                    response_cache=response_cache)
+
+
+BATCH_GENERATORS = {
+    'annotate': (SystemPrompt.Annotate, generate_annotation),
+    'explain': (SystemPrompt.Explain, generate_explanation),
+    'analyse': (SystemPrompt.Analyse, generate_analysis),
+    'revise': (SystemPrompt.Revise, generate_revision),
+    'define': (SystemPrompt.Define, generate_definition),
+}
+
+
+async def generate_batch(jobs: list[BatchJobIn], chat_sessions: ChatSessionFactory, response_cache: ResponseCache,
+                         max_concurrency: int) -> list[dict]:
+    """
+    Runs the jobs of a batch with at most `max_concurrency` generations in flight. Jobs that would produce the
+    same response share a single generation, results (or per job errors) are returned in submission order.
+    The generations still running are cancelled when the batch is, e.g. because its client disconnected.
+    """
+    concurrency_limit = asyncio.Semaphore(max_concurrency)
+    generations: dict[str, asyncio.Task] = dict()
+
+    # Failures of a job are part of its result, only cancellation ends the task group early
+    async def run_job(job: BatchJobIn) -> dict:
+        _, generate = BATCH_GENERATORS[job.command]
+        try:
+            async with concurrency_limit:
+                result = await generate(job.payload, chat_sessions, response_cache)
+        except HTTPException as e:
+            batch_jobs.inc(job.command, 'rejected')
+            return {"status": "error", "error": str(e.detail)}
+        except Exception:
+            logger.exception("Batch job %s failed", job.command)
+            batch_jobs.inc(job.command, 'failed')
+            return {"status": "error", "error": "Generation failed for this job"}
+        batch_jobs.inc(job.command, 'ok')
+        return {"status": "ok", "result": result}
+
+    def job_key(job: BatchJobIn) -> str:
+        command, _ = BATCH_GENERATORS[job.command]
+        return build_request_cache_key(command, job.payload)
+
+    async with asyncio.TaskGroup() as task_group:
+        for job in jobs:
+            if job_key(job) not in generations:
+                generations[job_key(job)] = task_group.create_task(run_job(job))
+
+    return [{"index": index, "command": job.command, **generations[job_key(job)].result()}
+            for index, job in enumerate(jobs)]
@@ -0,0 +1,192 @@
+import json
+import logging
+
+from typing import Any, Union
+from collections.abc import AsyncIterator, Awaitable, Callable
+
+from src.core.metrics import upstream_errors, verifications
+from src.generation.exceptions import openai_errors
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.tokenizer import CodeNormalizer, IncrementalTokenizer
+
+CODE_FENCE = '```'
+FENCE_TAIL_CHARACTERS = '\n`'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingFenceStripper:
+    """
+    Incremental version of removing the markdown code fences the model wraps code blocks in. A leading line
+    starting with ``` is dropped and trailing newlines and backticks are held back until it is known whether
+    more code follows them or they make up the closing fence.
+    """
+
+    def __init__(self):
+        self.head = ''
+        self.head_resolved = False
+        self.tail = ''
+
+    def feed(self, text: str) -> str:
+        if not self.head_resolved:
+            self.head += text
+            if '\n' not in self.head and (len(self.head) < len(CODE_FENCE) or self.head.startswith(CODE_FENCE)):
+                return ''
+
+            self.head_resolved = True
+            text, self.head = self.head, ''
+            if text.startswith(CODE_FENCE):
+                text = text.split('\n', 1)[1]
+
+        text = self.tail + text
+        stripped_text = text.rstrip(FENCE_TAIL_CHARACTERS)
+        self.tail = text[len(stripped_text):]
+        return stripped_text
+
+    def finish(self) -> str:
+        remaining_text, self.tail = self.tail, ''
+        if not self.head_resolved:
+            self.head_resolved = True
+            remaining_text, self.head = self.head, ''
+            if remaining_text.startswith(CODE_FENCE):
+                return ''
+        remaining_text = remaining_text.rstrip('\n')
+        if remaining_text.endswith(CODE_FENCE):
+            # The closing fence goes with the newlines ahead of it, a backtick ending the code itself is kept
+            remaining_text = remaining_text.rstrip('`').rstrip('\n')
+        return remaining_text
+
+
+class StreamingCodeVerifier:
+    """
+    Checks, as generated text arrives, that the generated code is the original code with only comments,
+    docstrings and blank lines added to it. Both sides are tokenized for their language and compared as
+    normalized token streams, so each piece of generated text is only looked at once. Whitespace between
+    tokens is not compared. Once the output is complete, the comments and docstrings of the original must
+    still be found in it, in their original order.
+    """
+
+    def __init__(
+        self,
+        original_code: str,
+        language: AcceptedCodeLanguages,
+        command_label: Union[str, None] = None,
+    ):
+        original_tokenizer = IncrementalTokenizer(language)
+        original_normalizer = CodeNormalizer(language)
+        original_normalizer.push(original_tokenizer.feed(original_code))
+        original_normalizer.push(original_tokenizer.finish())
+        self.expected_tokens = original_normalizer.finish()
+        self.expected_comments = original_normalizer.comments
+        self.tokenizer = IncrementalTokenizer(language)
+        self.normalizer = CodeNormalizer(language)
+        self.command_label = command_label
+
+        self.compared = 0
+        self.matched = True
+
+    def feed(self, text: str):
+        if not self.matched:
+            return
+        tokens = self.tokenizer.feed(text)
+        if tokens:
+            self.normalizer.push(tokens)
+            self.compare()
+
+    def compare(self):
+        generated_tokens = self.normalizer.normalized
+        if len(generated_tokens) > len(self.expected_tokens) \
+                or generated_tokens[self.compared:] != self.expected_tokens[self.compared:len(generated_tokens)]:
+            self.matched = False
+        self.compared = len(generated_tokens)
+
+    def finish(self) -> bool:
+        if self.matched:
+            self.normalizer.push(self.tokenizer.finish())
+            self.normalizer.finish()
+            self.compare()
+        successful = self.matched and self.compared == len(self.expected_tokens) \
+            and keeps_comments(self.expected_comments, self.normalizer.comments)
+        if self.command_label is not None:
+            verifications.inc(self.command_label, 'passed' if successful else 'failed')
+        return successful
+
+
+def keeps_comments(original_comments: list[str], generated_comments: list[str]) -> bool:
+    """Whether every original comment is among the generated ones, in the same order."""
+    remaining_comments = iter(generated_comments)
+    return all(comment in remaining_comments for comment in original_comments)
+
+
+class BufferedVerifier:
+    """Adapts a whole-output verification function to the incremental verifier interface."""
+
+    def __init__(self, verify: Callable[[str], bool]):
+        self.verify = verify
+        self.generated_pieces = []
+
+    def feed(self, text: str):
+        self.generated_pieces.append(text)
+
+    def finish(self) -> bool:
+        return self.verify(''.join(self.generated_pieces))
+
+
+def encode_event(event: str, **payload: Any) -> bytes:
+    return (json.dumps({"event": event, **payload}) + '\n').encode('utf-8')
+
+
+async def generation_events(
+    token_stream: AsyncIterator[str],
+    strip_code_fences: bool = True,
+    verifier: Union[StreamingCodeVerifier, BufferedVerifier, None] = None,
+    on_complete: Union[Callable[[str, Union[bool, None]], Awaitable[Any]], None] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Forwards model tokens as NDJSON `token` events, followed by a `verification` event when a verifier is
+    given and a closing `done` event. Upstream failures mid-stream are reported as an `error` event.
+    """
+    fence_stripper = StreamingFenceStripper() if strip_code_fences else None
+    generated_pieces = []
+
+    def forward(piece: str) -> Union[bytes, None]:
+        if not piece:
+            return None
+        generated_pieces.append(piece)
+        if verifier is not None:
+            verifier.feed(piece)
+        return encode_event('token', content=piece)
+
+    try:
+        async for token in token_stream:
+            event = forward(fence_stripper.feed(token) if fence_stripper is not None else token)
+            if event is not None:
+                yield event
+    except openai_errors() as e:
+        upstream_errors.inc(type(e).__name__)
+        logger.warning("OpenAI API stream was interrupted: %s", e)
+        yield encode_event('error', detail="Service is temporarily unavailable... Please try again later!")
+        return
+
+    if fence_stripper is not None:
+        event = forward(fence_stripper.finish())
+        if event is not None:
+            yield event
+
+    successful = None
+    if verifier is not None:
+        successful = verifier.finish()
+        yield encode_event('verification', successful=successful)
+
+    if on_complete is not None:
+        await on_complete(''.join(generated_pieces), successful)
+    yield encode_event('done')
+
+
+async def cached_generation_events(output: str, successful: Union[bool, None] = None) -> AsyncIterator[bytes]:
+    """Replays a cached response in the same event format as a live stream."""
+    yield encode_event('token', content=output)
+    if successful is not None:
+        yield encode_event('verification', successful=successful)
+    yield encode_event('done')
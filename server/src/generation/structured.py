@@ -0,0 +1,402 @@
+import re
+import json
+
+from typing import Any, Union
+
+from pydantic import ValidationError
+
+from src.core.metrics import structured_outputs
+from src.generation.schemas import FuncComplexity, FunctionExplanationSchema
+
+# Fenced block of a markdown answer, the closing fence may have been cut off
+FENCED_BLOCK = re.compile(r'```[\w+-]*[ \t]*\n([\s\S]*?)(?:\n[ \t]*```|$(?![\s\S]))')
+CLOSING_BRACKETS = {'{': '}', '[': ']'}
+OPENING_BRACKET = re.compile(r'[{\[]')
+# An object opening with a key or closing at once, or an array opening with a value, rather than a bracket of prose
+JSON_START = re.compile(r'\{\s*["}]|\[\s*(?:["{\[\]\d-]|true|false|null)')
+STRUCTURAL_CHARACTER = re.compile(r'["{}\[\],]')
+STRING_SPECIAL_CHARACTER = re.compile(r'["\\\x00-\x1f]')
+CONTROL_CHARACTER_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+# Truncated output is cut back to at most this many of its last complete elements before giving up
+MAX_TRUNCATION_CUTS = 32
+
+# Previous plain text formats, still understood when a model answers without JSON
+LEGACY_COMPLEXITY_LINE = re.compile(r'^\s*(?:[-*]\s*)?`?([^:`]+?)`?\s*:\s*(O\(.+\))\s*runtime\s*,\s*(O\(.+\))\s*space',
+                                    re.IGNORECASE)
+LEGACY_SECTION_SEPARATOR = '#####'
+DESCRIPTOR_NAME = re.compile(r'^\s*(?:function|method|class)?\s*`?([\w.$]+)', re.IGNORECASE)
+
+
+class StructuredOutputError(ValueError):
+    """Raised when nothing usable can be recovered from a model's structured output."""
+
+
+class JSONRepairer:
+    """
+    Rebuilds valid JSON from model output that starts with an object or array: raw newlines and control
+    characters in strings are escaped, trailing commas and mismatched closing brackets are removed, text after
+    the value is dropped and, when the output was cut off, the last incomplete element is dropped and every open
+    string and bracket is closed.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.pieces: list[str] = []
+        self.length = 0
+        self.stack: list[str] = []
+        self.in_string = False
+        self.escaped = False
+        self.finished = False
+        # Where the value ends in the text, the end of the text when it was cut off
+        self.end = len(text)
+        # Output length and open brackets after every comma between two elements, where truncated output is cut
+        self.cuts: list[tuple[int, tuple[str, ...]]] = []
+
+    def emit(self, text: str):
+        self.pieces.append(text)
+        self.length += len(text)
+
+    def drop_trailing_comma(self):
+        # Commas between elements are pieces of their own, only whitespace can follow them before a bracket
+        position = len(self.pieces) - 1
+        while position >= 0 and self.pieces[position].isspace():
+            position -= 1
+        if position >= 0 and self.pieces[position] == ',':
+            self.length -= sum(map(len, self.pieces[position:]))
+            del self.pieces[position:]
+
+    def scan(self):
+        text = self.text
+        self.stack.append(text[0])
+        self.emit(text[0])
+        position = 1
+        while position < len(text) and not self.finished:
+            position = self.scan_string(position) if self.in_string else self.scan_structure(position)
+        self.end = position
+
+    def scan_string(self, position: int) -> int:
+        text = self.text
+        match = STRING_SPECIAL_CHARACTER.search(text, position)
+        if match is None:
+            self.emit(text[position:])
+            return len(text)
+        if match.start() > position:
+            self.emit(text[position:match.start()])
+        character = match.group()
+        if character == '"':
+            self.in_string = False
+            self.emit(character)
+        elif character == '\\':
+            # An escape cut off by the end of the output is dropped when the string is closed
+            self.escaped = match.end() == len(text)
+            self.emit(text[match.start():match.end() + 1])
+            return match.end() + 1
+        else:
+            self.emit(CONTROL_CHARACTER_ESCAPES.get(character, f'\\u{ord(character):04x}'))
+        return match.end()
+
+    def scan_structure(self, position: int) -> int:
+        text = self.text
+        match = STRUCTURAL_CHARACTER.search(text, position)
+        if match is None:
+            self.emit(text[position:])
+            return len(text)
+        if match.start() > position:
+            self.emit(text[position:match.start()])
+        character = match.group()
+        if character == '"':
+            self.in_string = True
+            self.emit(character)
+        elif character in CLOSING_BRACKETS:
+            self.stack.append(character)
+            self.emit(character)
+        elif character == ',':
+            self.cuts.append((self.length, tuple(self.stack)))
+            self.emit(character)
+        else:
+            self.close_bracket(character)
+        return match.end()
+
+    def close_bracket(self, character: str):
+        if not any(CLOSING_BRACKETS[opening] == character for opening in self.stack):
+            return
+        # Brackets the model left open inside this one are closed first
+        while True:
+            self.drop_trailing_comma()
+            opening = self.stack.pop()
+            self.emit(CLOSING_BRACKETS[opening])
+            if CLOSING_BRACKETS[opening] == character:
+                break
+        self.finished = not self.stack
+
+    def candidates(self) -> list[str]:
+        """Repaired texts to try, the most complete first."""
+        text = ''.join(self.pieces)
+        if self.finished:
+            return [text]
+
+        if self.in_string:
+            closed = text[:-1] if self.escaped else text
+            candidates = [closed + '"' + self.closing(self.stack)]
+        else:
+            candidates = [text.rstrip().rstrip(',') + self.closing(self.stack)]
+        for length, stack in reversed(self.cuts[-MAX_TRUNCATION_CUTS:]):
+            candidates.append(text[:length] + self.closing(stack))
+        return candidates
+
+    @staticmethod
+    def closing(stack: Union[list[str], tuple[str, ...]]) -> str:
+        return ''.join(CLOSING_BRACKETS[opening] for opening in reversed(stack))
+
+    def repair(self) -> Any:
+        self.scan()
+        for candidate in self.candidates():
+            try:
+                return json.loads(candidate)
+            except ValueError:
+                continue
+        raise StructuredOutputError("The output does not contain a JSON object or array")
+
+
+def json_payload(text: str) -> str:
+    """The content of the first fenced block that holds an object or array, otherwise the whole text."""
+    for match in FENCED_BLOCK.finditer(text):
+        if OPENING_BRACKET.match(match.group(1).lstrip()):
+            return match.group(1)
+    return text
+
+
+def outermost_value(text: str) -> Union[tuple[Any, int, int], None]:
+    """The largest complete object or array in the text with its span, values nested in it are not tried."""
+    decoder = json.JSONDecoder()
+    largest = None
+    position = 0
+    while (match := OPENING_BRACKET.search(text, position)) is not None:
+        try:
+            value, end = decoder.raw_decode(text, match.start())
+        except ValueError:
+            position = match.end()
+            continue
+        if largest is None or end - match.start() > largest[2] - largest[1]:
+            largest = (value, match.start(), end)
+        position = end
+    return largest
+
+
+def parse_json_output(text: str) -> tuple[Any, bool]:
+    """
+    The JSON value in a model's output and whether it had to be repaired to be read. A fenced ```json block is
+    preferred over the rest of the answer, and prose around the value (which may hold brackets of its own) is
+    skipped. Output that was cut off is repaired from the first bracket that opens something that looks like
+    JSON, unless that bracket closes again before the largest complete value.
+    """
+    text = json_payload(text)
+    complete = outermost_value(text)
+    start = JSON_START.search(text)
+    if complete is not None and (start is None or start.start() >= complete[1]):
+        return complete[0], False
+    if start is None:
+        raise StructuredOutputError("The output does not contain a JSON object or array")
+
+    repairer = JSONRepairer(text[start.start():])
+    try:
+        repaired_value = repairer.repair()
+    except StructuredOutputError:
+        if complete is None:
+            raise
+        return complete[0], False
+    # A complete value after the repaired one, rather than inside it, is the answer
+    if complete is not None and start.start() + repairer.end <= complete[1]:
+        return complete[0], False
+    return repaired_value, True
+
+
+def as_text(value: Any, separator: str = ' ') -> str:
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return separator.join(as_text(item, separator) for item in value)
+    return str(value).strip()
+
+
+def first_list(data: Any, keys: tuple[str, ...]) -> list:
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        for key in keys:
+            if isinstance(data.get(key), list):
+                return data[key]
+    return []
+
+
+def complexity_notation(value: Any, kind: str) -> str:
+    # `O(n) runtime` and `O(n) space` are reduced to the notation itself
+    return re.sub(rf'\s*{kind}\s*$', '', as_text(value), flags=re.IGNORECASE)
+
+
+def parse_complexity_breakdown(text: str, command_label: str = 'analyse') -> dict[str, dict[str, str]]:
+    """
+    Runtime and space complexity of every function in an /analyse answer, validated as `FuncComplexity`. Reads
+    `{"functions": [{"name", "runtime", "space"}]}` as well as a mapping of names to complexities, and the
+    previous `<name>: O(n) runtime, O(1) space` lines when the answer is not JSON at all.
+    """
+    try:
+        data, repaired = parse_json_output(text)
+    except StructuredOutputError:
+        breakdown = dict()
+        for line in text.split('\n'):
+            match = LEGACY_COMPLEXITY_LINE.match(line)
+            if match:
+                breakdown[match.group(1).strip()] = FuncComplexity(
+                    runtime=match.group(2).strip(), space=match.group(3).strip()).model_dump()
+        structured_outputs.inc(command_label, 'legacy' if breakdown else 'failed')
+        return breakdown
+
+    items = first_list(data, ('functions', 'complexities', 'complexity_breakdown'))
+    if not items and isinstance(data, dict):
+        mapping = data.get('complexity_breakdown', data)
+        items = [{'name': name, **complexity} for name, complexity in mapping.items() if isinstance(complexity, dict)]
+
+    breakdown = dict()
+    for item in items:
+        if not isinstance(item, dict) or not as_text(item.get('name')):
+            continue
+        runtime = complexity_notation(item.get('runtime', item.get('time')), 'runtime')
+        space = complexity_notation(item.get('space'), 'space')
+        # Functions cut off before both complexities were written are left out
+        if not runtime or not space:
+            continue
+        try:
+            breakdown[as_text(item['name'])] = FuncComplexity(runtime=runtime, space=space).model_dump()
+        except ValidationError:
+            continue
+    structured_outputs.inc(command_label, 'failed' if not breakdown else 'repaired' if repaired else 'valid')
+    return breakdown
+
+
+def format_complexity_breakdown(breakdown: dict[str, dict[str, str]]) -> str:
+    """The breakdown as the readable lines /analyse has always answered with."""
+    return '\n'.join(f'{name}: {complexity["runtime"]} runtime, {complexity["space"]} space'
+                     for name, complexity in breakdown.items())
+
+
+def function_explanation(item: dict) -> Union[dict, None]:
+    descriptor = as_text(item.get('function_descriptor', item.get('signature')))
+    name = as_text(item.get('name'))
+    if not name:
+        match = DESCRIPTOR_NAME.match(descriptor)
+        name = match.group(1) if match else ''
+    description = as_text(item.get('description', item.get('explanation')))
+    if not name or not description:
+        return None
+    try:
+        return FunctionExplanationSchema(
+            name=name,
+            function_descriptor=descriptor or name,
+            description=description,
+            usage_example=as_text(item.get('usage_example', item.get('example')), separator='\n'),
+        ).model_dump()
+    except ValidationError:
+        return None
+
+
+def parse_legacy_pdf_metadata(text: str) -> dict:
+    """Title, description and function explanations of the previous `#####` separated format."""
+    title_section, *function_sections = text.split(LEGACY_SECTION_SEPARATOR)
+    title_lines, description_lines = [], []
+    for line in title_section.split('\n'):
+        if not line.strip():
+            continue
+        if 'title:' in line:
+            title_lines.append(line.replace('title: ', '').strip())
+        else:
+            description_lines.append(line.replace('description: ', '').strip())
+
+    function_explanations = []
+    for section in function_sections:
+        lines = [line for line in section.split('\n') if line.strip()]
+        if not lines:
+            continue
+        explanation_lines, usage_lines = [], []
+        for line in lines[1:]:
+            (usage_lines if usage_lines or 'Usage Example:' in line else explanation_lines).append(line)
+        descriptor_match = DESCRIPTOR_NAME.match(lines[0].split(':')[0])
+        explanation = function_explanation({
+            'name': descriptor_match.group(1) if descriptor_match else '',
+            'function_descriptor': lines[0].strip(),
+            'description': ' '.join(line.strip() for line in explanation_lines),
+            'usage_example': '\n'.join(line.replace('Usage Example:', '').strip() for line in usage_lines).strip(),
+        })
+        if explanation is not None:
+            function_explanations.append(explanation)
+    return {"title": ' '.join(title_lines), "description": ' '.join(description_lines),
+            "function_explanations": function_explanations}
+
+
+def parse_pdf_metadata(text: str, command_label: str = 'generate') -> dict:
+    """
+    Title, description and function explanations, validated as `FunctionExplanationSchema`, of a /generate or
+    /summarise answer: `{"title", "description", "functions": [{"name", "function_descriptor", "description",
+    "usage_example"}]}`, or the previous `#####` separated format when the answer is not JSON at all. Raises a
+    StructuredOutputError when neither a title nor a single function explanation can be recovered.
+    """
+    try:
+        data, repaired = parse_json_output(text)
+        if not isinstance(data, dict):
+            data = {'functions': data}
+        metadata = {
+            "title": as_text(data.get('title')),
+            "description": as_text(data.get('description')),
+            "function_explanations": [explanation for item in first_list(data, ('functions', 'function_explanations'))
+                                      if isinstance(item, dict) and (explanation := function_explanation(item))],
+        }
+        result = 'repaired' if repaired else 'valid'
+    except StructuredOutputError:
+        metadata = parse_legacy_pdf_metadata(text)
+        result = 'legacy'
+
+    if not metadata["title"] and not metadata["function_explanations"]:
+        structured_outputs.inc(command_label, 'failed')
+        raise StructuredOutputError("The output has neither a title nor any function explanation")
+    structured_outputs.inc(command_label, result)
+    return {**metadata, "footnotes": []}
+
+
+def insertion_line(value: Any) -> Union[int, None]:
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_insertions(text: str, command_label: str = 'annotate') -> list[tuple[int, str]]:
+    """
+    Line numbers and comment texts of an /annotate or /define answer given as insertions into the code block:
+    `{"insertions": [{"line", "comment"}]}`. Raises a StructuredOutputError when the answer is not JSON or none
+    of its insertions has both a line and a comment, so that the code block can be asked for as a whole instead.
+    """
+    try:
+        data, repaired = parse_json_output(text)
+    except StructuredOutputError:
+        structured_outputs.inc(command_label, 'failed')
+        raise
+
+    items = first_list(data, ('insertions', 'comments', 'definitions'))
+    insertions = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        line = insertion_line(item.get('line'))
+        comment = as_text(item.get('comment', item.get('text')), separator='\n')
+        if line is not None and comment:
+            insertions.append((line, comment))
+
+    # An empty list of insertions is a valid answer for code that needs no comments
+    if not insertions and (items or not isinstance(data, dict) or not isinstance(data.get('insertions'), list)):
+        structured_outputs.inc(command_label, 'failed')
+        raise StructuredOutputError("The output does not contain any insertion")
+    structured_outputs.inc(command_label, 'repaired' if repaired else 'valid')
+    return insertions
@@ -0,0 +1,238 @@
+import re
+
+from typing import NamedTuple
+from collections.abc import Iterator
+
+from src.generation.schemas import AcceptedCodeLanguages
+
+NAME = 'name'
+NUMBER = 'number'
+STRING = 'string'
+COMMENT = 'comment'
+NEWLINE = 'newline'
+OPERATOR = 'operator'
+WHITESPACE = 'whitespace'
+CODE = 'code'
+
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    start: int
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+
+PYTHON_COMMENT = r'(?P<comment>\#[^\n]*)'
+PYTHON_STRING = r'''(?P<string>(?:[rRbBuUfF]{0,2})(?:\'\'\'[\s\S]*?(?:\'\'\'|$(?![\s\S]))|""\"[\s\S]*?(?:""\"|$(?![\s\S]))
+                                    |'(?:\\.|[^'\\\n])*'?|"(?:\\.|[^"\\\n])*"?))'''
+C_FAMILY_COMMENT = r'(?P<comment>//[^\n]*|/\*[\s\S]*?(?:\*/|$(?![\s\S])))'
+C_FAMILY_STRING = r'''(?P<string>""\"[\s\S]*?(?:""\"|$(?![\s\S]))|"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)'''
+JAVASCRIPT_STRING = r'''(?P<string>`(?:\\[\s\S]|[^`\\])*`?|"(?:\\.|[^"\\\n])*"?|'(?:\\.|[^'\\\n])*'?)'''
+
+PYTHON_TOKEN_PATTERN = re.compile(rf'''
+    {PYTHON_COMMENT}
+  | {PYTHON_STRING}
+  | (?P<name>[^\W\d]\w*)
+  | (?P<number>\.?\d[\w.]*)
+  | (?P<newline>\r?\n)
+  | (?P<whitespace>[ \t\f\r]+|\\\r?\n)
+  | (?P<operator>[\s\S])
+''', re.VERBOSE)
+
+C_FAMILY_TOKEN_PATTERN = re.compile(rf'''
+    {C_FAMILY_COMMENT}
+  | {C_FAMILY_STRING}
+  | (?P<name>[^\W\d]\w*)
+  | (?P<number>\.?\d[\w.']*)
+  | (?P<newline>\r?\n)
+  | (?P<whitespace>[ \t\f\r]+)
+  | (?P<operator>[\s\S])
+''', re.VERBOSE)
+
+JAVASCRIPT_TOKEN_PATTERN = re.compile(rf'''
+    {C_FAMILY_COMMENT}
+  | {JAVASCRIPT_STRING}
+  | (?P<name>[^\W\d][\w$]*|\$[\w$]*)
+  | (?P<number>\.?\d[\w.]*)
+  | (?P<newline>\r?\n)
+  | (?P<whitespace>[ \t\f\r]+)
+  | (?P<operator>[\s\S])
+''', re.VERBOSE)
+
+# Coarse variants for comparisons that do not look inside a line of code: everything on a line up to a string
+# or comment is a single `code` token, and a line break takes the indentation of the next line along
+PYTHON_CODE_PATTERN = re.compile(rf'''
+    {PYTHON_COMMENT}
+  | {PYTHON_STRING}
+  | (?P<code>[^\s'"\#][^\n'"\#]*)
+  | (?P<newline>\r?\n[ \t\f\r]*)
+  | (?P<whitespace>[ \t\f\r]+)
+''', re.VERBOSE)
+
+C_FAMILY_CODE_PATTERN = re.compile(rf'''
+    {C_FAMILY_COMMENT}
+  | {C_FAMILY_STRING}
+  | (?P<code>(?:[^\s'"/]|/(?![/*]))(?:[^\n'"/]++|/(?![/*]))*)
+  | (?P<newline>\r?\n[ \t\f\r]*)
+  | (?P<whitespace>[ \t\f\r]+)
+''', re.VERBOSE)
+
+JAVASCRIPT_CODE_PATTERN = re.compile(rf'''
+    {C_FAMILY_COMMENT}
+  | {JAVASCRIPT_STRING}
+  | (?P<code>(?:[^\s'"`/]|/(?![/*]))(?:[^\n'"`/]++|/(?![/*]))*)
+  | (?P<newline>\r?\n[ \t\f\r]*)
+  | (?P<whitespace>[ \t\f\r]+)
+''', re.VERBOSE)
+
+TOKEN_PATTERNS = {
+    AcceptedCodeLanguages.Python: PYTHON_TOKEN_PATTERN,
+    AcceptedCodeLanguages.Java: C_FAMILY_TOKEN_PATTERN,
+    AcceptedCodeLanguages.CPlusPlus: C_FAMILY_TOKEN_PATTERN,
+    AcceptedCodeLanguages.Javascript: JAVASCRIPT_TOKEN_PATTERN,
+    AcceptedCodeLanguages.Typescript: JAVASCRIPT_TOKEN_PATTERN,
+    AcceptedCodeLanguages.JavascriptReact: JAVASCRIPT_TOKEN_PATTERN,
+    AcceptedCodeLanguages.TypescriptReact: JAVASCRIPT_TOKEN_PATTERN,
+}
+
+CODE_PATTERNS = {
+    AcceptedCodeLanguages.Python: PYTHON_CODE_PATTERN,
+    AcceptedCodeLanguages.Java: C_FAMILY_CODE_PATTERN,
+    AcceptedCodeLanguages.CPlusPlus: C_FAMILY_CODE_PATTERN,
+    AcceptedCodeLanguages.Javascript: JAVASCRIPT_CODE_PATTERN,
+    AcceptedCodeLanguages.Typescript: JAVASCRIPT_CODE_PATTERN,
+    AcceptedCodeLanguages.JavascriptReact: JAVASCRIPT_CODE_PATTERN,
+    AcceptedCodeLanguages.TypescriptReact: JAVASCRIPT_CODE_PATTERN,
+}
+
+
+def tokenize(source: str, language: AcceptedCodeLanguages) -> Iterator[Token]:
+    """
+    Splits source code into tokens in a single regular expression pass. The tokenizer is deliberately lenient:
+    unterminated strings and comments run to the end of the line or file instead of raising, since the code
+    blocks we receive are often fragments cut out of a larger file.
+    """
+    for match in TOKEN_PATTERNS[language].finditer(source):
+        yield Token(match.lastgroup, match.group(), match.start())
+
+
+class IncrementalTokenizer:
+    """
+    Tokenizes text that arrives in pieces. Tokens are final once the line they end on is complete, since no
+    token other than a multi-line string or comment crosses a line break, and an unterminated one runs to the
+    end of the text. The incomplete last line is matched again together with the next piece.
+    """
+
+    def __init__(self, language: AcceptedCodeLanguages, patterns: dict = TOKEN_PATTERNS):
+        self.pattern = patterns[language]
+        self.pending = ''
+
+    def feed(self, text: str) -> list[tuple[str, str]]:
+        self.pending += text
+        if '\n' not in text:
+            return []
+
+        tokens = [(match.lastgroup, match.group()) for match in self.pattern.finditer(self.pending)]
+        final_count = len(tokens) - 1
+        while final_count > 0 and tokens[final_count - 1][0] != NEWLINE:
+            final_count -= 1
+        if final_count == 0:
+            return []
+
+        self.pending = ''.join(text for _, text in tokens[final_count:])
+        return tokens[:final_count]
+
+    def finish(self) -> list[tuple[str, str]]:
+        remaining_text, self.pending = self.pending, ''
+        return [(match.lastgroup, match.group()) for match in self.pattern.finditer(remaining_text)]
+
+
+OPENING_BRACKETS = {'(': 1, '[': 1, '{': 1, ')': -1, ']': -1, '}': -1}
+C_FAMILY_OPENING_BRACKETS = {'(': 1, '[': 1, ')': -1, ']': -1}
+
+
+class CodeNormalizer:
+    """
+    Reduces a token stream to what the code means, leaving out comments, Python docstrings and formatting.
+    Line breaks are kept, except inside brackets, and so is the indentation of Python lines, which makes two
+    code blocks normalize the same when they only differ in their comments and blank lines. Accepts the fine
+    tokens of `TOKEN_PATTERNS` as well as the coarse `code` tokens of `CODE_PATTERNS`. The comments and Python
+    docstrings that were left out are collected in `comments`, with their whitespace collapsed.
+    """
+
+    def __init__(self, language: AcceptedCodeLanguages):
+        self.python = language == AcceptedCodeLanguages.Python
+        self.brackets = OPENING_BRACKETS if self.python else C_FAMILY_OPENING_BRACKETS
+        self.opening_brackets = [bracket for bracket, change in self.brackets.items() if change > 0]
+        self.closing_brackets = [bracket for bracket, change in self.brackets.items() if change < 0]
+        self.normalized: list[tuple[str, str]] = []
+        self.comments: list[str] = []
+
+        self.depth = 0
+        self.indentation = ''
+        self.line_started = False
+        self.pending_string = None
+
+    def push(self, tokens: list[tuple[str, str]]):
+        normalized = self.normalized
+        for kind, text in tokens:
+            if kind == WHITESPACE:
+                if not self.line_started:
+                    self.indentation = text
+            elif kind == COMMENT:
+                self.comments.append(' '.join(text.split()))
+            elif kind == NEWLINE:
+                # A string that is the only thing on its line is a docstring (or otherwise a no-op statement)
+                self.leave_out_pending_string()
+                if self.depth == 0:
+                    if self.line_started:
+                        normalized.append((NEWLINE, ''))
+                    self.line_started = False
+                    self.indentation = text.lstrip('\r\n')
+            elif self.python and kind == STRING and not self.line_started and self.depth == 0 \
+                    and self.pending_string is None:
+                self.pending_string = text
+            else:
+                if self.pending_string is not None:
+                    self.start_line()
+                    normalized.append((STRING, self.pending_string))
+                    self.pending_string = None
+                if not self.line_started:
+                    self.start_line()
+                if kind == CODE:
+                    self.depth = max(0, self.depth + sum(map(text.count, self.opening_brackets))
+                                     - sum(map(text.count, self.closing_brackets)))
+                    text = ' '.join(text.split())
+                elif kind == OPERATOR and text in self.brackets:
+                    self.depth = max(0, self.depth + self.brackets[text])
+                normalized.append((kind, text))
+
+    def start_line(self):
+        if not self.line_started:
+            self.line_started = True
+            if self.python:
+                self.normalized.append((WHITESPACE, self.indentation))
+
+    def leave_out_pending_string(self):
+        if self.pending_string is not None:
+            self.comments.append(' '.join(self.pending_string.split()))
+            self.pending_string = None
+
+    def finish(self) -> list[tuple[str, str]]:
+        self.leave_out_pending_string()
+        if self.line_started:
+            self.normalized.append((NEWLINE, ''))
+            self.line_started = False
+        return self.normalized
+
+
+def normalize_code(source: str, language: AcceptedCodeLanguages,
+                   patterns: dict = TOKEN_PATTERNS) -> list[tuple[str, str]]:
+    tokenizer = IncrementalTokenizer(language, patterns)
+    normalizer = CodeNormalizer(language)
+    normalizer.push(tokenizer.feed(source))
+    normalizer.push(tokenizer.finish())
+    return normalizer.finish()
@@ -0,0 +1,17 @@
+from typing import Annotated
+from fastapi import Depends, Request
+
+from src.jobs.store import JobStore
+from src.jobs.service import JobRunner
+
+
+def get_job_runner(request: Request) -> JobRunner:
+    return request.app.state.job_runner
+
+
+def get_job_store(request: Request) -> JobStore:
+    return request.app.state.job_runner.store
+
+
+JobRunnerDep = Annotated[JobRunner, Depends(get_job_runner)]
+JobStoreDep = Annotated[JobStore, Depends(get_job_store)]
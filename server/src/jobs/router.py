@@ -0,0 +1,56 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+
+from src.core.settings import get_settings
+from src.generation.streaming import NDJSON_MEDIA_TYPE
+from src.generation.dependencies import ChatSessions, RequestingUser
+from src.jobs.dependencies import JobRunnerDep, JobStoreDep
+from src.jobs.schemas import JobSchemaIn, JobSchemaOut, JobResultsSchemaOut
+
+
+settings = get_settings()
+
+jobs_router = APIRouter(
+    prefix='/jobs',
+    tags=['jobs', 'documentation'],
+    responses={401: {"description": "Invalid user authorization credentials"},
+               404: {"description": "Job not found."}}
+)
+
+
+async def get_job_or_404(job_store: JobStoreDep, job_id: str) -> dict:
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@jobs_router.post('/', response_model=JobSchemaOut, status_code=202)
+async def submit_documentation_job(metadata: JobSchemaIn, job_runner: JobRunnerDep, job_store: JobStoreDep,
+                                   chat_sessions: ChatSessions, user: RequestingUser):
+    if len(metadata.files) > settings.job_max_files:
+        raise HTTPException(status_code=413, detail=f"Jobs are limited to {settings.job_max_files} files")
+
+    # A job counts as a single request against the per user quota, however many files it documents
+    await chat_sessions.admit_user()
+    job_id = await job_runner.submit(metadata.files, user=user)
+    return await get_job_or_404(job_store, job_id)
+
+
+@jobs_router.get('/{job_id}/', response_model=JobSchemaOut)
+async def documentation_job_status(job_id: str, job_store: JobStoreDep):
+    return await get_job_or_404(job_store, job_id)
+
+
+@jobs_router.get('/{job_id}/results/', response_model=JobResultsSchemaOut)
+async def documentation_job_results(job_id: str, job_store: JobStoreDep):
+    job = await get_job_or_404(job_store, job_id)
+    return {"id": job["id"], "status": job["status"], "results": await asyncio.to_thread(job_store.get_results, job_id)}
+
+
+@jobs_router.get('/{job_id}/events/')
+async def documentation_job_events(job_id: str, job_runner: JobRunnerDep, job_store: JobStoreDep):
+    await get_job_or_404(job_store, job_id)
+    return StreamingResponse(job_runner.progress_events(job_id), media_type=NDJSON_MEDIA_TYPE)
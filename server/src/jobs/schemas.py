@@ -0,0 +1,47 @@
+from typing import Literal, Union
+from pydantic import Field
+
+from src.core.schemas import PrivateBaseModel
+from src.generation.schemas import GeneratePDFSchemaIn, GeneratePDFSchemaOut
+
+JobStatus = Literal['queued', 'running', 'completed']
+JobFileStatus = Literal['queued', 'running', 'completed', 'failed']
+
+
+class JobFileIn(GeneratePDFSchemaIn):
+    # Path of the file within the repository, used to tell the results of a job apart
+    file_name: str
+
+
+class JobSchemaIn(PrivateBaseModel):
+    files: list[JobFileIn] = Field(min_length=1)
+
+
+class JobFileStatusSchemaOut(PrivateBaseModel):
+    position: int
+    file_name: str
+    status: JobFileStatus
+    error: Union[str, None] = None
+
+
+class JobSchemaOut(PrivateBaseModel):
+    id: str
+    status: JobStatus
+    created_at: float
+    updated_at: float
+    total_files: int
+    completed_files: int
+    failed_files: int
+    files: list[JobFileStatusSchemaOut]
+
+
+class JobFileResultSchemaOut(PrivateBaseModel):
+    position: int
+    file_name: str
+    result: GeneratePDFSchemaOut
+
+
+class JobResultsSchemaOut(PrivateBaseModel):
+    id: str
+    status: JobStatus
+    results: list[JobFileResultSchemaOut]
@@ -0,0 +1,204 @@
+import time
+import asyncio
+import logging
+
+from typing import Union
+from fastapi import HTTPException
+from collections.abc import AsyncIterator
+
+from src.core.utils import generate_alphanumeric_id
+from src.jobs.store import JobStore
+from src.jobs.schemas import JobFileIn
+from src.generation.streaming import encode_event
+from src.generation.cache import ResponseCache
+from src.generation.ratelimit import RateLimitScheduler
+from src.generation.service import ChatSessionFactory, LLMClientRegistry, generate_pdf_documentation
+
+logger = logging.getLogger(__name__)
+
+
+class JobRunner:
+    """
+    Local worker pool that documents the files of submitted jobs. The files of every job are taken from a
+    single queue by `worker_count` workers, which is the concurrency budget all jobs share, and every outcome
+    is written to the job store as soon as it is known.
+
+    Every server process runs its own pool over the same store: a file is claimed before it is documented, the
+    leases of running files are renewed every third of `lease_seconds` and files that are queued, or whose
+    lease ran out, are picked up by whichever process gets to them first. A process that lost the lease of a
+    file drops its outcome, the file belongs to the process that took it over. Finished jobs are deleted once
+    they have not changed for `retention_seconds`.
+    """
+
+    # Subscribers re-read the job at least this often even when no progress was announced
+    PROGRESS_POLL_SECONDS = 15
+    # Progress made by other processes only shows in the store, which subscribers check this often
+    STORE_POLL_SECONDS = 1
+
+    # Finished jobs past their retention are looked for this often
+    PURGE_INTERVAL_SECONDS = 60 * 60
+
+    def __init__(self, store: JobStore, llm_clients: LLMClientRegistry, rate_limiter: RateLimitScheduler,
+                 response_cache: ResponseCache, worker_count: int, lease_seconds: float = 60,
+                 retention_seconds: float = 7 * 24 * 60 * 60):
+        self.store = store
+        self.llm_clients = llm_clients
+        self.rate_limiter = rate_limiter
+        self.response_cache = response_cache
+        self.worker_count = worker_count
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self.purged_at = 0.0
+        self.owner = generate_alphanumeric_id(length=16, lower_only=True)
+        self.queue: asyncio.Queue[tuple[str, int]] = asyncio.Queue()
+        self.queued: set[tuple[str, int]] = set()
+        self.workers: list[asyncio.Task] = []
+        self.lease_keeper: Union[asyncio.Task, None] = None
+        self.documenting = 0
+        self.draining = False
+        self.progress = asyncio.Condition()
+        self.progress_version = 0
+
+    async def start(self):
+        # Files that were queued or interrupted by a restart are picked up again in their original order
+        await self.enqueue_claimable_files()
+        self.workers = [asyncio.ensure_future(self.work()) for _ in range(self.worker_count)]
+        self.lease_keeper = asyncio.ensure_future(self.keep_leases())
+
+    async def stop(self, drain_seconds: float = 0):
+        """
+        Stops taking files from the queue and gives the files being documented up to `drain_seconds` to finish.
+        Files still running after that are put back in the queue of the store for the next process.
+        """
+        self.draining = True
+        if drain_seconds > 0:
+            async with self.progress:
+                try:
+                    await asyncio.wait_for(self.progress.wait_for(lambda: self.documenting == 0),
+                                           timeout=drain_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+        tasks = self.workers + ([self.lease_keeper] if self.lease_keeper is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.to_thread(self.store.release_files, self.owner)
+        self.workers = []
+        self.lease_keeper = None
+
+    def enqueue(self, job_id: str, position: int):
+        if (job_id, position) not in self.queued:
+            self.queued.add((job_id, position))
+            self.queue.put_nowait((job_id, position))
+
+    async def enqueue_claimable_files(self):
+        for job_id, position in await asyncio.to_thread(self.store.claimable_files):
+            self.enqueue(job_id, position)
+
+    async def submit(self, files: list[JobFileIn], user: str = None) -> str:
+        job_id = f'scribe_job__{generate_alphanumeric_id(length=12, lower_only=True)}'
+        await asyncio.to_thread(self.store.create_job, job_id, files, user=user)
+        for position in range(len(files)):
+            self.enqueue(job_id, position)
+        return job_id
+
+    async def keep_leases(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(self.store.renew_leases, self.owner, self.lease_seconds)
+            if not self.draining:
+                await self.enqueue_claimable_files()
+            if time.monotonic() - self.purged_at >= self.PURGE_INTERVAL_SECONDS:
+                self.purged_at = time.monotonic()
+                await asyncio.to_thread(self.store.purge_finished_jobs, self.retention_seconds)
+
+    async def work(self):
+        while not self.draining:
+            job_id, position = await self.queue.get()
+            self.queued.discard((job_id, position))
+            if self.draining:
+                # The file is still queued in the store for the next process
+                self.queue.task_done()
+                break
+            self.documenting += 1
+            try:
+                await self.document_file(job_id, position)
+            finally:
+                self.documenting -= 1
+                self.queue.task_done()
+            await self.announce_progress()
+
+    async def document_file(self, job_id: str, position: int):
+        file_metadata = await asyncio.to_thread(self.store.get_request, job_id, position)
+        # Another process may have claimed the file first
+        if file_metadata is None or not await asyncio.to_thread(self.store.claim_file, job_id, position, self.owner,
+                                                                self.lease_seconds):
+            return
+
+        await self.announce_progress()
+        # Jobs are admitted against the per user quota once, when they are submitted
+        chat_sessions = ChatSessionFactory(self.llm_clients, self.rate_limiter)
+        try:
+            pdf_metadata = await generate_pdf_documentation(file_metadata, chat_sessions, self.response_cache)
+        except HTTPException as e:
+            outcome = {"status": 'failed', "error": str(e.detail)}
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Job %s failed to document %s", job_id, file_metadata.file_name)
+            outcome = {"status": 'failed', "error": "Documentation could not be generated"}
+        else:
+            outcome = {"status": 'completed', "result": pdf_metadata.model_dump(mode='json')}
+
+        if not await asyncio.to_thread(self.store.update_file, job_id, position, self.owner, **outcome):
+            logger.warning("The lease of file %s of job %s was lost, its outcome is dropped", position, job_id)
+
+    async def announce_progress(self):
+        async with self.progress:
+            self.progress_version += 1
+            self.progress.notify_all()
+
+    async def wait_for_progress(self, seen_version: int, seen_data_version: int):
+        deadline = asyncio.get_running_loop().time() + self.PROGRESS_POLL_SECONDS
+        while self.progress_version == seen_version \
+                and await asyncio.to_thread(self.store.data_version) == seen_data_version:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return
+            async with self.progress:
+                if self.progress_version != seen_version:
+                    return
+                try:
+                    await asyncio.wait_for(self.progress.wait(), timeout=min(self.STORE_POLL_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def progress_events(self, job_id: str) -> AsyncIterator[bytes]:
+        """
+        NDJSON `file` events for every file as it finishes, a `progress` event with the counts of the job after
+        every change, and a closing `done` event once no file is left queued or running. A job that was deleted
+        while it was followed, by the purge of finished jobs for instance, ends the stream with an `error` event.
+        """
+        reported_files = set()
+        last_progress: Union[tuple, None] = None
+        while True:
+            seen_version, seen_data_version = self.progress_version, await asyncio.to_thread(self.store.data_version)
+            job = await asyncio.to_thread(self.store.get_job, job_id)
+            if job is None:
+                yield encode_event('error', detail="The job no longer exists")
+                return
+            for file in job["files"]:
+                if file["status"] in ('completed', 'failed') and file["position"] not in reported_files:
+                    reported_files.add(file["position"])
+                    yield encode_event('file', **file)
+
+            progress = (job["status"], job["completed_files"], job["failed_files"])
+            if progress != last_progress:
+                last_progress = progress
+                yield encode_event('progress', status=job["status"], total_files=job["total_files"],
+                                   completed_files=job["completed_files"], failed_files=job["failed_files"])
+            if job["status"] == 'completed':
+                yield encode_event('done')
+                return
+            await self.wait_for_progress(seen_version, seen_data_version)
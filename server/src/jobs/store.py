@@ -0,0 +1,174 @@
+import json
+import time
+import sqlite3
+import threading
+
+from typing import Any, Union
+
+from src.jobs.schemas import JobFileIn
+
+
+class JobStore:
+    """
+    SQLite record of every submitted job, one row per file with its request, status and generated result, so
+    that queued work and finished results survive server restarts. Worker processes sharing the file claim a
+    file before documenting it and hold a lease on it while they do, so every file is documented once.
+
+    Writes wait for the write lock of the database, which another process may hold, so the event loop calls the
+    store from a worker thread (`asyncio.to_thread`).
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        # Worker processes opening the store at the same time create and migrate it one after the other
+        self.connection.execute('BEGIN IMMEDIATE')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, user TEXT, created_at REAL NOT NULL, '
+            'updated_at REAL NOT NULL)')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS job_files (job_id TEXT NOT NULL, position INTEGER NOT NULL, '
+            'file_name TEXT NOT NULL, request TEXT NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT, '
+            'PRIMARY KEY (job_id, position))')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS job_files_status ON job_files (status)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS jobs_updated_at ON jobs (updated_at)')
+        # Stores created before files were leased lack the lease columns
+        columns = {row[1] for row in self.connection.execute('PRAGMA table_info(job_files)')}
+        if 'owner' not in columns:
+            self.connection.execute('ALTER TABLE job_files ADD COLUMN owner TEXT')
+        if 'lease_expires_at' not in columns:
+            self.connection.execute('ALTER TABLE job_files ADD COLUMN lease_expires_at REAL')
+        self.connection.execute('COMMIT')
+
+    def create_job(self, job_id: str, files: list[JobFileIn], user: Union[str, None] = None):
+        now = time.time()
+        with self.lock:
+            self.connection.execute('BEGIN')
+            self.connection.execute('INSERT INTO jobs (id, user, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                                    (job_id, user, now, now))
+            self.connection.executemany(
+                'INSERT INTO job_files (job_id, position, file_name, request, status) VALUES (?, ?, ?, ?, ?)',
+                [(job_id, position, file.file_name, file.model_dump_json(), 'queued')
+                 for position, file in enumerate(files)])
+            self.connection.execute('COMMIT')
+
+    def get_job(self, job_id: str) -> Union[dict, None]:
+        with self.lock:
+            job = self.connection.execute(
+                'SELECT id, created_at, updated_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if job is None:
+                return None
+            files = self.connection.execute(
+                'SELECT position, file_name, status, error FROM job_files WHERE job_id = ? ORDER BY position',
+                (job_id,)).fetchall()
+
+        file_statuses = [{"position": position, "file_name": file_name, "status": status, "error": error}
+                         for position, file_name, status, error in files]
+        return {
+            "id": job[0],
+            "status": self.job_status([file["status"] for file in file_statuses]),
+            "created_at": job[1],
+            "updated_at": job[2],
+            "total_files": len(file_statuses),
+            "completed_files": sum(file["status"] == 'completed' for file in file_statuses),
+            "failed_files": sum(file["status"] == 'failed' for file in file_statuses),
+            "files": file_statuses,
+        }
+
+    @staticmethod
+    def job_status(file_statuses: list[str]) -> str:
+        if all(status == 'queued' for status in file_statuses):
+            return 'queued'
+        if any(status in ('queued', 'running') for status in file_statuses):
+            return 'running'
+        return 'completed'
+
+    def get_request(self, job_id: str, position: int) -> Union[JobFileIn, None]:
+        with self.lock:
+            row = self.connection.execute('SELECT request FROM job_files WHERE job_id = ? AND position = ?',
+                                          (job_id, position)).fetchone()
+        return JobFileIn.model_validate_json(row[0]) if row is not None else None
+
+    def get_results(self, job_id: str) -> list[dict]:
+        """Results of the files of a job that have completed so far."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT position, file_name, result FROM job_files WHERE job_id = ? AND status = 'completed' "
+                "ORDER BY position", (job_id,)).fetchall()
+        return [{"position": position, "file_name": file_name, "result": json.loads(result)}
+                for position, file_name, result in rows]
+
+    def update_file(self, job_id: str, position: int, owner: str, status: str, result: Any = None,
+                    error: str = None) -> bool:
+        """Records the outcome of a file `owner` is running. False if its lease was lost to another worker."""
+        now = time.time()
+        with self.lock:
+            self.connection.execute('BEGIN')
+            cursor = self.connection.execute(
+                'UPDATE job_files SET status = ?, result = ?, error = ?, owner = NULL, lease_expires_at = NULL '
+                "WHERE job_id = ? AND position = ? AND owner = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, job_id, position, owner))
+            if cursor.rowcount == 1:
+                self.connection.execute('UPDATE jobs SET updated_at = ? WHERE id = ?', (now, job_id))
+            self.connection.execute('COMMIT')
+        return cursor.rowcount == 1
+
+    def claim_file(self, job_id: str, position: int, owner: str, lease_seconds: float) -> bool:
+        """Marks a queued file, or one whose lease ran out, as running for `owner`. False if it is not claimable."""
+        now = time.time()
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE job_files SET status = 'running', owner = ?, lease_expires_at = ? "
+                "WHERE job_id = ? AND position = ? AND (status = 'queued' OR (status = 'running' AND "
+                "(lease_expires_at IS NULL OR lease_expires_at <= ?)))",
+                (owner, now + lease_seconds, job_id, position, now))
+            if cursor.rowcount == 1:
+                self.connection.execute('UPDATE jobs SET updated_at = ? WHERE id = ?', (now, job_id))
+        return cursor.rowcount == 1
+
+    def renew_leases(self, owner: str, lease_seconds: float):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE job_files SET lease_expires_at = ? WHERE owner = ? AND status = 'running'",
+                (time.time() + lease_seconds, owner))
+
+    def release_files(self, owner: str):
+        """Puts the files `owner` is still running back in the queue, for another worker to pick up."""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE job_files SET status = 'queued', owner = NULL, lease_expires_at = NULL "
+                "WHERE owner = ? AND status = 'running'", (owner,))
+
+    def claimable_files(self) -> list[tuple[str, int]]:
+        """Files that are queued, or were interrupted while running and lost their lease, oldest job first."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT job_files.job_id, job_files.position FROM job_files JOIN jobs ON jobs.id = job_files.job_id "
+                "WHERE job_files.status = 'queued' OR (job_files.status = 'running' AND "
+                "(job_files.lease_expires_at IS NULL OR job_files.lease_expires_at <= ?)) "
+                "ORDER BY jobs.created_at, job_files.position", (time.time(),)
+            ).fetchall()
+
+    def purge_finished_jobs(self, retention_seconds: float) -> int:
+        """Deletes the jobs that have no file left to document and have not changed for `retention_seconds`."""
+        with self.lock:
+            self.connection.execute('BEGIN')
+            expired_jobs = [row[0] for row in self.connection.execute(
+                "SELECT id FROM jobs WHERE updated_at <= ? AND NOT EXISTS (SELECT 1 FROM job_files WHERE "
+                "job_files.job_id = jobs.id AND job_files.status IN ('queued', 'running'))",
+                (time.time() - retention_seconds,))]
+            expired_ids = [(job_id,) for job_id in expired_jobs]
+            self.connection.executemany('DELETE FROM job_files WHERE job_id = ?', expired_ids)
+            self.connection.executemany('DELETE FROM jobs WHERE id = ?', expired_ids)
+            self.connection.execute('COMMIT')
+        return len(expired_jobs)
+
+    def data_version(self) -> int:
+        """Changes whenever another connection, e.g. another worker process, commits to the store."""
+        with self.lock:
+            return self.connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,6 +1,18 @@
+import asyncio
+
+from typing import Union
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.core.settings import AppSettings, get_settings
+from src.core.metrics import PROMETHEUS_CONTENT_TYPE, CallbackMetric, MetricsMiddleware, metrics
+
+from src.jobs.router import jobs_router
+from src.generation.prompts import prompt_registry
+from src.generation.resilience import upstream_calls
 from src.generation.router import generation_router
 
 cors_origins = [
@@ -13,29 +25,115 @@ cors_origins = [
 ]
 
 
-def initialize_app() -> FastAPI:
-    from src.core.settings import AppSettings
+@asynccontextmanager
+async def lifespan(server_instance: FastAPI):
+    from src.generation.cache import ResponseCache
+    from src.generation.ratelimit import RateLimitScheduler
+    from src.generation.service import LLMClientRegistry
+    from src.jobs.service import JobRunner
+    from src.jobs.store import JobStore
+
+    settings = get_settings()
+    prompt_registry.precompile()
+    server_instance.state.llm_clients = LLMClientRegistry()
+    server_instance.state.response_cache = ResponseCache.from_settings(settings)
+    server_instance.state.rate_limiter = RateLimitScheduler(settings)
+    server_instance.state.job_runner = JobRunner(
+        JobStore(settings.job_store_path),
+        llm_clients=server_instance.state.llm_clients,
+        rate_limiter=server_instance.state.rate_limiter,
+        response_cache=server_instance.state.response_cache,
+        worker_count=settings.job_worker_count,
+        lease_seconds=settings.job_lease_seconds,
+        retention_seconds=settings.job_retention_seconds,
+    )
+    await server_instance.state.job_runner.start()
+    register_state_metrics(server_instance)
+    # The OpenAI SDK is imported and the upstream connections are opened while the server already accepts
+    # requests, a completion needed before that is done creates what it needs itself
+    warm_up = asyncio.create_task(server_instance.state.llm_clients.warm_up()) if settings.llm_warm_up_enabled \
+        else None
+    yield
+    if warm_up is not None and not warm_up.done():
+        warm_up.cancel()
+    # Requests in flight have been served by now, documentation jobs in flight get the same time to finish
+    await server_instance.state.job_runner.stop(drain_seconds=settings.shutdown_drain_seconds)
+    server_instance.state.job_runner.store.close()
+    server_instance.state.rate_limiter.close()
+    server_instance.state.response_cache.close()
+    await server_instance.state.llm_clients.aclose()
+
+
+def register_state_metrics(server_instance: FastAPI):
+    response_cache = server_instance.state.response_cache
+    rate_limiter = server_instance.state.rate_limiter
+    llm_clients = server_instance.state.llm_clients
+    job_runner = server_instance.state.job_runner
+
+    metrics.register(CallbackMetric(
+        'scribe_response_cache_lookups_total', 'Response cache lookups by result', ('result',), 'counter',
+        callback=lambda: {('hit',): response_cache.hits, ('miss',): response_cache.misses}))
+    metrics.register(CallbackMetric(
+        'scribe_coalesced_generations_total', 'Generations answered by an identical generation already in flight',
+        metric_type='counter', callback=lambda: {(): response_cache.stats()["coalesced"]}))
+    metrics.register(CallbackMetric(
+        'scribe_response_cache_entries', 'Responses held in the in-memory cache tier',
+        callback=lambda: {(): len(response_cache.entries)}))
+    metrics.register(CallbackMetric(
+        'scribe_rate_limit_queue_depth', 'Requests waiting for rate limit capacity', ('deployment', 'model'),
+        callback=lambda: {(deployment, model.value): limiter.queue_depth
+                          for deployment, limiters in rate_limiter.deployment_limiters.items()
+                          for model, limiter in limiters.items()}))
+    metrics.register(CallbackMetric(
+        'scribe_deployment_in_flight', 'Completions in flight on every Azure OpenAI deployment', ('deployment',),
+        callback=lambda: {(deployment.name,): deployment.in_flight
+                          for deployment in llm_clients.deployment_pool.deployments}))
+    metrics.register(CallbackMetric(
+        'scribe_prompt_tokens_estimate', 'Estimated tokens of every compiled system prompt',
+        ('command', 'parameter', 'output'),
+        callback=lambda: {(variant.command.name.lower(), str(getattr(variant.parameter, 'value', variant.parameter)),
+                           'patch' if variant.patch else 'full'):
+                          variant.estimated_tokens for variant in list(prompt_registry.variants.values())}))
+    metrics.register(CallbackMetric(
+        'scribe_circuit_breaker_open', 'Whether the circuit breaker of an OpenAI endpoint rejects completions',
+        ('endpoint', 'state'),
+        callback=lambda: {(endpoint, breaker.state): int(breaker.state != 'closed')
+                          for endpoint, breaker in list(upstream_calls.breakers.items())}))
+    metrics.register(CallbackMetric(
+        'scribe_job_queue_depth', 'Job files waiting for a worker', callback=lambda: {(): job_runner.queue.qsize()}))
+
 
+def initialize_app(settings: Union[AppSettings, None] = None) -> FastAPI:
+    settings = settings or get_settings()
     server_instance = FastAPI(
-        title=AppSettings().app_name,
-        version=AppSettings().app_version,
+        title=settings.app_name,
+        version=settings.app_version,
         description="Code documentation and analysis automation tool powered by AI",
+        lifespan=lifespan,
     )
 
     server_instance.include_router(generation_router)
+    server_instance.include_router(jobs_router)
+    if settings.metrics_enabled:
+        server_instance.add_middleware(MetricsMiddleware)
+    server_instance.add_middleware(
+        CORSMiddleware,
+        allow_origins=cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
     return server_instance
 
 
 app = initialize_app()
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=cors_origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
 
 @app.get("/")
 async def index():
     return {"message": "Setting up server!"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
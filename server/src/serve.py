@@ -0,0 +1,55 @@
+import os
+import argparse
+
+import uvicorn
+
+from src.core.settings import get_settings
+
+# SQLite files the worker processes share their state through when none are configured
+SHARED_STATE_DEFAULTS = {
+    'SHARED_STATE_PATH': 'scribe_state.sqlite3',
+    'RESPONSE_CACHE_PATH': 'scribe_responses.sqlite3',
+    'RESPONSE_CACHE_LEASE_SECONDS': '120',
+}
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def main():
+    """
+    Production entry point: runs the app in `WEB_CONCURRENCY` worker processes, one per available core by
+    default, behind uvicorn's process supervisor. With more than one worker, the rate limit quotas, the response
+    cache and the documentation jobs are shared through SQLite files so that limits and cache hits hold across
+    workers. On SIGTERM or SIGINT every worker stops accepting connections and drains the requests and jobs in
+    flight for up to `SHUTDOWN_DRAIN_SECONDS`. SIGHUP restarts the workers one by one.
+    """
+    parser = argparse.ArgumentParser(description="Run the Scribe server with one worker process per core")
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes, WEB_CONCURRENCY by default")
+    parser.add_argument('--log-level', default=os.getenv('LOG_LEVEL', 'info'))
+    args = parser.parse_args()
+
+    workers = args.workers or get_settings().web_concurrency or available_cores()
+    if workers > 1:
+        # Workers are spawned and read their settings from this environment
+        for name, value in SHARED_STATE_DEFAULTS.items():
+            os.environ.setdefault(name, value)
+
+    uvicorn.run(
+        'src.main:app',
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        log_level=args.log_level,
+        timeout_graceful_shutdown=get_settings().shutdown_drain_seconds,
+    )
+
+
+if __name__ == '__main__':
+    main()
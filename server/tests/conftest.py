@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+# The settings are read from the environment when `src` is first imported, tests never reach a real endpoint
+for variable, value in {
+    'ENVIRONMENT': 'test',
+    'AZURE_OPENAI_API_KEY': 'test',
+    'AZURE_OPENAI_ENDPOINT': 'http://127.0.0.1:9',
+    'OPENAI_API_VERSION': '2023-05-15',
+    'MODEL_NAME': 'test',
+    'OPENAI_SECRET_KEY': 'test',
+    'OPENAI_ORGANIZATION_ID': 'test',
+    'JOB_STORE_PATH': os.path.join(tempfile.mkdtemp(prefix='scribe-tests-'), 'jobs.sqlite3'),
+}.items():
+    os.environ.setdefault(variable, value)
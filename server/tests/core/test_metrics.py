@@ -0,0 +1,71 @@
+from fastapi.testclient import TestClient
+
+from src.core.settings import get_settings
+from src.core.metrics import CallbackMetric, MetricsMiddleware, MetricsRegistry
+from src.main import app, initialize_app
+
+
+def test_counters_and_gauges_are_rendered_with_their_labels():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', 'Requests answered', ('route', 'status'))
+    requests.inc('/explain/', '200')
+    requests.inc('/explain/', '200', amount=2)
+    requests.inc('/say "hi"\n', '503')
+    in_flight = registry.gauge('in_flight', 'Requests being answered')
+    in_flight.inc()
+    in_flight.dec(amount=0.5)
+
+    assert registry.render().split('\n') == [
+        '# HELP requests_total Requests answered',
+        '# TYPE requests_total counter',
+        'requests_total{route="/explain/",status="200"} 3',
+        'requests_total{route="/say \\"hi\\"\\n",status="503"} 1',
+        '# HELP in_flight Requests being answered',
+        '# TYPE in_flight gauge',
+        'in_flight 0.5',
+        '',
+    ]
+
+
+def test_histograms_are_rendered_as_cumulative_buckets_with_their_sum_and_count():
+    registry = MetricsRegistry()
+    durations = registry.histogram('duration_seconds', 'Durations', ('route',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        durations.observe('/', value=value)
+
+    assert registry.render().split('\n')[2:] == [
+        'duration_seconds_bucket{route="/",le="0.1"} 2',
+        'duration_seconds_bucket{route="/",le="1"} 3',
+        'duration_seconds_bucket{route="/",le="+Inf"} 4',
+        'duration_seconds_sum{route="/"} 3.65',
+        'duration_seconds_count{route="/"} 4',
+        '',
+    ]
+
+
+def test_callback_metrics_are_read_when_scraped():
+    registry = MetricsRegistry()
+    sizes = {('responses',): 1}
+    registry.register(CallbackMetric('cache_entries', 'Entries', ('cache',), callback=lambda: dict(sizes)))
+    sizes[('responses',)] = 7
+    assert 'cache_entries{cache="responses"} 7' in registry.render()
+
+
+def test_requests_are_exposed_on_the_metrics_route():
+    client = TestClient(app)
+    assert client.get('/').status_code == 200
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'text/plain; version=0.0.4; charset=utf-8'
+    assert 'scribe_http_request_duration_seconds_count{route="/",method="GET",status="200"}' in response.text
+    assert '# TYPE scribe_model_request_duration_seconds histogram' in response.text
+
+
+def test_requests_are_only_measured_with_metrics_enabled():
+    def middleware(metrics_enabled: bool) -> list[type]:
+        settings = get_settings().model_copy(update={"metrics_enabled": metrics_enabled})
+        return [middleware.cls for middleware in initialize_app(settings).user_middleware]
+
+    assert MetricsMiddleware in middleware(True)
+    assert MetricsMiddleware not in middleware(False)
@@ -0,0 +1,81 @@
+import json
+import asyncio
+import sqlite3
+import itertools
+import threading
+
+from types import SimpleNamespace
+from collections.abc import Callable
+
+from src.generation.service import OpenAIChatSession
+from src.generation.schemas import AcceptedCodeLanguages, SystemPrompt
+
+
+def completion(content: str, finish_reason: str = 'stop', completion_tokens: int = 10) -> SimpleNamespace:
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)],
+        usage=SimpleNamespace(prompt_tokens=10, completion_tokens=completion_tokens,
+                              total_tokens=10 + completion_tokens))
+
+
+class FakeCompletions:
+    """Stands in for `client.chat.completions`, answering every completion with `answer(messages, parameters)`."""
+
+    def __init__(self, answer: Callable[[list[dict], dict], SimpleNamespace]):
+        self.answer = answer
+        self.calls: list[tuple[list[dict], dict]] = []
+
+    async def create(self, model: str, messages: list[dict], **parameters):
+        self.calls.append((messages, parameters))
+        return self.answer(messages, parameters)
+
+
+# Circuit breakers and latency windows are kept per endpoint, every fake client is an endpoint of its own
+FAKE_ENDPOINTS = itertools.count()
+
+
+def fake_client(answer: Callable[[list[dict], dict], SimpleNamespace]) -> SimpleNamespace:
+    return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(answer)),
+                           base_url=f'http://fake-{next(FAKE_ENDPOINTS)}')
+
+
+def fake_session(command: SystemPrompt, answer: Callable[[list[dict], dict], SimpleNamespace],
+                 language: AcceptedCodeLanguages = AcceptedCodeLanguages.Python) -> OpenAIChatSession:
+    return OpenAIChatSession(command=command, language=language, client=fake_client(answer))
+
+
+def function_explanation(name: str) -> dict:
+    return {"name": name, "description": f"Explains {name}.", "function_descriptor": f"{name}()",
+            "usage_example": f"{name}()"}
+
+
+def pdf_answer(names: list[str], title: str = 'Title') -> str:
+    return json.dumps({"title": title, "description": "Description.", "footnotes": [],
+                       "function_explanations": [function_explanation(name) for name in names]})
+
+
+def hold_write_lock(path: str, seconds: float):
+    """Another process writing to the shared file: holds its write lock for `seconds` in a thread."""
+    connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    connection.execute('BEGIN IMMEDIATE')
+    timer = threading.Timer(seconds, lambda: (connection.execute('COMMIT'), connection.close()))
+    timer.start()
+    return timer
+
+
+async def ticks_while(awaitable) -> int:
+    """Times the event loop got to run something else while `awaitable` was awaited."""
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.ensure_future(tick())
+    try:
+        await awaitable
+    finally:
+        ticker.cancel()
+    return ticks
@@ -0,0 +1,72 @@
+import asyncio
+
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+
+from src.generation import service
+from src.generation.schemas import BatchJobIn
+from src.generation.service import generate_batch
+
+BATCH_JOB = TypeAdapter(BatchJobIn)
+
+
+def explain_job(code_block: str) -> BatchJobIn:
+    return BATCH_JOB.validate_python({"command": "explain", "payload": {
+        "language_model": "openai", "code_extension": "python", "code_block_to_generate_from": code_block}})
+
+
+def run_batch(monkeypatch, generate, code_blocks: list[str]) -> list[dict]:
+    monkeypatch.setitem(service.BATCH_GENERATORS, 'explain',
+                        (service.BATCH_GENERATORS['explain'][0], generate))
+    return asyncio.run(generate_batch([explain_job(code_block) for code_block in code_blocks], chat_sessions=None,
+                                      response_cache=None, max_concurrency=2))
+
+
+def test_failures_are_reported_per_job(monkeypatch):
+    async def generate(payload, chat_sessions, response_cache):
+        if 'reject' in payload.code_block_to_generate_from:
+            raise HTTPException(status_code=413, detail="Too large")
+        if 'fail' in payload.code_block_to_generate_from:
+            raise RuntimeError("Unexpected")
+        return {"explained_output": payload.code_block_to_generate_from}
+
+    results = run_batch(monkeypatch, generate, ['ok()', 'reject()', 'fail()'])
+    assert [(result["index"], result["status"]) for result in results] == [(0, 'ok'), (1, 'error'), (2, 'error')]
+    assert results[0]["result"] == {"explained_output": 'ok()'}
+    assert results[1]["error"] == "Too large"
+    assert results[2]["error"] == "Generation failed for this job"
+
+
+def test_identical_jobs_share_a_generation(monkeypatch):
+    calls = []
+
+    async def generate(payload, chat_sessions, response_cache):
+        calls.append(payload.code_block_to_generate_from)
+        return {"explained_output": 'Explained.'}
+
+    results = run_batch(monkeypatch, generate, ['same()', 'other()', 'same()'])
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert sorted(calls) == ['other()', 'same()']
+
+
+def test_cancelling_the_batch_cancels_its_generations(monkeypatch):
+    cancelled = []
+
+    async def generate(payload, chat_sessions, response_cache):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(payload.code_block_to_generate_from)
+            raise
+
+    monkeypatch.setitem(service.BATCH_GENERATORS, 'explain', (service.BATCH_GENERATORS['explain'][0], generate))
+
+    async def cancel_batch():
+        batch = asyncio.ensure_future(generate_batch([explain_job('first()'), explain_job('second()')],
+                                                     chat_sessions=None, response_cache=None, max_concurrency=2))
+        await asyncio.sleep(0.01)
+        batch.cancel()
+        await asyncio.gather(batch, return_exceptions=True)
+
+    asyncio.run(cancel_batch())
+    assert sorted(cancelled) == ['first()', 'second()']
@@ -0,0 +1,82 @@
+import pytest
+
+from src.generation.budget import PromptBudgetExceeded, approximate_tokens, compact_code, completion_token_limit, \
+    context_tokens, count_message_tokens, plan_prompt_budget
+from src.generation.constants import EXPLANATION_COMPLETION_TOKENS, GENERATE_TOKENS_PER_DECLARATION
+from src.generation.schemas import AcceptedCodeLanguages, AcceptedNaturalLanguages, GenerativeTransformerModel, \
+    SystemPrompt
+
+
+def messages(code_block: str, prefix: str = '/explain') -> list[dict]:
+    return [{"role": "system", "content": "You are a code documentation tool."},
+            {"role": "user", "content": f'{prefix}\n\n{code_block}'}]
+
+
+def test_approximate_tokens_counts_words_punctuation_and_whitespace():
+    assert approximate_tokens('') == 0
+    assert approximate_tokens('return') == 1
+    assert approximate_tokens('x = 1') == 3
+    assert approximate_tokens('a_very_long_identifier_name') > approximate_tokens('name')
+
+
+def test_compact_code_drops_comments_docstrings_and_blank_lines_but_keeps_indentation():
+    code = 'def f(x):\n    """Docstring."""\n\n    # comment\n    return  x   +  1  # trailing\n'
+    assert compact_code(code, AcceptedCodeLanguages.Python) == 'def f(x):\n    return x + 1'
+
+
+def test_compact_code_keeps_strings_that_are_values():
+    code = 'def f():\n    return "  spaced  "\n'
+    assert compact_code(code, AcceptedCodeLanguages.Python) == code.rstrip('\n')
+
+
+def test_compact_code_of_a_brace_language():
+    code = '/** Adds. */\nfunction add(a, b) {\n    // sum\n    return a + b;\n}\n'
+    assert compact_code(code, AcceptedCodeLanguages.Javascript) == 'function add(a, b) {\n    return a + b;\n}'
+
+
+def test_explanations_are_budgeted_by_complexity():
+    assert completion_token_limit(SystemPrompt.Explain, 1000, complexity=1) == EXPLANATION_COMPLETION_TOKENS[1]
+    assert completion_token_limit(SystemPrompt.Explain, 1000, complexity=5) == EXPLANATION_COMPLETION_TOKENS[5]
+
+
+def test_explanations_in_other_languages_get_more_tokens():
+    english = completion_token_limit(SystemPrompt.Explain, 0, complexity=3,
+                                     response_language=AcceptedNaturalLanguages.English)
+    for language in AcceptedNaturalLanguages:
+        if language != AcceptedNaturalLanguages.English:
+            assert completion_token_limit(SystemPrompt.Explain, 0, complexity=3, response_language=language) > english
+
+
+def test_pdf_documentation_is_budgeted_per_declaration():
+    single = completion_token_limit(SystemPrompt.Generate, 100, declarations=1)
+    twenty = completion_token_limit(SystemPrompt.Generate, 100, declarations=20)
+    assert twenty - single == 19 * GENERATE_TOKENS_PER_DECLARATION
+
+
+def test_echoing_commands_get_more_than_their_code_block():
+    assert completion_token_limit(SystemPrompt.Annotate, 1000) > 1000
+    assert completion_token_limit(SystemPrompt.Annotate, 1000, patch=True) < \
+        completion_token_limit(SystemPrompt.Annotate, 1000)
+
+
+def test_plan_prompt_budget_caps_the_completion_at_the_context_window():
+    model = GenerativeTransformerModel.Simple
+    prompt = messages('word ' * 3000, prefix='/generate')
+    budget = plan_prompt_budget(prompt, SystemPrompt.Generate, model)
+    assert budget.model == model
+    assert budget.prompt_tokens == count_message_tokens(prompt)
+    assert budget.completion_tokens == context_tokens(model) - budget.prompt_tokens
+
+
+def test_plan_prompt_budget_rejects_echoing_commands_that_cannot_fit_their_code_block():
+    prompt = messages('word ' * 2500, prefix='/annotate')
+    with pytest.raises(PromptBudgetExceeded):
+        plan_prompt_budget(prompt, SystemPrompt.Annotate, GenerativeTransformerModel.Simple)
+    # The same code block fits when only the comments are asked for
+    plan_prompt_budget(prompt, SystemPrompt.Annotate, GenerativeTransformerModel.Simple, patch=True)
+
+
+def test_plan_prompt_budget_rejects_prompts_larger_than_the_context_window():
+    with pytest.raises(PromptBudgetExceeded):
+        plan_prompt_budget(messages('word ' * 5000), SystemPrompt.Explain, GenerativeTransformerModel.Simple,
+                           complexity=1)
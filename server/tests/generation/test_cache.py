@@ -0,0 +1,149 @@
+import asyncio
+
+import pytest
+
+from src.generation.cache import ResponseCache, SingleFlight, SQLiteResponseStore
+
+from tests.generation.fakes import hold_write_lock, ticks_while
+
+
+def test_responses_are_kept_on_disk_across_caches(tmp_path):
+    path = str(tmp_path / 'responses.sqlite3')
+
+    async def generate():
+        return {"explained_output": "Adds two numbers."}
+
+    first = ResponseCache(disk_store=SQLiteResponseStore(path, max_entries=10))
+    second = ResponseCache(disk_store=SQLiteResponseStore(path, max_entries=10))
+    try:
+        assert asyncio.run(first.fetch('key', generate)) == {"explained_output": "Adds two numbers."}
+        assert asyncio.run(second.get('key')) == {"explained_output": "Adds two numbers."}
+        assert second.disk_hits == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_outputs_that_should_not_be_stored_are_generated_again():
+    cache = ResponseCache()
+    calls = []
+
+    async def generate():
+        calls.append(None)
+        return None
+
+    asyncio.run(cache.fetch('key', generate, should_store=lambda output: output is not None))
+    asyncio.run(cache.fetch('key', generate, should_store=lambda output: output is not None))
+    assert len(calls) == 2
+
+
+def test_the_least_recently_used_responses_are_dropped_from_memory():
+    cache = ResponseCache(max_entries=2)
+
+    async def fill():
+        await cache.set('first', 1)
+        await cache.set('second', 2)
+        await cache.get('first')
+        await cache.set('third', 3)
+
+    asyncio.run(fill())
+    assert list(cache.entries) == ['first', 'third']
+
+
+def test_concurrent_calls_share_one_generation():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def generate():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return 'output'
+
+    async def concurrently():
+        return await asyncio.gather(*[single_flight.run('key', generate) for _ in range(5)])
+
+    assert asyncio.run(concurrently()) == ['output'] * 5
+    assert len(calls) == 1
+    assert single_flight.coalesced == 4
+
+
+def test_a_failed_generation_is_raised_to_every_waiting_caller():
+    single_flight = SingleFlight()
+
+    async def generate():
+        await asyncio.sleep(0.01)
+        raise ValueError("The model did not answer")
+
+    async def concurrently():
+        return await asyncio.gather(*[single_flight.run('key', generate) for _ in range(3)], return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(concurrently()))
+    assert single_flight.in_flight == {}
+
+
+def test_a_waiting_caller_takes_over_when_the_first_one_is_cancelled():
+    single_flight = SingleFlight()
+
+    async def generate():
+        await asyncio.sleep(0.05)
+        return 'output'
+
+    async def cancel_the_first():
+        first = asyncio.ensure_future(single_flight.run('key', generate))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(single_flight.run('key', generate))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(cancel_the_first()) == 'output'
+
+
+def test_only_one_worker_holds_the_lease_of_a_generation(tmp_path):
+    store = SQLiteResponseStore(str(tmp_path / 'responses.sqlite3'), max_entries=10)
+    try:
+        assert store.acquire_lease('key', 'first', lease_seconds=60)
+        assert not store.acquire_lease('key', 'second', lease_seconds=60)
+        store.release_lease('key', 'first')
+        assert store.acquire_lease('key', 'second', lease_seconds=60)
+        # An expired lease is taken over
+        assert store.acquire_lease('other', 'first', lease_seconds=-1)
+        assert store.acquire_lease('other', 'second', lease_seconds=60)
+    finally:
+        store.close()
+
+
+def test_a_worker_waits_for_the_generation_of_another_worker(tmp_path):
+    path = str(tmp_path / 'responses.sqlite3')
+    first = ResponseCache(disk_store=SQLiteResponseStore(path, max_entries=10), lease_seconds=60)
+    second = ResponseCache(disk_store=SQLiteResponseStore(path, max_entries=10), lease_seconds=60)
+    first.LEASE_POLL_SECONDS = second.LEASE_POLL_SECONDS = 0.01
+    calls = []
+
+    async def generate():
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return 'output'
+
+    async def both():
+        return await asyncio.gather(first.fetch('key', generate), second.fetch('key', generate))
+
+    try:
+        assert asyncio.run(both()) == ['output', 'output']
+        assert len(calls) == 1
+        assert first.coalesced_across_workers + second.coalesced_across_workers == 1
+    finally:
+        first.close()
+        second.close()
+
+
+def test_waiting_for_the_disk_tier_does_not_block_the_event_loop(tmp_path):
+    path = str(tmp_path / 'responses.sqlite3')
+    cache = ResponseCache(disk_store=SQLiteResponseStore(path, max_entries=10))
+    try:
+        hold_write_lock(path, 0.3)
+        assert asyncio.run(ticks_while(cache.set('key', 'output'))) >= 10
+    finally:
+        cache.close()
@@ -0,0 +1,41 @@
+import os
+import sys
+import asyncio
+import logging
+import subprocess
+
+from src.core.settings import get_settings
+from src.generation.service import LLMClientRegistry
+
+SERVER_DIRECTORY = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def test_the_server_is_imported_without_the_openai_sdk():
+    completed = subprocess.run(
+        [sys.executable, '-c', 'import sys, src.main; print("openai" in sys.modules)'],
+        cwd=SERVER_DIRECTORY, env=os.environ, capture_output=True, text=True, check=True)
+    assert completed.stdout.strip() == 'False'
+
+
+def test_clients_are_shared_per_endpoint():
+    registry = LLMClientRegistry(get_settings())
+    try:
+        assert registry.get_client() is registry.get_client()
+        assert registry.get_client('http://127.0.0.1:10') is not registry.get_client()
+    finally:
+        asyncio.run(registry.aclose())
+
+
+def test_unreachable_endpoints_are_logged_by_the_warm_up(caplog):
+    # Nothing listens on the discard port
+    registry = LLMClientRegistry(get_settings().model_copy(update={
+        'azure_openai_endpoint': 'http://127.0.0.1:9', 'azure_openai_deployments': '', 'llm_warm_up_timeout': 1}))
+
+    async def warm_up():
+        await registry.warm_up()
+        await registry.aclose()
+
+    with caplog.at_level(logging.WARNING, logger='src.generation.service'):
+        asyncio.run(warm_up())
+    assert any('Could not warm up the connection to http://127.0.0.1:9' in record.getMessage()
+               for record in caplog.records)
@@ -0,0 +1,69 @@
+import asyncio
+
+from src.generation.declarations import split_declarations
+from src.generation.schemas import AcceptedNaturalLanguages, SystemPrompt
+from src.generation.service import TRUNCATED_DOCUMENTATION_FOOTNOTE
+
+from tests.generation.fakes import completion, fake_session, pdf_answer
+
+THREE_FUNCTIONS = 'def first():\n    return 1\n\n\ndef second():\n    return 2\n\n\ndef third():\n    return 3\n'
+
+
+def user_message(messages: list[dict]) -> str:
+    return messages[-1]["content"]
+
+
+def test_the_completion_budget_grows_with_the_declarations_of_the_file():
+    session = fake_session(SystemPrompt.Generate, lambda messages, parameters: completion(
+        pdf_answer(['first', 'second', 'third'])))
+    asyncio.run(session.generate_pdf_metadata(THREE_FUNCTIONS))
+    single = fake_session(SystemPrompt.Generate, lambda messages, parameters: completion(pdf_answer(['first'])))
+    asyncio.run(single.generate_pdf_metadata('def first():\n    return 1\n'))
+
+    (_, parameters), = session.session.chat.completions.calls
+    (_, single_parameters), = single.session.chat.completions.calls
+    assert parameters["max_tokens"] > single_parameters["max_tokens"]
+
+
+def test_a_truncated_file_is_documented_declaration_by_declaration():
+    def answer(messages, parameters):
+        if 'first' in user_message(messages) and 'third' in user_message(messages) \
+                and 'return 3' in user_message(messages):
+            # The whole file, cut off after its first function
+            return completion(pdf_answer(['first', 'second', 'third'])[:230], finish_reason='length')
+        name = next(name for name in ('first', 'second', 'third') if name in user_message(messages))
+        return completion(pdf_answer([name]))
+
+    session = fake_session(SystemPrompt.Generate, answer)
+    documentation = asyncio.run(session.generate_pdf_metadata(THREE_FUNCTIONS))
+    assert [explanation.name for explanation in documentation.function_explanations] == ['first', 'second', 'third']
+    assert documentation.footnotes == []
+
+
+def test_a_truncated_file_without_declarations_says_so_in_a_footnote():
+    session = fake_session(SystemPrompt.Generate, lambda messages, parameters: completion(
+        pdf_answer(['main', 'other'])[:230], finish_reason='length'))
+    documentation = asyncio.run(session.generate_pdf_metadata('print("hello")\n'))
+    assert TRUNCATED_DOCUMENTATION_FOOTNOTE in documentation.footnotes
+
+
+def test_a_truncated_declaration_is_asked_again_with_more_tokens():
+    answers = iter([completion(pdf_answer(['first', 'helper'])[:230], finish_reason='length', completion_tokens=300),
+                    completion(pdf_answer(['first', 'helper']))])
+    session = fake_session(SystemPrompt.Generate, lambda messages, parameters: next(answers))
+    declaration = split_declarations(THREE_FUNCTIONS, session.language)[0]
+    explanations = asyncio.run(session.explain_declaration(declaration))
+
+    assert [explanation["name"] for explanation in explanations] == ['first', 'helper']
+    first_call, second_call = session.session.chat.completions.calls
+    assert second_call[1]["max_tokens"] == 600
+
+
+def test_explanations_in_other_languages_are_given_more_tokens():
+    def max_tokens(language: AcceptedNaturalLanguages) -> int:
+        session = fake_session(SystemPrompt.Explain, lambda messages, parameters: completion('Explained.'))
+        asyncio.run(session.explain_code_block(THREE_FUNCTIONS, complexity=3, response_language=language))
+        (_, parameters), = session.session.chat.completions.calls
+        return parameters["max_tokens"]
+
+    assert max_tokens(AcceptedNaturalLanguages.Hindi) > max_tokens(AcceptedNaturalLanguages.English)
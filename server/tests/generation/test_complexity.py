@@ -0,0 +1,107 @@
+import pytest
+
+from src.generation.complexity import estimate_complexities
+from src.generation.schemas import AcceptedCodeLanguages
+
+
+def estimate(code_block: str, language: AcceptedCodeLanguages = AcceptedCodeLanguages.Python,
+             name: str = None) -> tuple[str, str, bool]:
+    estimates = estimate_complexities(code_block, language)
+    found = next(estimate for estimate in estimates if name is None or estimate.name == name)
+    return found.runtime.notation, found.space.notation, found.confident
+
+
+@pytest.mark.parametrize('code_block, expected', [
+    ('def first(xs):\n    return xs[0]\n', ('O(1)', 'O(1)')),
+    ('def total(xs):\n    result = 0\n    for x in xs:\n        result += x\n    return result\n', ('O(n)', 'O(1)')),
+    ('def pairs(xs):\n    for a in xs:\n        for b in xs:\n            print(a, b)\n', ('O(n^2)', 'O(1)')),
+    ('def squares(xs):\n    return [x * x for x in xs]\n', ('O(n)', 'O(n)')),
+    ('def ordered(xs):\n    return sorted(xs)\n', ('O(n log n)', 'O(n)')),
+    ('def search(xs, target):\n    low, high = 0, len(xs) - 1\n    while low <= high:\n'
+     '        middle = (low + high) // 2\n        if xs[middle] < target:\n            low = middle + 1\n'
+     '        else:\n            high = middle - 1\n    return low\n', ('O(log n)', 'O(1)')),
+    ('def factorial(n):\n    if n < 2:\n        return 1\n    return n * factorial(n - 1)\n', ('O(n)', 'O(n)')),
+    ('def fibonacci(n):\n    if n < 2:\n        return n\n    return fibonacci(n - 1) + fibonacci(n - 2)\n',
+     ('O(2^n)', 'O(n)')),
+    ('def digits(n):\n    count = 0\n    while n:\n        n //= 10\n        count += 1\n    return count\n',
+     ('O(log n)', 'O(1)')),
+])
+def test_python_functions(code_block, expected):
+    assert estimate(code_block) == (*expected, True)
+
+
+@pytest.mark.parametrize('code_block', [
+    'def drain(xs):\n    for x in xs:\n        xs.pop(0)\n',
+    'def drain(xs):\n    for x in list(xs):\n        del xs[0]\n',
+    'def drain(xs):\n    while xs:\n        xs.pop(0)\n',
+    'def drain(xs: list):\n    while xs:\n        xs.pop(0)\n',
+    'def shift(xs):\n    for x in xs:\n        xs.insert(0, x)\n',
+])
+def test_removing_from_the_front_of_a_list_in_a_loop_is_quadratic(code_block):
+    runtime, _, confident = estimate(code_block)
+    assert (runtime, confident) == ('O(n^2)', True)
+
+
+def test_concatenating_lists_in_a_loop_is_quadratic():
+    code_block = 'def copy(xs):\n    out = []\n    for x in xs:\n        out = out + [x]\n    return out\n'
+    assert estimate(code_block) == ('O(n^2)', 'O(n)', True)
+
+
+def test_appending_and_removing_from_the_end_stay_linear():
+    assert estimate('def copy(xs):\n    out = []\n    for x in xs:\n        out.append(x)\n    return out\n') \
+        == ('O(n)', 'O(n)', True)
+    assert estimate('def drain(xs):\n    while xs:\n        xs.pop()\n')[:1] == ('O(n)',)
+    assert estimate('def drain(xs):\n    while xs:\n        xs.pop(-1)\n')[:1] == ('O(n)',)
+
+
+def test_removing_from_dicts_is_constant():
+    code_block = 'def forget(counts: dict, keys):\n    for key in keys:\n        counts.pop(key)\n' \
+                 '        del counts[key]\n'
+    assert estimate(code_block) == ('O(n)', 'O(1)', True)
+
+
+@pytest.mark.parametrize('code_block', [
+    # pop and del by a variable on something that may be a list or a dict
+    'def forget(items, keys):\n    for key in keys:\n        items.pop(key)\n',
+    'def forget(items, keys):\n    for key in keys:\n        del items[key]\n',
+    # Membership in a container of unknown kind
+    'def common(xs, ys):\n    return [x for x in xs if x in ys]\n',
+    # Loops that end somewhere in their body
+    'def wait(queue):\n    while True:\n        if queue.ready():\n            return\n',
+    # Memoized recursion
+    'from functools import cache\n\n\n@cache\ndef ways(n):\n    if n < 2:\n        return 1\n'
+    '    return ways(n - 1) + ways(n - 2)\n',
+])
+def test_what_cannot_be_priced_is_left_to_the_model(code_block):
+    assert estimate(code_block)[2] is False
+
+
+def test_calls_to_other_functions_of_the_block_add_their_cost():
+    code_block = 'def inner(xs):\n    for x in xs:\n        print(x)\n\n\n' \
+                 'def outer(xs):\n    for x in xs:\n        inner(xs)\n'
+    assert estimate(code_block, name='outer')[:1] == ('O(n^2)',)
+
+
+def test_code_that_does_not_parse_has_no_estimates():
+    assert estimate_complexities('def broken(:\n', AcceptedCodeLanguages.Python) == []
+
+
+@pytest.mark.parametrize('code_block, language, expected', [
+    ('function total(xs) {\n  let sum = 0;\n  for (let i = 0; i < xs.length; i++) {\n    sum += xs[i];\n  }\n'
+     '  return sum;\n}\n', AcceptedCodeLanguages.Javascript, ('O(n)', 'O(1)')),
+    ('function pairs(xs) {\n  for (const a of xs) {\n    for (const b of xs) {\n      console.log(a, b);\n    }\n'
+     '  }\n}\n', AcceptedCodeLanguages.Javascript, ('O(n^2)', 'O(1)')),
+    ('function drain(xs) {\n  while (xs.length) {\n    xs.shift();\n  }\n}\n', AcceptedCodeLanguages.Javascript,
+     ('O(n^2)', 'O(1)')),
+    ('public class Search {\n    static int search(int[] xs, int target) {\n        int low = 0, high = xs.length - 1;\n'
+     '        while (low <= high) {\n            int middle = (low + high) / 2;\n'
+     '            if (xs[middle] < target) { low = middle + 1; } else { high = middle - 1; }\n        }\n'
+     '        return low;\n    }\n}\n', AcceptedCodeLanguages.Java, ('O(log n)', 'O(1)')),
+])
+def test_brace_language_functions(code_block, language, expected):
+    assert estimate(code_block, language) == (*expected, True)
+
+
+def test_ambiguous_brace_lookups_are_left_to_the_model():
+    code_block = 'boolean has(Collection<Integer> xs, int x) {\n    return xs.contains(x);\n}\n'
+    assert estimate(code_block, AcceptedCodeLanguages.Java)[2] is False
@@ -0,0 +1,86 @@
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.declarations import documented_span, normalize_declaration_source, outline_declarations, \
+    split_declarations
+
+PYTHON_CODE = '''import os
+
+
+@cached
+def load(path):
+    return open(path).read()
+
+
+class Store:
+    def get(self, key):
+        return key
+
+    async def put(self, key):
+        pass
+'''
+
+TYPESCRIPT_CODE = '''import { a } from 'a';
+
+// Adds two numbers
+export function add(x: number, y: number): number {
+    if (x) { return x + y; }
+    return y;
+}
+
+const double = (x: number) => x * 2;
+
+const square = (x: number) => {
+    return x * x;
+};
+
+items.forEach((item) => { console.log(item); });
+
+class Shape {
+    area(): number {
+        return 0;
+    }
+}
+'''
+
+
+def test_python_files_are_split_into_functions_and_methods():
+    declarations = split_declarations(PYTHON_CODE, AcceptedCodeLanguages.Python)
+    assert [declaration.name for declaration in declarations] == ['load', 'Store.get', 'Store.put']
+    assert declarations[0].source.startswith('@cached\ndef load(path):')
+    assert all(PYTHON_CODE[declaration.start:declaration.end] == declaration.source for declaration in declarations)
+
+
+def test_containers_come_ahead_of_their_methods_when_requested():
+    declarations = split_declarations(PYTHON_CODE, AcceptedCodeLanguages.Python, include_containers=True)
+    assert [declaration.name for declaration in declarations] == ['load', 'Store', 'Store.get', 'Store.put']
+
+
+def test_python_that_does_not_parse_has_no_declarations():
+    assert split_declarations('def broken(:\n', AcceptedCodeLanguages.Python) == []
+
+
+def test_brace_files_are_split_into_named_declarations_skipping_callbacks_and_control_flow():
+    declarations = split_declarations(TYPESCRIPT_CODE, AcceptedCodeLanguages.Typescript)
+    assert [declaration.name for declaration in declarations] == ['add', 'square', 'Shape.area']
+    assert all(TYPESCRIPT_CODE[declaration.start:declaration.end] == declaration.source
+               for declaration in declarations)
+
+
+def test_outlines_collapse_every_declaration_to_its_signature():
+    declarations = split_declarations(PYTHON_CODE, AcceptedCodeLanguages.Python)
+    outline = outline_declarations(PYTHON_CODE, declarations)
+    assert 'def load(path): ...' in outline and 'return open(path)' not in outline
+    assert outline.startswith('import os\n')
+
+
+def test_declarations_that_only_differ_in_documentation_normalize_the_same():
+    documented = '    def get(self, key):\n        """Gets a key."""\n        # Plain lookup\n\n        return key\n'
+    plain = 'def get(self, key):\n    return key  \n'
+    assert normalize_declaration_source(documented, AcceptedCodeLanguages.Python) \
+        == normalize_declaration_source(plain, AcceptedCodeLanguages.Python)
+
+
+def test_documented_spans_include_the_comments_above_a_declaration():
+    add = split_declarations(TYPESCRIPT_CODE, AcceptedCodeLanguages.Typescript)[0]
+    start, end = documented_span(TYPESCRIPT_CODE, add, AcceptedCodeLanguages.Typescript)
+    assert TYPESCRIPT_CODE[start:end].startswith('// Adds two numbers\nexport function add(')
+    assert end == add.end
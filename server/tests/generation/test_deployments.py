@@ -0,0 +1,105 @@
+import json
+import itertools
+
+import pytest
+
+from src.core.settings import get_settings
+from src.generation.resilience import upstream_calls
+from src.generation.schemas import GenerativeTransformerModel
+from src.generation.deployments import DEFAULT_DEPLOYMENT, Deployment, DeploymentPool, parse_deployments
+
+# Circuit breakers are kept per deployment name, every test deployment gets a name of its own
+DEPLOYMENT_NAMES = itertools.count()
+
+
+def deployment(weight: float = 1.0, models=None) -> Deployment:
+    return Deployment(f'deployment-{next(DEPLOYMENT_NAMES)}', 'http://fake', 'key', 'version', weight=weight,
+                      models=models)
+
+
+class FakeRateLimiter:
+    def __init__(self, delays: dict[str, float]):
+        self.delays = delays
+
+    def expected_delay(self, model, estimated_tokens, deployment):
+        return self.delays.get(deployment, 0.0)
+
+
+def test_the_endpoint_in_the_settings_is_the_only_deployment_when_none_are_listed():
+    deployments = parse_deployments(get_settings().model_copy(update={"azure_openai_deployments": ""}))
+    assert [deployment.name for deployment in deployments] == [DEFAULT_DEPLOYMENT]
+    assert all(deployments[0].serves(model) for model in GenerativeTransformerModel)
+
+
+def test_listed_deployments_are_parsed_with_their_models():
+    listed = [{"name": "east", "endpoint": "http://east", "api_key": "key", "weight": 2,
+               "models": {"gpt-4": {"deployment": "gpt-4-east", "token_rate_limit": 1000}}},
+              {"name": "west", "endpoint": "http://west", "api_key": "key"}]
+    east, west = parse_deployments(get_settings().model_copy(update={"azure_openai_deployments": json.dumps(listed)}))
+
+    model = GenerativeTransformerModel.Complex
+    assert east.weight == 2.0 and east.deployment_name(model) == 'gpt-4-east'
+    assert east.rate_limits({model: (10, 20)}) == {model: (1000, 20)}
+    assert not east.serves(GenerativeTransformerModel.Simple)
+    assert west.deployment_name(model) == model.value
+
+
+def test_deployments_need_distinct_names():
+    listed = [{"name": "east", "endpoint": "http://east", "api_key": "key"}] * 2
+    with pytest.raises(ValueError):
+        parse_deployments(get_settings().model_copy(update={"azure_openai_deployments": json.dumps(listed)}))
+
+
+def test_the_least_loaded_deployment_is_selected_for_its_weight():
+    light, heavy = deployment(), deployment(weight=4)
+    light.in_flight = heavy.in_flight = 2
+    pool = DeploymentPool([light, heavy])
+    assert pool.select(GenerativeTransformerModel.Azure, 100) is heavy
+
+
+def test_deployments_that_score_the_same_take_turns():
+    first, second = deployment(), deployment()
+    pool = DeploymentPool([first, second])
+    selected = [pool.select(GenerativeTransformerModel.Azure, 100).name for _ in range(4)]
+    assert selected == [first.name, second.name] * 2
+
+
+def test_the_deployment_with_quota_left_is_preferred():
+    throttled, free = deployment(), deployment()
+    pool = DeploymentPool([throttled, free])
+    rate_limiter = FakeRateLimiter({throttled.name: 5.0})
+    assert pool.select(GenerativeTransformerModel.Azure, 100, rate_limiter) is free
+
+
+def test_latency_selection_prefers_the_deployment_expected_to_answer_first():
+    slow, fast = deployment(), deployment()
+    slow.observe_latency(2.0)
+    fast.observe_latency(0.5)
+    fast.in_flight = 1
+    pool = DeploymentPool([slow, fast], selection='latency')
+    assert pool.select(GenerativeTransformerModel.Azure, 100) is fast
+
+
+def test_deployments_with_an_open_circuit_are_skipped_while_another_one_is_healthy():
+    broken, healthy = deployment(), deployment()
+    breaker = upstream_calls.breaker(broken.name)
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+    pool = DeploymentPool([broken, healthy])
+    assert pool.candidates(GenerativeTransformerModel.Azure) == [healthy]
+    assert pool.candidates(GenerativeTransformerModel.Azure, excluded=[healthy.name]) == [broken]
+
+
+def test_selecting_a_model_no_deployment_serves_fails():
+    pool = DeploymentPool([deployment(models={GenerativeTransformerModel.Azure: dict()})])
+    with pytest.raises(ValueError):
+        pool.select(GenerativeTransformerModel.Complex, 100)
+
+
+def test_requests_are_tracked_while_in_flight():
+    tracked = deployment()
+    pool = DeploymentPool([tracked])
+    with pool.track(tracked):
+        assert tracked.in_flight == 1
+    assert tracked.in_flight == 0 and tracked.latency_seconds is not None
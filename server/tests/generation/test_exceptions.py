@@ -0,0 +1,27 @@
+import logging
+
+import httpx
+import openai
+import pytest
+
+from fastapi import HTTPException
+
+from src.core.metrics import upstream_errors
+from src.generation.exceptions import raise_service_unavailable
+
+
+def rate_limit_error() -> openai.RateLimitError:
+    request = httpx.Request('POST', 'http://fake/chat/completions')
+    return openai.RateLimitError('Too many requests', response=httpx.Response(429, request=request), body=None)
+
+
+def test_upstream_errors_are_counted_logged_and_answered_as_unavailable(caplog):
+    errors_before = upstream_errors.values.get(('RateLimitError',), 0)
+    with caplog.at_level(logging.WARNING, logger='src.generation.exceptions'):
+        with pytest.raises(HTTPException) as raised:
+            raise_service_unavailable(rate_limit_error())
+
+    assert raised.value.status_code == 503
+    assert upstream_errors.values[('RateLimitError',)] == errors_before + 1
+    assert [record.getMessage() for record in caplog.records] == [
+        "OpenAI API request exceeded rate limit: Too many requests"]
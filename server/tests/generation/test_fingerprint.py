@@ -0,0 +1,37 @@
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.fingerprint import fingerprint_code_block
+
+
+def fingerprints(*code_blocks: str, language: AcceptedCodeLanguages = AcceptedCodeLanguages.Python) -> set[str]:
+    return {fingerprint_code_block(code_block, language) for code_block in code_blocks}
+
+
+def test_python_code_differing_in_layout_comments_and_docstrings_shares_a_fingerprint():
+    assert len(fingerprints(
+        'def add(a, b):\n    """Adds."""\n    return a + b\n',
+        '    def add(a, b):  # sum\n        return (a +\n                b)\n',
+        "def add(a,b):\n    '''Other docstring.'''\n    return a+b",
+    )) == 1
+
+
+def test_python_code_differing_in_behaviour_has_another_fingerprint():
+    assert len(fingerprints('def add(a, b):\n    return a + b\n', 'def add(a, b):\n    return a - b\n')) == 2
+    assert len(fingerprints("print('a')", "print('b')")) == 2
+
+
+def test_a_function_made_of_a_docstring_is_not_empty():
+    fingerprint = fingerprint_code_block('def f():\n    """Only a docstring."""\n', AcceptedCodeLanguages.Python)
+    assert fingerprint == fingerprint_code_block('def f():\n    pass\n', AcceptedCodeLanguages.Python)
+
+
+def test_python_that_does_not_parse_falls_back_to_its_tokens():
+    fingerprint = fingerprint_code_block('if ready:\n    start(  # go\n', AcceptedCodeLanguages.Python)
+    assert fingerprint.startswith('tokens\n')
+    assert fingerprint == fingerprint_code_block('if  ready :\n    start (\n', AcceptedCodeLanguages.Python)
+
+
+def test_other_languages_ignore_whitespace_and_comments_but_keep_meaningful_spaces():
+    java = AcceptedCodeLanguages.Java
+    assert len(fingerprints('int x = a - -b; // negate', 'int x=a - -b;', language=java)) == 1
+    assert len(fingerprints('int x = a - -b;', 'int x = a--b;', language=java)) == 2
+    assert len(fingerprints('String s = "a  b";', 'String s = "a b";', language=java)) == 2
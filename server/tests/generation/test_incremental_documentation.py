@@ -0,0 +1,122 @@
+import re
+import json
+import asyncio
+
+from types import SimpleNamespace
+
+from src.generation.cache import ResponseCache
+from src.generation.schemas import AcceptedCodeLanguages, GeneratePDFSchemaIn, SystemPrompt
+from src.generation.service import generate_pdf_documentation
+
+from tests.generation.fakes import completion, fake_session, pdf_answer
+
+THREE_FUNCTIONS = 'def first():\n    return 1\n\n\ndef second():\n    return 2\n\n\ndef third():\n    return 3\n'
+
+SHAPES = '''class Shapes:
+    def area(self, width):
+        return width * width
+
+    def perimeter(self, width):
+        return 4 * width
+
+
+def unit():
+    return 1
+'''
+
+
+def sent_code(messages: list[dict]) -> str:
+    return messages[-1]["content"]
+
+
+def define_answer(messages: list[dict], parameters: dict) -> SimpleNamespace:
+    """Documents every function of the numbered code block it is sent, classes are left as they are."""
+    insertions = [{"line": int(number), "comment": f"Documents {name}."}
+                  for number, name in re.findall(r'^(\d+)\| *def (\w+)', sent_code(messages), re.MULTILINE)]
+    return completion(json.dumps({"insertions": insertions}))
+
+
+def define_incrementally(session, code_block: str, response_cache: ResponseCache) -> tuple[bool, str]:
+    return asyncio.run(session.define_code_block_incrementally(code_block, response_cache=response_cache))
+
+
+def test_only_changed_declarations_are_sent_once_a_block_was_defined():
+    response_cache = ResponseCache()
+    session = fake_session(SystemPrompt.Define, define_answer)
+    calls = session.session.chat.completions.calls
+    assert define_incrementally(session, THREE_FUNCTIONS, response_cache)[0]
+    assert len(calls) == 1
+
+    changed = THREE_FUNCTIONS.replace('return 3', 'return 4')
+    successful_definition, defined_output = define_incrementally(session, changed, response_cache)
+    assert successful_definition
+    assert len(calls) == 2
+    assert 'def third' in sent_code(calls[-1][0]) and 'def first' not in sent_code(calls[-1][0])
+    assert defined_output.count('Documents') == 3
+    assert 'def third():\n    """\n    Documents third.\n    """\n    return 4\n' in defined_output
+
+
+def test_stored_definitions_are_indented_back_into_their_declaration():
+    response_cache = ResponseCache()
+    session = fake_session(SystemPrompt.Define, define_answer)
+    define_incrementally(session, SHAPES, response_cache)
+
+    changed = SHAPES.replace('4 * width', '2 * width + 2 * width')
+    successful_definition, defined_output = define_incrementally(session, changed, response_cache)
+    calls = session.session.chat.completions.calls
+    # The changed method is sent without its class, its definition is indented back into it
+    assert sent_code(calls[-1][0]).endswith('1| def perimeter(self, width):\n2|     return 2 * width + 2 * width\n3| ')
+    assert successful_definition
+    whole_session = fake_session(SystemPrompt.Define, define_answer)
+    assert defined_output == asyncio.run(whole_session.define_code_block(changed))[1]
+    compile(defined_output, '<defined>', 'exec')
+
+
+def test_definitions_that_failed_verification_are_not_stored():
+    response_cache = ResponseCache()
+    session = fake_session(SystemPrompt.Define, define_answer)
+    define_incrementally(session, THREE_FUNCTIONS, response_cache)
+
+    def answer(messages, parameters):
+        # The second function comes back neither as insertions nor as the same code
+        if 'def second' in sent_code(messages):
+            return completion('not json')
+        return define_answer(messages, parameters)
+
+    session.session.chat.completions.answer = answer
+    changed = THREE_FUNCTIONS.replace('return 2', 'return 5').replace('return 3', 'return 6')
+    successful_definition, _ = define_incrementally(session, changed, response_cache)
+    assert not successful_definition
+
+    declarations = {'second': 'def second():\n    return 5\n', 'third': 'def third():\n    return 6\n'}
+    stored = {name: asyncio.run(response_cache.get(session.declaration_cache_key(source, alternative_framework=None)))
+              for name, source in declarations.items()}
+    assert stored['second'] is None
+    assert stored['third'] == 'def third():\n    """\n    Documents third.\n    """\n    return 6'
+
+
+def explain_answer(messages: list[dict], parameters: dict) -> SimpleNamespace:
+    names = re.findall(r'def (\w+)\(\):\n +return', sent_code(messages))
+    return completion(pdf_answer(names, title='Numbers'))
+
+
+def test_create_pdf_only_explains_the_declarations_that_changed_since_the_file_was_documented():
+    response_cache = ResponseCache()
+    session = fake_session(SystemPrompt.Generate, explain_answer)
+    chat_sessions = SimpleNamespace(create=lambda **parameters: session)
+    calls = session.session.chat.completions.calls
+
+    def create_pdf(code_file: str):
+        metadata = GeneratePDFSchemaIn(language_model='openai', code_extension=AcceptedCodeLanguages.Python,
+                                       code_file_to_generate_from=code_file)
+        return asyncio.run(generate_pdf_documentation(metadata, chat_sessions, response_cache=response_cache))
+
+    create_pdf(THREE_FUNCTIONS)
+    assert len(calls) == 1
+
+    documentation = create_pdf(THREE_FUNCTIONS.replace('return 3', 'return 4'))
+    # The summary of the unchanged outline and the first two explanations come from the cache
+    assert len(calls) == 2
+    assert 'return 4' in sent_code(calls[-1][0]) and 'return 1' not in sent_code(calls[-1][0])
+    assert documentation.title == 'Numbers'
+    assert [explanation.name for explanation in documentation.function_explanations] == ['first', 'second', 'third']
@@ -0,0 +1,90 @@
+import pytest
+
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.structured import StructuredOutputError
+from src.generation.patches import insert_annotations, insert_definitions, number_lines, supports_patches
+
+PYTHON_CODE = '''import os
+
+
+def read(path):
+    text = """first
+second"""
+    return open(path).read() + text
+
+
+class Reader:
+    """Old docstring."""
+
+    def close(self):
+        pass
+'''
+
+JAVA_CODE = '''public class Shapes {
+    /** Old documentation. */
+    public int area(int width, int height) {
+        return width * height;
+    }
+}
+'''
+
+
+def test_lines_are_numbered_from_one():
+    assert number_lines('a\nb') == '1| a\n2| b'
+
+
+def test_annotations_are_written_above_their_line_with_its_indentation():
+    annotated = insert_annotations(PYTHON_CODE, AcceptedCodeLanguages.Python,
+                                   [(7, '# Appends the text to the file contents')])
+    assert '    # Appends the text to the file contents\n    return open(path)' in annotated
+    assert annotated.replace('    # Appends the text to the file contents\n', '') == PYTHON_CODE
+
+
+def test_annotations_anchored_to_a_blank_line_describe_the_code_after_it():
+    annotated = insert_annotations(PYTHON_CODE, AcceptedCodeLanguages.Python, [(2, 'Reads a file')])
+    assert '# Reads a file\ndef read(path):' in annotated
+
+
+def test_annotations_inside_multi_line_strings_are_dropped():
+    annotated = insert_annotations(PYTHON_CODE, AcceptedCodeLanguages.Python,
+                                   [(6, 'Inside the string'), (1, 'Imports os')])
+    assert 'Inside the string' not in annotated
+    assert annotated.startswith('# Imports os\nimport os')
+    with pytest.raises(StructuredOutputError):
+        insert_annotations(PYTHON_CODE, AcceptedCodeLanguages.Python, [(6, 'Inside the string')])
+
+
+def test_long_annotations_are_wrapped():
+    annotated = insert_annotations('x = 1\n', AcceptedCodeLanguages.Javascript, [(1, 'word ' * 40)])
+    comment_lines = [line for line in annotated.split('\n') if line.startswith('//')]
+    assert len(comment_lines) > 1 and all(len(line) <= 100 for line in comment_lines)
+
+
+def test_python_definitions_become_docstrings_replacing_the_existing_one():
+    documented = insert_definitions(PYTHON_CODE, AcceptedCodeLanguages.Python,
+                                    [(4, 'Reads the file at path.'), (10, 'Reads files.')])
+    assert 'def read(path):\n    """\n    Reads the file at path.\n    """\n    text' in documented
+    assert 'Old docstring' not in documented
+    assert 'class Reader:\n    """\n    Reads files.\n    """\n' in documented
+
+
+def test_definitions_away_from_any_declaration_are_rejected():
+    with pytest.raises(StructuredOutputError):
+        insert_definitions(PYTHON_CODE, AcceptedCodeLanguages.Python, [(1, 'Imports os.')])
+
+
+def test_docstrings_cannot_be_ended_by_the_definition():
+    documented = insert_definitions('def f():\n    pass\n', AcceptedCodeLanguages.Python,
+                                    [(1, 'Returns """nothing""".')])
+    compile(documented, '<documented>', 'exec')
+
+
+def test_brace_definitions_become_documentation_blocks():
+    documented = insert_definitions(JAVA_CODE, AcceptedCodeLanguages.Java, [(3, 'Area of a rectangle.')])
+    assert '    /**\n     * Area of a rectangle.\n     */\n    public int area' in documented
+    assert 'Old documentation' not in documented
+
+
+def test_jsx_code_is_left_to_the_model():
+    assert supports_patches('const a = 1;', AcceptedCodeLanguages.JavascriptReact)
+    assert not supports_patches('const a = <div>{b}</div>;', AcceptedCodeLanguages.JavascriptReact)
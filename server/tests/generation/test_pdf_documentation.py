@@ -0,0 +1,73 @@
+import asyncio
+
+import openai
+import pytest
+
+from fastapi import HTTPException
+
+from src.generation.schemas import SystemPrompt
+from src.generation.service import DEFAULT_FILE_SUMMARY, MISSING_SUMMARY_FOOTNOTE
+
+from tests.generation.fakes import completion, fake_session, pdf_answer
+
+THREE_FUNCTIONS = 'def first():\n    return 1\n\n\ndef second():\n    return 2\n\n\ndef third():\n    return 3\n'
+
+
+def declaration_name(messages: list[dict]) -> str:
+    names = {'return 1': 'first', 'return 2': 'second', 'return 3': 'third'}
+    return next(name for body, name in names.items() if body in messages[-1]["content"])
+
+
+def is_summary(messages: list[dict]) -> bool:
+    return 'return' not in messages[-1]["content"]
+
+
+def test_a_malformed_summary_is_asked_again():
+    summaries = iter(['not json', pdf_answer([], title='Numbers')])
+
+    def answer(messages, parameters):
+        if is_summary(messages):
+            return completion(next(summaries))
+        return completion(pdf_answer([declaration_name(messages)]))
+
+    session = fake_session(SystemPrompt.Generate, answer)
+    documentation = asyncio.run(session.generate_pdf_metadata_by_declaration(THREE_FUNCTIONS))
+    assert documentation.title == 'Numbers'
+    assert documentation.footnotes == []
+
+
+def test_a_file_without_a_summary_gets_a_default_title_and_a_footnote():
+    def answer(messages, parameters):
+        if is_summary(messages):
+            return completion('not json')
+        return completion(pdf_answer([declaration_name(messages)]))
+
+    session = fake_session(SystemPrompt.Generate, answer)
+    documentation = asyncio.run(session.generate_pdf_metadata_by_declaration(THREE_FUNCTIONS))
+    assert documentation.title == DEFAULT_FILE_SUMMARY["title"]
+    assert documentation.footnotes == [MISSING_SUMMARY_FOOTNOTE]
+    assert [explanation.name for explanation in documentation.function_explanations] == ['first', 'second', 'third']
+
+
+def test_a_failing_declaration_becomes_a_footnote():
+    def answer(messages, parameters):
+        if is_summary(messages):
+            return completion(pdf_answer([], title='Numbers'))
+        if declaration_name(messages) == 'second':
+            raise RuntimeError("The connection was reset")
+        return completion(pdf_answer([declaration_name(messages)]))
+
+    session = fake_session(SystemPrompt.Generate, answer)
+    documentation = asyncio.run(session.generate_pdf_metadata_by_declaration(THREE_FUNCTIONS))
+    assert [explanation.name for explanation in documentation.function_explanations] == ['first', 'third']
+    assert documentation.footnotes == ['Documentation could not be generated for second.']
+
+
+def test_an_unavailable_upstream_is_reported_when_nothing_was_documented():
+    def answer(messages, parameters):
+        raise openai.APITimeoutError(request=None)
+
+    session = fake_session(SystemPrompt.Generate, answer)
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(session.generate_pdf_metadata_by_declaration(THREE_FUNCTIONS))
+    assert raised.value.status_code == 503
@@ -0,0 +1,42 @@
+from src.generation.schemas import SystemPrompt
+from src.generation.prompts import PromptRegistry, compile_prompt, estimate_prose_tokens
+
+
+def test_every_request_with_the_same_command_and_parameter_gets_the_same_prompt_text():
+    registry = PromptRegistry()
+    first = registry.get(SystemPrompt.Explain, 'german')
+    second = registry.get(SystemPrompt.Explain, 'german')
+    assert first is second
+    assert compile_prompt(SystemPrompt.Explain, 'german').content is first.content
+    assert registry.get(SystemPrompt.Explain, 'latin').content != first.content
+
+
+def test_patch_prompts_are_compiled_apart_from_the_full_ones():
+    registry = PromptRegistry()
+    full = registry.get(SystemPrompt.Annotate)
+    patch = registry.get(SystemPrompt.Annotate, patch=True)
+    assert patch.patch and not full.patch
+    assert patch.content != full.content
+
+
+def test_token_estimates_are_found_by_prompt_text():
+    registry = PromptRegistry()
+    registry.precompile()
+    variant = registry.get(SystemPrompt.Define)
+    assert registry.find(variant.content) is variant
+    assert registry.estimated_tokens(variant.content) == estimate_prose_tokens(variant.content) > 0
+    assert registry.estimated_tokens('Some other system prompt') is None
+
+
+def test_variants_beyond_the_limit_are_compiled_without_being_kept():
+    registry = PromptRegistry()
+    registry.MAX_VARIANTS = 1
+    registry.get(SystemPrompt.Revise, 'lower')
+    variant = registry.get(SystemPrompt.Revise, 'upper')
+    assert variant.parameter == 'upper'
+    assert list(registry.variants) == [(SystemPrompt.Revise, 'lower', False)]
+    assert registry.find(variant.content) is None
+
+
+def test_prose_tokens_count_short_words_numbers_and_punctuation():
+    assert estimate_prose_tokens('Explain this code, 12345 times!') == 8
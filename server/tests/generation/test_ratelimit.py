@@ -0,0 +1,147 @@
+import time
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+from starlette.requests import Request
+
+from src.core.settings import get_settings
+from src.generation.dependencies import get_requesting_user
+from src.generation.ratelimit import ModelRateLimiter, RateLimitScheduler, SQLiteBucketStore, TokenBucket, \
+    token_bucket
+
+from tests.generation.fakes import hold_write_lock, ticks_while
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def clocked_bucket(capacity: float, refill_per_second: float, clock: Clock) -> TokenBucket:
+    class ClockedBucket(TokenBucket):
+        pass
+
+    ClockedBucket.clock = staticmethod(clock)
+    return ClockedBucket(capacity, refill_per_second)
+
+
+def test_a_bucket_refills_at_its_rate_up_to_its_capacity():
+    clock = Clock()
+    bucket = clocked_bucket(10, 2, clock)
+    bucket.consume(10)
+    assert bucket.time_until_available(4) == 2
+    clock.now += 1
+    assert bucket.time_until_available(4) == 1
+    clock.now += 100
+    bucket.refill()
+    assert bucket.available == 10
+
+
+def test_spending_more_than_is_available_is_waited_out():
+    clock = Clock()
+    bucket = clocked_bucket(10, 1, clock)
+    bucket.consume(15)
+    # Requests larger than the bucket wait for a full bucket, not forever
+    assert bucket.time_until_available(20) == 15
+
+
+def test_shared_buckets_spend_the_same_quota(tmp_path):
+    path = str(tmp_path / 'buckets.sqlite3')
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    try:
+        one = token_bucket(10, 0.001, store=first, key='model/tokens')
+        other = token_bucket(10, 0.001, store=second, key='model/tokens')
+        one.consume(8)
+        assert other.time_until_available(5) > 0
+        assert other.time_until_available(2) == 0
+    finally:
+        first.close()
+        second.close()
+
+
+def test_callers_are_held_back_until_the_model_has_capacity():
+    async def acquisitions():
+        limiter = ModelRateLimiter(token_limit_per_minute=6000, request_limit_per_minute=6000, burst_seconds=1)
+        await limiter.acquire(100)
+        assert 0 < limiter.expected_delay(10) <= 0.1
+        await limiter.acquire(10)
+
+    asyncio.run(acquisitions())
+
+
+def test_users_are_not_held_back_unless_a_per_user_limit_is_set():
+    async def acquisitions(scheduler: RateLimitScheduler):
+        for _ in range(100):
+            await asyncio.wait_for(scheduler.acquire_for_user('address:127.0.0.1'), timeout=1)
+
+    assert get_settings().requests_per_user_per_minute == 0
+    scheduler = RateLimitScheduler(get_settings())
+    asyncio.run(acquisitions(scheduler))
+    assert not scheduler.user_buckets
+
+    limited = RateLimitScheduler(get_settings().model_copy(update={"requests_per_user_per_minute": 10}))
+    with pytest.raises(TimeoutError):
+        asyncio.run(acquisitions(limited))
+
+
+def test_the_users_seen_the_longest_ago_are_forgotten():
+    scheduler = RateLimitScheduler(get_settings().model_copy(update={"requests_per_user_per_minute": 10}))
+    scheduler.MAX_TRACKED_USERS = 3
+    for user in ('first', 'second', 'third'):
+        scheduler.user_bucket(user).consume(1)
+    scheduler.user_bucket('first')
+    scheduler.user_bucket('fourth')
+    assert list(scheduler.user_buckets) == ['third', 'first', 'fourth']
+
+
+def request(headers: dict = None, client: tuple = ('10.0.0.1', 4000), user=None) -> Request:
+    scope = {'type': 'http', 'headers': [(key.lower().encode(), value.encode())
+                                         for key, value in (headers or {}).items()], 'client': client}
+    if user is not None:
+        scope['user'] = user
+    return Request(scope)
+
+
+def test_requests_are_accounted_to_the_client_address_whatever_the_headers_claim():
+    assert get_requesting_user(request()) == get_requesting_user(request({'X-Scribe-User': 'someone-else'}))
+    assert get_requesting_user(request()) != get_requesting_user(request(client=('10.0.0.2', 4000)))
+
+
+def test_requests_are_accounted_to_the_signed_in_user():
+    alice = SimpleNamespace(is_authenticated=True, display_name='alice')
+    assert get_requesting_user(request(user=alice)) == get_requesting_user(request(client=('10.0.0.2', 1), user=alice))
+    anonymous = SimpleNamespace(is_authenticated=False, display_name='')
+    assert get_requesting_user(request(user=anonymous)) == get_requesting_user(request())
+
+
+def test_the_expected_delay_only_reads_the_shared_buckets(tmp_path):
+    path = str(tmp_path / 'buckets.sqlite3')
+    store = SQLiteBucketStore(path)
+    try:
+        limiter = ModelRateLimiter(600, 600, bucket_store=store, key='model')
+        timer = hold_write_lock(path, 1)
+        started = time.perf_counter()
+        assert limiter.expected_delay(10) == 0
+        assert limiter.status()["available_requests"] == 600
+        assert time.perf_counter() - started < 0.5
+        timer.join()
+    finally:
+        store.close()
+
+
+def test_waiting_for_the_shared_buckets_does_not_block_the_event_loop(tmp_path):
+    path = str(tmp_path / 'buckets.sqlite3')
+    store = SQLiteBucketStore(path)
+    try:
+        limiter = ModelRateLimiter(600, 600, bucket_store=store, key='model')
+        hold_write_lock(path, 0.3)
+        assert asyncio.run(ticks_while(limiter.acquire(10))) >= 10
+        assert limiter.status()["available_requests"] == 599
+    finally:
+        store.close()
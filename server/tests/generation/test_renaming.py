@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from src.generation.renaming import apply_naming_scheme, is_consistent_renaming, rename_identifiers
+from src.generation.schemas import AcceptedCodeLanguages, SystemPrompt
+
+from tests.generation.fakes import completion, fake_session
+
+PYTHON = AcceptedCodeLanguages.Python
+JAVASCRIPT = AcceptedCodeLanguages.Javascript
+JAVA = AcceptedCodeLanguages.Java
+
+
+@pytest.mark.parametrize('name, scheme, expected', [
+    ('itemList', 'snake', 'item_list'),
+    ('item_list', 'camel', 'itemList'),
+    ('item_list', 'pascal', 'ItemList'),
+    ('HTTPResponse', 'snake', 'http_response'),
+    ('_privateValue', 'snake', '_private_value'),
+    ('value2', 'upper', 'VALUE2'),
+    ('itemList', 'hungarian', 'itemList'),
+])
+def test_apply_naming_scheme(name, scheme, expected):
+    assert apply_naming_scheme(name, scheme) == expected
+
+
+def test_python_parameters_and_locals_are_renamed_together():
+    code_block = 'def total_price(itemList, taxRate):\n    subTotal = sum(itemList)\n' \
+                 '    return subTotal * (1 + taxRate)\n'
+    assert rename_identifiers(code_block, PYTHON, 'snake') == \
+        'def total_price(item_list, tax_rate):\n    sub_total = sum(item_list)\n    return sub_total * (1 + tax_rate)\n'
+
+
+def test_python_methods_keep_self_and_their_name():
+    code_block = 'class Cart:\n    def addItem(self, item_name):\n        item_count = len(item_name)\n' \
+                 '        return item_count\n'
+    assert rename_identifiers(code_block, PYTHON, 'camel') == \
+        'class Cart:\n    def addItem(self, itemName):\n        itemCount = len(itemName)\n        return itemCount\n'
+
+
+def test_python_names_inside_f_strings_are_renamed():
+    code_block = 'def greet(userName):\n    return f"Hello {userName}"\n'
+    assert rename_identifiers(code_block, PYTHON, 'snake') == 'def greet(user_name):\n    return f"Hello {user_name}"\n'
+
+
+def test_brace_languages_follow_the_same_rule():
+    assert rename_identifiers('function totalPrice(itemList, taxRate) {\n  const subTotal = itemList.length;\n'
+                              '  return subTotal * taxRate;\n}\n', JAVASCRIPT, 'snake') == \
+        'function totalPrice(item_list, tax_rate) {\n  const sub_total = item_list.length;\n' \
+        '  return sub_total * tax_rate;\n}\n'
+    assert rename_identifiers('int total(int[] itemList) {\n    int subTotal = 0;\n'
+                              '    for (int eachItem : itemList) { subTotal += eachItem; }\n    return subTotal;\n}\n',
+                              JAVA, 'snake') == \
+        'int total(int[] item_list) {\n    int sub_total = 0;\n' \
+        '    for (int each_item : item_list) { sub_total += each_item; }\n    return sub_total;\n}\n'
+
+
+def test_code_already_in_the_scheme_is_returned_unchanged():
+    code_block = 'def total(item_list):\n    return sum(item_list)\n'
+    assert rename_identifiers(code_block, PYTHON, 'snake') == code_block
+
+
+@pytest.mark.parametrize('code_block, language', [
+    # Nothing but module level code
+    ('myValue = 1\nprint(myValue)\n', PYTHON),
+    ('const fooBar = 1;\nconsole.log(fooBar);\n', JAVASCRIPT),
+    # The new name is taken by another variable
+    ('def f(fooBar):\n    foo_bar = 1\n    return fooBar + foo_bar\n', PYTHON),
+    ('function f(fooBar) {\n  const foo_bar = 1;\n  return fooBar + foo_bar;\n}\n', JAVASCRIPT),
+    # A parameter passed by keyword
+    ('def f(itemList):\n    return itemList\n\n\nf(itemList=[1])\n', PYTHON),
+    # Variables reachable by name at runtime
+    ('def f():\n    itemCount = 1\n    return locals()\n', PYTHON),
+    ('function f() {\n  const itemCount = 1;\n  return eval("itemCount");\n}\n', JAVASCRIPT),
+    # Code that does not parse
+    ('def f(:\n    itemCount = 1\n', PYTHON),
+])
+def test_what_cannot_be_converted_completely_is_left_to_the_model(code_block, language):
+    assert rename_identifiers(code_block, language, 'snake') is None
+
+
+MY_THING = 'class MyThing:\n    def __init__(self):\n        self.itemCount = 0\n\n' \
+           '    def addOne(self, stepSize):\n        self.itemCount += stepSize\n'
+
+
+@pytest.mark.parametrize('code_block, language', [
+    (MY_THING, PYTHON),
+    ('class MyThing:\n    maxItems = 3\n\n    def add(self, stepSize):\n        return stepSize\n', PYTHON),
+    ('class MyThing {\n  constructor() {\n    this.itemCount = 0;\n  }\n\n  add(stepSize) {\n'
+     '    this.total += stepSize;\n  }\n}\n', JAVASCRIPT),
+    ('class MyThing {\n    private int itemCount = 0;\n\n    void add(int stepSize) {\n'
+     '        itemCount += stepSize;\n    }\n}\n', JAVA),
+    ('class MyThing {\n    void addOne(int stepSize) {\n        System.out.println(stepSize);\n    }\n}\n', JAVA),
+])
+def test_classes_whose_members_are_not_in_the_scheme_are_left_to_the_model(code_block, language):
+    assert rename_identifiers(code_block, language, 'snake') is None
+
+
+def test_classes_whose_members_are_in_the_scheme_have_their_variables_renamed():
+    assert rename_identifiers(MY_THING, PYTHON, 'camel') == MY_THING
+    assert rename_identifiers(MY_THING.replace('itemCount', 'item_count').replace('addOne', 'add_one'), PYTHON,
+                              'snake') == MY_THING.replace('itemCount', 'item_count').replace('addOne', 'add_one') \
+        .replace('stepSize', 'step_size')
+
+
+def test_revisions_of_classes_whose_members_are_not_in_the_scheme_are_asked_of_the_model():
+    revised = MY_THING.replace('itemCount', 'item_count').replace('addOne', 'add_one').replace('stepSize', 'step_size')
+    session = fake_session(SystemPrompt.Revise, lambda messages, parameters: completion(revised))
+    assert asyncio.run(session.revise_code_block(MY_THING, 'snake')) == (True, revised.rstrip('\n'))
+    assert len(session.session.chat.completions.calls) == 1
+
+
+def test_members_of_the_classes_in_the_code_block_can_be_renamed_consistently():
+    renamed = MY_THING.replace('itemCount', 'item_count')
+    assert is_consistent_renaming(MY_THING, renamed, PYTHON)
+    assert not is_consistent_renaming(MY_THING, renamed.replace('self.item_count +=', 'self.itemCount +='), PYTHON)
+    assert not is_consistent_renaming('def f(items):\n    items.append(1)\n',
+                                      'def f(items):\n    items.add(1)\n', PYTHON)
+
+
+def test_hungarian_notation_is_left_to_the_model():
+    assert rename_identifiers('def f(itemList):\n    return itemList\n', PYTHON, 'hungarian') is None
+
+
+def test_consistent_renamings_are_recognised():
+    original = 'def f(itemList):\n    total = 0\n    for x in itemList:\n        total += x\n    return total\n'
+    assert is_consistent_renaming(original, original.replace('itemList', 'item_list'), PYTHON)
+    assert is_consistent_renaming(original, original.replace('itemList', 'items   ').replace('   )', ')'), PYTHON)
+
+
+@pytest.mark.parametrize('revised', [
+    # Renamed in one place only
+    'def f(items):\n    total = 0\n    for x in itemList:\n        total += x\n    return total\n',
+    # Two names merged into one
+    'def f(total):\n    total = 0\n    for x in total:\n        total += x\n    return total\n',
+    # Code changed besides the names
+    'def f(itemList):\n    total = 1\n    for x in itemList:\n        total += x\n    return total\n',
+    # A member renamed
+    'def f(itemList):\n    total = 0\n    for x in itemList.values:\n        total += x\n    return total\n',
+])
+def test_inconsistent_renamings_are_rejected(revised):
+    original = 'def f(itemList):\n    total = 0\n    for x in itemList:\n        total += x\n    return total\n'
+    assert not is_consistent_renaming(original, revised, PYTHON)
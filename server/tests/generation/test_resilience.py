@@ -0,0 +1,119 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from src.core.settings import get_settings
+from src.generation.resilience import CircuitBreaker, CircuitOpenError, UpstreamCallPolicy
+
+
+def upstream_policy(**overrides) -> UpstreamCallPolicy:
+    policy = UpstreamCallPolicy(get_settings())
+    policy.max_attempts = 3
+    policy.backoff_base_seconds = policy.backoff_max_seconds = 0
+    for name, value in overrides.items():
+        setattr(policy, name, value)
+    return policy
+
+
+def connection_error() -> openai.APIConnectionError:
+    return openai.APIConnectionError(request=httpx.Request('POST', 'http://fake/chat/completions'))
+
+
+def failing(failures: int, result: str = 'answer'):
+    calls = []
+
+    async def create():
+        calls.append(None)
+        if len(calls) <= failures:
+            raise connection_error()
+        return result
+
+    return create, calls
+
+
+def counting_charge():
+    charges = []
+
+    async def charge():
+        charges.append(None)
+
+    return charge, charges
+
+
+def test_the_circuit_opens_after_repeated_failures_and_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open' and not breaker.allow()
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+
+
+def test_calls_are_rejected_while_the_circuit_is_open():
+    policy = upstream_policy(failure_threshold=3, reset_seconds=60)
+    create, calls = failing(failures=10)
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(policy.call('http://fake', ('model', 'explain'), create))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(policy.call('http://fake', ('model', 'explain'), create))
+    assert len(calls) == 3
+
+
+def test_every_retry_is_charged():
+    policy = upstream_policy()
+    create, calls = failing(failures=2)
+    charge, charges = counting_charge()
+    assert asyncio.run(policy.call('http://fake', ('model', 'explain'), create, charge=charge)) == 'answer'
+    assert len(calls) == 3
+    # The first request is paid for by the caller
+    assert len(charges) == 2
+
+
+def test_errors_that_are_not_transient_are_not_retried():
+    policy = upstream_policy()
+    calls = []
+
+    async def create():
+        calls.append(None)
+        raise ValueError("Bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(policy.call('http://fake', ('model', 'explain'), create))
+    assert len(calls) == 1
+
+
+def slow_then_fast():
+    calls = []
+
+    async def create():
+        calls.append(None)
+        await asyncio.sleep(1 if len(calls) == 1 else 0)
+        return f'answer {len(calls)}'
+
+    return create, calls
+
+
+def test_a_hedged_request_is_charged():
+    policy = upstream_policy()
+    create, calls = slow_then_fast()
+    charge, charges = counting_charge()
+    result = asyncio.run(policy.hedged(create, hedge_delay=0.01, charge=charge, can_charge=lambda: True))
+    assert result == 'answer 2'
+    assert len(calls) == 2 and len(charges) == 1
+
+
+def test_requests_are_not_hedged_without_quota_to_spare():
+    policy = upstream_policy()
+    create, calls = slow_then_fast()
+    charge, charges = counting_charge()
+    result = asyncio.run(policy.hedged(create, hedge_delay=0.01, charge=charge, can_charge=lambda: False))
+    assert result == 'answer 1'
+    assert len(calls) == 1 and charges == []
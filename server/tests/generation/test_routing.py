@@ -0,0 +1,66 @@
+from src.core.settings import get_settings
+from src.generation.routing import ModelRouter
+from src.generation.schemas import GenerativeTransformerModel, SystemPrompt
+
+DEFAULT_MODEL = GenerativeTransformerModel.Azure
+SMALL_MODEL = GenerativeTransformerModel.Simple
+LARGE_CONTEXT_MODEL = GenerativeTransformerModel.Intermediate
+
+
+class FakeRateLimiter:
+    def __init__(self, delays: dict[GenerativeTransformerModel, float]):
+        self.delays = delays
+
+    def expected_delay(self, model, estimated_tokens):
+        return self.delays.get(model, 0.0)
+
+
+def model_router(**overrides) -> ModelRouter:
+    return ModelRouter(get_settings().model_copy(update={
+        "model_routing_enabled": True,
+        "model_routing_default_model": DEFAULT_MODEL.value,
+        "model_routing_small_model": SMALL_MODEL.value,
+        "model_routing_large_context_model": LARGE_CONTEXT_MODEL.value,
+        "model_routing_small_commands": 'explain, analyse',
+        "model_routing_small_max_tokens": 1500,
+        "model_routing_small_max_complexity": 2,
+        "model_routing_large_context_min_tokens": 3500,
+        "model_routing_max_wait_seconds": 1.0,
+        **overrides,
+    }))
+
+
+def test_short_requests_of_small_commands_go_to_the_small_model():
+    router = model_router()
+    assert router.route(DEFAULT_MODEL, SystemPrompt.Explain, 500, complexity=1) == SMALL_MODEL
+    assert router.route(DEFAULT_MODEL, SystemPrompt.Explain, 500, complexity=3) == DEFAULT_MODEL
+    assert router.route(DEFAULT_MODEL, SystemPrompt.Analyse, 2000) == DEFAULT_MODEL
+    assert router.route(DEFAULT_MODEL, SystemPrompt.Annotate, 500) == DEFAULT_MODEL
+
+
+def test_long_requests_go_to_the_large_context_model_even_when_it_is_saturated():
+    router = model_router()
+    rate_limiter = FakeRateLimiter({LARGE_CONTEXT_MODEL: 30.0})
+    assert router.route(DEFAULT_MODEL, SystemPrompt.Explain, 4000, rate_limiter=rate_limiter) == LARGE_CONTEXT_MODEL
+
+
+def test_saturated_models_are_passed_over_for_the_next_candidate():
+    router = model_router()
+    rate_limiter = FakeRateLimiter({SMALL_MODEL: 5.0})
+    assert router.route(DEFAULT_MODEL, SystemPrompt.Explain, 500, rate_limiter=rate_limiter) == DEFAULT_MODEL
+
+    rate_limiter = FakeRateLimiter({SMALL_MODEL: 5.0, DEFAULT_MODEL: 5.0, LARGE_CONTEXT_MODEL: 5.0})
+    assert router.route(DEFAULT_MODEL, SystemPrompt.Explain, 500, rate_limiter=rate_limiter) == SMALL_MODEL
+
+
+def test_sessions_for_another_model_or_without_routing_keep_their_model():
+    assert model_router().route(GenerativeTransformerModel.Complex, SystemPrompt.Explain, 500) \
+        == GenerativeTransformerModel.Complex
+    assert model_router(model_routing_enabled=False).route(DEFAULT_MODEL, SystemPrompt.Explain, 500) == DEFAULT_MODEL
+
+
+def test_requests_too_long_for_the_default_model_move_to_the_large_context_model():
+    router = model_router()
+    assert router.large_context_route(DEFAULT_MODEL) == LARGE_CONTEXT_MODEL
+    assert router.large_context_route(SMALL_MODEL) == SMALL_MODEL
+    assert model_router(model_routing_enabled=False).large_context_route(DEFAULT_MODEL) == DEFAULT_MODEL
@@ -0,0 +1,83 @@
+import json
+import asyncio
+
+import httpx
+import openai
+
+from src.generation.streaming import BufferedVerifier, StreamingFenceStripper, cached_generation_events, \
+    generation_events
+
+
+def strip_fences(pieces: list[str]) -> str:
+    fence_stripper = StreamingFenceStripper()
+    return ''.join(fence_stripper.feed(piece) for piece in pieces) + fence_stripper.finish()
+
+
+async def token_stream(pieces: list[str], failure: Exception = None):
+    for piece in pieces:
+        yield piece
+    if failure is not None:
+        raise failure
+
+
+def collect_events(events) -> list[dict]:
+    async def collect():
+        return [json.loads(event) async for event in events]
+
+    return asyncio.run(collect())
+
+
+def test_fences_split_across_tokens_are_stripped():
+    assert strip_fences(['``', '`py', 'thon\nx = 1\n', 'y = 2\n`', '``', '\n']) == 'x = 1\ny = 2'
+    assert strip_fences(['```\nx', ' = 1\n```']) == 'x = 1'
+
+
+def test_code_without_fences_is_passed_through():
+    assert strip_fences(['x', ' = `a`', '\ny = 2']) == 'x = `a`\ny = 2'
+    assert strip_fences(['`a', '` + b']) == '`a` + b'
+    assert strip_fences(['x = `a`\n']) == 'x = `a`'
+
+
+def test_backticks_and_newlines_followed_by_more_code_are_kept():
+    fence_stripper = StreamingFenceStripper()
+    assert fence_stripper.feed('x = 1\n\n') == 'x = 1'
+    assert fence_stripper.feed('y = 2') == '\n\ny = 2'
+    assert fence_stripper.finish() == ''
+
+
+def test_an_output_made_of_an_opening_fence_is_empty():
+    assert strip_fences(['```python']) == ''
+
+
+def test_tokens_are_forwarded_as_events_followed_by_the_verification_and_done():
+    completed = []
+
+    async def on_complete(output, successful):
+        completed.append((output, successful))
+
+    events = collect_events(generation_events(token_stream(['```\n', 'x = 1', '\n```']),
+                                              verifier=BufferedVerifier(lambda output: output == 'x = 1'),
+                                              on_complete=on_complete))
+    assert events == [{"event": 'token', "content": 'x = 1'}, {"event": 'verification', "successful": True},
+                      {"event": 'done'}]
+    assert completed == [('x = 1', True)]
+
+
+def test_upstream_failures_mid_stream_end_the_stream_with_an_error_event(caplog):
+    completed = []
+
+    async def on_complete(output, successful):
+        completed.append(output)
+
+    failure = openai.APIConnectionError(request=httpx.Request('POST', 'http://fake/chat/completions'))
+    events = collect_events(generation_events(token_stream(['x = 1'], failure), strip_code_fences=False,
+                                              on_complete=on_complete))
+    assert [event["event"] for event in events] == ['token', 'error']
+    assert completed == []
+    assert 'OpenAI API stream was interrupted' in caplog.text
+
+
+def test_cached_responses_are_replayed_as_events():
+    events = collect_events(cached_generation_events('x = 1', successful=False))
+    assert events == [{"event": 'token', "content": 'x = 1'}, {"event": 'verification', "successful": False},
+                      {"event": 'done'}]
@@ -0,0 +1,64 @@
+import pytest
+
+from src.generation.structured import JSONRepairer, StructuredOutputError, parse_complexity_breakdown, \
+    parse_insertions, parse_json_output, parse_pdf_metadata
+
+
+def test_prose_around_the_value_is_skipped():
+    assert parse_json_output('Here is [the] result: {"a": [1, 2]}') == ({"a": [1, 2]}, False)
+    assert parse_json_output('See [1] and {"a": {"b": 2}, "c": 3}. Done [ok]') == ({"a": {"b": 2}, "c": 3}, False)
+
+
+def test_a_fenced_json_block_is_preferred():
+    answer = 'Use [x] like {"not": "this"}:\n```json\n{"a": 1}\n```\nThen [3]'
+    assert parse_json_output(answer) == ({"a": 1}, False)
+
+
+def test_a_fenced_block_cut_off_before_its_closing_fence_is_repaired():
+    assert parse_json_output('```json\n{"a": [1, 2') == ({"a": [1, 2]}, True)
+
+
+def test_truncated_output_keeps_its_complete_elements():
+    value, repaired = parse_json_output('{"functions": [{"name": "first"}, {"name": "sec')
+    assert repaired
+    assert value == {"functions": [{"name": "first"}, {"name": "sec"}]}
+
+
+def test_raw_control_characters_and_trailing_commas_are_repaired():
+    assert JSONRepairer('{"a": "line\none\ttab", "b": [1, 2,],}').repair() == {"a": "line\none\ttab", "b": [1, 2]}
+
+
+def test_an_escape_cut_off_at_the_end_is_dropped():
+    assert JSONRepairer('{"a": "quote \\').repair() == {"a": "quote "}
+
+
+def test_prose_without_json_is_rejected():
+    with pytest.raises(StructuredOutputError):
+        parse_json_output('Here is [the] result, sorry.')
+
+
+def test_pdf_metadata_reads_functions_and_legacy_answers():
+    metadata = parse_pdf_metadata('{"title": "Numbers", "description": "Adds.", "functions": ['
+                                  '{"name": "add", "function_descriptor": "add(a, b)", "description": "Adds.", '
+                                  '"usage_example": "add(1, 2)"}, {"name": "cut"')
+    assert metadata["title"] == 'Numbers'
+    assert [explanation["name"] for explanation in metadata["function_explanations"]] == ['add']
+
+    legacy = parse_pdf_metadata('title: Numbers\ndescription: Adds.\n#####\nadd(a, b):\nAdds them.\n'
+                                'Usage Example: add(1, 2)\n')
+    assert legacy["title"] == 'Numbers'
+    assert legacy["function_explanations"][0]["name"] == 'add'
+
+
+def test_complexity_breakdowns_are_read_from_json_and_legacy_lines():
+    assert parse_complexity_breakdown('{"functions": [{"name": "add", "runtime": "O(1)", "space": "O(1)"}]}') \
+        == {"add": {"runtime": "O(1)", "space": "O(1)"}}
+    assert parse_complexity_breakdown('add: O(n) runtime, O(1) space') == {"add": {"runtime": "O(n)", "space": "O(1)"}}
+
+
+def test_insertions_need_a_line_and_a_comment():
+    assert parse_insertions('{"insertions": [{"line": 2, "comment": "Adds"}, {"line": "x", "comment": "No"}]}') \
+        == [(2, 'Adds')]
+    assert parse_insertions('{"insertions": []}') == []
+    with pytest.raises(StructuredOutputError):
+        parse_insertions('{"insertions": [{"comment": "No line"}]}')
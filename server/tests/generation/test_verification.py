@@ -0,0 +1,62 @@
+from src.generation.schemas import AcceptedCodeLanguages
+from src.generation.streaming import StreamingCodeVerifier
+from src.generation.tokenizer import COMMENT, NAME, NEWLINE, OPERATOR, STRING, IncrementalTokenizer, tokenize
+
+PYTHON = AcceptedCodeLanguages.Python
+JAVA = AcceptedCodeLanguages.Java
+
+ORIGINAL_PYTHON = '''def total(prices, tax):
+    """Sum of the prices with tax."""
+    # Prices are in cents
+    return sum(prices)*(1+tax)
+'''
+
+
+def verify(original: str, generated: str, language: AcceptedCodeLanguages = PYTHON, piece_size: int = 7) -> bool:
+    verifier = StreamingCodeVerifier(original, language)
+    for start in range(0, len(generated), piece_size):
+        verifier.feed(generated[start:start + piece_size])
+    return verifier.finish()
+
+
+def test_tokens_are_split_without_losing_text():
+    source = 'x = "a # b"  # comment\n'
+    tokens = list(tokenize(source, PYTHON))
+    assert ''.join(token.text for token in tokens) == source
+    assert [token.kind for token in tokens if token.kind != 'whitespace'] == [NAME, OPERATOR, STRING, COMMENT,
+                                                                               NEWLINE]
+
+
+def test_incremental_tokens_are_final_once_their_line_is_complete():
+    tokenizer = IncrementalTokenizer(PYTHON)
+    assert tokenizer.feed('x = 1') == []
+    tokens = tokenizer.feed('\ny = ') + tokenizer.feed('2\n') + tokenizer.finish()
+    assert ''.join(text for _, text in tokens) == 'x = 1\ny = 2\n'
+
+
+def test_added_comments_and_docstrings_pass():
+    generated = ('def total(prices, tax):\n    """Sum of the prices with tax."""\n    # Prices are in cents\n'
+                 '    # Tax is a fraction of the price\n    return sum(prices)*(1+tax)\n')
+    assert verify(ORIGINAL_PYTHON, generated)
+
+
+def test_whitespace_between_tokens_is_not_compared():
+    generated = ORIGINAL_PYTHON.replace('sum(prices)*(1+tax)', 'sum( prices ) * (1 + tax)')
+    assert verify(ORIGINAL_PYTHON, generated)
+    assert verify('int x = a+1;\n', 'int x = a + 1;  // Next value\n', JAVA)
+
+
+def test_changed_code_fails():
+    assert not verify(ORIGINAL_PYTHON, ORIGINAL_PYTHON.replace('1+tax', '1-tax'))
+    assert not verify('int x = a+1;\n', 'int x = a+2;\n', JAVA)
+    assert not verify('return x\n', 'returnx\n')
+
+
+def test_dropped_comments_fail():
+    assert not verify(ORIGINAL_PYTHON, ORIGINAL_PYTHON.replace('    # Prices are in cents\n', ''))
+    assert not verify(ORIGINAL_PYTHON, ORIGINAL_PYTHON.replace('    """Sum of the prices with tax."""\n', ''))
+    assert not verify('/* Counter */\nint x = 0;\n', 'int x = 0;\n', JAVA)
+
+
+def test_reindented_comments_are_kept():
+    assert verify('/* Counter\n * of visits */\nint x = 0;\n', '/* Counter\n   * of visits */\nint x = 0;\n', JAVA)
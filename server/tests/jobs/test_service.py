@@ -0,0 +1,27 @@
+import json
+import asyncio
+
+from src.jobs.store import JobStore
+from src.jobs.service import JobRunner
+
+from tests.jobs.test_store import job_files
+
+
+async def collect_events(job_runner: JobRunner, job_id: str) -> list[dict]:
+    return [json.loads(event) async for event in job_runner.progress_events(job_id)]
+
+
+def test_following_a_job_that_was_purged_ends_with_an_error(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    try:
+        store.create_job('job', job_files(1))
+        store.claim_file('job', 0, 'worker', lease_seconds=60)
+        store.update_file('job', 0, 'worker', 'completed', result={"title": "Done"})
+        # The job was found when the stream was requested and purged before it was first read
+        store.purge_finished_jobs(retention_seconds=-1)
+
+        job_runner = JobRunner(store, llm_clients=None, rate_limiter=None, response_cache=None, worker_count=1)
+        events = asyncio.run(asyncio.wait_for(collect_events(job_runner, 'job'), timeout=5))
+        assert events == [{"event": "error", "detail": "The job no longer exists"}]
+    finally:
+        store.close()
@@ -0,0 +1,61 @@
+import time
+
+from src.jobs.store import JobStore
+from src.jobs.schemas import JobFileIn
+
+
+def job_files(count: int) -> list[JobFileIn]:
+    return [JobFileIn.model_validate({"file_name": f"file_{position}.py", "language_model": "openai",
+                                      "code_extension": "python",
+                                      "code_file_to_generate_from": f"def f{position}():\n    return {position}\n"})
+            for position in range(count)]
+
+
+def test_files_are_claimed_by_one_worker_until_their_lease_runs_out(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    try:
+        store.create_job('job', job_files(1))
+        assert store.claim_file('job', 0, 'first', lease_seconds=60)
+        assert not store.claim_file('job', 0, 'second', lease_seconds=60)
+        assert store.claimable_files() == []
+
+        store.renew_leases('first', lease_seconds=-1)
+        assert store.claimable_files() == [('job', 0)]
+        assert store.claim_file('job', 0, 'second', lease_seconds=60)
+    finally:
+        store.close()
+
+
+def test_only_the_lease_owner_records_the_outcome_of_a_file(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    try:
+        store.create_job('job', job_files(1))
+        store.claim_file('job', 0, 'first', lease_seconds=-1)
+        # The lease ran out and another worker took the file over
+        store.claim_file('job', 0, 'second', lease_seconds=60)
+
+        assert not store.update_file('job', 0, 'first', 'failed', error="Lost")
+        assert store.update_file('job', 0, 'second', 'completed', result={"title": "Done"})
+        assert store.get_results('job') == [{"position": 0, "file_name": "file_0.py", "result": {"title": "Done"}}]
+        assert not store.update_file('job', 0, 'second', 'failed', error="Twice")
+        assert store.get_job('job')["status"] == 'completed'
+    finally:
+        store.close()
+
+
+def test_finished_jobs_are_purged_after_their_retention(tmp_path):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    try:
+        store.create_job('finished', job_files(1))
+        store.claim_file('finished', 0, 'worker', lease_seconds=60)
+        store.update_file('finished', 0, 'worker', 'completed', result={"title": "Done"})
+        store.create_job('queued', job_files(2))
+
+        assert store.purge_finished_jobs(retention_seconds=60) == 0
+        time.sleep(0.01)
+        assert store.purge_finished_jobs(retention_seconds=0) == 1
+        assert store.get_job('finished') is None
+        assert store.get_results('finished') == []
+        assert store.get_job('queued')["total_files"] == 2
+    finally:
+        store.close()